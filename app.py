@@ -2,20 +2,45 @@
 Aplikacja Flask do pomiaru dachów na podstawie ortofotomap z Geoportalu
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
-from io import BytesIO
+from flask import Flask, Response, render_template, request, jsonify, send_file, stream_with_context, url_for
 import base64
 import json
 import os
-from PIL import Image
 
-from utils.geoportal import pobierz_mape_dla_wspolrzednych
+from utils.geoportal import (
+    LIMIT_KANDYDATOW_API,
+    STATYSTYKI_HEDGE,
+    kandydaci_geokodowania,
+    parsuj_wspolrzedne_tekst,
+    pobierz_mape_dla_wspolrzednych
+)
+from utils.autocomplete import DOMYSLNY_LIMIT as LIMIT_PODPOWIEDZI, podpowiedz_adresy
+from utils.batch_geocoder import geokoduj_wsadowo, maks_adresow, pobierz_ogranicznik, sciezka_zadania
 from utils.calculations import AnalizatorDachu, oblicz_skale
+from utils.geocode_cache import pobierz_cache_geokodowania
+from utils.geocode_engine import STATYSTYKI_GEOKODOWANIA
+from utils.http_session import pobierz_sesje_http
+from utils.image_cache import obraz_ze_zrodla, pobierz_pamiec_obrazow, zrodlowe_dane
+from utils.image_encoding import koduj_obraz, wybierz_ustawienia
+from utils.map_snapshots import pobierz_magazyn_migawek
+from utils.parcels import dzialka_w_punkcie, znajdz_dzialke
+from utils.prefetch import pobierz_wyprzedzanie
+from utils.singleflight import pobierz_pojedynczy_lot
+from utils.tile_cache import pobierz_cache_kafelkow
+from utils.tile_pack import pobierz_paczki_kafelkow
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'roof-geoportal-secret-key-2024'
 app.config['GOOGLE_MAPS_API_KEY'] = os.environ.get('GOOGLE_MAPS_API_KEY', '')
+# Czas cache'owania niezmiennych migawek map w przeglądarce (s)
+ROK_S = 365 * 24 * 3600
+
+
+def wczytaj_obraz_demo(sciezka):
+    """Otwiera mapę demonstracyjną z zachowaniem bajtów pliku (wysyłane bez ponownego kodowania)."""
+    with open(sciezka, 'rb') as plik:
+        return obraz_ze_zrodla(plik.read())
 
 
 @app.route('/')
@@ -34,9 +59,13 @@ def get_map():
         szerokosc: szerokość obrazu (opcjonalne)
         wysokosc: wysokość obrazu (opcjonalne)
         demo: tryb demonstracyjny (opcjonalne)
+        format: webp, jpeg lub png (opcjonalne - domyślnie z nagłówka Accept i ROOF_MAP_FORMATS)
+        jakosc: jakość JPEG/WebP 1-100 (opcjonalne)
+        kompresja: poziom kompresji PNG 0-9 (opcjonalne)
         
     Zwraca:
-        JSON z obrazem mapy w base64
+        JSON z adresem obrazu mapy (image_url, typ w polu mime) albo, przy
+        wyłączonych migawkach, z obrazem w base64 (image)
     """
     try:
         data = request.get_json()
@@ -56,12 +85,27 @@ def get_map():
                 'success': False,
                 'error': 'Brak współrzędnych'
             }), 400
+
+        # Format obrazu: z żądania, z nagłówka Accept albo domyślny dla źródła mapy
+        kodowanie = {
+            'format': data.get('format'),
+            'jakosc': data.get('jakosc'),
+            'kompresja': data.get('kompresja'),
+            'accept': request.headers.get('Accept'),
+        }
+        try:
+            ustawienia_kodowania = wybierz_ustawienia(map_source, **kodowanie)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
         
         # Tryb demonstracyjny - użyj przykładowego obrazu
         if demo_mode or wspolrzedne.lower() in ['demo', 'test']:
             demo_image_path = os.path.join('static', 'images', 'demo_map.png')
             if os.path.exists(demo_image_path):
-                mapa = Image.open(demo_image_path)
+                mapa = wczytaj_obraz_demo(demo_image_path)
                 lon, lat = 21.0122, 52.2297  # Warszawa
                 demo_used = True
                 notice = 'Załadowano mapę demonstracyjną (tryb DEMO)'
@@ -86,7 +130,7 @@ def get_map():
             if mapa is None:
                 demo_image_path = os.path.join('static', 'images', 'demo_map.png')
                 if os.path.exists(demo_image_path):
-                    mapa = Image.open(demo_image_path)
+                    mapa = wczytaj_obraz_demo(demo_image_path)
                     lon, lat = 21.0122, 52.2297
                     app.logger.warning('Mapa niedostępna - użyto mapy demonstracyjnej')
                     demo_used = True
@@ -98,25 +142,48 @@ def get_map():
                         'error': error_message or 'Nie udało się pobrać mapy. Sprawdź dane wejściowe.'
                     }), 400
         
-        # Konwertuj obraz do base64
-        buffer = BytesIO()
-        mapa.save(buffer, format='PNG')
-        buffer.seek(0)
-        img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        
+        # Niezmieniony obraz ze źródła (JPEG z Geoportalu/Google) w żądanym formacie
+        # idzie dalej bez dekodowania i ponownego kodowania; pozostałe są kodowane
+        if demo_used:
+            ustawienia_kodowania = wybierz_ustawienia('demo', **kodowanie)
+        dane_obrazu, mime = koduj_obraz(mapa, ustawienia_kodowania, zrodlowe_dane(mapa))
+        # Obraz jako migawka adresowana skrótem treści - przeglądarka pobiera go
+        # osobno i cache'uje na stałe; bez magazynu wraca w JSON jako base64
         response = {
             'success': True,
-            'image': img_base64,
+            'mime': mime,
             'lon': lon,
             'lat': lat,
             'szerokosc': mapa.width,
             'wysokosc': mapa.height,
             'demo': demo_used
         }
+        magazyn_migawek = pobierz_magazyn_migawek()
+        skrot = None
+        if magazyn_migawek is not None:
+            try:
+                skrot = magazyn_migawek.zapisz(dane_obrazu, mime)
+            except OSError as e:
+                app.logger.warning(f'Nie zapisano migawki mapy: {e}')
+        if skrot is not None:
+            response['image_id'] = skrot
+            response['image_url'] = url_for('map_image', skrot=skrot)
+        else:
+            response['image'] = base64.b64encode(dane_obrazu).decode('utf-8')
         if notice:
             response['notice'] = notice
         if notice_level:
             response['notice_level'] = notice_level
+        # Dla adresu - pozostali kandydaci z cache (bez ponownego geokodowania),
+        # klient może przełączyć się na innego, wysyłając jego "lat lon"
+        if not demo_used:
+            dzialka = znajdz_dzialke(wspolrzedne)
+            if dzialka is None and parsuj_wspolrzedne_tekst(wspolrzedne)[0] is None:
+                response['kandydaci'] = kandydaci_geokodowania(wspolrzedne, tylko_lokalnie=True)
+            # Działka ewidencyjna wpisana identyfikatorem lub zawierająca środek mapy
+            dzialka = dzialka or dzialka_w_punkcie(lon, lat)
+            if dzialka:
+                response['dzialka'] = dzialka
 
         return jsonify(response)
         
@@ -128,6 +195,79 @@ def get_map():
         }), 500
 
 
+@app.route('/api/map_image/<skrot>', methods=['GET'])
+def map_image(skrot):
+    """
+    Endpoint zwracający obraz mapy zapisany przez get_map
+
+    Migawka adresowana jest skrótem SHA-256 treści, więc nigdy się nie zmienia:
+    skrót jest silnym ETagiem, odpowiedź ma Cache-Control: immutable, a żądanie
+    z pasującym If-None-Match dostaje 304 bez treści.
+    """
+    magazyn_migawek = pobierz_magazyn_migawek()
+    migawka = magazyn_migawek.znajdz(skrot) if magazyn_migawek is not None else None
+    if migawka is None:
+        return jsonify({
+            'success': False,
+            'error': 'Nie znaleziono obrazu mapy - pobierz mapę ponownie'
+        }), 404
+    sciezka, mime = migawka
+    response = send_file(sciezka, mimetype=mime, etag=skrot, max_age=ROK_S, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.route('/api/geocode_candidates', methods=['POST'])
+def geocode_candidates():
+    """
+    Endpoint zwracający ocenionych kandydatów geokodowania adresu
+
+    Oczekiwane dane POST:
+        adres: adres do wyszukania
+        limit: maksymalna liczba kandydatów (opcjonalne)
+
+    Zwraca:
+        JSON z listą kandydatów (najlepszy pierwszy) z oceną i jej składnikami
+    """
+    data = request.get_json(silent=True) or {}
+    adres = str(data.get('adres') or '').strip()
+    if not adres:
+        return jsonify({
+            'success': False,
+            'error': 'Brak adresu'
+        }), 400
+    try:
+        limit = max(1, min(int(data.get('limit', LIMIT_KANDYDATOW_API)), LIMIT_KANDYDATOW_API))
+    except (TypeError, ValueError):
+        limit = LIMIT_KANDYDATOW_API
+    return jsonify({
+        'success': True,
+        'kandydaci': kandydaci_geokodowania(adres, limit)
+    })
+
+
+@app.route('/api/autocomplete', methods=['GET'])
+def autocomplete():
+    """
+    Endpoint podpowiedzi adresów dla wpisywanego tekstu (bez zapytań do serwisów)
+
+    Parametry zapytania:
+        q: dotychczas wpisany tekst
+        limit: maksymalna liczba podpowiedzi (opcjonalne)
+
+    Zwraca:
+        JSON z listą podpowiedzi (etykieta, lon, lat, ocena)
+    """
+    zapytanie = request.args.get('q', '')
+    limit = request.args.get('limit', LIMIT_PODPOWIEDZI, type=int)
+    limit = max(1, min(limit, 20))
+    return jsonify({
+        'success': True,
+        'podpowiedzi': podpowiedz_adresy(zapytanie, limit)
+    })
+
+
 @app.route('/api/calculate', methods=['POST'])
 def calculate():
     """
@@ -217,6 +357,70 @@ def health():
     })
 
 
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """Endpoint ze statystykami cache i puli połączeń (do strojenia workerów)"""
+    cache_kafelkow = pobierz_cache_kafelkow()
+    pamiec_obrazow = pobierz_pamiec_obrazow()
+    cache_geokodowania = pobierz_cache_geokodowania()
+    wyprzedzanie = pobierz_wyprzedzanie()
+    paczki_kafelkow = pobierz_paczki_kafelkow()
+    magazyn_migawek = pobierz_magazyn_migawek()
+    return jsonify({
+        'cache_kafelkow': cache_kafelkow.statystyki() if cache_kafelkow else None,
+        'pamiec_obrazow': pamiec_obrazow.statystyki() if pamiec_obrazow else None,
+        'cache_geokodowania': cache_geokodowania.statystyki() if cache_geokodowania else None,
+        'http': pobierz_sesje_http().statystyki(),
+        'wyscig_wms_wmts': STATYSTYKI_HEDGE.statystyki(),
+        'single_flight': pobierz_pojedynczy_lot().statystyki(),
+        'limit_nominatim': pobierz_ogranicznik().statystyki(),
+        'zrodla_geokodowania': STATYSTYKI_GEOKODOWANIA.statystyki(),
+        'wyprzedzanie': wyprzedzanie.statystyki() if wyprzedzanie else None,
+        'paczki_kafelkow': paczki_kafelkow.statystyki() if paczki_kafelkow else None,
+        'migawki_map': magazyn_migawek.statystyki() if magazyn_migawek else None
+    })
+
+
+@app.route('/api/geocode_batch', methods=['POST'])
+def geocode_batch():
+    """
+    Endpoint do wsadowego geokodowania listy adresów
+
+    Oczekiwane dane POST:
+        adresy: lista adresów
+        zadanie: identyfikator zadania (opcjonalne - domyślnie skrót listy)
+
+    Zwraca:
+        Strumień NDJSON - jeden wiersz na adres, w kolejności uzyskania wyniku.
+        Ponowne wysłanie tej samej listy (lub identyfikatora) wznawia zadanie.
+    """
+    data = request.get_json(silent=True) or {}
+    adresy = data.get('adresy')
+    if not isinstance(adresy, list) or not adresy:
+        return jsonify({
+            'success': False,
+            'error': 'Brak listy adresów'
+        }), 400
+    if len(adresy) > maks_adresow():
+        return jsonify({
+            'success': False,
+            'error': f'Za dużo adresów (limit {maks_adresow()})'
+        }), 400
+    try:
+        sciezka = sciezka_zadania(adresy, data.get('zadanie'))
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    def strumien():
+        for wynik in geokoduj_wsadowo(adresy, sciezka):
+            yield json.dumps(wynik, ensure_ascii=False) + '\n'
+
+    return Response(stream_with_context(strumien()), mimetype='application/x-ndjson')
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     
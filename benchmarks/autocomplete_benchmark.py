@@ -0,0 +1,170 @@
+"""
+Benchmark podpowiedzi adresów (utils.autocomplete)
+
+Buduje syntetyczny indeks adresowy o rozkładzie zbliżonym do PRG (kilka dużych
+miast z tysiącami ulic, powtarzające się nazwy ulic w wielu miejscowościach),
+a następnie mierzy czas odpowiedzi na typowe wpisy użytkownika - krótkie
+prefiksy, nazwy ulic z numerem i miejscowością - względem progu 5 ms.
+
+Sprawdza też, czy szeroki prefiks podpowiada najlepiej ocenione i najpopularniejsze
+ulice, a nie pierwsze alfabetycznie.
+
+Uruchomienie: python -m benchmarks.autocomplete_benchmark [--ulice N] [--powtorzenia N]
+"""
+
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+from utils.autocomplete import zbuduj_indeks_podpowiedzi
+from utils.geocode_cache import tokeny_adresu
+from utils.geocode_scoring import LOCALITY_MATCH_SCORE, ROAD_MATCH_SCORE
+from utils.offline_geocoder import IndeksAdresow, zbuduj_indeks_adresow
+
+
+PROG_MS = 5.0
+
+MIASTA = [('Warszawa', 0.25), ('Kraków', 0.12), ('Łódź', 0.08), ('Wrocław', 0.08), ('Poznań', 0.06)]
+# Nazwy ulic powtarzające się w całym kraju
+POPULARNE_ULICE = [
+    'Polna', 'Leśna', 'Słoneczna', 'Krótka', 'Szkolna', 'Ogrodowa', 'Lipowa', 'Łąkowa',
+    'Brzozowa', 'Kwiatowa', 'Kościelna', 'Sosnowa', 'Zielona', 'Parkowa', 'Akacjowa',
+    'Marszałkowska', 'Mickiewicza', 'Kościuszki', 'Słowackiego', '3 Maja',
+]
+SYLABY = ['ba', 'bro', 'cze', 'da', 'gó', 'ka', 'ko', 'la', 'lin', 'ma', 'mi', 'no', 'po', 'ra',
+          'ro', 'sa', 'sko', 'ta', 'to', 'wa', 'wie', 'za', 'zie', 'ży']
+
+
+def _nazwa(los, sylaby):
+    return ''.join(los.choice(SYLABY) for _ in range(sylaby)).capitalize()
+
+
+def zbuduj_dane(katalog, liczba_ulic, ziarno=1992):
+    """
+    Zapisuje syntetyczne punkty adresowe do CSV i buduje z nich indeks adresowy
+
+    Returns:
+        tuple: (IndeksAdresow, lista (ulica, miejscowość, liczba punktów))
+    """
+    los = random.Random(ziarno)
+    wsie = [_nazwa(los, 3) for _ in range(max(1, liczba_ulic // 20))]
+    ulice = []
+    for _ in range(liczba_ulic):
+        miasto = los.random()
+        for nazwa_miasta, udzial in MIASTA:
+            if miasto < udzial:
+                miejscowosc = nazwa_miasta
+                break
+            miasto -= udzial
+        else:
+            miejscowosc = los.choice(wsie)
+        ulica = los.choice(POPULARNE_ULICE) if los.random() < 0.3 else _nazwa(los, los.randint(2, 4))
+        punkty = max(1, int(los.paretovariate(1.2) * 4))
+        ulice.append((ulica, miejscowosc, min(punkty, 400)))
+
+    sciezka_csv = os.path.join(katalog, 'punkty.csv')
+    with open(sciezka_csv, 'w', newline='', encoding='utf-8') as plik:
+        zapis = csv.writer(plik, delimiter=';')
+        zapis.writerow(['miejscowosc', 'ulica', 'numer', 'lon', 'lat'])
+        for ulica, miejscowosc, punkty in ulice:
+            lon, lat = los.uniform(14.2, 24.1), los.uniform(49.0, 54.8)
+            for numer in range(1, punkty + 1):
+                zapis.writerow([miejscowosc, ulica, numer, f"{lon + numer * 1e-5:.6f}", f"{lat:.6f}"])
+    sciezka_npz = os.path.join(katalog, 'indeks.npz')
+    zbuduj_indeks_adresow(sciezka_csv, sciezka_npz)
+    return IndeksAdresow.wczytaj(sciezka_npz), ulice
+
+
+def zapytania(ulice, los):
+    """Typowe wpisy: prefiksy, ulica z numerem, ulica z numerem i miejscowością."""
+    wpisy = ['wa', 'war', 'warsz', 'kr', 'pol', 'polna', 'polna 1', 'les', 'szkolna 5',
+             'marsz 10', 'marszałkowska 1 warszawa', 'mickiewicza 3 krak', '3 maja 1', 'ko', 'po']
+    for ulica, miejscowosc, _ in los.sample(ulice, 25):
+        wpisy.append(ulica[:3])
+        wpisy.append(f"{ulica} 1")
+        wpisy.append(f"{ulica} 2 {miejscowosc[:4]}")
+    return wpisy
+
+
+def sprawdz_ranking(podpowiedzi, ulice):
+    """
+    Dla szerokiego prefiksu pierwsza podpowiedź powinna być najlepiej ocenioną,
+    a przy równej ocenie najpopularniejszą (najwięcej punktów) ulicą - wyznaczoną
+    tu przeglądem wszystkich ulic, niezależnie od obcięcia zakresu w indeksie
+
+    Returns:
+        list: Prefiksy, dla których tak nie jest
+    """
+    punkty = {}
+    for ulica, miejscowosc, liczba in ulice:
+        punkty[(ulica, miejscowosc)] = punkty.get((ulica, miejscowosc), 0) + liczba
+
+    def pasuje(tekst, prefiks):
+        return any(slowo.startswith(prefiks) for slowo in tokeny_adresu(tekst)[0])
+
+    bledy = []
+    for prefiks in ('po', 'ko', 'ma', 'sa', 'ta'):
+        ocenione = [
+            (ROAD_MATCH_SCORE * pasuje(ulica, prefiks) + LOCALITY_MATCH_SCORE * pasuje(miejscowosc, prefiks),
+             liczba, f"{ulica}, {miejscowosc}")
+            for (ulica, miejscowosc), liczba in punkty.items()
+        ]
+        ocena, _, oczekiwana = max(ocenione)
+        if not ocena:
+            continue
+        etykiety = [p['etykieta'] for p in podpowiedzi.podpowiedz(prefiks)]
+        if etykiety[:1] != [oczekiwana]:
+            bledy.append((prefiks, oczekiwana, etykiety))
+    return bledy
+
+
+def zmierz(podpowiedzi, wpisy, powtorzenia):
+    """
+    Returns:
+        list: Czasy pojedynczych zapytań (ms), posortowane
+    """
+    czasy = []
+    for _ in range(powtorzenia):
+        for wpis in wpisy:
+            start = time.perf_counter()
+            podpowiedzi.podpowiedz(wpis)
+            czasy.append((time.perf_counter() - start) * 1000)
+    return sorted(czasy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark podpowiedzi adresów')
+    parser.add_argument('--ulice', type=int, default=30000, help='Liczba ulic w syntetycznym indeksie')
+    parser.add_argument('--powtorzenia', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as katalog:
+        start = time.perf_counter()
+        indeks_adresow, ulice = zbuduj_dane(katalog, args.ulice)
+        print(f"Indeks adresowy: {len(indeks_adresow)} punktów, {len(ulice)} ulic "
+              f"({time.perf_counter() - start:.1f} s)")
+        start = time.perf_counter()
+        podpowiedzi = zbuduj_indeks_podpowiedzi(indeks_adresow)
+        print(f"Indeks podpowiedzi: {len(podpowiedzi)} wpisów ({time.perf_counter() - start:.1f} s)")
+
+        wpisy = zapytania(ulice, random.Random(7))
+        # Pierwsze zapytanie o szeroki prefiks liczy listę jego najcięższych wpisów
+        zimne = zmierz(podpowiedzi, wpisy, 1)
+        czasy = zmierz(podpowiedzi, wpisy, args.powtorzenia)
+        bledy = sprawdz_ranking(podpowiedzi, ulice)
+
+    for prefiks, oczekiwana, etykiety in bledy:
+        print(f"RANKING: '{prefiks}' - brak {oczekiwana!r} w {etykiety}")
+    p50 = czasy[len(czasy) // 2]
+    p95 = czasy[int(len(czasy) * 0.95)]
+    print(f"{len(wpisy)} wpisów x {args.powtorzenia}: p50 {p50:.2f} ms, p95 {p95:.2f} ms, "
+          f"maks {czasy[-1]:.2f} ms (pierwsze zapytania: maks {zimne[-1]:.2f} ms), próg {PROG_MS:.0f} ms")
+    return 1 if bledy or p95 > PROG_MS else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
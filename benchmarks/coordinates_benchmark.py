@@ -0,0 +1,106 @@
+"""
+Benchmark parsera współrzędnych (utils.coordinates)
+
+Korpus zawiera typowe wpisy użytkowników: pary dziesiętne, DMS, PUWG 1992,
+linki Google Maps/OSM oraz adresy, które nie mogą zostać odczytane jako współrzędne.
+
+Uruchomienie: python -m benchmarks.coordinates_benchmark [--powtorzenia N]
+"""
+
+import argparse
+import sys
+import time
+
+from utils.coordinates import parsuj_wspolrzedne
+
+
+# Pałac Kultury i Nauki w Warszawie
+PKIN = (21.0122, 52.2297)
+PKIN_DMS = (21.0 + 44 / 3600, 52 + 13 / 60 + 47 / 3600)
+PKIN_2180 = (21.006704, 52.231977)
+
+# (wpis, oczekiwane (lon, lat) lub None, tolerancja w stopniach)
+KORPUS = [
+    ("52.2297 21.0122", PKIN, 1e-9),
+    ("52.2297, 21.0122", PKIN, 1e-9),
+    ("52,2297 21,0122", PKIN, 1e-9),
+    ("52,2297; 21,0122", PKIN, 1e-9),
+    ("21.0122 52.2297", PKIN, 1e-9),
+    ("52.2297N 21.0122E", PKIN, 1e-9),
+    ("N52.2297 E21.0122", PKIN, 1e-9),
+    ("E 21.0122 N 52.2297", PKIN, 1e-9),
+    ("52.2297° N, 21.0122° E", PKIN, 1e-9),
+    ("52°13'47\"N 21°0'44\"E", PKIN_DMS, 1e-9),
+    ("52°13′47″N 21°00′44″E", PKIN_DMS, 1e-9),
+    ("52° 13' 47'' N, 21° 00' 44'' E", PKIN_DMS, 1e-9),
+    ("N 52°13.7833' E 21°0.7333'", PKIN_DMS, 1e-5),
+    ("52 13 47 N 21 0 44 E", PKIN_DMS, 1e-9),
+    ("X=487000 Y=637000", PKIN_2180, 1e-5),
+    ("Y=637000 X=487000", PKIN_2180, 1e-5),
+    ("x: 487000,00 y: 637000,00", PKIN_2180, 1e-5),
+    ("487000 637000", PKIN_2180, 1e-5),
+    ("PUWG 1992: 487000 637000", PKIN_2180, 1e-5),
+    ("EPSG:2180 487000 637000", PKIN_2180, 1e-5),
+    ("https://www.google.com/maps/@52.2297,21.0122,15z", PKIN, 1e-9),
+    ("https://www.google.com/maps/place/Pa%C5%82ac+Kultury+i+Nauki/@52.2318,21.0060,17z"
+     "/data=!3m1!4b1!4m6!3m5!1s0x471ecc8c92692e49:0xc2e97ae5311f2dc2!8m2!3d52.2297!4d21.0122", PKIN, 1e-9),
+    ("https://www.google.com/maps?q=52.2297,21.0122", PKIN, 1e-9),
+    ("https://maps.google.com/?ll=52.2297,21.0122&z=14", PKIN, 1e-9),
+    ("https://www.google.com/maps/search/52.2297,+21.0122", PKIN, 1e-9),
+    ("https://www.google.com/maps/place/52%C2%B013'47.0%22N+21%C2%B000'44.0%22E", PKIN_DMS, 1e-9),
+    ("https://www.google.com/maps/dir/?api=1&destination=52.2297%2C21.0122", PKIN, 1e-9),
+    ("https://www.openstreetmap.org/#map=17/52.2297/21.0122", PKIN, 1e-9),
+    ("https://www.openstreetmap.org/?mlat=52.2297&mlon=21.0122#map=17/52.2297/21.0122", PKIN, 1e-9),
+    ("https://www.openstreetmap.org/directions?lat=52.2297&lon=21.0122", PKIN, 1e-9),
+    ("geo:52.2297,21.0122?z=17", PKIN, 1e-9),
+    ("geo:52.2297,21.0122,110;u=35", PKIN, 1e-9),
+    ("3 Maja 5 Warszawa", None, 0),
+    ("ul. Marszałkowska 10, Warszawa", None, 0),
+    ("Aleje Jerozolimskie 123A, 00-001 Warszawa", None, 0),
+    ("11 Listopada 3 Kraków", None, 0),
+    ("Plac Defilad 1", None, 0),
+    ("Warszawa", None, 0),
+    ("https://maps.app.goo.gl/xyz123", None, 0),
+    ("200 300", None, 0),
+]
+
+
+def sprawdz_korpus():
+    """Zwraca listę wpisów, dla których wynik różni się od oczekiwanego."""
+    bledy = []
+    for wpis, oczekiwane, tolerancja in KORPUS:
+        lon, lat = parsuj_wspolrzedne(wpis)
+        if oczekiwane is None:
+            if lon is not None:
+                bledy.append((wpis, oczekiwane, (lon, lat)))
+        elif lon is None or abs(lon - oczekiwane[0]) > tolerancja or abs(lat - oczekiwane[1]) > tolerancja:
+            bledy.append((wpis, oczekiwane, (lon, lat)))
+    return bledy
+
+
+def zmierz(powtorzenia):
+    """Średni czas parsowania jednego wpisu korpusu (µs)."""
+    wpisy = [wpis for wpis, _, _ in KORPUS]
+    start = time.perf_counter()
+    for _ in range(powtorzenia):
+        for wpis in wpisy:
+            parsuj_wspolrzedne(wpis)
+    return (time.perf_counter() - start) / (powtorzenia * len(wpisy)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parsera współrzędnych')
+    parser.add_argument('--powtorzenia', type=int, default=200)
+    args = parser.parse_args()
+
+    bledy = sprawdz_korpus()
+    for wpis, oczekiwane, wynik in bledy:
+        print(f"NIEZGODNOŚĆ: {wpis!r}: oczekiwano {oczekiwane}, otrzymano {wynik}")
+    zmierz(1)
+    print(f"{len(KORPUS)} wpisów, {len(bledy)} niezgodności, "
+          f"średnio {zmierz(args.powtorzenia):.1f} µs na wpis")
+    return 1 if bledy else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Benchmark i walidacja jądra NumPy EPSG:2180 (utils.crs) względem pyproj
+
+Sprawdza maksymalną różnicę obu implementacji na losowych punktach z obszaru
+Polski (z marginesem) i porównuje czasy przeliczenia tablic różnej wielkości.
+
+Uruchomienie: python -m benchmarks.crs_benchmark [--punkty N]
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from utils.crs import (
+    PUWG1992,
+    WGS84,
+    epsg2180_do_wgs84_numpy,
+    transformuj,
+    wgs84_do_epsg2180_numpy,
+)
+
+
+# Dopuszczalna różnica względem pyproj (m)
+TOLERANCJA_M = 0.001
+ROZMIARY = (1, 10, 100, 1000, 2000, 10000, 100000, 1000000)
+
+
+def sprawdz_dokladnosc(liczba_punktow, ziarno=0):
+    """
+    Returns:
+        tuple: (maks. różnica odwzorowania w m, maks. różnica odwrotnego w m)
+    """
+    losowe = np.random.default_rng(ziarno)
+    lon = losowe.uniform(13.5, 24.5, liczba_punktow)
+    lat = losowe.uniform(48.5, 55.2, liczba_punktow)
+    x_ref, y_ref = transformuj(WGS84, PUWG1992, lon, lat)
+    x, y = wgs84_do_epsg2180_numpy(lon, lat)
+    blad_wprost = max(np.abs(x - x_ref).max(), np.abs(y - y_ref).max())
+
+    lon_ref, lat_ref = transformuj(PUWG1992, WGS84, x_ref, y_ref)
+    lon_np, lat_np = epsg2180_do_wgs84_numpy(x_ref, y_ref)
+    # Różnica kątowa przeliczona na metry w terenie
+    metry_na_stopien = 111320.0
+    blad_odwrotny = max(
+        (np.abs(lon_np - lon_ref) * np.cos(np.radians(lat_ref))).max() * metry_na_stopien,
+        np.abs(lat_np - lat_ref).max() * metry_na_stopien,
+    )
+    return float(blad_wprost), float(blad_odwrotny)
+
+
+def _czas(funkcja, a, b):
+    """Najlepszy czas (s) z kilku powtórzeń, łącznie co najmniej ~0.2 s."""
+    powtorzenia = max(1, int(200000 / max(1, a.size)))
+    najlepszy = float('inf')
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(powtorzenia):
+            funkcja(a, b)
+        najlepszy = min(najlepszy, (time.perf_counter() - start) / powtorzenia)
+    return najlepszy
+
+
+def zmierz(rozmiary=ROZMIARY, ziarno=1):
+    """Wypisuje czasy pyproj i NumPy w obu kierunkach dla tablic podanych rozmiarów."""
+    losowe = np.random.default_rng(ziarno)
+    print(f"{'punkty':>9} | {'pyproj ->2180':>13} {'numpy ->2180':>13} | {'pyproj ->4326':>13} {'numpy ->4326':>13}")
+    for rozmiar in rozmiary:
+        lon = losowe.uniform(14.0, 24.2, rozmiar)
+        lat = losowe.uniform(49.0, 54.9, rozmiar)
+        x, y = transformuj(WGS84, PUWG1992, lon, lat)
+        czasy = (
+            _czas(lambda a, b: transformuj(WGS84, PUWG1992, a, b), lon, lat),
+            _czas(wgs84_do_epsg2180_numpy, lon, lat),
+            _czas(lambda a, b: transformuj(PUWG1992, WGS84, a, b), x, y),
+            _czas(epsg2180_do_wgs84_numpy, x, y),
+        )
+        print(f"{rozmiar:>9} | " + ' '.join(
+            f"{c * 1e3:>10.3f} ms" + (' |' if i == 1 else '') for i, c in enumerate(czasy)
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Walidacja i benchmark jądra NumPy EPSG:2180')
+    parser.add_argument('--punkty', type=int, default=1000000, help='Liczba punktów walidacji')
+    args = parser.parse_args()
+
+    blad_wprost, blad_odwrotny = sprawdz_dokladnosc(args.punkty)
+    print(f"Różnica względem pyproj ({args.punkty} punktów): WGS84->2180 {blad_wprost * 1000:.6f} mm, "
+          f"2180->WGS84 {blad_odwrotny * 1000:.6f} mm")
+    zmierz()
+    return 0 if max(blad_wprost, blad_odwrotny) <= TOLERANCJA_M else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
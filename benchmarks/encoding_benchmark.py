@@ -0,0 +1,81 @@
+"""
+Benchmark kodowania obrazu mapy (utils.image_encoding) na mapie demonstracyjnej
+
+Dla każdego wariantu (WebP, JPEG z różną jakością, PNG z różnym poziomem kompresji)
+podaje najlepszy czas kodowania, rozmiar pliku i rozmiar po base64 (JSON bez migawek).
+
+Uruchomienie: python -m benchmarks.encoding_benchmark [--obraz PLIK] [--powtorzenia N] [--metoda-webp 0-6]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from PIL import Image
+
+from utils import image_encoding
+from utils.image_encoding import UstawieniaKodowania, koduj_obraz
+
+
+DOMYSLNY_OBRAZ = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'images', 'demo_map.png'
+)
+WARIANTY = (
+    UstawieniaKodowania('png', None, 9, False),
+    UstawieniaKodowania('png', None, 6, False),
+    UstawieniaKodowania('png', None, 3, False),
+    UstawieniaKodowania('png', None, 1, False),
+    UstawieniaKodowania('png', None, 0, False),
+    UstawieniaKodowania('jpeg', 95, None, False),
+    UstawieniaKodowania('jpeg', 85, None, False),
+    UstawieniaKodowania('jpeg', 75, None, False),
+    UstawieniaKodowania('webp', 90, None, False),
+    UstawieniaKodowania('webp', 85, None, False),
+    UstawieniaKodowania('webp', 75, None, False),
+)
+
+
+def zmierz(img, ustawienia, powtorzenia):
+    """
+    Returns:
+        tuple: (najlepszy czas kodowania w s, rozmiar w bajtach)
+    """
+    najlepszy = float('inf')
+    dane = b''
+    for _ in range(powtorzenia):
+        start = time.perf_counter()
+        dane, _ = koduj_obraz(img, ustawienia)
+        najlepszy = min(najlepszy, time.perf_counter() - start)
+    return najlepszy, len(dane)
+
+
+def opis(ustawienia):
+    if ustawienia.format == 'png':
+        return f"png kompresja {ustawienia.kompresja}"
+    return f"{ustawienia.format} jakość {ustawienia.jakosc}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Czas i rozmiar kodowania obrazu mapy')
+    parser.add_argument('--obraz', default=DOMYSLNY_OBRAZ, help='Obraz do kodowania')
+    parser.add_argument('--powtorzenia', type=int, default=5, help='Powtórzenia każdego wariantu')
+    parser.add_argument('--metoda-webp', type=int, default=image_encoding.METODA_WEBP,
+                        help='Metoda WebP 0-6 (wyższa - mniejszy plik, wolniej)')
+    args = parser.parse_args()
+    image_encoding.METODA_WEBP = args.metoda_webp
+
+    img = Image.open(args.obraz)
+    img.load()
+    print(f"{args.obraz}: {img.width}x{img.height} {img.mode}, plik {os.path.getsize(args.obraz) / 1024:.0f} KB, "
+          f"metoda WebP {args.metoda_webp}")
+    print(f"{'wariant':<22} | {'czas':>9} | {'rozmiar':>9} | {'base64':>9}")
+    for ustawienia in WARIANTY:
+        czas, rozmiar = zmierz(img, ustawienia, args.powtorzenia)
+        base64_kb = 4 * ((rozmiar + 2) // 3) / 1024
+        print(f"{opis(ustawienia):<22} | {czas * 1e3:>6.1f} ms | {rozmiar / 1024:>6.0f} KB | {base64_kb:>6.0f} KB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
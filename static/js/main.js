@@ -8,7 +8,8 @@ const CONFIG = {
     canvasWidth: 800,
     canvasHeight: 600,
     punktRadius: 5,
-    liniaWidth: 2
+    liniaWidth: 2,
+    podpowiedziOpoznienieMs: 150
 };
 
 // Kolory elementów
@@ -29,7 +30,9 @@ const state = {
     punktA: null,
     punktB: null,
     trybWyboru: null, // null, 'punkt_a', 'punkt_b'
-    wyniki: null
+    wyniki: null,
+    podpowiedzi: new Map(), // etykieta podpowiedzi -> "lat lon"
+    podpowiedziTimer: null
 };
 
 // Elementy DOM
@@ -50,7 +53,10 @@ const elements = {
     obliczBtn: null,
     resultsSection: null,
     loadingOverlay: null,
-    roofPlanInput: null
+    roofPlanInput: null,
+    kandydaciRow: null,
+    kandydaciSelect: null,
+    podpowiedziLista: null
 };
 
 /**
@@ -75,6 +81,9 @@ function init() {
     elements.obliczBtn = document.getElementById('oblicz-btn');
     elements.resultsSection = document.getElementById('results-section');
     elements.loadingOverlay = document.getElementById('loading-overlay');
+    elements.kandydaciRow = document.getElementById('kandydaci-row');
+    elements.kandydaciSelect = document.getElementById('kandydaci-select');
+    elements.podpowiedziLista = document.getElementById('podpowiedzi-adresow');
 
     // Dodaj event listenery
     elements.zaladujMapeBtn.addEventListener('click', zaladujMape);
@@ -103,6 +112,17 @@ function init() {
         }
     });
 
+    if (elements.podpowiedziLista) {
+        elements.wspolrzedneInput.addEventListener('input', () => {
+            clearTimeout(state.podpowiedziTimer);
+            state.podpowiedziTimer = setTimeout(pobierzPodpowiedzi, CONFIG.podpowiedziOpoznienieMs);
+        });
+    }
+
+    if (elements.kandydaciSelect) {
+        elements.kandydaciSelect.addEventListener('change', wybierzKandydata);
+    }
+
     if (elements.mapSourceSelect) {
         elements.mapSourceSelect.addEventListener('change', aktualizujPoleGoogleApi);
         aktualizujPoleGoogleApi();
@@ -149,9 +169,17 @@ function zaladujZrzutDachu(event) {
 
 /**
  * Ładowanie mapy z Geoportalu
+ *
+ * @param {string} [wspolrzedneKandydata] - "lat lon" wybranego kandydata adresu
+ *     (bez ponownego geokodowania i bez zmiany listy kandydatów)
  */
-async function zaladujMape() {
-    const wspolrzedne = elements.wspolrzedneInput.value.trim();
+async function zaladujMape(wspolrzedneKandydata) {
+    const wybranoKandydata = typeof wspolrzedneKandydata === 'string';
+    let wspolrzedne = wybranoKandydata ? wspolrzedneKandydata : elements.wspolrzedneInput.value.trim();
+    // Wybrana podpowiedź ma już współrzędne - bez geokodowania
+    if (!wybranoKandydata && state.podpowiedzi.has(wspolrzedne)) {
+        wspolrzedne = state.podpowiedzi.get(wspolrzedne);
+    }
     const mapSource = elements.mapSourceSelect ? elements.mapSourceSelect.value : 'geoportal';
     const googleApiKey = elements.googleApiKeyInput ? elements.googleApiKeyInput.value.trim() : '';
 
@@ -166,7 +194,8 @@ async function zaladujMape() {
         const response = await fetch('/api/get_map', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'Accept': 'application/json, image/webp, image/jpeg, image/png'
             },
             body: JSON.stringify({
                 wspolrzedne: wspolrzedne,
@@ -194,7 +223,11 @@ async function zaladujMape() {
                     pokazKomunikat('Mapa załadowana pomyślnie', 'success');
                 }
             };
-            img.src = 'data:image/png;base64,' + data.image;
+            img.src = data.image_url || ('data:' + (data.mime || 'image/png') + ';base64,' + data.image);
+
+            if (!wybranoKandydata) {
+                pokazKandydatow(data.kandydaci || []);
+            }
 
             // Wyczyść poprzednie dane
             resetujPunkty();
@@ -209,6 +242,54 @@ async function zaladujMape() {
     }
 }
 
+/**
+ * Podpowiedzi adresów dla wpisywanego tekstu (lokalny indeks na serwerze)
+ */
+async function pobierzPodpowiedzi() {
+    const zapytanie = elements.wspolrzedneInput.value.trim();
+    if (zapytanie.length < 2 || state.podpowiedzi.has(zapytanie)) {
+        return;
+    }
+    try {
+        const response = await fetch('/api/autocomplete?q=' + encodeURIComponent(zapytanie));
+        const data = await response.json();
+        if (!data.success || elements.wspolrzedneInput.value.trim() !== zapytanie) {
+            return;
+        }
+        state.podpowiedzi = new Map();
+        elements.podpowiedziLista.innerHTML = '';
+        data.podpowiedzi.forEach((podpowiedz) => {
+            state.podpowiedzi.set(podpowiedz.etykieta, `${podpowiedz.lat} ${podpowiedz.lon}`);
+            const opcja = document.createElement('option');
+            opcja.value = podpowiedz.etykieta;
+            elements.podpowiedziLista.appendChild(opcja);
+        });
+    } catch (error) {
+        console.error('Błąd podpowiedzi:', error);
+    }
+}
+
+/**
+ * Lista kandydatów geokodowania adresu - pokazywana, gdy jest z czego wybierać
+ */
+function pokazKandydatow(kandydaci) {
+    if (!elements.kandydaciSelect) {
+        return;
+    }
+    elements.kandydaciSelect.innerHTML = '';
+    kandydaci.forEach((kandydat) => {
+        const opcja = document.createElement('option');
+        opcja.value = `${kandydat.lat} ${kandydat.lon}`;
+        opcja.textContent = `${kandydat.display_name} (ocena ${kandydat.ocena.toFixed(1)})`;
+        elements.kandydaciSelect.appendChild(opcja);
+    });
+    elements.kandydaciRow.style.display = kandydaci.length > 1 ? '' : 'none';
+}
+
+function wybierzKandydata() {
+    zaladujMape(elements.kandydaciSelect.value);
+}
+
 function aktualizujPoleGoogleApi() {
     if (!elements.googleApiKeyInput || !elements.mapSourceSelect) {
         return;
@@ -0,0 +1,42 @@
+from utils import autocomplete
+from utils.autocomplete import MAKS_SKANOWANYCH, IndeksPodpowiedzi
+
+
+def test_szeroki_prefiks_wybiera_najciezsze_wpisy():
+    podpowiedzi = IndeksPodpowiedzi()
+    # Alfabetycznie pierwsze wpisy są lekkie - najcięższy jest na końcu zakresu
+    for numer in range(MAKS_SKANOWANYCH * 2):
+        podpowiedzi.dodaj(f"Aleja {numer:05d}", 21.0, 52.0, ulica=f"Aleja {numer:05d}")
+    podpowiedzi.dodaj('Azaliowa', 21.0, 52.0, ulica='Azaliowa', waga=500)
+    podpowiedzi.zakoncz()
+
+    etykiety = [p['etykieta'] for p in podpowiedzi.podpowiedz('a')]
+    assert etykiety[0] == 'Azaliowa'
+
+
+def test_powtorzona_etykieta_zwieksza_wage():
+    podpowiedzi = IndeksPodpowiedzi()
+    podpowiedzi.dodaj('Polna, Kraków', 19.9, 50.0, ulica='Polna', miejscowosc='Kraków')
+    podpowiedzi.dodaj('Polna, Gdańsk', 18.6, 54.3, ulica='Polna', miejscowosc='Gdańsk')
+    podpowiedzi.dodaj('Polna, Gdańsk', 18.6, 54.3, ulica='Polna', miejscowosc='Gdańsk')
+    podpowiedzi.zakoncz()
+
+    assert len(podpowiedzi) == 2
+    assert [p['etykieta'] for p in podpowiedzi.podpowiedz('polna')] == ['Polna, Gdańsk', 'Polna, Kraków']
+
+
+def test_blad_budowy_nie_jest_ponawiany_przy_kazdym_zadaniu(monkeypatch):
+    proby = []
+
+    def zepsuty_indeks():
+        proby.append(1)
+        raise OSError('brak pliku indeksu')
+
+    monkeypatch.setattr(autocomplete, 'pobierz_indeks_adresow', zepsuty_indeks)
+    monkeypatch.setattr(autocomplete, '_domyslny_indeks', None)
+    monkeypatch.setattr(autocomplete, '_blad_budowy', False)
+    monkeypatch.setattr(autocomplete, '_zbudowano', 0.0)
+
+    for _ in range(5):
+        assert autocomplete.podpowiedz_adresy('polna') == []
+    assert len(proby) == 1
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+import requests
+
+from utils import batch_geocoder
+from utils.geocode_cache import ustaw_cache_geokodowania
+from utils.geocode_engine import BladGeokodowania, SilnikGeokodowania, ustaw_silnik_geokodowania
+from utils.offline_geocoder import ustaw_indeks_adresow
+
+
+def _blad_429(adres, anuluj):
+    odpowiedz = requests.Response()
+    odpowiedz.status_code = 429
+    odpowiedz.headers['Retry-After'] = '3'
+    raise requests.HTTPError('429', response=odpowiedz)
+
+
+def _silnik_czesciowo_zawodny():
+    return SilnikGeokodowania([
+        ('offline', 0, lambda adres, anuluj: []),
+        ('nominatim', 0, _blad_429),
+    ])
+
+
+class OgranicznikTestowy:
+    def __init__(self):
+        self.wstrzymania = []
+
+    def pobierz(self, anuluj=None):
+        return True
+
+    def wstrzymaj(self, sekundy):
+        self.wstrzymania.append(sekundy)
+
+
+@pytest.fixture
+def bez_zrodel_lokalnych():
+    ustaw_indeks_adresow(None)
+    ustaw_cache_geokodowania(None)
+    yield
+    ustaw_silnik_geokodowania(None)
+
+
+def test_brak_kandydatow_przy_bledzie_zrodla_zglasza_blad():
+    wynik = _silnik_czesciowo_zawodny().szukaj('Długa 5 Warszawa')
+    assert wynik.kandydaci == [] and 'nominatim' in wynik.bledy
+
+    with pytest.raises(BladGeokodowania) as blad:
+        _silnik_czesciowo_zawodny().szukaj('Długa 5 Warszawa', zglaszaj_bledy=True)
+    assert blad.value.response.status_code == 429
+
+
+def test_pusty_wynik_bez_bledow_nie_jest_bledem():
+    silnik = SilnikGeokodowania([('offline', 0, lambda adres, anuluj: [])])
+    assert silnik.szukaj('Długa 5 Warszawa', zglaszaj_bledy=True).kandydaci == []
+
+
+def test_wsadowo_czesciowy_blad_nie_trafia_do_postepu(tmp_path, bez_zrodel_lokalnych):
+    ustaw_silnik_geokodowania(_silnik_czesciowo_zawodny())
+    ogranicznik = OgranicznikTestowy()
+    postep = tmp_path / 'zadanie.jsonl'
+
+    wyniki = list(batch_geocoder.geokoduj_wsadowo(['Długa 5 Warszawa'], str(postep), ogranicznik))
+
+    assert [w['zrodlo'] for w in wyniki] == ['blad']
+    assert ogranicznik.wstrzymania == [3.0] * batch_geocoder.MAKS_PROB
+    assert not postep.read_text(encoding='utf-8')
+
+    # Po ustąpieniu błędu wznowienie pyta źródła ponownie
+    ustaw_silnik_geokodowania(SilnikGeokodowania([
+        ('nominatim', 0, lambda adres, anuluj: [{'lat': '52.25', 'lon': '21.0', 'display_name': adres}]),
+    ]))
+    wyniki = list(batch_geocoder.geokoduj_wsadowo(['Długa 5 Warszawa'], str(postep), ogranicznik))
+    assert [(w['zrodlo'], w['lon'], w['lat']) for w in wyniki] == [('siec', 21.0, 52.25)]
+    zapisane = [json.loads(w) for w in postep.read_text(encoding='utf-8').splitlines()]
+    assert [z['wynik'] for z in zapisane] == [[21.0, 52.25]]
@@ -0,0 +1,23 @@
+import pytest
+
+from benchmarks.coordinates_benchmark import KORPUS, PKIN
+from utils.coordinates import parsuj_wspolrzedne
+
+
+@pytest.mark.parametrize('wpis, oczekiwane, tolerancja', KORPUS)
+def test_korpus(wpis, oczekiwane, tolerancja):
+    lon, lat = parsuj_wspolrzedne(wpis)
+    if oczekiwane is None:
+        assert (lon, lat) == (None, None)
+    else:
+        assert lon == pytest.approx(oczekiwane[0], abs=tolerancja)
+        assert lat == pytest.approx(oczekiwane[1], abs=tolerancja)
+
+
+@pytest.mark.parametrize('wpis', [None, 52.2297, '', '   ', '1' * 5000])
+def test_wpisy_niebedace_tekstem_wspolrzednych(wpis):
+    assert parsuj_wspolrzedne(wpis) == (None, None)
+
+
+def test_bialy_znak_wokol_wpisu():
+    assert parsuj_wspolrzedne('  52.2297 21.0122\n') == PKIN
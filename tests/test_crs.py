@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from benchmarks.crs_benchmark import TOLERANCJA_M, sprawdz_dokladnosc
+from utils import crs
+from utils.crs import (
+    PUWG1992,
+    WGS84,
+    epsg2180_do_wgs84_numpy,
+    epsg2180_do_wgs84_wsadowo,
+    transformuj,
+    wgs84_do_epsg2180_numpy,
+    wgs84_do_epsg2180_wsadowo,
+)
+
+
+def test_jadro_zgodne_z_pyproj():
+    blad_wprost, blad_odwrotny = sprawdz_dokladnosc(20000)
+    assert blad_wprost < TOLERANCJA_M
+    assert blad_odwrotny < TOLERANCJA_M
+
+
+def test_punkt_referencyjny():
+    # Pałac Kultury i Nauki
+    x, y = wgs84_do_epsg2180_numpy(np.array([21.0122]), np.array([52.2297]))
+    x_ref, y_ref = transformuj(WGS84, PUWG1992, 21.0122, 52.2297)
+    assert x[0] == pytest.approx(x_ref, abs=1e-6)
+    assert y[0] == pytest.approx(y_ref, abs=1e-6)
+
+
+def test_bloki_i_ksztalt_tablicy(monkeypatch):
+    monkeypatch.setattr(crs, 'ROZMIAR_BLOKU_NUMPY', 7)
+    losowe = np.random.default_rng(1)
+    lon = losowe.uniform(14.0, 24.0, (5, 9))
+    lat = losowe.uniform(49.0, 55.0, (5, 9))
+
+    x, y = wgs84_do_epsg2180_numpy(lon, lat)
+    assert x.shape == (5, 9)
+    lon_2, lat_2 = epsg2180_do_wgs84_numpy(x, y)
+    np.testing.assert_allclose(lon_2, lon, atol=1e-9)
+    np.testing.assert_allclose(lat_2, lat, atol=1e-9)
+
+
+@pytest.mark.parametrize('prog', ['0', '1', 'błędny'])
+def test_wsadowo_niezaleznie_od_progu(monkeypatch, prog):
+    monkeypatch.setenv('ROOF_CRS_NUMPY_MIN', prog)
+    lon, lat = np.array([14.5, 21.0122, 23.9]), np.array([49.1, 52.2297, 54.7])
+    x_ref, y_ref = transformuj(WGS84, PUWG1992, lon, lat)
+
+    x, y = wgs84_do_epsg2180_wsadowo(lon, lat)
+    np.testing.assert_allclose(x, x_ref, atol=TOLERANCJA_M)
+    np.testing.assert_allclose(y, y_ref, atol=TOLERANCJA_M)
+    lon_2, lat_2 = epsg2180_do_wgs84_wsadowo(x, y)
+    np.testing.assert_allclose(lon_2, lon, atol=1e-8)
+    np.testing.assert_allclose(lat_2, lat, atol=1e-8)
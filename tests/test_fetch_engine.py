@@ -0,0 +1,50 @@
+import threading
+import time
+
+from utils.fetch_engine import SilnikPobierania, limit_hosta
+
+
+class Licznik:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.teraz = 0
+        self.maks = 0
+
+    def __enter__(self):
+        with self._lock:
+            self.teraz += 1
+            self.maks = max(self.maks, self.teraz)
+
+    def __exit__(self, *args):
+        with self._lock:
+            self.teraz -= 1
+
+
+def test_limit_hosta_obejmuje_tylko_zadanie_sieciowe():
+    silnik = SilnikPobierania(maks_watkow=8, limit_na_hosta=2)
+    siec, cache = Licznik(), Licznik()
+    bariera = threading.Barrier(6, timeout=5)
+
+    def pobierz(numer):
+        if numer < 6:
+            # Trafienie w cache - wszystkie naraz, mimo zajętego limitu hosta
+            with cache:
+                bariera.wait()
+            return 'cache'
+        with limit_hosta('example.org'), siec:
+            time.sleep(0.02)
+        return 'siec'
+
+    zadania = [(numer, pobierz, (numer,)) for numer in range(12)]
+    wyniki = dict(silnik.pobierz_wszystkie(zadania))
+    silnik.zamknij()
+
+    assert sorted(wyniki.values()) == ['cache'] * 6 + ['siec'] * 6
+    assert cache.maks == 6
+    assert siec.maks == 2
+
+
+def test_limit_hosta_poza_pula_uzywa_wspoldzielonego_silnika():
+    semafor = limit_hosta('example.org')
+    assert semafor is limit_hosta('example.org')
+    assert semafor is not SilnikPobierania(1, 1).limit_hosta('example.org')
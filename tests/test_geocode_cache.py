@@ -0,0 +1,11 @@
+from utils.geocode_cache import normalizuj_adres, tokeny_adresu
+
+
+def test_skroty_ujednolicone():
+    assert normalizuj_adres('ul. Aleja Róż 5') == normalizuj_adres('al. Róż 5')
+    assert normalizuj_adres('ulica Długa 5, Polska') == 'dluga 5'
+
+
+def test_inicjal_m_nie_jest_pomijany():
+    assert normalizuj_adres('M. Skłodowskiej-Curie 1') != normalizuj_adres('Skłodowskiej-Curie 1')
+    assert tokeny_adresu('M. Skłodowskiej-Curie 1') == (['m', 'sklodowskiej', 'curie'], ['1'])
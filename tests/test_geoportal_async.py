@@ -0,0 +1,201 @@
+import asyncio
+import io
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from PIL import Image
+
+from utils import fetch_engine, geoportal, image_cache, tile_cache, tile_pack
+from utils.fetch_engine import SilnikPobierania, host_z_url, limit_hosta
+from utils.geocode_engine import SilnikGeokodowania
+from utils.geoportal_async import pobierz_mape_dla_obszaru_async, uruchom, zloz_okno_wmts_async
+from utils.hedge import StatystykiWyscigu, wyscig_async
+from utils.http_session import zamknij_sesje_http_async
+
+
+def _jpeg(rozmiar):
+    bufor = io.BytesIO()
+    Image.new('RGB', (rozmiar, rozmiar), 'green').save(bufor, 'JPEG')
+    return bufor.getvalue()
+
+
+KAFELEK = _jpeg(geoportal.WMTS_TILE_SIZE)
+
+
+class Serwis:
+    """Lokalny serwis WMTS/WMS liczący równoczesne żądania."""
+
+    def __init__(self, opoznienie_wms=0.0, status_wms=200):
+        self.opoznienie_wms = opoznienie_wms
+        self.status_wms = status_wms
+        self.zadania = 0
+        self.teraz = 0
+        self.maks = 0
+        app = web.Application()
+        app.router.add_get('/wmts', self.wmts)
+        app.router.add_get('/wms', self.wms)
+        self.serwer = TestServer(app)
+
+    async def wmts(self, request):
+        self.zadania += 1
+        self.teraz += 1
+        self.maks = max(self.maks, self.teraz)
+        try:
+            await asyncio.sleep(0.02)
+        finally:
+            self.teraz -= 1
+        return web.Response(body=KAFELEK, content_type='image/jpeg')
+
+    async def wms(self, request):
+        await asyncio.sleep(self.opoznienie_wms)
+        if self.status_wms != 200:
+            return web.Response(status=self.status_wms)
+        return web.Response(body=_jpeg(64), content_type='image/jpeg')
+
+    def podlacz(self, monkeypatch):
+        monkeypatch.setattr(geoportal, 'GEOPORTAL_WMTS_URL', str(self.serwer.make_url('/wmts')))
+        monkeypatch.setattr(geoportal, 'GEOPORTAL_WMS_URL', str(self.serwer.make_url('/wms')))
+
+
+@pytest.fixture(autouse=True)
+def bez_cache(monkeypatch):
+    monkeypatch.setattr(image_cache, '_domyslna_pamiec', False)
+    monkeypatch.setattr(tile_cache, '_domyslny_cache', False)
+    monkeypatch.setattr(tile_pack, '_domyslne_paczki', False)
+    monkeypatch.setattr(fetch_engine, '_domyslny_silnik', SilnikPobierania(maks_watkow=1, limit_na_hosta=2))
+    monkeypatch.setattr(geoportal, 'STATYSTYKI_HEDGE', StatystykiWyscigu())
+
+
+def test_mozaika_async_w_limicie_hosta(monkeypatch):
+    serwis = Serwis()
+
+    async def scenariusz():
+        await serwis.serwer.start_server()
+        serwis.podlacz(monkeypatch)
+        try:
+            return await zloz_okno_wmts_async(0, 0, 1500, 1500, 14)
+        finally:
+            await zamknij_sesje_http_async()
+            await serwis.serwer.close()
+
+    mapa = asyncio.run(scenariusz())
+    assert mapa.size == (1500, 1500)
+    assert serwis.zadania == 9
+    assert serwis.maks == 2
+
+
+def test_limit_hosta_wspolny_z_watkami(monkeypatch):
+    serwis = Serwis()
+
+    async def scenariusz():
+        await serwis.serwer.start_server()
+        serwis.podlacz(monkeypatch)
+        semafor = limit_hosta(host_z_url(geoportal.GEOPORTAL_WMTS_URL))
+        # Oba miejsca limitu zajęte przez wątki - pętla czeka, nie wysyła żądań
+        semafor.acquire()
+        semafor.acquire()
+        try:
+            zadanie = asyncio.ensure_future(zloz_okno_wmts_async(0, 0, 512, 512, 14))
+            await asyncio.sleep(0.1)
+            przed_zwolnieniem = serwis.zadania
+        finally:
+            semafor.release()
+            semafor.release()
+        try:
+            return przed_zwolnieniem, await zadanie
+        finally:
+            await zamknij_sesje_http_async()
+            await serwis.serwer.close()
+
+    przed_zwolnieniem, mapa = asyncio.run(scenariusz())
+    assert przed_zwolnieniem == 0
+    assert mapa is not None
+
+
+def test_wyscig_async_anuluje_przegrana_sciezke():
+    anulowane = []
+
+    async def wolna():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            anulowane.append('wolna')
+            raise
+
+    async def szybka():
+        await asyncio.sleep(0.01)
+        return 'wynik'
+
+    statystyki = StatystykiWyscigu()
+    t0 = time.monotonic()
+    wynik = asyncio.run(wyscig_async([('wolna', 0.0, wolna), ('szybka', 0.0, szybka)], statystyki))
+
+    assert wynik == ('szybka', 'wynik')
+    assert time.monotonic() - t0 < 1
+    assert anulowane == ['wolna']
+    assert statystyki.statystyki()['wolna']['anulowane'] == 1
+
+
+def test_wyscig_async_startuje_nastepna_po_bledzie():
+    async def blad():
+        return None
+
+    async def zapasowa():
+        return 'zapas'
+
+    wynik = asyncio.run(wyscig_async([('blad', 0.0, blad), ('zapasowa', float('inf'), zapasowa)]))
+    assert wynik == ('zapasowa', 'zapas')
+
+
+def test_wms_przegrywa_z_wmts(monkeypatch):
+    serwis = Serwis(opoznienie_wms=5)
+
+    async def scenariusz():
+        await serwis.serwer.start_server()
+        serwis.podlacz(monkeypatch)
+        try:
+            return await pobierz_mape_dla_obszaru_async(21.0, 52.0, 256, 256, hedge_opoznienie=0)
+        finally:
+            await zamknij_sesje_http_async()
+            await serwis.serwer.close()
+
+    t0 = time.monotonic()
+    mapa = asyncio.run(scenariusz())
+    assert mapa is not None and mapa.size == (256, 256)
+    assert time.monotonic() - t0 < 2
+    assert geoportal.STATYSTYKI_HEDGE.statystyki()['wms']['anulowane'] == 1
+
+
+def test_api_synchroniczne_przez_petle_w_tle(monkeypatch):
+    monkeypatch.setenv('ROOF_ASYNC_FETCH', '1')
+    serwis = Serwis(status_wms=500)
+    uruchom(serwis.serwer.start_server())
+    serwis.podlacz(monkeypatch)
+    try:
+        mapa, lon, lat, blad = geoportal.pobierz_mape_dla_wspolrzednych(
+            '52.2297, 21.0122', 256, 256, return_error=True
+        )
+    finally:
+        uruchom(serwis.serwer.close())
+
+    assert blad is None
+    assert mapa.size == (256, 256)
+    assert (round(lon, 4), round(lat, 4)) == (21.0122, 52.2297)
+    assert serwis.zadania > 0
+
+
+def test_silnik_geokodowania_async_laczy_zrodla():
+    kandydat = {'lat': '52.2297', 'lon': '21.0122', 'display_name': 'Warszawa', 'address': {'city': 'Warszawa'}}
+
+    async def nominatim_async(adres):
+        return [kandydat]
+
+    silnik = SilnikGeokodowania(
+        [('offline', 0, lambda adres, anuluj: []), ('nominatim', 0, lambda adres, anuluj: [])],
+        zrodla_async={'nominatim': nominatim_async}
+    )
+    wynik = asyncio.run(silnik.szukaj_async('Warszawa'))
+    assert [k['zrodlo'] for k in wynik.kandydaci] == ['nominatim']
+    assert wynik.bledy == {}
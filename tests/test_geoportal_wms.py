@@ -0,0 +1,85 @@
+import io
+import threading
+
+from PIL import Image
+
+import utils.geoportal as geoportal
+
+
+def _jpeg():
+    bufor = io.BytesIO()
+    Image.new('RGB', (8, 8), 'green').save(bufor, 'JPEG')
+    return bufor.getvalue()
+
+
+class OdpowiedzTestowa:
+    status_code = 200
+    headers = {'Content-Type': 'image/jpeg'}
+
+    def __init__(self, dane, po_pierwszej_czesci=None):
+        self.dane = dane
+        self.po_pierwszej_czesci = po_pierwszej_czesci
+        self.przeczytane = 0
+        self.zamknieta = False
+
+    @property
+    def content(self):
+        self.przeczytane = len(self.dane)
+        return self.dane
+
+    def iter_content(self, rozmiar):
+        for poczatek in range(0, len(self.dane), 4):
+            self.przeczytane += 4
+            yield self.dane[poczatek:poczatek + 4]
+            if self.po_pierwszej_czesci:
+                self.po_pierwszej_czesci()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.zamknieta = True
+
+
+class SesjaTestowa:
+    def __init__(self, odpowiedz):
+        self.odpowiedz = odpowiedz
+        self.wywolania = 0
+
+    def get(self, url, **kwargs):
+        self.wywolania += 1
+        return self.odpowiedz
+
+
+def _ustaw_sesje(monkeypatch, odpowiedz):
+    sesja = SesjaTestowa(odpowiedz)
+    monkeypatch.setattr(geoportal, 'pobierz_sesje_http', lambda: sesja)
+    return sesja
+
+
+def test_anulowany_wms_nie_wysyla_zadania(monkeypatch):
+    sesja = _ustaw_sesje(monkeypatch, OdpowiedzTestowa(_jpeg()))
+    anuluj = threading.Event()
+    anuluj.set()
+
+    assert geoportal._pobierz_mape_wms(21.0, 52.0, 64, 64, anuluj=anuluj) is None
+    assert sesja.wywolania == 0
+
+
+def test_anulowanie_przerywa_pobieranie_wms(monkeypatch):
+    anuluj = threading.Event()
+    dane = _jpeg()
+    odpowiedz = OdpowiedzTestowa(dane, po_pierwszej_czesci=anuluj.set)
+    _ustaw_sesje(monkeypatch, odpowiedz)
+
+    assert geoportal._pobierz_mape_wms(21.0, 52.0, 64, 64, anuluj=anuluj) is None
+    assert odpowiedz.przeczytane < len(dane)
+    assert odpowiedz.zamknieta
+
+
+def test_wms_bez_anulowania_zwraca_obraz(monkeypatch):
+    _ustaw_sesje(monkeypatch, OdpowiedzTestowa(_jpeg()))
+
+    img = geoportal._pobierz_mape_wms(21.0, 52.0, 64, 64, anuluj=threading.Event())
+    assert img is not None
+    assert img.size == (8, 8)
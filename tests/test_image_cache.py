@@ -0,0 +1,40 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from utils.image_cache import PamiecObrazow, obraz_ze_zrodla, sprawdz_obraz
+
+
+def _bajty(format, rozmiar=(64, 48)):
+    bufor = BytesIO()
+    img = Image.effect_noise(rozmiar, 60)
+    img.convert('P' if format == 'GIF' else 'RGB').save(bufor, format)
+    return bufor.getvalue()
+
+
+@pytest.mark.parametrize('format', ['JPEG', 'PNG', 'GIF', 'WEBP'])
+def test_sprawdz_obraz_przepuszcza_poprawne_bez_dekodowania(format):
+    img = obraz_ze_zrodla(_bajty(format))
+    sprawdz_obraz(img)
+    assert img._im is None
+
+
+@pytest.mark.parametrize('format', ['JPEG', 'PNG', 'GIF', 'WEBP'])
+def test_sprawdz_obraz_odrzuca_uciete(format):
+    dane = _bajty(format)
+    with pytest.raises(OSError):
+        sprawdz_obraz(obraz_ze_zrodla(dane[:len(dane) * 2 // 3]))
+
+
+def test_budzet_liczy_bajty_zrodla_i_piksele():
+    pamiec = PamiecObrazow(10 ** 7)
+    dane = _bajty('JPEG', (200, 100))
+    pamiec.zapisz('zrodlo', obraz_ze_zrodla(dane))
+    assert pamiec.statystyki()['rozmiar_bajtow'] == len(dane)
+
+    pamiec.zapisz('mozaika', Image.new('RGB', (200, 100)))
+    assert pamiec.statystyki()['rozmiar_bajtow'] == len(dane) + 200 * 100 * 3
+
+    kopia = pamiec.pobierz('zrodlo')
+    assert kopia.zrodlowe_dane == dane and kopia._im is None
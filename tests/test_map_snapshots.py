@@ -0,0 +1,70 @@
+import hashlib
+
+import pytest
+
+import app as aplikacja
+from utils import map_snapshots
+from utils.map_snapshots import MagazynMigawek
+
+
+DANE = b'\xff\xd8\xff\xe0' + bytes(range(256)) * 4
+
+
+@pytest.fixture
+def magazyn(tmp_path, monkeypatch):
+    magazyn = MagazynMigawek(str(tmp_path / 'mapy'))
+    monkeypatch.setattr(map_snapshots, '_domyslny_magazyn', magazyn)
+    return magazyn
+
+
+@pytest.fixture
+def klient():
+    return aplikacja.app.test_client()
+
+
+def test_zapis_adresowany_trescia(magazyn):
+    skrot = magazyn.zapisz(DANE, 'image/jpeg')
+
+    assert skrot == hashlib.sha256(DANE).hexdigest()
+    assert magazyn.zapisz(DANE, 'image/jpeg') == skrot
+    sciezka, mime = magazyn.znajdz(skrot)
+    assert mime == 'image/jpeg' and sciezka.endswith(f"{skrot}.jpg")
+    assert magazyn.statystyki()['zapisy'] == 1
+    assert magazyn.statystyki()['powtorzenia'] == 1
+    assert magazyn.znajdz('../' + skrot) is None
+
+
+def test_etag_i_cache_control(magazyn, klient):
+    skrot = magazyn.zapisz(DANE, 'image/jpeg')
+
+    odpowiedz = klient.get(f'/api/map_image/{skrot}')
+    assert odpowiedz.status_code == 200
+    assert odpowiedz.data == DANE
+    assert odpowiedz.mimetype == 'image/jpeg'
+    assert odpowiedz.headers['ETag'] == f'"{skrot}"'
+    assert 'immutable' in odpowiedz.headers['Cache-Control']
+    assert f'max-age={aplikacja.ROK_S}' in odpowiedz.headers['Cache-Control']
+
+
+def test_pasujacy_if_none_match_daje_304(magazyn, klient):
+    skrot = magazyn.zapisz(DANE, 'image/jpeg')
+
+    odpowiedz = klient.get(f'/api/map_image/{skrot}', headers={'If-None-Match': f'"{skrot}"'})
+    assert odpowiedz.status_code == 304
+    assert odpowiedz.data == b''
+    assert odpowiedz.headers['ETag'] == f'"{skrot}"'
+
+    inny = klient.get(f'/api/map_image/{skrot}', headers={'If-None-Match': '"' + '0' * 64 + '"'})
+    assert inny.status_code == 200
+    assert inny.data == DANE
+
+
+def test_brak_migawki(magazyn, klient):
+    assert klient.get('/api/map_image/' + 'a' * 64).status_code == 404
+    assert klient.get('/api/map_image/nie-skrot').status_code == 404
+
+
+def test_migawki_wylaczone(monkeypatch, klient):
+    monkeypatch.setattr(map_snapshots, '_domyslny_magazyn', False)
+    skrot = hashlib.sha256(DANE).hexdigest()
+    assert klient.get(f'/api/map_image/{skrot}').status_code == 404
@@ -0,0 +1,85 @@
+import sqlite3
+
+import pytest
+
+from utils import mbtiles_cache
+from utils.mbtiles_cache import MBTilesCacheKafelkow
+from utils.tile_cache import KluczKafelka
+
+
+def _klucz(kolumna, wiersz=0, tms='EPSG:2180'):
+    return KluczKafelka('ORTOFOTOMAPA', tms, 14, wiersz, kolumna, 'image/jpeg')
+
+
+def _w_bazie(sciezka):
+    polaczenie = sqlite3.connect(sciezka)
+    try:
+        return polaczenie.execute('SELECT COUNT(*) FROM tiles').fetchone()[0]
+    finally:
+        polaczenie.close()
+
+
+@pytest.fixture(autouse=True)
+def bez_zapisu_w_tle(monkeypatch):
+    # Paczki zapisywane tylko po rozmiar_paczki kafelkach lub jawnym oproznij()
+    monkeypatch.setattr(mbtiles_cache, 'OPOZNIENIE_ZAPISU_S', 3600)
+
+
+def test_zapisy_paczkami(tmp_path):
+    sciezka = str(tmp_path / 'kafelki.mbtiles')
+    cache = MBTilesCacheKafelkow(sciezka, rozmiar_paczki=3)
+
+    cache.zapisz(_klucz(1), b'a')
+    cache.zapisz(_klucz(2), b'b')
+    # Czekające kafelki widoczne w procesie, ale jeszcze nie w bazie
+    assert cache.pobierz(_klucz(1)) == b'a'
+    assert cache.zawiera(_klucz(2))
+    assert _w_bazie(sciezka) == 0
+
+    cache.zapisz(_klucz(3), b'c')
+    assert _w_bazie(sciezka) == 3
+    cache.zapisz(_klucz(4), b'd')
+    assert cache.oproznij() == 1
+    assert _w_bazie(sciezka) == 4
+
+    statystyki = cache.statystyki()
+    assert (statystyki['zapisy'], statystyki['paczki'], statystyki['oczekujace']) == (4, 2, 0)
+    assert MBTilesCacheKafelkow(sciezka).pobierz(_klucz(4)) == b'd'
+
+
+def test_inna_warstwa_pomijana(tmp_path):
+    cache = MBTilesCacheKafelkow(str(tmp_path / 'kafelki.mbtiles'), rozmiar_paczki=1)
+
+    cache.zapisz(_klucz(1), b'a')
+    cache.zapisz(_klucz(1, tms='EPSG:3857'), b'b')
+    assert cache.pobierz(_klucz(1, tms='EPSG:3857')) is None
+    assert cache.pobierz(_klucz(1)) == b'a'
+    assert cache.statystyki()['pominiete'] == 2
+
+
+def test_przycinanie_lru(tmp_path, monkeypatch):
+    sciezka = str(tmp_path / 'kafelki.mbtiles')
+    cache = MBTilesCacheKafelkow(sciezka, maks_bajtow=1000, rozmiar_paczki=1)
+    czas = [1000.0]
+    monkeypatch.setattr(mbtiles_cache.time, 'time', lambda: czas[0])
+
+    for kolumna in range(4):
+        czas[0] += 1
+        cache.zapisz(_klucz(kolumna), bytes(200))
+    # Kafelek 0 użyty ponownie - przy przycinaniu usuwane są najdawniej używane
+    czas[0] += 1
+    assert cache.pobierz(_klucz(0)) is not None
+    cache.oproznij()
+
+    czas[0] += 1
+    cache.zapisz(_klucz(4), bytes(300))
+    assert cache.rozmiar() <= 1000 * mbtiles_cache.POZIOM_PO_PRZYCIECIU
+    assert cache.zawiera(_klucz(0))
+    assert not cache.zawiera(_klucz(1))
+    assert cache.zawiera(_klucz(4))
+    assert cache.statystyki()['usuniete'] >= 1
+
+
+def test_nieznana_polityka(tmp_path):
+    with pytest.raises(ValueError):
+        MBTilesCacheKafelkow(str(tmp_path / 'kafelki.mbtiles'), polityka='fifo')
@@ -0,0 +1,78 @@
+import sqlite3
+import struct
+
+import pytest
+
+from utils.offline_geocoder import IndeksAdresow, zbuduj_indeks_adresow
+
+
+PUNKTY = [
+    ('Warszawa', 'Polna', '1', 21.01),
+    ('Warszawa', 'Polna', '2', 21.02),
+    ('Warszawa', 'Polna', '12a', 21.03),
+    ('Warszawa', 'Leśna', '1', 21.04),
+    ('Kraków', 'Polna', '1', 19.91),
+    ('Kraków', 'Polna', '3', 19.92),
+]
+
+
+def _indeks(tmp_path, punkty=PUNKTY):
+    sciezka_csv = tmp_path / 'punkty.csv'
+    wiersze = ['miejscowosc;ulica;numer;lon;lat']
+    wiersze += [f"{m};{u};{n};{lon};52.0" for m, u, n, lon in punkty]
+    sciezka_csv.write_text('\n'.join(wiersze), encoding='utf-8')
+    zbuduj_indeks_adresow(str(sciezka_csv), str(tmp_path / 'indeks.npz'))
+    return IndeksAdresow.wczytaj(str(tmp_path / 'indeks.npz'))
+
+
+def _dlugosci(kandydaci):
+    return sorted(round(float(k['lon']), 2) for k in kandydaci)
+
+
+def test_szukaj_z_numerem(tmp_path):
+    indeks = _indeks(tmp_path)
+
+    assert _dlugosci(indeks.szukaj('Polna 1')) == [19.91, 21.01]
+    assert _dlugosci(indeks.szukaj('Polna 1 Warszawa')) == [21.01]
+    assert _dlugosci(indeks.szukaj('Polna 12 A')) == [21.03]
+    assert indeks.szukaj('Leśna 2') == []
+
+
+def test_szukaj_z_czestym_numerem(tmp_path):
+    # Numer "1" częstszy niż punkty pasujących ulic - przecięcie od zakresów ulic
+    punkty = PUNKTY + [('Gdańsk', f"Ulica {n}", '1', 18.6) for n in range(40)]
+    indeks = _indeks(tmp_path, punkty)
+
+    assert _dlugosci(indeks.szukaj('Polna 1 Kraków')) == [19.91]
+    assert _dlugosci(indeks.szukaj('Polna 1')) == [19.91, 21.01]
+
+
+def _gpkg(sciezka, organizacja_id):
+    polaczenie = sqlite3.connect(sciezka)
+    polaczenie.executescript(f"""
+        CREATE TABLE gpkg_contents (table_name TEXT, data_type TEXT);
+        CREATE TABLE gpkg_geometry_columns (table_name TEXT, column_name TEXT, srs_id INTEGER);
+        CREATE TABLE gpkg_spatial_ref_sys (srs_id INTEGER, organization_coordsys_id INTEGER);
+        CREATE TABLE punkty (geom BLOB, miejscowosc TEXT, ulica TEXT, numer TEXT);
+        INSERT INTO gpkg_contents VALUES ('punkty', 'features');
+        INSERT INTO gpkg_geometry_columns VALUES ('punkty', 'geom', 1);
+        INSERT INTO gpkg_spatial_ref_sys VALUES (1, {organizacja_id});
+    """)
+    geometria = b'GP\x00\x01' + struct.pack('<i', 1) + b'\x01' + struct.pack('<Idd', 1, 21.01, 52.0)
+    polaczenie.execute('INSERT INTO punkty VALUES (?, ?, ?, ?)', (geometria, 'Warszawa', 'Polna', '1'))
+    polaczenie.commit()
+    polaczenie.close()
+
+
+def test_gpkg_wgs84(tmp_path):
+    _gpkg(tmp_path / 'punkty.gpkg', 4326)
+    zbuduj_indeks_adresow(str(tmp_path / 'punkty.gpkg'), str(tmp_path / 'indeks.npz'))
+    indeks = IndeksAdresow.wczytaj(str(tmp_path / 'indeks.npz'))
+
+    assert _dlugosci(indeks.szukaj('Polna 1')) == [21.01]
+
+
+def test_gpkg_nieobslugiwany_uklad(tmp_path):
+    _gpkg(tmp_path / 'punkty.gpkg', 3857)
+    with pytest.raises(ValueError, match='EPSG:3857'):
+        zbuduj_indeks_adresow(str(tmp_path / 'punkty.gpkg'), str(tmp_path / 'indeks.npz'))
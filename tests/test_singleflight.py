@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from utils.singleflight import PojedynczyLot, fcntl
+
+
+def test_jedno_wykonanie_dla_rownoczesnych_wywolan():
+    lot = PojedynczyLot()
+    start = threading.Event()
+    wywolania = []
+    wyniki = []
+
+    def zadanie():
+        wywolania.append(1)
+        start.wait(5)
+        return object()
+
+    def klient():
+        wyniki.append(lot.wykonaj('kafelek', zadanie))
+
+    watki = [threading.Thread(target=klient) for _ in range(8)]
+    for watek in watki:
+        watek.start()
+    # Wszyscy klienci dołączają do lotu, zanim pierwszy skończy
+    while lot.statystyki()['wspoldzielone'] < 7:
+        time.sleep(0.001)
+    start.set()
+    for watek in watki:
+        watek.join(5)
+
+    assert len(wywolania) == 1
+    assert len(wyniki) == 8 and all(w is wyniki[0] for w in wyniki)
+    assert lot.statystyki() == {'wykonania': 1, 'wspoldzielone': 7, 'w_locie': 0}
+    # Zakończony lot nie jest zapamiętywany - kolejne wywołanie wykonuje funkcję
+    lot.wykonaj('kafelek', zadanie)
+    assert len(wywolania) == 2
+
+
+def test_wyjatek_trafia_do_wszystkich_czekajacych():
+    lot = PojedynczyLot()
+    start = threading.Event()
+    bledy = []
+
+    def zadanie():
+        start.wait(5)
+        raise OSError('serwis niedostępny')
+
+    def klient():
+        try:
+            lot.wykonaj('kafelek', zadanie)
+        except OSError as e:
+            bledy.append(e)
+
+    watki = [threading.Thread(target=klient) for _ in range(4)]
+    for watek in watki:
+        watek.start()
+    while lot.statystyki()['wspoldzielone'] < 3:
+        time.sleep(0.001)
+    start.set()
+    for watek in watki:
+        watek.join(5)
+
+    assert len(bledy) == 4
+    assert lot.statystyki()['w_locie'] == 0
+
+
+def test_rozne_klucze_niezalezne():
+    lot = PojedynczyLot()
+    assert [lot.wykonaj(k, lambda k=k: k * 2) for k in (1, 2, 3)] == [2, 4, 6]
+    assert lot.statystyki()['wykonania'] == 3
+
+
+@pytest.mark.skipif(fcntl is None, reason='blokady plików tylko z fcntl')
+def test_blokada_miedzy_procesami(tmp_path):
+    # Dwie instancje z jednym katalogiem blokad odpowiadają dwóm workerom
+    workery = [PojedynczyLot(str(tmp_path)), PojedynczyLot(str(tmp_path))]
+    magazyn = {}
+    pobrania = []
+
+    def zadanie():
+        if 'kafelek' in magazyn:
+            return magazyn['kafelek']
+        pobrania.append(1)
+        time.sleep(0.05)
+        magazyn['kafelek'] = b'dane'
+        return magazyn['kafelek']
+
+    wyniki = []
+
+    def worker(lot):
+        wyniki.append(lot.wykonaj('kafelek', zadanie, miedzy_procesami=True))
+
+    watki = [threading.Thread(target=worker, args=(lot,)) for lot in workery]
+    for watek in watki:
+        watek.start()
+    for watek in watki:
+        watek.join(5)
+
+    assert wyniki == [b'dane', b'dane']
+    assert len(pobrania) == 1
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from utils.tile_cache import KluczKafelka
+from utils.tile_pack import PaczkaKafelkow, ZestawPaczek, sciezki_paczek, zbuduj_paczke
+
+
+WARSTWA = ('ORTOFOTOMAPA', 'EPSG:2180', 'image/jpeg')
+
+
+def _klucz(zoom, kolumna, wiersz, warstwa=WARSTWA):
+    return KluczKafelka(warstwa[0], warstwa[1], zoom, wiersz, kolumna, warstwa[2])
+
+
+def test_zapis_i_odczyt(tmp_path):
+    kafelki = [
+        (14, 9000, 5000, b'kafelek-b'),
+        (3, 1, 2, b'kafelek-a'),
+        (14, 9000, 5000, b'duplikat'),
+        (14, 9001, 5000, b''),
+        (14, 9002, 4999, b'kafelek-c' * 100),
+    ]
+    sciezka = str(tmp_path / 'orto.pack')
+    assert zbuduj_paczke(kafelki, sciezka, *WARSTWA) == 3
+
+    paczka = PaczkaKafelkow(sciezka)
+    try:
+        assert paczka.liczba == 3
+        assert bytes(paczka.pobierz(_klucz(14, 9000, 5000))) == b'kafelek-b'
+        assert bytes(paczka.pobierz(_klucz(3, 1, 2))) == b'kafelek-a'
+        assert bytes(paczka.pobierz(_klucz(14, 9002, 4999))) == b'kafelek-c' * 100
+        # Pusty kafelek pominięty, inna warstwa i klucz spoza zakresu to brak trafienia
+        assert paczka.pobierz(_klucz(14, 9001, 5000)) is None
+        assert paczka.pobierz(_klucz(3, 1, 2, ('ORTOFOTOMAPA', 'EPSG:3857', 'image/jpeg'))) is None
+        assert paczka.pobierz(_klucz(3, -1, 2)) is None
+        assert paczka.zawiera(_klucz(3, 1, 2))
+    finally:
+        paczka.zamknij()
+
+
+def test_pusta_paczka(tmp_path):
+    sciezka = str(tmp_path / 'pusta.pack')
+    assert zbuduj_paczke([], sciezka, *WARSTWA) == 0
+
+    paczka = PaczkaKafelkow(sciezka)
+    try:
+        assert paczka.liczba == 0
+        assert paczka.pobierz(_klucz(14, 9000, 5000)) is None
+        assert not paczka.zawiera(_klucz(0, 0, 0))
+    finally:
+        paczka.zamknij()
+
+
+def test_zestaw_paczek_i_statystyki(tmp_path):
+    zbuduj_paczke([(1, 0, 0, b'a')], str(tmp_path / 'a.pack'), *WARSTWA)
+    zbuduj_paczke([(1, 1, 0, b'b')], str(tmp_path / 'b.pack'), *WARSTWA)
+    (tmp_path / '.tmp-c.pack').write_bytes(b'')
+
+    sciezki = sciezki_paczek(str(tmp_path))
+    assert [os.path.basename(s) for s in sciezki] == ['a.pack', 'b.pack']
+    zestaw = ZestawPaczek([PaczkaKafelkow(s) for s in sciezki])
+    try:
+        assert bytes(zestaw.pobierz(_klucz(1, 1, 0))) == b'b'
+        assert zestaw.pobierz(_klucz(1, 1, 1)) is None
+        statystyki = zestaw.statystyki()
+        assert (statystyki['trafienia'], statystyki['chybienia'], statystyki['kafelki']) == (1, 1, 2)
+    finally:
+        zestaw.zamknij()
+
+
+def test_plik_nie_bedacy_paczka(tmp_path):
+    sciezka = tmp_path / 'zly.pack'
+    sciezka.write_bytes(b'x' * 128)
+    with pytest.raises(ValueError):
+        PaczkaKafelkow(str(sciezka))
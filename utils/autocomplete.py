@@ -0,0 +1,395 @@
+"""
+Moduł podpowiedzi adresów (autouzupełnianie)
+Posortowana tablica słów z wyszukiwaniem binarnym, budowana z indeksu
+adresowego i wyników zapisanych w cache geokodowania
+"""
+
+import bisect
+import functools
+import heapq
+import os
+import threading
+import time
+
+import numpy as np
+
+from utils.geocode_cache import pobierz_cache_geokodowania, tokeny_adresu
+from utils.geocode_scoring import (
+    HOUSE_MATCH_SCORE,
+    LOCALITY_MATCH_SCORE,
+    PLACE_CLASS_SCORE,
+    PLACE_TYPE_SCORE,
+    ROAD_MATCH_SCORE
+)
+from utils.offline_geocoder import pobierz_indeks_adresow
+
+
+DOMYSLNY_LIMIT = 8
+MIN_DLUGOSC_ZAPYTANIA = 2
+# Ile wpisów pasujących do najrzadszego słowa sprawdzać przy jednym zapytaniu -
+# przy szerszym zakresie sprawdzane są wpisy o największej wadze
+MAKS_SKANOWANYCH = 1000
+# Ile list najcięższych wpisów szerokich prefiksów trzymać w pamięci
+MAKS_ZAPAMIETANYCH_PREFIKSOW = 4096
+# Waga adresu z cache geokodowania (za każde wyszukanie) względem ulicy z indeksu
+# adresowego, której waga to liczba jej punktów adresowych
+WAGA_WYNIKU_Z_CACHE = 50.0
+# Ile ulic rozwijać do numerów, gdy zapytanie zawiera numer
+MAKS_ROZWIJANYCH_ULIC = 10
+DOMYSLNY_LIMIT_Z_CACHE = 100000
+DOMYSLNE_ODSWIEZANIE_S = 300
+# Po ilu sekundach ponowić nieudaną budowę indeksu (w tle)
+PONOWIENIE_PO_BLEDZIE_S = 60
+
+
+@functools.lru_cache(maxsize=65536)
+def _slowa(tekst):
+    # Nazwy miejscowości i ulic powtarzają się w tysiącach wpisów
+    return tuple(tokeny_adresu(tekst)[0])
+
+
+class IndeksPodpowiedzi:
+    """
+    Indeks prefiksowy podpowiedzi adresów.
+
+    Każde słowo każdego wpisu trafia do posortowanej listy (słowo, wpis);
+    zapytanie wyznacza bisect zakres słów zaczynających się od każdego słowa
+    zapytania, zaczynając od najrzadszego, a pozostałe słowa sprawdza na
+    wybranych wpisach. Gdy zakres najrzadszego słowa jest szerszy niż
+    MAKS_SKANOWANYCH, sprawdzane są jego najcięższe wpisy (popularność:
+    liczba punktów adresowych ulicy, liczba wyszukań adresu) - lista liczona
+    raz na prefiks. Wpisy ulic z indeksu adresowego rozwijane są do
+    konkretnych numerów, gdy zapytanie zawiera numer.
+    """
+
+    def __init__(self, indeks_adresow=None):
+        """
+        Args:
+            indeks_adresow: Opcjonalny IndeksAdresow do rozwijania ulic do numerów
+        """
+        self.indeks_adresow = indeks_adresow
+        self._etykiety = []
+        self._wspolrzedne = []
+        # (słowa ulicy, słowa miejscowości, numer znormalizowany, klucz ulicy lub -1,
+        #  wszystkie słowa wpisu)
+        self._cechy = []
+        self._wagi = []
+        self._znane = {}
+        self._slowa = []
+        self._wpisy_slow = []
+        # (początek, koniec) zakresu szerokiego prefiksu -> najcięższe wpisy
+        self._najciezsze = {}
+
+    def __len__(self):
+        return len(self._etykiety)
+
+    def dodaj(self, etykieta, lon, lat, ulica='', miejscowosc='', numer='', klucz_ulicy=-1,
+              slowa_etykiety=True, waga=1.0):
+        """
+        Dodaje wpis (przed wywołaniem zakoncz)
+
+        Args:
+            etykieta: Tekst podpowiedzi
+            lon: Długość geograficzna (None - wyliczana przy wyborze, dla ulic z indeksu)
+            lat: Szerokość geograficzna
+            ulica: Nazwa ulicy
+            miejscowosc: Nazwa miejscowości
+            numer: Numer porządkowy
+            klucz_ulicy: Klucz (miejscowość, ulica) w indeksie adresowym
+            slowa_etykiety: Czy indeksować także słowa etykiety (poza ulicą i miejscowością)
+            waga: Popularność wpisu - ponowne dodanie etykiety zwiększa jej wagę
+        """
+        if not etykieta:
+            return
+        if etykieta in self._znane:
+            self._wagi[self._znane[etykieta]] += waga
+            return
+        slowa_ulicy = _slowa(ulica)
+        slowa_miejscowosci = _slowa(miejscowosc)
+        numer = '/'.join(tokeny_adresu(numer)[1]) if numer else ''
+        indeks = len(self._etykiety)
+        self._znane[etykieta] = indeks
+        self._etykiety.append(etykieta)
+        self._wagi.append(waga)
+        self._wspolrzedne.append((lon, lat))
+        slowa = set(slowa_ulicy) | set(slowa_miejscowosci)
+        if slowa_etykiety or not slowa:
+            slowa.update(tokeny_adresu(etykieta)[0])
+        self._cechy.append((slowa_ulicy, slowa_miejscowosci, numer, klucz_ulicy, tuple(slowa)))
+        for slowo in slowa:
+            self._slowa.append((slowo, indeks))
+
+    def zakoncz(self):
+        """Sortuje słowa - po tym indeks jest gotowy do zapytań."""
+        self._slowa.sort()
+        self._wpisy_slow = np.fromiter((indeks for _, indeks in self._slowa), dtype=np.int64,
+                                       count=len(self._slowa))
+        self._slowa = [slowo for slowo, _ in self._slowa]
+        self._wagi = np.asarray(self._wagi, dtype=np.float64)
+        self._znane = {}
+
+    def _zakres(self, prefiks):
+        poczatek = bisect.bisect_left(self._slowa, prefiks)
+        koniec = bisect.bisect_left(self._slowa, prefiks + '\uffff', poczatek)
+        return poczatek, koniec
+
+    def podpowiedz(self, zapytanie, limit=DOMYSLNY_LIMIT):
+        """
+        Zwraca podpowiedzi dla wpisywanego adresu
+
+        Args:
+            zapytanie: Dotychczas wpisany tekst (ostatnie słowo może być niedokończone)
+            limit: Maksymalna liczba podpowiedzi
+
+        Returns:
+            list: Słowniki etykieta, lon, lat, ocena (najlepsze pierwsze)
+        """
+        slowa, numery = tokeny_adresu(zapytanie)
+        if not slowa:
+            return []
+        zakresy = sorted((self._zakres(slowo) for slowo in set(slowa)), key=lambda z: z[1] - z[0])
+        poczatek, koniec = zakresy[0]
+        if poczatek == koniec:
+            return []
+        if koniec - poczatek > MAKS_SKANOWANYCH:
+            wpisy = self._najciezsze_wpisy(poczatek, koniec)
+        else:
+            wpisy = set(self._wpisy_slow[poczatek:koniec].tolist())
+        # Słowo z najwęższego zakresu pasuje z definicji - sprawdzane są pozostałe
+        pozostale = set(slowa) if len(zakresy) > 1 else ()
+        trafienia = [
+            indeks for indeks in wpisy
+            if all(any(s.startswith(slowo) for s in self._cechy[indeks][4]) for slowo in pozostale)
+        ]
+        numer = numery[0] if numery else ''
+        ocenione = [
+            (self._ocena_wpisu(indeks, slowa, numer), self._wagi[indeks], indeks) for indeks in trafienia
+        ]
+        # Ulice rozwijane do numerów wybierane są spośród najlepiej ocenionych
+        # (przy równej ocenie - najpopularniejszych)
+        najlepsze = heapq.nlargest(max(limit, MAKS_ROZWIJANYCH_ULIC), ocenione)
+        wyniki = [self._podpowiedz_wpisu(indeks, ocena) for ocena, _, indeks in najlepsze]
+        if numer and self.indeks_adresow is not None:
+            ulice = [w for w in wyniki if w['klucz'] >= 0]
+            for ulica in ulice[:MAKS_ROZWIJANYCH_ULIC]:
+                wyniki.extend(self._numery_ulicy(ulica['indeks'], slowa, numer, limit))
+        wyniki.sort(key=lambda w: (-w['ocena'], -w['waga'], len(w['etykieta']), w['etykieta']))
+        etykiety = set()
+        wyniki = [
+            w for w in wyniki if not (w['etykieta'] in etykiety or etykiety.add(w['etykieta']))
+        ][:limit]
+        for wynik in wyniki:
+            # Środek ulicy liczony dopiero dla zwracanych podpowiedzi
+            if wynik['lon'] is None and wynik['klucz'] >= 0:
+                kandydat = self.indeks_adresow.kandydat(wynik['klucz'])
+                wynik['lon'], wynik['lat'] = float(kandydat['lon']), float(kandydat['lat'])
+        return [{k: w[k] for k in ('etykieta', 'lon', 'lat', 'ocena')} for w in wyniki]
+
+    def _najciezsze_wpisy(self, poczatek, koniec):
+        """
+        MAKS_SKANOWANYCH wpisów o największej wadze z zakresu słów (liczone raz na prefiks)
+
+        Returns:
+            list: Indeksy wpisów, najcięższe pierwsze
+        """
+        wpisy = self._najciezsze.get((poczatek, koniec))
+        if wpisy is None:
+            zakres = self._wpisy_slow[poczatek:koniec]
+            wagi = self._wagi[zakres]
+            # Wpis może wystąpić w zakresie kilka razy (kilka słów z tym prefiksem)
+            # - wybierany jest zapas, a duplikaty usuwane po wyborze
+            zapas = min(len(zakres), 2 * MAKS_SKANOWANYCH)
+            wybrane = np.argpartition(-wagi, zapas - 1)[:zapas]
+            wybrane = wybrane[np.argsort(-wagi[wybrane], kind='stable')]
+            wpisy = list(dict.fromkeys(zakres[wybrane].tolist()))[:MAKS_SKANOWANYCH]
+            if len(self._najciezsze) >= MAKS_ZAPAMIETANYCH_PREFIKSOW:
+                self._najciezsze.clear()
+            self._najciezsze[(poczatek, koniec)] = wpisy
+        return wpisy
+
+    def _ocena(self, slowa, numer, slowa_ulicy, slowa_miejscowosci, numer_wpisu):
+        """Punktacja jak w score_candidate, z dopasowaniem słów po prefiksie."""
+        ocena = 0.0
+        if numer and numer_wpisu:
+            if numer_wpisu == numer:
+                ocena += HOUSE_MATCH_SCORE
+            elif numer_wpisu.startswith(numer):
+                ocena += HOUSE_MATCH_SCORE / 2
+            ocena += PLACE_CLASS_SCORE + PLACE_TYPE_SCORE
+        if slowa_ulicy and any(s.startswith(slowo) for slowo in slowa for s in slowa_ulicy):
+            ocena += ROAD_MATCH_SCORE
+        if slowa_miejscowosci and any(s.startswith(slowo) for slowo in slowa for s in slowa_miejscowosci):
+            ocena += LOCALITY_MATCH_SCORE
+        return ocena
+
+    def _ocena_wpisu(self, indeks, slowa, numer):
+        ulica, miejscowosc, numer_wpisu, _, _ = self._cechy[indeks]
+        return self._ocena(slowa, numer, ulica, miejscowosc, numer_wpisu)
+
+    def _podpowiedz_wpisu(self, indeks, ocena):
+        lon, lat = self._wspolrzedne[indeks]
+        return {
+            'indeks': indeks,
+            'etykieta': self._etykiety[indeks],
+            'lon': lon,
+            'lat': lat,
+            'klucz': self._cechy[indeks][3],
+            'ocena': ocena,
+            'waga': float(self._wagi[indeks]),
+        }
+
+    def _numery_ulicy(self, indeks, slowa, numer, limit):
+        """Punkty adresowe ulicy z numerem zaczynającym się od wpisanego."""
+        ulica, miejscowosc, _, klucz, _ = self._cechy[indeks]
+        pasujace = []
+        for rekord in self.indeks_adresow.punkty_ulicy(klucz):
+            numer_punktu = self.indeks_adresow.numer_punktu(rekord)
+            if numer_punktu.startswith(numer):
+                ocena = self._ocena(slowa, numer, ulica, miejscowosc, numer_punktu)
+                pasujace.append((-ocena, len(numer_punktu), numer_punktu, rekord))
+        wyniki = []
+        for minus_ocena, _, _, rekord in sorted(pasujace)[:limit]:
+            kandydat = self.indeks_adresow.kandydat(klucz, rekord)
+            wyniki.append({
+                'etykieta': kandydat['display_name'],
+                'lon': float(kandydat['lon']),
+                'lat': float(kandydat['lat']),
+                'klucz': -1,
+                'ocena': -minus_ocena,
+                'waga': 0.0,
+            })
+        return wyniki
+
+
+def zbuduj_indeks_podpowiedzi(indeks_adresow=None, cache=None, limit_z_cache=DOMYSLNY_LIMIT_Z_CACHE):
+    """
+    Buduje indeks podpowiedzi z ulic indeksu adresowego i kandydatów z cache
+
+    Args:
+        indeks_adresow: IndeksAdresow lub None
+        cache: CacheGeokodowania lub None
+        limit_z_cache: Maksymalna liczba list kandydatów odczytanych z cache
+
+    Returns:
+        IndeksPodpowiedzi
+    """
+    podpowiedzi = IndeksPodpowiedzi(indeks_adresow)
+    if cache is not None:
+        for kandydaci in cache.wpisy('kandydaci', limit_z_cache):
+            for kandydat in kandydaci or []:
+                address = kandydat.get('address') or {}
+                podpowiedzi.dodaj(
+                    kandydat.get('display_name'),
+                    kandydat.get('lon'),
+                    kandydat.get('lat'),
+                    ulica=address.get('road', ''),
+                    miejscowosc=address.get('city') or address.get('town') or address.get('village', ''),
+                    numer=address.get('house_number', ''),
+                    waga=WAGA_WYNIKU_Z_CACHE
+                )
+    if indeks_adresow is not None:
+        for klucz, (ulica, miejscowosc) in enumerate(indeks_adresow.ulice_z_miejscowosciami()):
+            etykieta = f"{ulica}, {miejscowosc}" if ulica else miejscowosc
+            podpowiedzi.dodaj(
+                etykieta, None, None, ulica, miejscowosc, klucz_ulicy=klucz, slowa_etykiety=False,
+                waga=len(indeks_adresow.punkty_ulicy(klucz))
+            )
+    podpowiedzi.zakoncz()
+    return podpowiedzi
+
+
+def podpowiedz_adresy(zapytanie, limit=DOMYSLNY_LIMIT):
+    """
+    Zwraca podpowiedzi adresów ze współdzielonego indeksu
+
+    Args:
+        zapytanie: Dotychczas wpisany tekst
+        limit: Maksymalna liczba podpowiedzi
+
+    Returns:
+        list: Słowniki etykieta, lon, lat, ocena
+    """
+    if len(zapytanie.strip()) < MIN_DLUGOSC_ZAPYTANIA:
+        return []
+    return pobierz_indeks_podpowiedzi().podpowiedz(zapytanie, limit)
+
+
+_domyslny_indeks = None
+_zbudowano = 0.0
+_przebudowa_trwa = False
+_blad_budowy = False
+_domyslny_indeks_lock = threading.Lock()
+
+
+def _liczba_ze_zmiennej(nazwa, domyslna, typ=int):
+    """Liczba ze zmiennej środowiskowej (błędna wartość - domyślna)."""
+    try:
+        return typ(os.environ.get(nazwa, domyslna))
+    except ValueError:
+        print(f"{nazwa}: błędna wartość - użyto domyślnej ({domyslna})")
+        return domyslna
+
+
+def _przebuduj():
+    global _domyslny_indeks, _zbudowano, _przebudowa_trwa, _blad_budowy
+    start = time.monotonic()
+    indeks, blad = None, True
+    try:
+        indeks = zbuduj_indeks_podpowiedzi(
+            pobierz_indeks_adresow(),
+            pobierz_cache_geokodowania(),
+            _liczba_ze_zmiennej('ROOF_AUTOCOMPLETE_CACHE_LIMIT', DOMYSLNY_LIMIT_Z_CACHE)
+        )
+        print(f"Indeks podpowiedzi: {len(indeks)} wpisów zbudowanych w {time.monotonic() - start:.2f} s")
+        blad = False
+    except Exception as e:
+        # Błąd zapamiętywany jest jak wynik - żądania nie budują indeksu ponownie,
+        # a ponowna próba odbywa się w tle po PONOWIENIE_PO_BLEDZIE_S
+        print(f"Indeks podpowiedzi: błąd budowy: {e}")
+    finally:
+        with _domyslny_indeks_lock:
+            if indeks is not None:
+                _domyslny_indeks = indeks
+            elif _domyslny_indeks is None:
+                _domyslny_indeks = IndeksPodpowiedzi()
+                _domyslny_indeks.zakoncz()
+            _blad_budowy = blad
+            _zbudowano = time.monotonic()
+            _przebudowa_trwa = False
+
+
+def pobierz_indeks_podpowiedzi():
+    """
+    Zwraca współdzielony indeks podpowiedzi. Pierwsze wywołanie buduje go
+    synchronicznie, później co ROOF_AUTOCOMPLETE_REFRESH_S sekund indeks jest
+    przebudowywany w tle (nowe wyniki z cache geokodowania). Po nieudanej
+    budowie zwracany jest pusty (lub poprzedni) indeks, a budowa ponawiana
+    jest w tle po PONOWIENIE_PO_BLEDZIE_S sekund.
+
+    Returns:
+        IndeksPodpowiedzi
+    """
+    global _przebudowa_trwa
+    if _domyslny_indeks is None:
+        with _domyslny_indeks_lock:
+            pierwszy = _domyslny_indeks is None and not _przebudowa_trwa
+            if pierwszy:
+                _przebudowa_trwa = True
+        if pierwszy:
+            _przebuduj()
+        else:
+            while _domyslny_indeks is None and _przebudowa_trwa:
+                time.sleep(0.01)
+        return _domyslny_indeks if _domyslny_indeks is not None else IndeksPodpowiedzi()
+
+    odswiezanie = _liczba_ze_zmiennej('ROOF_AUTOCOMPLETE_REFRESH_S', DOMYSLNE_ODSWIEZANIE_S, float)
+    with _domyslny_indeks_lock:
+        wiek = time.monotonic() - _zbudowano
+        przebuduj = not _przebudowa_trwa and (
+            (_blad_budowy and wiek > PONOWIENIE_PO_BLEDZIE_S) or (odswiezanie > 0 and wiek > odswiezanie)
+        )
+        if przebuduj:
+            _przebudowa_trwa = True
+    if przebuduj:
+        threading.Thread(target=_przebuduj, name='podpowiedzi', daemon=True).start()
+    return _domyslny_indeks
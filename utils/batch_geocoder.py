@@ -0,0 +1,304 @@
+"""
+Moduł wsadowego geokodowania list adresów
+Trafienia z indeksu i cache zwracane są od razu, chybienia idą do źródeł sieciowych
+przez kolejkę z limitem zapytań (token bucket), a postęp zapisywany jest w JSONL
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import requests
+
+from utils.geocode_cache import BRAK, normalizuj_adres
+from utils.geocode_engine import BladGeokodowania
+from utils.geoportal import geokoduj_adres_lokalnie, geokoduj_adres_z_sieci
+
+
+# Polityka publicznego Nominatim: najwyżej 1 zapytanie na sekundę
+DOMYSLNA_CZESTOTLIWOSC = 1.0
+DOMYSLNY_ZAPAS = 1
+DOMYSLNY_MAKS_ADRESOW = 50000
+DOMYSLNY_KATALOG_ZADAN = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'geokodowanie_wsadowe'
+)
+MAKS_PROB = 3
+MAKS_PRZERWY_S = 60.0
+_ID_ZADANIA_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class KubelekZetonow:
+    """
+    Ogranicznik częstotliwości zapytań (token bucket), bezpieczny wątkowo.
+
+    Żetony przybywają ze stałą częstotliwością aż do pojemności kubełka;
+    każde zapytanie zużywa jeden. Kara (np. po HTTP 429) wstrzymuje wydawanie.
+    """
+
+    def __init__(self, na_sekunde=DOMYSLNA_CZESTOTLIWOSC, pojemnosc=DOMYSLNY_ZAPAS):
+        """
+        Args:
+            na_sekunde: Średnia liczba zapytań na sekundę
+            pojemnosc: Maksymalna liczba zapytań wysłanych jedno po drugim
+        """
+        if na_sekunde <= 0:
+            raise ValueError("Częstotliwość musi być dodatnia")
+        self.na_sekunde = float(na_sekunde)
+        self.pojemnosc = max(1.0, float(pojemnosc))
+        self._zetony = self.pojemnosc
+        self._ostatnio = time.monotonic()
+        self._wstrzymane_do = 0.0
+        self._lock = threading.Lock()
+        self._wydane = 0
+        self._oczekiwanie_s = 0.0
+
+    def pobierz(self, anuluj=None):
+        """
+        Czeka na żeton
+
+        Args:
+            anuluj: Opcjonalny threading.Event przerywający oczekiwanie
+
+        Returns:
+            bool: True jeśli pobrano żeton, False jeśli anulowano
+        """
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                teraz = time.monotonic()
+                self._zetony = min(
+                    self.pojemnosc, self._zetony + (teraz - self._ostatnio) * self.na_sekunde
+                )
+                self._ostatnio = teraz
+                if teraz >= self._wstrzymane_do and self._zetony >= 1.0:
+                    self._zetony -= 1.0
+                    self._wydane += 1
+                    self._oczekiwanie_s += teraz - start
+                    return True
+                czekaj = max(self._wstrzymane_do - teraz, (1.0 - self._zetony) / self.na_sekunde)
+            if anuluj is not None:
+                if anuluj.wait(czekaj):
+                    return False
+            else:
+                time.sleep(czekaj)
+
+    def wstrzymaj(self, sekundy):
+        """Wstrzymuje wydawanie żetonów (np. po odpowiedzi 429 lub 503)."""
+        with self._lock:
+            self._wstrzymane_do = max(self._wstrzymane_do, time.monotonic() + sekundy)
+            self._zetony = 0.0
+
+    def statystyki(self):
+        """
+        Returns:
+            dict: częstotliwość, liczba wydanych żetonów i łączny czas oczekiwania
+        """
+        with self._lock:
+            return {
+                'na_sekunde': self.na_sekunde,
+                'pojemnosc': self.pojemnosc,
+                'wydane': self._wydane,
+                'oczekiwanie_s': round(self._oczekiwanie_s, 3),
+            }
+
+
+def _przerwa_po_bledzie(blad, proba):
+    """Czas wstrzymania po błędzie - nagłówek Retry-After lub wykładniczo."""
+    odpowiedz = getattr(blad, 'response', None)
+    if odpowiedz is not None:
+        try:
+            return min(MAKS_PRZERWY_S, float(odpowiedz.headers.get('Retry-After', '')))
+        except ValueError:
+            pass
+    return min(MAKS_PRZERWY_S, 2.0 ** proba)
+
+
+def _wczytaj_postep(sciezka):
+    """Wczytuje zapisane wyniki {klucz: wynik}; uszkodzony ostatni wiersz jest pomijany."""
+    wyniki = {}
+    if not sciezka or not os.path.exists(sciezka):
+        return wyniki
+    with open(sciezka, encoding='utf-8') as plik:
+        for wiersz in plik:
+            try:
+                wpis = json.loads(wiersz)
+                wyniki[wpis['klucz']] = wpis['wynik']
+            except (ValueError, KeyError, TypeError):
+                continue
+    return wyniki
+
+
+def geokoduj_wsadowo(adresy, sciezka_postepu=None, ogranicznik=None, anuluj=None):
+    """
+    Geokoduje listę adresów, zwracając wyniki w miarę ich powstawania
+
+    Najpierw wszystkie adresy sprawdzane są lokalnie (indeks adresowy, cache),
+    potem chybienia - każdy znormalizowany adres raz - wysyłane są kolejno do
+    źródeł geokodowania w tempie ogranicznika. Wyniki zapisywane są w pliku
+    postępu, więc ponowne uruchomienie z tym samym plikiem pomija gotowe adresy. Adresy z
+    błędem sieci nie trafiają do pliku postępu i są ponawiane przy wznowieniu.
+
+    Args:
+        adresy: Lista adresów
+        sciezka_postepu: Plik JSONL z postępem (None - bez wznawiania)
+        ogranicznik: KubelekZetonow (domyślnie współdzielony - pobierz_ogranicznik)
+        anuluj: Opcjonalny threading.Event przerywający zadanie
+
+    Yields:
+        dict: indeks, adres, lon, lat (None jeśli nie znaleziono), zrodlo
+              ('postep', 'offline', 'cache', 'siec' lub 'blad')
+    """
+    ogranicznik = ogranicznik or pobierz_ogranicznik()
+    zapisane = _wczytaj_postep(sciezka_postepu)
+    plik_postepu = None
+    if sciezka_postepu:
+        os.makedirs(os.path.dirname(os.path.abspath(sciezka_postepu)), exist_ok=True)
+        plik_postepu = open(sciezka_postepu, 'a', encoding='utf-8')
+
+    def zapisz_postep(klucz, wynik):
+        zapisane[klucz] = wynik
+        if plik_postepu is not None:
+            plik_postepu.write(json.dumps({'klucz': klucz, 'wynik': wynik}, ensure_ascii=False) + '\n')
+            plik_postepu.flush()
+
+    def rekord(indeks, adres, wynik, zrodlo):
+        lon, lat = wynik if wynik else (None, None)
+        return {'indeks': indeks, 'adres': adres, 'lon': lon, 'lat': lat, 'zrodlo': zrodlo}
+
+    try:
+        # Przebieg lokalny - bez sieci, z pełną prędkością
+        chybienia = {}
+        for indeks, adres in enumerate(adresy):
+            adres = str(adres or '').strip()
+            klucz = normalizuj_adres(adres)
+            if not klucz:
+                yield rekord(indeks, adres, None, 'blad')
+                continue
+            if klucz in zapisane:
+                yield rekord(indeks, adres, zapisane[klucz], 'postep')
+                continue
+            if klucz in chybienia:
+                chybienia[klucz].append((indeks, adres))
+                continue
+            lokalnie = geokoduj_adres_lokalnie(adres)
+            if lokalnie is BRAK:
+                chybienia[klucz] = [(indeks, adres)]
+                continue
+            wynik, zrodlo = lokalnie
+            wynik = list(wynik) if wynik else None
+            zapisz_postep(klucz, wynik)
+            yield rekord(indeks, adres, wynik, zrodlo)
+
+        # Kolejka do źródeł sieciowych - jedno wyszukiwanie na znormalizowany adres
+        for klucz, wystapienia in chybienia.items():
+            wynik = BRAK
+            for proba in range(MAKS_PROB):
+                if not ogranicznik.pobierz(anuluj):
+                    return
+                try:
+                    wynik = geokoduj_adres_z_sieci(wystapienia[0][1], zglaszaj_bledy=True)
+                    break
+                except (BladGeokodowania, requests.RequestException, ValueError) as e:
+                    print(f"Geokodowanie wsadowe: błąd dla '{wystapienia[0][1]}': {e}")
+                    ogranicznik.wstrzymaj(_przerwa_po_bledzie(e, proba))
+            if wynik is BRAK:
+                for indeks, adres in wystapienia:
+                    yield rekord(indeks, adres, None, 'blad')
+                continue
+            wynik = list(wynik) if wynik else None
+            zapisz_postep(klucz, wynik)
+            for indeks, adres in wystapienia:
+                yield rekord(indeks, adres, wynik, 'siec')
+    finally:
+        if plik_postepu is not None:
+            plik_postepu.close()
+
+
+def sciezka_zadania(adresy, id_zadania=None, katalog=None):
+    """
+    Zwraca plik postępu zadania wsadowego
+
+    Bez jawnego identyfikatora zadanie identyfikuje skrót listy adresów -
+    ponowne wysłanie tej samej listy wznawia przerwane zadanie.
+
+    Args:
+        adresy: Lista adresów
+        id_zadania: Identyfikator zadania (litery, cyfry, '_' i '-')
+        katalog: Katalog plików postępu (domyślnie ROOF_GEOCODE_BATCH_DIR)
+
+    Returns:
+        str: Ścieżka pliku JSONL
+    """
+    if id_zadania is None:
+        skrot = hashlib.sha256('\n'.join(str(a) for a in adresy).encode('utf-8'))
+        id_zadania = skrot.hexdigest()[:32]
+    elif not _ID_ZADANIA_RE.match(str(id_zadania)):
+        raise ValueError("Nieprawidłowy identyfikator zadania")
+    katalog = katalog or os.environ.get('ROOF_GEOCODE_BATCH_DIR') or DOMYSLNY_KATALOG_ZADAN
+    return os.path.join(katalog, f"{id_zadania}.jsonl")
+
+
+def maks_adresow():
+    """Limit liczby adresów w jednym zadaniu (ROOF_GEOCODE_BATCH_MAX)."""
+    try:
+        return int(os.environ.get('ROOF_GEOCODE_BATCH_MAX', DOMYSLNY_MAKS_ADRESOW))
+    except ValueError:
+        print(f"ROOF_GEOCODE_BATCH_MAX: błędna wartość - użyto domyślnej ({DOMYSLNY_MAKS_ADRESOW})")
+        return DOMYSLNY_MAKS_ADRESOW
+
+
+_domyslny_ogranicznik = None
+_domyslny_ogranicznik_lock = threading.Lock()
+
+
+def pobierz_ogranicznik():
+    """
+    Zwraca współdzielony ogranicznik zapytań do Nominatim skonfigurowany zmiennymi:
+        ROOF_GEOCODE_RATE - zapytania na sekundę (domyślnie 1 - polityka Nominatim)
+        ROOF_GEOCODE_BURST - pojemność kubełka
+
+    Wszystkie zadania wsadowe w procesie dzielą ten sam limit.
+
+    Returns:
+        KubelekZetonow
+    """
+    global _domyslny_ogranicznik
+    if _domyslny_ogranicznik is None:
+        with _domyslny_ogranicznik_lock:
+            if _domyslny_ogranicznik is None:
+                try:
+                    _domyslny_ogranicznik = KubelekZetonow(
+                        float(os.environ.get('ROOF_GEOCODE_RATE', DOMYSLNA_CZESTOTLIWOSC)),
+                        float(os.environ.get('ROOF_GEOCODE_BURST', DOMYSLNY_ZAPAS))
+                    )
+                except ValueError as e:
+                    print(f"ROOF_GEOCODE_RATE/ROOF_GEOCODE_BURST: {e} - użyto wartości domyślnych")
+                    _domyslny_ogranicznik = KubelekZetonow()
+    return _domyslny_ogranicznik
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Wsadowe geokodowanie listy adresów')
+    parser.add_argument('adresy', help='Plik tekstowy z jednym adresem w wierszu')
+    parser.add_argument('--postep', help='Plik postępu JSONL (wznawianie po przerwaniu)')
+    args = parser.parse_args()
+
+    with open(args.adresy, encoding='utf-8') as plik:
+        adresy = [wiersz.strip() for wiersz in plik if wiersz.strip()]
+    start = time.monotonic()
+    zrodla = {}
+    for wynik in geokoduj_wsadowo(adresy, args.postep):
+        zrodla[wynik['zrodlo']] = zrodla.get(wynik['zrodlo'], 0) + 1
+        sys.stdout.write(json.dumps(wynik, ensure_ascii=False) + '\n')
+        sys.stdout.flush()
+    print(f"Zgeokodowano {len(adresy)} adresów w {time.monotonic() - start:.1f} s: {zrodla}",
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+Moduł rozpoznawania współrzędnych wpisanych przez użytkownika
+Stopnie dziesiętne, DMS, półkule N/S/E/W, PUWG 1992 (EPSG:2180),
+linki Google Maps i OpenStreetMap oraz URI geo: - bez zapytań sieciowych
+"""
+
+import re
+from urllib.parse import parse_qs, unquote_plus, urlsplit
+
+from utils.crs import PUWG1992, WGS84, transformuj
+
+
+# Obszar Polski z marginesem - do rozstrzygania kolejności osi
+ZAKRES_POLSKI_LON = (13.5, 24.5)
+ZAKRES_POLSKI_LAT = (48.5, 55.2)
+# Zakres współrzędnych EPSG:2180 na obszarze Polski (m)
+ZAKRES_PUWG1992 = (100000.0, 900000.0)
+
+_LICZBA = r"[-+]?\d+(?:[.,]\d+)?"
+_NIE_LICZBA = (None, None)
+
+
+def _skladowa(n):
+    """Wzorzec jednej współrzędnej: stopnie dziesiętne lub DMS z opcjonalną półkulą."""
+    return rf"""
+        (?P<p{n}>[NSEW])?\s*
+        (?P<st{n}>[-+]?\d{{1,3}}(?:[.,]\d+)?)
+        (?:
+            \s*[°º˚d]\s*
+            (?:(?P<min{n}>\d{{1,2}}(?:[.,]\d+)?)\s*['′’]\s*
+               (?:(?P<sek{n}>\d{{1,2}}(?:[.,]\d+)?)\s*(?:"|″|”|'')?)?
+            )?
+          | \s+(?P<min_b{n}>\d{{1,2}})\s+(?P<sek_b{n}>\d{{1,2}}(?:[.,]\d+)?)(?=\s*[NSEW])
+          | \s+(?P<min_c{n}>\d{{1,2}}[.,]\d+)(?=\s*[NSEW])
+        )?
+        (?(p{n})|\s*(?P<h{n}>[NSEW])?)
+    """
+
+
+_PARA_RE = re.compile(
+    rf"^\s*{_skladowa(1)}\s*(?:[,;/]|\s)\s*{_skladowa(2)}\s*$",
+    re.IGNORECASE | re.VERBOSE
+)
+_PUWG_RE = re.compile(
+    rf"""^\s*(?:(?:EPSG\s*:?\s*2180|PUWG\s*-?\s*1992|układ\s*1992|1992)\s*[:,;]?\s*)?
+        (?:(?P<o1>[XY])\s*[=:]?\s*)?(?P<a>{_LICZBA})\s*(?:m\b)?\s*[,;]?\s*
+        (?:(?P<o2>[XY])\s*[=:]?\s*)?(?P<b>{_LICZBA})\s*(?:m\b)?\s*$""",
+    re.IGNORECASE | re.VERBOSE
+)
+_GOOGLE_3D4D_RE = re.compile(rf"!3d({_LICZBA})!4d({_LICZBA})")
+_GOOGLE_AT_RE = re.compile(rf"@({_LICZBA}),({_LICZBA})(?:,|$|/|\?)")
+_OSM_MAP_RE = re.compile(rf"map=\d+(?:\.\d+)?/({_LICZBA})/({_LICZBA})")
+_GEO_URI_RE = re.compile(rf"^geo:\s*({_LICZBA})\s*,\s*({_LICZBA})", re.IGNORECASE)
+_PARA_W_TEKSCIE_RE = re.compile(r"(-?\d{1,3}\.\d{3,})\s*,\s*(-?\d{1,3}\.\d{3,})")
+_PARAMETRY_PARY = ('q', 'query', 'll', 'sll', 'center', 'destination', 'daddr', 'saddr', 'coordinates')
+
+
+def _liczba(tekst):
+    return float(tekst.replace(',', '.'))
+
+
+def _w_polsce(lon, lat):
+    return (ZAKRES_POLSKI_LON[0] <= lon <= ZAKRES_POLSKI_LON[1]
+            and ZAKRES_POLSKI_LAT[0] <= lat <= ZAKRES_POLSKI_LAT[1])
+
+
+def _poprawne(lon, lat):
+    return -180.0 <= lon <= 180.0 and -90.0 <= lat <= 90.0
+
+
+def _kat(dopasowanie, n):
+    """Wartość kąta w stopniach i litera półkuli (lub None) dla składowej n."""
+    grupa = dopasowanie.group
+    stopnie = _liczba(grupa(f'st{n}'))
+    minuty = grupa(f'min{n}') or grupa(f'min_b{n}') or grupa(f'min_c{n}')
+    sekundy = grupa(f'sek{n}') or grupa(f'sek_b{n}')
+    polkula = grupa(f'p{n}') or grupa(f'h{n}')
+    if minuty is not None:
+        minuty = _liczba(minuty)
+        sekundy = _liczba(sekundy) if sekundy is not None else 0.0
+        if minuty >= 60 or sekundy >= 60:
+            return None, None
+        znak = -1.0 if stopnie < 0 or grupa(f'st{n}').startswith('-') else 1.0
+        stopnie = znak * (abs(stopnie) + minuty / 60.0 + sekundy / 3600.0)
+    polkula = polkula.upper() if polkula else None
+    if polkula in ('S', 'W'):
+        if stopnie < 0:
+            return None, None
+        stopnie = -stopnie
+    return stopnie, polkula
+
+
+def _para_katow(tekst):
+    """Para kątów (stopnie dziesiętne lub DMS) -> (lon, lat)."""
+    dopasowanie = _PARA_RE.match(tekst)
+    if not dopasowanie:
+        return _NIE_LICZBA
+    pierwsza, h1 = _kat(dopasowanie, 1)
+    druga, h2 = _kat(dopasowanie, 2)
+    if pierwsza is None or druga is None:
+        return _NIE_LICZBA
+    szerokosci = {'N', 'S'}
+    if h1 and h2 and (h1 in szerokosci) == (h2 in szerokosci):
+        return _NIE_LICZBA
+    if h1 in ('E', 'W') or h2 in szerokosci:
+        lon, lat = pierwsza, druga
+    else:
+        # Domyślnie "szerokość długość"; odwrócona kolejność tylko gdy wskazuje na nią obszar Polski
+        lat, lon = pierwsza, druga
+        if not (h1 or h2) and not _w_polsce(lon, lat) and _w_polsce(lat, lon):
+            lon, lat = lat, lon
+    if not _poprawne(lon, lat):
+        return _NIE_LICZBA
+    return lon, lat
+
+
+def _puwg1992(tekst):
+    """Para współrzędnych EPSG:2180 w metrach -> (lon, lat)."""
+    dopasowanie = _PUWG_RE.match(tekst)
+    if not dopasowanie:
+        return _NIE_LICZBA
+    a, b = _liczba(dopasowanie.group('a')), _liczba(dopasowanie.group('b'))
+    if not all(ZAKRES_PUWG1992[0] <= v <= ZAKRES_PUWG1992[1] for v in (a, b)):
+        return _NIE_LICZBA
+    o1 = (dopasowanie.group('o1') or '').upper()
+    o2 = (dopasowanie.group('o2') or '').upper()
+    if o1 and o2 and o1 == o2:
+        return _NIE_LICZBA
+    # Oznaczenia X/Y w konwencji geodezyjnej (X na północ), jak w Geoportalu
+    if o1 == 'Y' or o2 == 'X':
+        wschod, polnoc = a, b
+    elif o1 == 'X' or o2 == 'Y':
+        polnoc, wschod = a, b
+    else:
+        # Bez oznaczeń: zawsze kolejność geodezyjna X Y (para "wschód północ" z GIS
+        # zwykle też trafia w Polskę, więc nie da się jej rozpoznać); odwrotna
+        # tylko, gdy geodezyjna wypada poza Polską
+        polnoc, wschod = a, b
+        lon, lat = transformuj(PUWG1992, WGS84, wschod, polnoc)
+        if not _w_polsce(lon, lat):
+            wschod, polnoc = a, b
+    lon, lat = transformuj(PUWG1992, WGS84, wschod, polnoc)
+    if not _w_polsce(lon, lat):
+        return _NIE_LICZBA
+    return float(lon), float(lat)
+
+
+def _z_url(tekst):
+    """Współrzędne osadzone w linku Google Maps, OpenStreetMap lub URI geo:."""
+    dopasowanie = _GEO_URI_RE.match(tekst)
+    if dopasowanie:
+        return _para_z_liczb(dopasowanie.group(1), dopasowanie.group(2))
+
+    tekst = unquote_plus(tekst)
+    # Google: "!3d..!4d.." to dokładne położenie miejsca, "@lat,lon" - środek widoku
+    for wzorzec in (_GOOGLE_3D4D_RE, _OSM_MAP_RE):
+        dopasowanie = wzorzec.search(tekst)
+        if dopasowanie:
+            return _para_z_liczb(dopasowanie.group(1), dopasowanie.group(2))
+
+    czesci = urlsplit(tekst if '://' in tekst else 'https://' + tekst)
+    parametry = parse_qs(czesci.query)
+    if 'mlat' in parametry and 'mlon' in parametry:
+        return _para_z_liczb(parametry['mlat'][0], parametry['mlon'][0])
+    if 'lat' in parametry and ('lon' in parametry or 'lng' in parametry):
+        return _para_z_liczb(parametry['lat'][0], (parametry.get('lon') or parametry['lng'])[0])
+    for nazwa in _PARAMETRY_PARY:
+        for wartosc in parametry.get(nazwa, ()):
+            lon, lat = _para_katow(wartosc)
+            if lon is not None:
+                return lon, lat
+
+    dopasowanie = _GOOGLE_AT_RE.search(tekst)
+    if dopasowanie:
+        return _para_z_liczb(dopasowanie.group(1), dopasowanie.group(2))
+    # Ścieżka /maps/place/52°13'47"N 21°00'44"E/ lub /search/52.2,21.0
+    for segment in czesci.path.split('/'):
+        if any(c.isdigit() for c in segment):
+            lon, lat = _para_katow(segment)
+            if lon is not None:
+                return lon, lat
+    dopasowanie = _PARA_W_TEKSCIE_RE.search(tekst)
+    if dopasowanie:
+        return _para_z_liczb(dopasowanie.group(1), dopasowanie.group(2))
+    return _NIE_LICZBA
+
+
+def _para_z_liczb(lat, lon):
+    try:
+        lon, lat = _liczba(lon), _liczba(lat)
+    except (TypeError, ValueError):
+        return _NIE_LICZBA
+    return (lon, lat) if _poprawne(lon, lat) else _NIE_LICZBA
+
+
+def _wyglada_na_url(tekst):
+    poczatek = tekst[:40].lower()
+    return (
+        '://' in poczatek
+        or poczatek.startswith(('geo:', 'www.', 'maps.', 'goo.gl', 'openstreetmap.', 'osm.org'))
+        or 'google.' in poczatek
+    )
+
+
+def parsuj_wspolrzedne(tekst):
+    """
+    Rozpoznaje współrzędne w tekście wpisanym przez użytkownika (bez sieci)
+
+    Obsługiwane formaty:
+        "52.2297 21.0122", "52,2297; 21,0122" - szerokość i długość dziesiętnie
+        "52°13'47\\"N 21°0'44\\"E", "N 52°13.783' E 21°0.733'", "52 13 47 N 21 0 44 E" - DMS
+        "X=487000 Y=637000", "EPSG:2180 487000 637000" - PUWG 1992 w metrach; bez
+            oznaczeń X/Y para czytana jest w kolejności geodezyjnej X (północ) Y (wschód),
+            jak w Geoportalu - odwrotnie tylko, gdy wyłącznie taka trafia w Polskę
+        linki Google Maps (@lat,lon, !3d!4d, ?q=), OpenStreetMap (#map=, mlat/mlon), geo:lat,lon
+
+    Krótkie linki (goo.gl, maps.app.goo.gl) wymagają przekierowania - nie są
+    rozpoznawane, tekst trafia wtedy do geokodowania.
+
+    Args:
+        tekst: Tekst wpisany przez użytkownika
+
+    Returns:
+        tuple: (lon, lat) w WGS84 lub (None, None) jeśli tekst nie zawiera współrzędnych
+    """
+    if not isinstance(tekst, str):
+        return _NIE_LICZBA
+    tekst = tekst.strip()
+    if not tekst or len(tekst) > 4096 or not any(c.isdigit() for c in tekst):
+        return _NIE_LICZBA
+    if _wyglada_na_url(tekst):
+        return _z_url(tekst)
+    lon, lat = _para_katow(tekst)
+    if lon is not None:
+        return lon, lat
+    return _puwg1992(tekst)
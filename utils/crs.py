@@ -0,0 +1,279 @@
+"""
+Moduł transformacji układów współrzędnych
+Transformery pyproj są tworzone raz na proces, funkcje wsadowe działają na tablicach NumPy;
+duże tablice WGS84 <-> EPSG:2180 liczone są bezpośrednio wzorami odwzorowania w NumPy
+"""
+
+import functools
+import os
+
+import numpy as np
+from pyproj import Transformer
+
+
+WGS84 = "EPSG:4326"
+PUWG1992 = "EPSG:2180"
+
+# PUWG 1992: odwzorowanie Gaussa-Krügera na elipsoidzie GRS80
+GRS80_A = 6378137.0
+GRS80_F = 1 / 298.257222101
+PUWG1992_LON0 = 19.0
+PUWG1992_K0 = 0.9993
+PUWG1992_FE = 500000.0
+PUWG1992_FN = -5300000.0
+# Od tylu punktów tablice są przeliczane jądrem NumPy zamiast pyproj
+DOMYSLNY_PROG_NUMPY = 2000
+# Jądro NumPy liczy blokami - tablice pośrednie mieszczą się w pamięci podręcznej CPU
+ROZMIAR_BLOKU_NUMPY = 16384
+
+
+def _wspolczynniki_krugera():
+    """Stałe szeregów Krügera 6. rzędu (Karney 2011) dla GRS80."""
+    n = GRS80_F / (2 - GRS80_F)
+    n2, n3, n4, n5, n6 = n ** 2, n ** 3, n ** 4, n ** 5, n ** 6
+    promien = GRS80_A / (1 + n) * (1 + n2 / 4 + n4 / 64 + n6 / 256)
+    alfa = np.array([
+        n / 2 - 2 * n2 / 3 + 5 * n3 / 16 + 41 * n4 / 180 - 127 * n5 / 288 + 7891 * n6 / 37800,
+        13 * n2 / 48 - 3 * n3 / 5 + 557 * n4 / 1440 + 281 * n5 / 630 - 1983433 * n6 / 1935360,
+        61 * n3 / 240 - 103 * n4 / 140 + 15061 * n5 / 26880 + 167603 * n6 / 181440,
+        49561 * n4 / 161280 - 179 * n5 / 168 + 6601661 * n6 / 7257600,
+        34729 * n5 / 80640 - 3418889 * n6 / 1995840,
+        212378941 * n6 / 319334400,
+    ])
+    beta = np.array([
+        n / 2 - 2 * n2 / 3 + 37 * n3 / 96 - n4 / 360 - 81 * n5 / 512 + 96199 * n6 / 604800,
+        n2 / 48 + n3 / 15 - 437 * n4 / 1440 + 46 * n5 / 105 - 1118711 * n6 / 3870720,
+        17 * n3 / 480 - 37 * n4 / 840 - 209 * n5 / 4480 + 5569 * n6 / 90720,
+        4397 * n4 / 161280 - 11 * n5 / 504 - 830251 * n6 / 7257600,
+        4583 * n5 / 161280 - 108847 * n6 / 3991680,
+        20648693 * n6 / 638668800,
+    ])
+    return promien * PUWG1992_K0, alfa, beta
+
+
+_SKALA_KRUGERA, _ALFA, _BETA = _wspolczynniki_krugera()
+_E = np.sqrt(GRS80_F * (2 - GRS80_F))
+
+
+def _tau_konforemne(tau):
+    """tan szerokości konforemnej z tan szerokości geodezyjnej."""
+    sec = np.sqrt(1.0 + tau * tau)
+    sigma = np.sinh(_E * np.arctanh(_E * tau / sec))
+    return tau * np.sqrt(1.0 + sigma * sigma) - sigma * sec
+
+
+def _szereg_krugera(wspolczynniki, xi, eta):
+    """
+    Suma sum_j c_j * sin(2j(xi + i*eta)) schematem Clenshawa
+
+    Zespolone sin/cos są w NumPy wolne, więc liczone są raz z rzeczywistych
+    sin, cos, sinh i cosh; kolejne wyrazy to tylko mnożenia zespolone.
+
+    Returns:
+        np.ndarray: Suma szeregu (complex128)
+    """
+    sin_xi, cos_xi = np.sin(2.0 * xi), np.cos(2.0 * xi)
+    sinh_eta, cosh_eta = np.sinh(2.0 * eta), np.cosh(2.0 * eta)
+    mnoznik = 2.0 * (cos_xi * cosh_eta - 1j * (sin_xi * sinh_eta))
+    b1 = np.full(mnoznik.shape, wspolczynniki[-1], dtype=np.complex128)
+    b2 = np.zeros_like(b1)
+    for c in wspolczynniki[-2::-1]:
+        b1, b2 = mnoznik * b1 - b2 + c, b1
+    return b1 * (sin_xi * cosh_eta + 1j * (cos_xi * sinh_eta))
+
+
+def _blokami(jadro, a, b):
+    """Wywołuje jądro na kolejnych blokach spłaszczonych tablic i składa wynik."""
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+    if a.size <= ROZMIAR_BLOKU_NUMPY:
+        return jadro(a, b)
+    plaskie_a, plaskie_b = a.ravel(), b.ravel()
+    wynik_a, wynik_b = np.empty(a.size), np.empty(a.size)
+    for start in range(0, a.size, ROZMIAR_BLOKU_NUMPY):
+        blok = slice(start, start + ROZMIAR_BLOKU_NUMPY)
+        wynik_a[blok], wynik_b[blok] = jadro(plaskie_a[blok], plaskie_b[blok])
+    return wynik_a.reshape(a.shape), wynik_b.reshape(a.shape)
+
+
+def wgs84_do_epsg2180_numpy(lon, lat):
+    """
+    Odwzorowanie WGS84 -> EPSG:2180 wzorami Krügera (Karney 2011) w NumPy
+
+    Zgodne z pyproj z dokładnością lepszą niż 0.001 mm w granicach Polski.
+
+    Args:
+        lon: Tablica długości geograficznych
+        lat: Tablica szerokości geograficznych
+
+    Returns:
+        tuple: (x, y) jako tablice NumPy float64 (x na wschód)
+    """
+    return _blokami(_wgs84_do_epsg2180_blok, lon, lat)
+
+
+def _wgs84_do_epsg2180_blok(lon, lat):
+    lam = np.radians(lon - PUWG1992_LON0)
+    tau_p = _tau_konforemne(np.tan(np.radians(lat)))
+    cos_lam = np.cos(lam)
+    xi_p = np.arctan2(tau_p, cos_lam)
+    eta_p = np.arcsinh(np.sin(lam) / np.sqrt(tau_p * tau_p + cos_lam * cos_lam))
+    suma = _szereg_krugera(_ALFA, xi_p, eta_p)
+    x = PUWG1992_FE + _SKALA_KRUGERA * (eta_p + suma.imag)
+    y = PUWG1992_FN + _SKALA_KRUGERA * (xi_p + suma.real)
+    return x, y
+
+
+def epsg2180_do_wgs84_numpy(x, y):
+    """
+    Odwzorowanie odwrotne EPSG:2180 -> WGS84 wzorami Krügera w NumPy
+
+    Args:
+        x: Tablica współrzędnych X (na wschód)
+        y: Tablica współrzędnych Y (na północ)
+
+    Returns:
+        tuple: (lon, lat) jako tablice NumPy float64
+    """
+    return _blokami(_epsg2180_do_wgs84_blok, x, y)
+
+
+def _epsg2180_do_wgs84_blok(x, y):
+    xi = (y - PUWG1992_FN) / _SKALA_KRUGERA
+    eta = (x - PUWG1992_FE) / _SKALA_KRUGERA
+    suma = _szereg_krugera(_BETA, xi, eta)
+    xi_p = xi - suma.real
+    sinh_eta = np.sinh(eta - suma.imag)
+    cos_xi = np.cos(xi_p)
+    tau_p = np.sin(xi_p) / np.sqrt(sinh_eta * sinh_eta + cos_xi * cos_xi)
+    lam = np.arctan2(sinh_eta, cos_xi)
+
+    # Szerokość geodezyjna z konforemnej - metoda Newtona, zbieżna w 2-3 krokach
+    e2 = _E * _E
+    tau = tau_p / (1 - e2)
+    for _ in range(5):
+        tau_i = _tau_konforemne(tau)
+        krok = ((tau_p - tau_i) / np.sqrt(1.0 + tau_i * tau_i)
+                * (1 + (1 - e2) * tau * tau) / ((1 - e2) * np.sqrt(1.0 + tau * tau)))
+        tau = tau + krok
+        if np.all(np.abs(krok) < 1e-14):
+            break
+    return PUWG1992_LON0 + np.degrees(lam), np.degrees(np.arctan(tau))
+
+
+def prog_numpy():
+    """Minimalny rozmiar tablicy przeliczanej w NumPy (ROOF_CRS_NUMPY_MIN, 0 - zawsze pyproj)."""
+    try:
+        return int(os.environ.get('ROOF_CRS_NUMPY_MIN', DOMYSLNY_PROG_NUMPY))
+    except ValueError:
+        return DOMYSLNY_PROG_NUMPY
+
+
+def _uzyj_numpy(tablica):
+    prog = prog_numpy()
+    return prog > 0 and tablica.size >= prog
+
+
+@functools.lru_cache(maxsize=32)
+def pobierz_transformer(z_crs, do_crs):
+    """
+    Zwraca współdzielony transformer między układami (kolejność osi x/lon, y/lat)
+
+    Budowa transformera trwa milisekundy, więc jest wykonywana raz na proces.
+    Transformery pyproj >= 3.1 są bezpieczne wątkowo.
+
+    Args:
+        z_crs: Układ źródłowy (np. "EPSG:4326")
+        do_crs: Układ docelowy (np. "EPSG:2180")
+
+    Returns:
+        pyproj.Transformer
+    """
+    return Transformer.from_crs(z_crs, do_crs, always_xy=True)
+
+
+def transformuj(z_crs, do_crs, a, b):
+    """
+    Transformuje współrzędne (skalary lub tablice) jednym wywołaniem
+
+    Args:
+        z_crs: Układ źródłowy
+        do_crs: Układ docelowy
+        a: Pierwsza współrzędna (x/lon) - liczba lub tablica
+        b: Druga współrzędna (y/lat) - liczba lub tablica
+
+    Returns:
+        tuple: (a', b') w układzie docelowym
+    """
+    return pobierz_transformer(z_crs, do_crs).transform(a, b)
+
+
+def wgs84_do_epsg2180_wsadowo(lon, lat):
+    """
+    Konwertuje tablice współrzędnych WGS84 do EPSG:2180
+
+    Tablice od ROOF_CRS_NUMPY_MIN punktów liczone są jądrem NumPy (wgs84_do_epsg2180_numpy).
+
+    Args:
+        lon: Tablica długości geograficznych
+        lat: Tablica szerokości geograficznych
+
+    Returns:
+        tuple: (x, y) jako tablice NumPy float64
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    if _uzyj_numpy(lon):
+        return wgs84_do_epsg2180_numpy(lon, lat)
+    x, y = transformuj(WGS84, PUWG1992, lon, lat)
+    return np.asarray(x), np.asarray(y)
+
+
+def epsg2180_do_wgs84_wsadowo(x, y):
+    """
+    Konwertuje tablice współrzędnych EPSG:2180 do WGS84
+
+    Tablice od ROOF_CRS_NUMPY_MIN punktów liczone są jądrem NumPy (epsg2180_do_wgs84_numpy).
+
+    Args:
+        x: Tablica współrzędnych X
+        y: Tablica współrzędnych Y
+
+    Returns:
+        tuple: (lon, lat) jako tablice NumPy float64
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if _uzyj_numpy(x):
+        return epsg2180_do_wgs84_numpy(x, y)
+    lon, lat = transformuj(PUWG1992, WGS84, x, y)
+    return np.asarray(lon), np.asarray(lat)
+
+
+def punkty_wgs84_do_epsg2180(punkty):
+    """
+    Konwertuje listę punktów [(lon, lat), ...] (np. wierzchołki wielokąta)
+
+    Args:
+        punkty: Tablica o kształcie (N, 2) z kolumnami lon, lat
+
+    Returns:
+        np.ndarray: Tablica (N, 2) z kolumnami x, y
+    """
+    punkty = np.asarray(punkty, dtype=np.float64).reshape(-1, 2)
+    x, y = wgs84_do_epsg2180_wsadowo(punkty[:, 0], punkty[:, 1])
+    return np.column_stack((x, y))
+
+
+def punkty_epsg2180_do_wgs84(punkty):
+    """
+    Konwertuje listę punktów [(x, y), ...] z EPSG:2180 do WGS84
+
+    Args:
+        punkty: Tablica o kształcie (N, 2) z kolumnami x, y
+
+    Returns:
+        np.ndarray: Tablica (N, 2) z kolumnami lon, lat
+    """
+    punkty = np.asarray(punkty, dtype=np.float64).reshape(-1, 2)
+    lon, lat = epsg2180_do_wgs84_wsadowo(punkty[:, 0], punkty[:, 1])
+    return np.column_stack((lon, lat))
@@ -0,0 +1,189 @@
+"""
+Moduł równoległego pobierania danych z serwisów mapowych
+Ograniczona pula wątków z limitem równoczesnych połączeń na hosta - limit
+obejmuje tylko samo żądanie HTTP, trafienia w cache nie czekają na niego
+"""
+
+import asyncio
+import contextlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+
+DOMYSLNA_LICZBA_WATKOW = 8
+DOMYSLNY_LIMIT_NA_HOSTA = 4
+# Najdłuższa przerwa między próbami zajęcia limitu hosta z pętli zdarzeń (s)
+MAKS_ODSTEP_LIMITU_ASYNC_S = 0.02
+
+# Silnik, w którego puli działa bieżący wątek (jego limit hostów obowiązuje w limit_hosta)
+_biezacy = threading.local()
+
+
+def host_z_url(url):
+    """Zwraca nazwę hosta z adresu URL (klucz limitu połączeń)."""
+    return urlparse(url).netloc or url
+
+
+class SilnikPobierania:
+    """
+    Wykonuje zadania pobierania równolegle w ograniczonej puli wątków.
+
+    Zadania same zajmują limit hosta (limit_hosta) wokół żądania HTTP -
+    niezależnie od rozmiaru puli do jednego hosta trafia jednocześnie najwyżej
+    limit_na_hosta żądań, a zadania obsłużone z cache nie czekają na limit.
+    """
+
+    def __init__(self, maks_watkow=DOMYSLNA_LICZBA_WATKOW, limit_na_hosta=DOMYSLNY_LIMIT_NA_HOSTA):
+        """
+        Args:
+            maks_watkow: Rozmiar puli wątków
+            limit_na_hosta: Maksymalna liczba równoczesnych żądań do jednego hosta
+        """
+        self.maks_watkow = maks_watkow
+        self.limit_na_hosta = limit_na_hosta
+        self._executor = ThreadPoolExecutor(max_workers=maks_watkow, thread_name_prefix='pobieranie')
+        self._semafory = {}
+        self._lock = threading.Lock()
+
+    def limit_hosta(self, host):
+        """
+        Returns:
+            threading.BoundedSemaphore: Limit równoczesnych żądań do hosta
+        """
+        with self._lock:
+            semafor = self._semafory.get(host)
+            if semafor is None:
+                semafor = threading.BoundedSemaphore(self.limit_na_hosta)
+                self._semafory[host] = semafor
+            return semafor
+
+    def zlec(self, funkcja, *args, **kwargs):
+        """
+        Zleca wykonanie funkcji w puli; limit_hosta() wywołany w funkcji
+        zwraca limit tego silnika
+
+        Args:
+            funkcja: Funkcja pobierająca
+            *args, **kwargs: Argumenty funkcji
+
+        Returns:
+            concurrent.futures.Future
+        """
+        def wykonaj():
+            poprzedni = getattr(_biezacy, 'silnik', None)
+            _biezacy.silnik = self
+            try:
+                return funkcja(*args, **kwargs)
+            finally:
+                _biezacy.silnik = poprzedni
+
+        return self._executor.submit(wykonaj)
+
+    def pobierz_wszystkie(self, zadania, anuluj=None):
+        """
+        Uruchamia wszystkie zadania naraz i zwraca wyniki w kolejności ukończenia
+
+        Args:
+            zadania: Lista krotek (klucz, funkcja, args)
+            anuluj: Opcjonalny threading.Event - po jego ustawieniu zadania,
+                    które jeszcze nie wystartowały, są anulowane
+
+        Yields:
+            tuple: (klucz, wynik) - wynik to None jeśli zadanie rzuciło wyjątek
+        """
+        futures = {}
+        for klucz, funkcja, args in zadania:
+            futures[self.zlec(funkcja, *args)] = klucz
+        for future in as_completed(futures):
+            if anuluj is not None and anuluj.is_set():
+                for pozostaly in futures:
+                    pozostaly.cancel()
+                return
+            klucz = futures[future]
+            try:
+                wynik = future.result()
+            except Exception as e:
+                print(f"Błąd pobierania {klucz}: {e}")
+                wynik = None
+            yield klucz, wynik
+
+    def zamknij(self):
+        """Zamyka pulę wątków (czeka na zakończenie zadań)."""
+        self._executor.shutdown(wait=True)
+
+
+_domyslny_silnik = None
+_domyslny_silnik_lock = threading.Lock()
+
+
+def _liczba_ze_zmiennej(nazwa, domyslna):
+    """Dodatnia liczba całkowita ze zmiennej środowiskowej (błędna wartość - domyślna)."""
+    try:
+        return max(1, int(os.environ.get(nazwa, domyslna)))
+    except ValueError:
+        print(f"{nazwa}: błędna wartość - użyto domyślnej ({domyslna})")
+        return domyslna
+
+
+def pobierz_silnik():
+    """
+    Zwraca współdzielony silnik pobierania skonfigurowany zmiennymi:
+        ROOF_FETCH_THREADS - rozmiar puli wątków
+        ROOF_FETCH_PER_HOST - limit równoczesnych żądań na hosta
+
+    Returns:
+        SilnikPobierania
+    """
+    global _domyslny_silnik
+    if _domyslny_silnik is None:
+        with _domyslny_silnik_lock:
+            if _domyslny_silnik is None:
+                _domyslny_silnik = SilnikPobierania(
+                    maks_watkow=_liczba_ze_zmiennej('ROOF_FETCH_THREADS', DOMYSLNA_LICZBA_WATKOW),
+                    limit_na_hosta=_liczba_ze_zmiennej('ROOF_FETCH_PER_HOST', DOMYSLNY_LIMIT_NA_HOSTA)
+                )
+    return _domyslny_silnik
+
+
+def limit_hosta(host):
+    """
+    Limit równoczesnych żądań do hosta - do użycia jako `with limit_hosta(host):`
+    wokół samego żądania HTTP
+
+    W wątku puli silnika obowiązuje limit tego silnika, poza pulą (np. pobieranie
+    wyprzedzające) - limit współdzielonego silnika (ROOF_FETCH_PER_HOST).
+
+    Args:
+        host: Nazwa hosta (host_z_url)
+
+    Returns:
+        threading.BoundedSemaphore
+    """
+    silnik = getattr(_biezacy, 'silnik', None) or pobierz_silnik()
+    return silnik.limit_hosta(host)
+
+
+@contextlib.asynccontextmanager
+async def limit_hosta_async(host):
+    """
+    Asynchroniczny odpowiednik limit_hosta - `async with limit_hosta_async(host):`
+
+    Zajmuje ten sam semafor co wątki współdzielonego silnika, więc żądania
+    z pętli zdarzeń i z puli wątków liczą się do jednego limitu na hosta.
+    Semafor jest wątkowy, dlatego oczekiwanie to ponawiane próby bez
+    blokowania z rosnącą przerwą - pętla zdarzeń nigdy nie stoi.
+
+    Args:
+        host: Nazwa hosta (host_z_url)
+    """
+    semafor = limit_hosta(host)
+    odstep = 0.001
+    while not semafor.acquire(blocking=False):
+        await asyncio.sleep(odstep)
+        odstep = min(odstep * 2, MAKS_ODSTEP_LIMITU_ASYNC_S)
+    try:
+        yield
+    finally:
+        semafor.release()
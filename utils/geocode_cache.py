@@ -0,0 +1,335 @@
+"""
+Moduł trwałego cache geokodowania z normalizacją adresów
+Wyniki (także negatywne) zapisywane są w SQLite z czasem ważności
+"""
+
+import contextlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+
+DOMYSLNA_SCIEZKA_CACHE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'geokodowanie.sqlite3'
+)
+DOMYSLNY_TTL_DNI = 30
+DOMYSLNY_TTL_NEGATYWNY_GODZ = 24
+
+# Znak braku wpisu (w odróżnieniu od zapamiętanego wyniku negatywnego None)
+BRAK = object()
+
+# Litery, których NFKD nie rozkłada na literę bazową i znak diakrytyczny
+_ZNAKI_SPECJALNE = str.maketrans({'ł': 'l', 'Ł': 'l', 'ß': 'ss', 'ø': 'o', 'đ': 'd'})
+_NIE_ALFANUMERYCZNE_RE = re.compile(r"[^\w]+")
+_CYFRA_RE = re.compile(r"\d")
+# Skróty i pełne nazwy sprowadzane do jednej postaci; None - słowo pomijane
+SKROTY_ADRESOWE = {
+    'ul': None,
+    'ulica': None,
+    'al': 'al',
+    'aleja': 'al',
+    'aleje': 'al',
+    'alei': 'al',
+    'pl': 'pl',
+    'plac': 'pl',
+    'placu': 'pl',
+    'os': 'os',
+    'osiedle': 'os',
+    'osiedla': 'os',
+    'rondo': 'rondo',
+    'skwer': 'skwer',
+    'nr': None,
+    'numer': None,
+    # Samo "m" nie jest pomijane - to także inicjał w nazwie ("M. Skłodowskiej-Curie")
+    'mieszk': None,
+    'gm': 'gmina',
+    'pow': 'powiat',
+    'woj': 'wojewodztwo',
+    'polska': None,
+    'poland': None,
+}
+
+
+def normalizuj_adres(adres):
+    """
+    Sprowadza adres do postaci kanonicznej używanej jako klucz cache
+
+    Małe litery, bez polskich znaków i interpunkcji, ujednolicone skróty
+    ("ul."/"ulica" pomijane, "aleja" -> "al" itd.), pojedyncze spacje.
+    Kolejność słów pozostaje bez zmian - "Nowa Wieś, Stara 5" i "Stara Wieś,
+    Nowa 5" to różne adresy.
+
+    Args:
+        adres: Adres wpisany przez użytkownika
+
+    Returns:
+        str: Znormalizowany adres
+    """
+    return ' '.join(token for token, _ in _tokeny(adres))
+
+
+def usun_diakrytyki(tekst):
+    """Zamienia tekst na małe litery bez polskich (i innych) znaków diakrytycznych."""
+    tekst = str(tekst).translate(_ZNAKI_SPECJALNE).lower()
+    tekst = unicodedata.normalize('NFKD', tekst)
+    return ''.join(znak for znak in tekst if not unicodedata.combining(znak))
+
+
+def tokeny_adresu(adres):
+    """
+    Dzieli adres na znormalizowane słowa i elementy z cyframi
+
+    Args:
+        adres: Adres lub jego fragment (np. nazwa ulicy)
+
+    Returns:
+        tuple: (lista słów po ujednoliceniu skrótów, lista numerów w kolejności)
+    """
+    slowa = []
+    numery = []
+    for token, numer in _tokeny(adres):
+        (numery if numer else slowa).append(token)
+    return slowa, numery
+
+
+def _tokeny(adres):
+    """Kolejne tokeny adresu jako (token, czy_zawiera_cyfre) po ujednoliceniu skrótów."""
+    for token in _NIE_ALFANUMERYCZNE_RE.split(usun_diakrytyki(adres)):
+        if not token:
+            continue
+        if _CYFRA_RE.search(token):
+            yield token, True
+            continue
+        if token in SKROTY_ADRESOWE:
+            token = SKROTY_ADRESOWE[token]
+            if token is None:
+                continue
+        yield token, False
+
+
+def _klucz(adres, rodzaj):
+    klucz = normalizuj_adres(adres)
+    return f"{rodzaj}:{klucz}" if rodzaj else klucz
+
+
+class CacheGeokodowania:
+    """
+    Trwały cache wyników geokodowania w SQLite.
+
+    Wynik pozytywny ważny jest ttl_s sekund, negatywny (brak wyników)
+    ttl_negatywny_s sekund. Każdy wątek używa własnego połączenia,
+    baza działa w trybie WAL, więc może być współdzielona przez workery.
+    """
+
+    def __init__(self, sciezka, ttl_s=DOMYSLNY_TTL_DNI * 86400,
+                 ttl_negatywny_s=DOMYSLNY_TTL_NEGATYWNY_GODZ * 3600):
+        """
+        Args:
+            sciezka: Ścieżka pliku bazy SQLite (":memory:" - tylko w pamięci)
+            ttl_s: Czas ważności wyników pozytywnych w sekundach
+            ttl_negatywny_s: Czas ważności wyników negatywnych w sekundach
+        """
+        self.sciezka = sciezka
+        self.ttl_s = ttl_s
+        self.ttl_negatywny_s = ttl_negatywny_s
+        if sciezka != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(sciezka)), exist_ok=True)
+        self._lokalne = threading.local()
+        self._lock = threading.Lock()
+        self._trafienia = 0
+        self._trafienia_negatywne = 0
+        self._chybienia = 0
+        self._zapisy = 0
+        # Dla ":memory:" wszystkie wątki muszą współdzielić jedno połączenie
+        self._wspolne_polaczenie = None
+        self._blokada_bazy = contextlib.nullcontext()
+        if sciezka == ':memory:':
+            self._wspolne_polaczenie = self._otworz()
+            self._blokada_bazy = threading.Lock()
+
+    def _otworz(self):
+        polaczenie = sqlite3.connect(self.sciezka, timeout=10, check_same_thread=False)
+        polaczenie.execute('PRAGMA journal_mode=WAL')
+        polaczenie.execute('PRAGMA synchronous=NORMAL')
+        polaczenie.execute(
+            'CREATE TABLE IF NOT EXISTS geokody ('
+            ' klucz TEXT PRIMARY KEY,'
+            ' wynik TEXT,'
+            ' zapisano REAL NOT NULL,'
+            ' wygasa REAL NOT NULL)'
+        )
+        polaczenie.commit()
+        return polaczenie
+
+    def _polaczenie(self):
+        if self._wspolne_polaczenie is not None:
+            return self._wspolne_polaczenie
+        polaczenie = getattr(self._lokalne, 'polaczenie', None)
+        if polaczenie is None:
+            polaczenie = self._otworz()
+            self._lokalne.polaczenie = polaczenie
+        return polaczenie
+
+    def pobierz(self, adres, rodzaj=None):
+        """
+        Odczytuje wynik geokodowania z cache
+
+        Args:
+            adres: Adres (normalizowany przed wyszukaniem)
+            rodzaj: Rodzaj wpisu (None - współrzędne, np. 'kandydaci' - lista kandydatów)
+
+        Returns:
+            Zapamiętany wynik (None dla wyniku negatywnego) lub BRAK
+        """
+        klucz = _klucz(adres, rodzaj)
+        try:
+            with self._blokada_bazy:
+                wiersz = self._polaczenie().execute(
+                    'SELECT wynik, wygasa FROM geokody WHERE klucz = ?', (klucz,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Cache geokodowania: błąd odczytu: {e}")
+            wiersz = None
+        if wiersz is None or wiersz[1] < time.time():
+            with self._lock:
+                self._chybienia += 1
+            return BRAK
+        wynik = json.loads(wiersz[0]) if wiersz[0] is not None else None
+        with self._lock:
+            if wynik is None:
+                self._trafienia_negatywne += 1
+            else:
+                self._trafienia += 1
+        return wynik
+
+    def zapisz(self, adres, wynik, rodzaj=None):
+        """
+        Zapisuje wynik geokodowania
+
+        Args:
+            adres: Adres (normalizowany przed zapisem)
+            wynik: Wartość serializowalna do JSON lub None (wynik negatywny)
+            rodzaj: Rodzaj wpisu (jak w pobierz)
+        """
+        teraz = time.time()
+        ttl = self.ttl_s if wynik is not None else self.ttl_negatywny_s
+        wartosc = json.dumps(wynik) if wynik is not None else None
+        try:
+            with self._blokada_bazy:
+                polaczenie = self._polaczenie()
+                polaczenie.execute(
+                    'INSERT OR REPLACE INTO geokody (klucz, wynik, zapisano, wygasa) VALUES (?, ?, ?, ?)',
+                    (_klucz(adres, rodzaj), wartosc, teraz, teraz + ttl)
+                )
+                polaczenie.commit()
+        except sqlite3.Error as e:
+            print(f"Cache geokodowania: błąd zapisu: {e}")
+            return
+        with self._lock:
+            self._zapisy += 1
+
+    def wpisy(self, rodzaj, limit=None):
+        """
+        Zwraca ważne, pozytywne wpisy danego rodzaju (np. do budowy podpowiedzi)
+
+        Args:
+            rodzaj: Rodzaj wpisu (jak w pobierz)
+            limit: Maksymalna liczba wpisów (najnowsze pierwsze)
+
+        Returns:
+            list: Odczytane wartości
+        """
+        zapytanie = (
+            'SELECT wynik FROM geokody WHERE klucz >= ? AND klucz < ? AND wygasa >= ?'
+            ' AND wynik IS NOT NULL ORDER BY zapisano DESC'
+        )
+        # Zakres kluczy zamiast LIKE - korzysta z indeksu klucza głównego
+        parametry = [f"{rodzaj}:", f"{rodzaj};", time.time()]
+        if limit is not None:
+            zapytanie += ' LIMIT ?'
+            parametry.append(int(limit))
+        try:
+            with self._blokada_bazy:
+                wiersze = self._polaczenie().execute(zapytanie, parametry).fetchall()
+        except sqlite3.Error as e:
+            print(f"Cache geokodowania: błąd odczytu: {e}")
+            return []
+        return [json.loads(wiersz[0]) for wiersz in wiersze]
+
+    def usun_wygasle(self):
+        """
+        Usuwa przeterminowane wpisy
+
+        Returns:
+            int: Liczba usuniętych wpisów
+        """
+        with self._blokada_bazy:
+            polaczenie = self._polaczenie()
+            kursor = polaczenie.execute('DELETE FROM geokody WHERE wygasa < ?', (time.time(),))
+            polaczenie.commit()
+        return kursor.rowcount
+
+    def statystyki(self):
+        """
+        Returns:
+            dict: trafienia (pozytywne i negatywne), chybienia i zapisy
+        """
+        with self._lock:
+            zapytania = self._trafienia + self._trafienia_negatywne + self._chybienia
+            return {
+                'trafienia': self._trafienia,
+                'trafienia_negatywne': self._trafienia_negatywne,
+                'chybienia': self._chybienia,
+                'wspolczynnik_trafien': (
+                    (self._trafienia + self._trafienia_negatywne) / zapytania if zapytania else 0.0
+                ),
+                'zapisy': self._zapisy,
+            }
+
+
+_domyslny_cache = None
+_domyslny_cache_lock = threading.Lock()
+
+
+def pobierz_cache_geokodowania():
+    """
+    Zwraca współdzielony cache geokodowania skonfigurowany zmiennymi:
+        ROOF_GEOCODE_CACHE_PATH - plik bazy SQLite (pusty - cache wyłączony)
+        ROOF_GEOCODE_TTL_DAYS - ważność wyników pozytywnych w dniach
+        ROOF_GEOCODE_NEGATIVE_TTL_HOURS - ważność wyników negatywnych w godzinach
+
+    Returns:
+        CacheGeokodowania lub None jeśli cache jest wyłączony
+    """
+    global _domyslny_cache
+    if _domyslny_cache is not None:
+        return _domyslny_cache or None
+    with _domyslny_cache_lock:
+        if _domyslny_cache is None:
+            sciezka = os.environ.get('ROOF_GEOCODE_CACHE_PATH', DOMYSLNA_SCIEZKA_CACHE)
+            try:
+                if not sciezka:
+                    _domyslny_cache = False
+                else:
+                    _domyslny_cache = CacheGeokodowania(
+                        sciezka,
+                        ttl_s=float(os.environ.get('ROOF_GEOCODE_TTL_DAYS', DOMYSLNY_TTL_DNI)) * 86400,
+                        ttl_negatywny_s=float(
+                            os.environ.get('ROOF_GEOCODE_NEGATIVE_TTL_HOURS', DOMYSLNY_TTL_NEGATYWNY_GODZ)
+                        ) * 3600
+                    )
+            except (OSError, ValueError, sqlite3.Error) as e:
+                print(f"Cache geokodowania wyłączony: {e}")
+                _domyslny_cache = False
+    return _domyslny_cache or None
+
+
+def ustaw_cache_geokodowania(cache):
+    """Podmienia współdzielony cache geokodowania (None wyłącza cache)."""
+    global _domyslny_cache
+    with _domyslny_cache_lock:
+        _domyslny_cache = cache if cache is not None else False
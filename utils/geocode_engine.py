@@ -0,0 +1,415 @@
+"""
+Moduł geokodowania z wielu źródeł jednocześnie
+Indeks lokalny, Nominatim (publiczny i własny) oraz Photon odpytywane są
+z opóźnieniami, a kandydaci ze wszystkich źródeł oceniani wspólną punktacją
+"""
+
+import asyncio
+import os
+import threading
+from collections import namedtuple
+
+from utils.geocode_scoring import cechy_zapytania, skladniki_oceny
+from utils.fetch_engine import host_z_url, limit_hosta_async
+from utils.hedge import StatystykiWyscigu, wyscig, wyscig_async
+from utils.http_session import aiohttp, pobierz_sesje_http, pobierz_sesje_http_async
+from utils.offline_geocoder import pobierz_indeks_adresow
+
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+LIMIT_KANDYDATOW = 5
+# Wynik trafienia w numer budynku na właściwej ulicy (numer + ulica + typ budynku)
+DOMYSLNY_PROG_PEWNOSCI = 9.0
+# Kolejność i opóźnienia startu źródeł (s); publiczny Nominatim rusza wcześniej,
+# gdy wszystkie wcześniejsze źródła odpowiedzą bez pewnego wyniku
+DOMYSLNE_ZRODLA = "offline:0,nominatim_wlasny:0,photon:0,nominatim:1"
+
+STATYSTYKI_GEOKODOWANIA = StatystykiWyscigu()
+
+# kandydaci - posortowani od najlepszego, z oceną w polu 'ocena' i jej
+# składnikami w 'skladniki';
+# bledy - słownik nazwa źródła -> wyjątek dla źródeł zakończonych błędem
+WynikWyszukiwania = namedtuple('WynikWyszukiwania', ['kandydaci', 'bledy'])
+
+
+class BladGeokodowania(Exception):
+    """Brak kandydatów, a co najmniej jedno źródło geokodowania zawiodło."""
+
+    def __init__(self, komunikat, response=None):
+        super().__init__(komunikat)
+        # Odpowiedź HTTP źródła (np. 429 z nagłówkiem Retry-After), jeśli była
+        self.response = response
+
+
+def szukaj_nominatim(url, adres, anuluj=None):
+    """
+    Pobiera kandydatów z serwera Nominatim (publicznego lub własnego)
+
+    Args:
+        url: Adres endpointu /search
+        adres: Szukany adres
+        anuluj: Opcjonalny threading.Event - zapytanie nie jest wysyłane po anulowaniu
+
+    Returns:
+        list: Kandydaci w formacie Nominatim
+    """
+    if anuluj is not None and anuluj.is_set():
+        return []
+    # Nagłówek User-Agent wymagany przez Nominatim ustawia sesja HTTP
+    response = pobierz_sesje_http().get(url, params=_parametry_nominatim(adres))
+    response.raise_for_status()
+    return list(response.json())
+
+
+async def szukaj_nominatim_async(url, adres):
+    """Asynchroniczna wersja szukaj_nominatim (sesja aiohttp, wspólny limit hosta)."""
+    async with limit_hosta_async(host_z_url(url)):
+        async with pobierz_sesje_http_async().get(url, params=_parametry_nominatim(adres)) as response:
+            response.raise_for_status()
+            return list(await response.json(content_type=None))
+
+
+def _parametry_nominatim(adres):
+    return {
+        "q": adres,
+        "format": "json",
+        "limit": LIMIT_KANDYDATOW,
+        "addressdetails": 1,
+        "countrycodes": "pl"
+    }
+
+
+def szukaj_photon(url, adres, anuluj=None):
+    """
+    Pobiera kandydatów z serwera Photon i sprowadza je do formatu Nominatim
+
+    Args:
+        url: Adres endpointu /api
+        adres: Szukany adres
+        anuluj: Opcjonalny threading.Event - zapytanie nie jest wysyłane po anulowaniu
+
+    Returns:
+        list: Kandydaci w formacie Nominatim
+    """
+    if anuluj is not None and anuluj.is_set():
+        return []
+    response = pobierz_sesje_http().get(url, params={"q": adres, "limit": LIMIT_KANDYDATOW})
+    response.raise_for_status()
+    return _kandydaci_photon(response.json())
+
+
+async def szukaj_photon_async(url, adres):
+    """Asynchroniczna wersja szukaj_photon (sesja aiohttp, wspólny limit hosta)."""
+    async with limit_hosta_async(host_z_url(url)):
+        async with pobierz_sesje_http_async().get(url, params={"q": adres, "limit": LIMIT_KANDYDATOW}) as response:
+            response.raise_for_status()
+            return _kandydaci_photon(await response.json(content_type=None))
+
+
+def _kandydaci_photon(odpowiedz):
+    """Sprowadza odpowiedź GeoJSON Photona do kandydatów w formacie Nominatim."""
+    kandydaci = []
+    for obiekt in odpowiedz.get("features", []):
+        wlasnosci = obiekt.get("properties") or {}
+        if wlasnosci.get("countrycode", "PL").upper() != "PL":
+            continue
+        lon, lat = obiekt["geometry"]["coordinates"][:2]
+        address = {}
+        for pole_photon, pole_nominatim in (("housenumber", "house_number"), ("street", "road"),
+                                            ("city", "city"), ("postcode", "postcode")):
+            if wlasnosci.get(pole_photon):
+                address[pole_nominatim] = wlasnosci[pole_photon]
+        czesci = [wlasnosci.get("name"), " ".join(
+            str(c) for c in (wlasnosci.get("street"), wlasnosci.get("housenumber")) if c
+        ), wlasnosci.get("postcode"), wlasnosci.get("city")]
+        kandydaci.append({
+            "lat": str(lat),
+            "lon": str(lon),
+            "display_name": ", ".join(c for c in czesci if c),
+            "address": address,
+            "class": wlasnosci.get("osm_key", ""),
+            "type": "house" if wlasnosci.get("type") == "house" else wlasnosci.get("osm_value", ""),
+        })
+    return kandydaci
+
+
+def szukaj_offline(adres, anuluj=None):
+    """Pobiera kandydatów z lokalnego indeksu adresowego."""
+    indeks = pobierz_indeks_adresow()
+    return indeks.szukaj(adres, limit=LIMIT_KANDYDATOW * 4) if indeks is not None else []
+
+
+def ocen_kandydatow(kandydaci, adres, zrodlo, cechy=None):
+    """
+    Ocenia kandydatów jednego źródła
+
+    Args:
+        kandydaci: Lista kandydatów w formacie Nominatim
+        adres: Adres wpisany przez użytkownika
+        zrodlo: Nazwa źródła zapisywana w polu 'zrodlo'
+        cechy: Opcjonalnie wynik cechy_zapytania(adres)
+
+    Returns:
+        list: Kopie kandydatów z polami 'zrodlo', 'skladniki' i 'ocena',
+              posortowane od najlepszego
+    """
+    cechy = cechy or cechy_zapytania(adres)
+    ocenieni = []
+    for kandydat in kandydaci:
+        kandydat = dict(kandydat, zrodlo=zrodlo)
+        kandydat['skladniki'] = skladniki_oceny(kandydat, adres, cechy)
+        kandydat['ocena'] = sum(kandydat['skladniki'].values())
+        ocenieni.append(kandydat)
+    ocenieni.sort(key=_klucz_sortowania, reverse=True)
+    return ocenieni
+
+
+def _klucz_sortowania(kandydat):
+    # Przy równej ocenie wygrywa dłuższa, bardziej opisowa nazwa (jak w wybierz_najlepszego)
+    display_name = str(kandydat.get('display_name', ''))
+    return kandydat['ocena'], len(display_name), display_name
+
+
+class SilnikGeokodowania:
+    """
+    Geokodowanie z kilku źródeł w wyścigu z opóźnieniami.
+
+    Każde źródło startuje po swoim opóźnieniu (albo wcześniej, gdy wcześniejsze
+    nie dały pewnego wyniku). Kandydaci ze wszystkich odpowiedzi są łączeni
+    i oceniani wspólną punktacją (score_candidate); gdy najlepszy osiągnie próg
+    pewności, wynik zwracany jest od razu, a pozostałe źródła są anulowane.
+    """
+
+    def __init__(self, zrodla, prog_pewnosci=DOMYSLNY_PROG_PEWNOSCI, statystyki=None, zrodla_async=None):
+        """
+        Args:
+            zrodla: Lista krotek (nazwa, opoznienie_s, funkcja(adres, anuluj) -> lista kandydatów)
+            prog_pewnosci: Ocena kandydata kończąca wyszukiwanie
+            statystyki: Opcjonalny obiekt StatystykiWyscigu (czasy i skuteczność źródeł)
+            zrodla_async: Opcjonalny słownik nazwa -> async funkcja(adres) używana przez
+                          szukaj_async zamiast funkcji synchronicznej o tej nazwie
+        """
+        self.zrodla = list(zrodla)
+        self.prog_pewnosci = prog_pewnosci
+        self.statystyki = statystyki
+        self.zrodla_async = dict(zrodla_async or {})
+
+    def szukaj(self, adres, zglaszaj_bledy=False):
+        """
+        Wyszukuje kandydatów dla adresu we wszystkich źródłach
+
+        Args:
+            adres: Adres wpisany przez użytkownika
+            zglaszaj_bledy: Czy zgłosić BladGeokodowania, gdy nie ma kandydatów, a któreś
+                            źródło zawiodło (pusty wynik nie jest wtedy pewny)
+
+        Returns:
+            WynikWyszukiwania
+        """
+        cechy = cechy_zapytania(adres)
+        kandydaci = []
+        bledy = {}
+
+        def sciezka(nazwa, funkcja):
+            def wykonaj(anuluj):
+                try:
+                    return funkcja(adres, anuluj)
+                except Exception as e:
+                    print(f"Geokodowanie: źródło {nazwa} zakończone błędem: {e}")
+                    bledy[nazwa] = e
+                    return None
+            return wykonaj
+
+        def akceptuj(nazwa, wyniki):
+            ocenieni = ocen_kandydatow(wyniki, adres, nazwa, cechy)
+            kandydaci.extend(ocenieni)
+            return any(k['ocena'] >= self.prog_pewnosci for k in ocenieni)
+
+        nazwa, _ = wyscig(
+            [(nazwa, opoznienie, sciezka(nazwa, funkcja)) for nazwa, opoznienie, funkcja in self.zrodla],
+            self.statystyki,
+            akceptuj
+        )
+        return self._zakoncz(nazwa, kandydaci, bledy, zglaszaj_bledy)
+
+    async def szukaj_async(self, adres, zglaszaj_bledy=False):
+        """
+        Asynchroniczna wersja szukaj - wyścig źródeł w bieżącej pętli zdarzeń
+
+        Źródła z wersją w zrodla_async pytane są przez aiohttp; pozostałe
+        (np. indeks lokalny) wykonują się w wątku i po przegranej dostają
+        sygnał anulowania jak w szukaj.
+
+        Args:
+            adres: Adres wpisany przez użytkownika
+            zglaszaj_bledy: Jak w szukaj
+
+        Returns:
+            WynikWyszukiwania
+        """
+        cechy = cechy_zapytania(adres)
+        kandydaci = []
+        bledy = {}
+
+        def sciezka(nazwa, funkcja):
+            async def wykonaj():
+                funkcja_async = self.zrodla_async.get(nazwa)
+                anuluj = threading.Event()
+                try:
+                    if funkcja_async is not None:
+                        return await funkcja_async(adres)
+                    return await asyncio.to_thread(funkcja, adres, anuluj)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Geokodowanie: źródło {nazwa} zakończone błędem: {e}")
+                    bledy[nazwa] = e
+                    return None
+                finally:
+                    anuluj.set()
+            return wykonaj
+
+        def akceptuj(nazwa, wyniki):
+            ocenieni = ocen_kandydatow(wyniki, adres, nazwa, cechy)
+            kandydaci.extend(ocenieni)
+            return any(k['ocena'] >= self.prog_pewnosci for k in ocenieni)
+
+        nazwa, _ = await wyscig_async(
+            [(nazwa, opoznienie, sciezka(nazwa, funkcja)) for nazwa, opoznienie, funkcja in self.zrodla],
+            self.statystyki,
+            akceptuj
+        )
+        return self._zakoncz(nazwa, kandydaci, bledy, zglaszaj_bledy)
+
+    def _zakoncz(self, nazwa, kandydaci, bledy, zglaszaj_bledy):
+        """Sortuje kandydatów wyścigu źródeł i buduje wynik (albo zgłasza błąd)."""
+        kandydaci.sort(key=_klucz_sortowania, reverse=True)
+        # Bez pewnego wyniku wygrywa źródło najlepszego kandydata
+        if nazwa is None and kandydaci and self.statystyki is not None:
+            self.statystyki.zapisz_wygrana(kandydaci[0]['zrodlo'])
+        if zglaszaj_bledy and not kandydaci and bledy:
+            odpowiedzi = [getattr(e, 'response', None) for e in bledy.values()]
+            raise BladGeokodowania(
+                f"Brak kandydatów, źródła geokodowania zawiodły: {', '.join(bledy)}",
+                next((r for r in odpowiedzi if r is not None), None)
+            )
+        return WynikWyszukiwania(kandydaci, dict(bledy))
+
+    def geokoduj(self, adres, zglaszaj_bledy=False):
+        """
+        Zwraca współrzędne najlepszego kandydata
+
+        Args:
+            adres: Adres wpisany przez użytkownika
+            zglaszaj_bledy: Czy zgłosić BladGeokodowania, gdy nie ma kandydatów, a któreś
+                            źródło zawiodło (pusty wynik nie jest wtedy pewny)
+
+        Returns:
+            tuple: (lon, lat) lub None
+        """
+        kandydaci = self.szukaj(adres, zglaszaj_bledy).kandydaci
+        if not kandydaci:
+            return None
+        return float(kandydaci[0]['lon']), float(kandydaci[0]['lat'])
+
+
+def zrodla_z_konfiguracji(specyfikacja=None):
+    """
+    Buduje listę źródeł ze specyfikacji "nazwa:opóźnienie,..." (ROOF_GEOCODE_BACKENDS)
+
+    Źródła bez konfiguracji są pomijane: offline wymaga ROOF_ADDRESS_INDEX,
+    nominatim_wlasny - ROOF_NOMINATIM_URL, photon - ROOF_PHOTON_URL.
+
+    Args:
+        specyfikacja: Tekst specyfikacji (domyślnie ze zmiennej środowiskowej)
+
+    Returns:
+        list: Krotki (nazwa, opoznienie_s, funkcja)
+    """
+    if specyfikacja is None:
+        specyfikacja = os.environ.get('ROOF_GEOCODE_BACKENDS', DOMYSLNE_ZRODLA)
+    wlasny_url = os.environ.get('ROOF_NOMINATIM_URL')
+    photon_url = os.environ.get('ROOF_PHOTON_URL')
+    dostepne = {
+        'offline': szukaj_offline if pobierz_indeks_adresow() is not None else None,
+        'nominatim': lambda adres, anuluj: szukaj_nominatim(NOMINATIM_URL, adres, anuluj),
+        'nominatim_wlasny': (
+            (lambda adres, anuluj: szukaj_nominatim(wlasny_url, adres, anuluj)) if wlasny_url else None
+        ),
+        'photon': (lambda adres, anuluj: szukaj_photon(photon_url, adres, anuluj)) if photon_url else None,
+    }
+    zrodla = []
+    for pozycja in specyfikacja.split(','):
+        nazwa, _, opoznienie = pozycja.strip().partition(':')
+        if nazwa not in dostepne:
+            if nazwa:
+                print(f"Geokodowanie: nieznane źródło '{nazwa}'")
+            continue
+        if dostepne[nazwa] is None:
+            continue
+        try:
+            opoznienie_s = float(opoznienie or 0)
+        except ValueError:
+            opoznienie_s = None
+        if opoznienie_s is None or not opoznienie_s >= 0:
+            print(f"Geokodowanie: błędne opóźnienie źródła '{pozycja.strip()}' - pominięte")
+            continue
+        zrodla.append((nazwa, opoznienie_s, dostepne[nazwa]))
+    return zrodla
+
+
+def zrodla_async_z_konfiguracji():
+    """
+    Asynchroniczne (aiohttp) wersje źródeł sieciowych do SilnikGeokodowania.szukaj_async
+
+    Returns:
+        dict: nazwa źródła -> async funkcja(adres); pusty bez pakietu aiohttp
+    """
+    if aiohttp is None:
+        return {}
+    wlasny_url = os.environ.get('ROOF_NOMINATIM_URL')
+    photon_url = os.environ.get('ROOF_PHOTON_URL')
+    zrodla = {'nominatim': lambda adres: szukaj_nominatim_async(NOMINATIM_URL, adres)}
+    if wlasny_url:
+        zrodla['nominatim_wlasny'] = lambda adres: szukaj_nominatim_async(wlasny_url, adres)
+    if photon_url:
+        zrodla['photon'] = lambda adres: szukaj_photon_async(photon_url, adres)
+    return zrodla
+
+
+_domyslny_silnik = None
+_domyslny_silnik_lock = threading.Lock()
+
+
+def pobierz_silnik_geokodowania():
+    """
+    Zwraca współdzielony silnik geokodowania skonfigurowany zmiennymi:
+        ROOF_GEOCODE_BACKENDS - źródła i ich opóźnienia (zob. zrodla_z_konfiguracji)
+        ROOF_GEOCODE_CONFIDENCE - ocena kandydata kończąca wyszukiwanie
+
+    Returns:
+        SilnikGeokodowania
+    """
+    global _domyslny_silnik
+    if _domyslny_silnik is None:
+        with _domyslny_silnik_lock:
+            if _domyslny_silnik is None:
+                try:
+                    prog = float(os.environ.get('ROOF_GEOCODE_CONFIDENCE', DOMYSLNY_PROG_PEWNOSCI))
+                except ValueError:
+                    print("ROOF_GEOCODE_CONFIDENCE: błędna wartość - użyto domyślnej")
+                    prog = DOMYSLNY_PROG_PEWNOSCI
+                _domyslny_silnik = SilnikGeokodowania(
+                    zrodla_z_konfiguracji(),
+                    prog,
+                    STATYSTYKI_GEOKODOWANIA,
+                    zrodla_async_z_konfiguracji()
+                )
+    return _domyslny_silnik
+
+
+def ustaw_silnik_geokodowania(silnik):
+    """Podmienia współdzielony silnik geokodowania (None - ponowna konfiguracja ze zmiennych)."""
+    global _domyslny_silnik
+    with _domyslny_silnik_lock:
+        _domyslny_silnik = silnik
@@ -0,0 +1,125 @@
+"""
+Moduł oceny kandydatów geokodowania
+Wspólna punktacja dopasowania adresu dla Nominatim i lokalnych indeksów adresowych
+"""
+
+import re
+
+
+DIGITS_RE = re.compile(r"\d+")
+TOKEN_RE = re.compile(r"\w+")
+HOUSE_MATCH_SCORE = 5.0
+DIGIT_MATCH_SCORE = 2.0
+ROAD_MATCH_SCORE = 2.0
+LOCALITY_MATCH_SCORE = 1.0
+PLACE_CLASS_SCORE = 2.0
+PLACE_TYPE_SCORE = 2.0
+IMPORTANCE_WEIGHT = 3.0
+
+
+def cechy_zapytania(adres):
+    """
+    Wylicza cechy zapytania używane przy ocenie kandydatów (raz na zapytanie)
+
+    Args:
+        adres: Adres wpisany przez użytkownika
+
+    Returns:
+        tuple: (adres małymi literami, zbiór tokenów, zbiór liczb)
+    """
+    adres_lower = adres.lower()
+    return adres_lower, set(TOKEN_RE.findall(adres_lower)), set(DIGITS_RE.findall(adres))
+
+
+def score_candidate(kandydat, adres, cechy=None):
+    """
+    Zwraca wynik dopasowania adresu na podstawie numeru, ulicy i typu.
+
+    Args:
+        kandydat: Słownik w formacie odpowiedzi Nominatim (address, display_name, class, type...)
+        adres: Adres wpisany przez użytkownika
+        cechy: Opcjonalnie wynik cechy_zapytania(adres) - przy ocenie wielu kandydatów
+
+    Returns:
+        float: Wynik dopasowania (większy - lepszy)
+    """
+    return sum(skladniki_oceny(kandydat, adres, cechy).values())
+
+
+def skladniki_oceny(kandydat, adres, cechy=None):
+    """
+    Rozbija wynik dopasowania na składniki (do pokazania użytkownikowi)
+
+    Args:
+        kandydat: Słownik w formacie odpowiedzi Nominatim
+        adres: Adres wpisany przez użytkownika
+        cechy: Opcjonalnie wynik cechy_zapytania(adres)
+
+    Returns:
+        dict: numer, cyfry, ulica, miejscowosc, klasa, typ, waznosc - punkty
+              za każde kryterium (suma to score_candidate)
+    """
+    adres_lower, adres_tokens, digits_set = cechy or cechy_zapytania(adres)
+    skladniki = dict.fromkeys(
+        ("numer", "cyfry", "ulica", "miejscowosc", "klasa", "typ", "waznosc"), 0.0
+    )
+    address = kandydat.get("address") or {}
+    house_number = str(address.get("house_number", ""))
+    house_digits = DIGITS_RE.findall(house_number)
+    house_digits_set = set(house_digits)
+    display_name = str(kandydat.get("display_name", ""))
+    place_type = str(kandydat.get("type", ""))
+    place_class = str(kandydat.get("class", ""))
+
+    if house_digits_set and digits_set and house_digits_set & digits_set:
+        skladniki["numer"] = HOUSE_MATCH_SCORE
+    elif digits_set:
+        display_digits_set = set(DIGITS_RE.findall(display_name))
+        if display_digits_set & digits_set:
+            skladniki["cyfry"] = DIGIT_MATCH_SCORE
+
+    if address.get("road"):
+        road_tokens = set(TOKEN_RE.findall(address["road"].lower()))
+        if road_tokens and adres_tokens:
+            road_overlap = len(road_tokens & adres_tokens) / len(road_tokens)
+            if road_overlap >= 0.5:
+                skladniki["ulica"] = ROAD_MATCH_SCORE
+
+    for field in ("city", "town", "village", "municipality", "county"):
+        value = address.get(field)
+        if value and value.lower() in adres_lower:
+            skladniki["miejscowosc"] = LOCALITY_MATCH_SCORE
+            break
+
+    if place_class in ("building", "place"):
+        skladniki["klasa"] = PLACE_CLASS_SCORE
+    if place_type in ("house", "building", "residential", "apartments", "detached"):
+        skladniki["typ"] = PLACE_TYPE_SCORE
+
+    importance = kandydat.get("importance")
+    if isinstance(importance, (int, float)):
+        skladniki["waznosc"] = importance * IMPORTANCE_WEIGHT
+    return skladniki
+
+
+def wybierz_najlepszego(kandydaci, adres):
+    """
+    Wybiera najlepiej pasującego kandydata
+
+    Args:
+        kandydaci: Lista kandydatów w formacie Nominatim
+        adres: Adres wpisany przez użytkownika
+
+    Returns:
+        dict lub None jeśli lista jest pusta
+    """
+    if not kandydaci:
+        return None
+    cechy = cechy_zapytania(adres)
+
+    def sort_key(kandydat):
+        # Tie-breaker: prefer longer, more descriptive display names after score.
+        display_name = str(kandydat.get("display_name", ""))
+        return (score_candidate(kandydat, adres, cechy), len(display_name), display_name)
+
+    return max(kandydaci, key=sort_key)
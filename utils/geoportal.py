@@ -4,11 +4,39 @@ Pobieranie ortofotomap z polskiego Geoportalu
 """
 
 import requests
-import re
 from io import BytesIO
 from PIL import Image, UnidentifiedImageError
 import math
-from pyproj import Transformer
+import os
+
+from utils.crs import PUWG1992, WGS84, transformuj
+from utils.coordinates import parsuj_wspolrzedne
+from utils.fetch_engine import host_z_url, limit_hosta, pobierz_silnik
+from utils.geocode_cache import BRAK, normalizuj_adres, pobierz_cache_geokodowania
+from utils.geocode_engine import NOMINATIM_URL, ocen_kandydatow, pobierz_silnik_geokodowania
+# Stałe punktacji eksportowane także stąd dla zgodności z wcześniejszym API
+from utils.geocode_scoring import (
+    DIGITS_RE,
+    TOKEN_RE,
+    HOUSE_MATCH_SCORE,
+    DIGIT_MATCH_SCORE,
+    ROAD_MATCH_SCORE,
+    LOCALITY_MATCH_SCORE,
+    PLACE_CLASS_SCORE,
+    PLACE_TYPE_SCORE,
+    IMPORTANCE_WEIGHT,
+    score_candidate,
+    wybierz_najlepszego
+)
+from utils.hedge import StatystykiWyscigu, wyscig
+from utils.http_session import aiohttp, pobierz_sesje_http
+from utils.image_cache import kopia_obrazu, obraz_ze_zrodla, pobierz_pamiec_obrazow, sprawdz_obraz
+from utils.offline_geocoder import pobierz_indeks_adresow
+from utils.parcels import normalizuj_identyfikator, zakres_mapy_dzialki, znajdz_dzialke
+from utils.prefetch import pobierz_wyprzedzanie, ustawienia_wyprzedzania, zadanie_interaktywne
+from utils.singleflight import pobierz_pojedynczy_lot
+from utils.tile_cache import KluczKafelka, pobierz_cache_kafelkow
+from utils.tile_pack import pobierz_paczki_kafelkow
 
 
 # URL serwisu WMTS Geoportalu
@@ -17,16 +45,47 @@ GEOPORTAL_WMTS_URL = "https://mapy.geoportal.gov.pl/wss/service/PZGIK/ORTO/WMTS/
 GEOPORTAL_WMS_URL = "https://mapy.geoportal.gov.pl/wss/service/PZGIK/ORTO/WMS/StandardResolution"
 OSM_STATIC_URL = "https://staticmap.openstreetmap.de/staticmap.php"
 GOOGLE_STATIC_URL = "https://maps.googleapis.com/maps/api/staticmap"
-NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
-DIGITS_RE = re.compile(r"\d+")
-TOKEN_RE = re.compile(r"\w+")
-HOUSE_MATCH_SCORE = 5.0
-DIGIT_MATCH_SCORE = 2.0
-ROAD_MATCH_SCORE = 2.0
-LOCALITY_MATCH_SCORE = 1.0
-PLACE_CLASS_SCORE = 2.0
-PLACE_TYPE_SCORE = 2.0
-IMPORTANCE_WEIGHT = 3.0
+WMTS_LAYER = "ORTOFOTOMAPA"
+WMTS_TILE_MATRIX_SET = "EPSG:2180"
+WMTS_FORMAT = "image/jpeg"
+# Parametry macierzy kafelków dla EPSG:2180 z GetCapabilities Geoportalu
+# TopLeftCorner zgodny z oficjalną specyfikacją WMTS Geoportalu
+# Źródło: https://mapy.geoportal.gov.pl/wss/service/PZGIK/ORTO/WMTS/StandardResolution?SERVICE=WMTS&REQUEST=GetCapabilities
+WMTS_ORIGIN_X = 0.0
+WMTS_ORIGIN_Y = 850000.0
+WMTS_TILE_SIZE = 512  # Geoportal używa kafelków 512x512 dla StandardResolution
+# Rozdzielczość dla różnych poziomów zoom (metry na piksel)
+# Źródło: GetCapabilities WMTS Geoportalu, obliczone ze ScaleDenominator × 0.00028
+WMTS_RESOLUTIONS = {
+    0: 8466.68360,
+    1: 4233.34180,
+    2: 2116.67090,
+    3: 1058.33545,
+    4: 529.16773,
+    5: 264.58386,
+    6: 132.29193,
+    7: 66.14597,
+    8: 26.45839,
+    9: 13.22919,
+    10: 6.61460,
+    11: 2.64584,
+    12: 1.32292,
+    13: 0.52917,
+    14: 0.26458,
+    15: 0.13229
+}
+# Domyślny obszar mapy WMS wokół punktu (m)
+DOMYSLNY_ZAKRES_WMS_M = (400, 300)
+# Po ilu sekundach oczekiwania na WMS startuje równolegle mozaika WMTS
+DOMYSLNE_OPOZNIENIE_HEDGE_S = 2.0
+STATYSTYKI_HEDGE = StatystykiWyscigu()
+# Rozmiar fragmentu odpowiedzi czytanego między sprawdzeniami anulowania (B)
+ROZMIAR_CZESCI_ODPOWIEDZI = 64 * 1024
+# Liczba kandydatów geokodowania zwracanych przez API i zapamiętywanych w cache
+LIMIT_KANDYDATOW_API = 10
+MAKS_KANDYDATOW_W_CACHE = 20
+# Pola adresu kandydata zachowywane w cache (do podpowiedzi i ponownej oceny)
+POLA_ADRESU_KANDYDATA = ('house_number', 'road', 'city', 'town', 'village', 'postcode')
 
 
 def wgs84_do_epsg2180(lon, lat):
@@ -40,9 +99,7 @@ def wgs84_do_epsg2180(lon, lat):
     Returns:
         tuple: (x, y) w układzie EPSG:2180
     """
-    transformer = Transformer.from_crs("EPSG:4326", "EPSG:2180", always_xy=True)
-    x, y = transformer.transform(lon, lat)
-    return x, y
+    return transformuj(WGS84, PUWG1992, lon, lat)
 
 
 def epsg2180_do_wgs84(x, y):
@@ -56,146 +113,257 @@ def epsg2180_do_wgs84(x, y):
     Returns:
         tuple: (lon, lat) w WGS84
     """
-    transformer = Transformer.from_crs("EPSG:2180", "EPSG:4326", always_xy=True)
-    lon, lat = transformer.transform(x, y)
-    return lon, lat
+    return transformuj(PUWG1992, WGS84, x, y)
 
 
 def geokoduj_adres(adres):
     """
-    Zamienia adres na współrzędne GPS (WGS84) przy użyciu Nominatim.
+    Zamienia adres na współrzędne GPS (WGS84) - najpierw z lokalnego indeksu
+    adresowego (jeśli skonfigurowano), potem przy użyciu Nominatim.
     """
     if not adres:
         return None
-    try:
-        adres_lower = adres.lower()
-        adres_tokens = set(TOKEN_RE.findall(adres_lower))
-        digits = DIGITS_RE.findall(adres)
-        digits_set = set(digits)
-
-        def score_candidate(kandydat):
-            """Zwraca wynik dopasowania adresu na podstawie numeru, ulicy i typu."""
-            score = 0.0
-            address = kandydat.get("address") or {}
-            house_number = str(address.get("house_number", ""))
-            house_digits = DIGITS_RE.findall(house_number)
-            house_digits_set = set(house_digits)
-            display_name = str(kandydat.get("display_name", ""))
-            place_type = str(kandydat.get("type", ""))
-            place_class = str(kandydat.get("class", ""))
-
-            if house_digits_set and digits_set and house_digits_set & digits_set:
-                score += HOUSE_MATCH_SCORE
-            elif digits_set:
-                display_digits_set = set(DIGITS_RE.findall(display_name))
-                if display_digits_set & digits_set:
-                    score += DIGIT_MATCH_SCORE
-
-            if address.get("road"):
-                road_tokens = set(TOKEN_RE.findall(address["road"].lower()))
-                if road_tokens and adres_tokens:
-                    road_overlap = len(road_tokens & adres_tokens) / len(road_tokens)
-                    if road_overlap >= 0.5:
-                        score += ROAD_MATCH_SCORE
-
-            for field in ("city", "town", "village", "municipality", "county"):
-                value = address.get(field)
-                if value and value.lower() in adres_lower:
-                    score += LOCALITY_MATCH_SCORE
-                    break
-
-            if place_class in ("building", "place"):
-                score += PLACE_CLASS_SCORE
-            if place_type in ("house", "building", "residential", "apartments", "detached"):
-                score += PLACE_TYPE_SCORE
-
-            importance = kandydat.get("importance")
-            if isinstance(importance, (int, float)):
-                score += importance * IMPORTANCE_WEIGHT
-            return score
-
-        params = {
-            "q": adres,
-            "format": "json",
-            "limit": 5,
-            "addressdetails": 1,
-            "countrycodes": "pl"
-        }
-        headers = {
-            "User-Agent": "RoofGeoportal/1.0 (https://github.com/Majcher-creator/RoofGeoportal)"
-        }
-        response = requests.get(NOMINATIM_URL, params=params, headers=headers, timeout=10)
-        if response.status_code != 200:
-            return None
-        dane = response.json()
-        if not dane:
-            return None
-        def sort_key(kandydat):
-            # Tie-breaker: prefer longer, more descriptive display names after score.
-            display_name = str(kandydat.get("display_name", ""))
-            return (score_candidate(kandydat), len(display_name), display_name)
-
-        najlepszy = max(dane, key=sort_key)
-        lat = float(najlepszy["lat"])
-        lon = float(najlepszy["lon"])
-        return lon, lat
-    except (requests.RequestException, ValueError, KeyError, IndexError, TypeError):
+    wynik = geokoduj_adres_lokalnie(adres)
+    if wynik is not BRAK:
+        return wynik[0]
+    return geokoduj_adres_z_sieci(adres)
+
+
+def geokoduj_adres_lokalnie(adres):
+    """
+    Geokoduje adres bez ruchu sieciowego - z indeksu adresowego lub cache
+
+    Args:
+        adres: Adres wpisany przez użytkownika
+
+    Returns:
+        tuple: ((lon, lat) lub None, źródło 'offline'/'cache') albo BRAK,
+               jeśli potrzebne jest zapytanie do Nominatim
+    """
+    indeks = pobierz_indeks_adresow()
+    if indeks is not None:
+        wynik = indeks.geokoduj(adres)
+        if wynik is not None:
+            return wynik, 'offline'
+    cache = pobierz_cache_geokodowania()
+    if cache is not None:
+        wynik = cache.pobierz(adres)
+        if wynik is not BRAK:
+            return (tuple(wynik) if wynik else None), 'cache'
+    return BRAK
+
+
+def geokoduj_adres_z_sieci(adres, zglaszaj_bledy=False):
+    """
+    Geokoduje adres zapytaniami do skonfigurowanych źródeł (z zapisem do cache)
+
+    Args:
+        adres: Adres wpisany przez użytkownika
+        zglaszaj_bledy: Czy zgłaszać BladGeokodowania, gdy brak wyników, a któreś
+                        źródło zawiodło (domyślnie błąd daje None, jak brak wyników)
+
+    Returns:
+        tuple: (lon, lat) lub None
+    """
+    kandydaci = _kandydaci_z_sieci(adres, zglaszaj_bledy)
+    if not kandydaci:
         return None
+    return kandydaci[0]['lon'], kandydaci[0]['lat']
 
 
-def pobierz_kafelek_wmts(tile_col, tile_row, zoom_level=14):
+def kandydaci_geokodowania(adres, limit=LIMIT_KANDYDATOW_API, tylko_lokalnie=False):
     """
-    Pobiera pojedynczy kafelek z serwisu WMTS Geoportalu
-    
+    Zwraca ocenionych kandydatów dla adresu (najlepszy pierwszy)
+
+    Lista zapisywana jest w cache razem z wynikiem geokodowania, więc wybór
+    innego kandydata nie wymaga ponownego zapytania do serwisów.
+
+    Args:
+        adres: Adres wpisany przez użytkownika
+        limit: Maksymalna liczba kandydatów
+        tylko_lokalnie: Bez ruchu sieciowego - tylko cache i indeks adresowy
+
+    Returns:
+        list: Słowniki lon, lat, display_name, ocena, skladniki, zrodlo
+    """
+    if not adres:
+        return []
+    cache = pobierz_cache_geokodowania()
+    if cache is not None:
+        kandydaci = cache.pobierz(adres, 'kandydaci')
+        if kandydaci is not BRAK:
+            return (kandydaci or [])[:limit]
+    if tylko_lokalnie:
+        indeks = pobierz_indeks_adresow()
+        if indeks is None:
+            return []
+        return [_kandydat_api(k) for k in ocen_kandydatow(indeks.szukaj(adres), adres, 'offline')][:limit]
+    return _kandydaci_z_sieci(adres)[:limit]
+
+
+def _kandydaci_z_sieci(adres, zglaszaj_bledy=False):
+    # Równoczesne zapytania o ten sam (znormalizowany) adres czekają na jedno
+    # wyszukiwanie
+    return pobierz_pojedynczy_lot().wykonaj(
+        ('geokod', normalizuj_adres(adres), zglaszaj_bledy),
+        lambda: _geokoduj_zrodlami(adres, pobierz_cache_geokodowania(), zglaszaj_bledy)
+    )
+
+
+def _kandydat_api(kandydat):
+    """Zwięzła, serializowalna postać ocenionego kandydata."""
+    return {
+        'lon': float(kandydat['lon']),
+        'lat': float(kandydat['lat']),
+        'display_name': str(kandydat.get('display_name', '')),
+        'ocena': round(kandydat['ocena'], 3),
+        'skladniki': {nazwa: round(wartosc, 3) for nazwa, wartosc in kandydat['skladniki'].items()},
+        'zrodlo': kandydat.get('zrodlo'),
+        'address': {
+            pole: str(wartosc) for pole, wartosc in (kandydat.get('address') or {}).items()
+            if pole in POLA_ADRESU_KANDYDATA and wartosc
+        },
+    }
+
+
+def _geokoduj_zrodlami(adres, cache=None, zglaszaj_bledy=False):
+    """
+    Wyszukuje adres silnikiem geokodowania i zwraca listę kandydatów.
+    Najlepszy wynik i lista kandydatów (także pusta) zapisywane są w cache;
+    gdy któreś źródło zawiodło, brak wyników nie jest zapamiętywany.
+    """
+    wynik = pobierz_silnik_geokodowania().szukaj(adres, zglaszaj_bledy)
+    return zapisz_kandydatow(adres, wynik, cache)
+
+
+def zapisz_kandydatow(adres, wynik, cache=None):
+    """
+    Zamienia wynik silnika geokodowania na kandydatów API i zapisuje je w cache
+
+    Args:
+        adres: Adres wpisany przez użytkownika
+        wynik: WynikWyszukiwania silnika geokodowania
+        cache: Opcjonalny cache geokodowania
+
+    Returns:
+        list: Kandydaci (_kandydat_api), najlepszy pierwszy
+    """
+    kandydaci = []
+    for kandydat in wynik.kandydaci[:MAKS_KANDYDATOW_W_CACHE]:
+        try:
+            kandydaci.append(_kandydat_api(kandydat))
+        except (KeyError, TypeError, ValueError):
+            continue
+    if cache is not None and (kandydaci or not wynik.bledy):
+        najlepszy = [kandydaci[0]['lon'], kandydaci[0]['lat']] if kandydaci else None
+        cache.zapisz(adres, najlepszy)
+        cache.zapisz(adres, kandydaci or None, 'kandydaci')
+    return kandydaci
+
+
+def pobierz_bajty_kafelka_wmts(tile_col, tile_row, zoom_level=14):
+    """
+    Pobiera surowe bajty kafelka WMTS - najpierw z paczek kafelków (ROOF_TILE_PACKS),
+    potem z cache na dysku, na końcu z Geoportalu
+
     Args:
         tile_col: Kolumna kafelka
         tile_row: Wiersz kafelka
         zoom_level: Poziom powiększenia (domyślnie 14)
-        
+
     Returns:
-        PIL.Image lub None jeśli błąd
+        bytes (memoryview na zmapowaną paczkę) lub None jeśli błąd
     """
-    # Parametry WMTS zgodne z GetCapabilities Geoportalu
-    params = {
+    klucz = klucz_kafelka_wmts(tile_col, tile_row, zoom_level)
+    paczki = pobierz_paczki_kafelkow()
+    if paczki is not None:
+        dane = paczki.pobierz(klucz)
+        if dane is not None:
+            return dane
+    cache = pobierz_cache_kafelkow()
+    if cache is not None:
+        dane = cache.pobierz(klucz)
+        if dane is not None:
+            return dane
+
+    # Równoczesne żądania tego samego kafelka czekają na jedno pobranie
+    return pobierz_pojedynczy_lot().wykonaj(
+        ('wmts',) + tuple(klucz),
+        lambda: _pobierz_bajty_kafelka_z_sieci(klucz, cache),
+        miedzy_procesami=True
+    )
+
+
+def klucz_kafelka_wmts(tile_col, tile_row, zoom_level):
+    """Klucz kafelka ortofotomapy w paczkach i cache na dysku."""
+    return KluczKafelka(WMTS_LAYER, WMTS_TILE_MATRIX_SET, zoom_level, tile_row, tile_col, WMTS_FORMAT)
+
+
+def parametry_kafelka_wmts(klucz):
+    """Parametry żądania GetTile zgodne z GetCapabilities Geoportalu."""
+    return {
         'SERVICE': 'WMTS',
         'REQUEST': 'GetTile',
         'VERSION': '1.0.0',
-        'LAYER': 'ORTOFOTOMAPA',
+        'LAYER': klucz.warstwa,
         'STYLE': 'default',
-        'FORMAT': 'image/jpeg',
-        'TILEMATRIXSET': 'EPSG:2180',
-        'TILEMATRIX': f'EPSG:2180:{zoom_level}',
-        'TILEROW': str(tile_row),
-        'TILECOL': str(tile_col)
+        'FORMAT': klucz.format,
+        'TILEMATRIXSET': klucz.tms,
+        'TILEMATRIX': f'{klucz.tms}:{klucz.zoom}',
+        'TILEROW': str(klucz.wiersz),
+        'TILECOL': str(klucz.kolumna)
     }
-    
+
+
+def tresc_obrazu(status_code, content_type, tresc, zrodlo):
+    """
+    Sprawdza odpowiedź WMS/WMTS - serwis przy błędzie zwraca XML z kodem 200
+
+    Args:
+        status_code: Kod HTTP odpowiedzi
+        content_type: Nagłówek Content-Type
+        tresc: Treść odpowiedzi (bytes)
+        zrodlo: Nazwa serwisu do komunikatów
+
+    Returns:
+        bytes lub None, jeśli odpowiedź nie jest obrazem
+    """
+    if status_code != 200:
+        print(f"{zrodlo}: błąd HTTP {status_code}")
+        if tresc:
+            print(f"Treść błędu: {tresc[:200].decode('utf-8', errors='ignore')}")
+        return None
+    if 'xml' in content_type.lower() or tresc[:5] == b'<?xml':
+        print(f"{zrodlo}: otrzymano XML zamiast obrazu")
+        if len(tresc) < 1000:
+            print(f"Odpowiedź: {tresc[:500].decode('utf-8', errors='ignore')}")
+        return None
+    if not (content_type.startswith('image/') or tresc[:2] == b'\xff\xd8'):
+        print(f"{zrodlo}: nieprawidłowy format odpowiedzi (Content-Type: {content_type})")
+        print(f"Pierwsze bajty: {tresc[:20]}")
+        return None
+    return tresc
+
+
+def _pobierz_bajty_kafelka_z_sieci(klucz, cache):
+    """Pobiera kafelek z Geoportalu i zapisuje go w cache na dysku."""
+    # Inny worker mógł właśnie pobrać ten kafelek (czekaliśmy na jego blokadę)
+    if cache is not None and cache.zawiera(klucz):
+        dane = cache.pobierz(klucz)
+        if dane is not None:
+            return dane
     try:
-        response = requests.get(GEOPORTAL_WMTS_URL, params=params, timeout=10)
+        # Limit połączeń do hosta obejmuje tylko żądanie - trafienia w paczki
+        # i cache na dysku nie czekają na wolne miejsce
+        with limit_hosta(host_z_url(GEOPORTAL_WMTS_URL)):
+            response = pobierz_sesje_http().get(GEOPORTAL_WMTS_URL, params=parametry_kafelka_wmts(klucz))
         
-        if response.status_code == 200:
-            # Sprawdź czy odpowiedź to obraz czy XML (błąd)
-            content_type = response.headers.get('Content-Type', '')
-            
-            # Jeśli odpowiedź to XML, to prawdopodobnie błąd WMTS
-            if 'xml' in content_type.lower() or response.content[:5] == b'<?xml':
-                print(f"Błąd WMTS: otrzymano XML zamiast obrazu")
-                if len(response.content) < 1000:
-                    print(f"Odpowiedź: {response.content[:500].decode('utf-8', errors='ignore')}")
-                return None
-            
-            # Sprawdź czy to rzeczywiście obraz
-            if not (content_type.startswith('image/') or response.content[:2] == b'\xff\xd8'):
-                print(f"Błąd: nieprawidłowy format odpowiedzi (Content-Type: {content_type})")
-                print(f"Pierwsze bajty: {response.content[:20]}")
-                return None
-            
-            img = Image.open(BytesIO(response.content))
-            return img
-        else:
-            print(f"Błąd pobierania kafelka: HTTP {response.status_code}")
-            if response.content:
-                print(f"Treść błędu: {response.content[:200].decode('utf-8', errors='ignore')}")
-            return None
+        dane = tresc_obrazu(
+            response.status_code, response.headers.get('Content-Type', ''), response.content, 'WMTS'
+        )
+        if dane is not None and cache is not None:
+            cache.zapisz(klucz, dane)
+        return dane
             
     except Exception as e:
         print(f"Błąd podczas pobierania kafelka: {e}")
@@ -204,6 +372,87 @@ def pobierz_kafelek_wmts(tile_col, tile_row, zoom_level=14):
         return None
 
 
+def pobierz_kafelek_wmts(tile_col, tile_row, zoom_level=14):
+    """
+    Pobiera pojedynczy kafelek z serwisu WMTS Geoportalu
+    
+    Args:
+        tile_col: Kolumna kafelka
+        tile_row: Wiersz kafelka
+        zoom_level: Poziom powiększenia (domyślnie 14)
+        
+    Returns:
+        PIL.Image lub None jeśli błąd
+    """
+    def pobierz():
+        dane = pobierz_bajty_kafelka_wmts(tile_col, tile_row, zoom_level)
+        if dane is None:
+            return None
+        try:
+            return Image.open(BytesIO(dane))
+        except (UnidentifiedImageError, OSError) as e:
+            print(f"Błąd dekodowania kafelka: {e}")
+            return None
+
+    return _z_pamieci_obrazow(klucz_obrazu_kafelka(tile_col, tile_row, zoom_level), pobierz)
+
+
+def klucz_obrazu_kafelka(tile_col, tile_row, zoom_level):
+    """Klucz zdekodowanego kafelka WMTS w pamięci obrazów."""
+    return ('wmts', WMTS_LAYER, WMTS_TILE_MATRIX_SET, zoom_level, tile_row, tile_col)
+
+
+def klucz_mapy(zrodlo, lon, lat, szerokosc_pikseli, wysokosc_pikseli, wariant):
+    """
+    Klucz mapy w pamięci obrazów
+
+    Args:
+        zrodlo: 'wms', 'osm' lub 'google'
+        lon, lat: Środek mapy (WGS84)
+        szerokosc_pikseli, wysokosc_pikseli: Rozmiar obrazu
+        wariant: Zakres WMS (zakres_wms) albo zoom mapy statycznej
+    """
+    return (zrodlo, round(lon, 7), round(lat, 7), szerokosc_pikseli, wysokosc_pikseli, wariant)
+
+
+def _z_pamieci_obrazow(klucz, pobierz):
+    """
+    Zwraca zdekodowany obraz z pamięci procesu albo pobiera go i zapamiętuje
+
+    Args:
+        klucz: Krotka (źródło, parametry żądania...)
+        pobierz: Funkcja bez argumentów zwracająca PIL.Image lub None
+
+    Returns:
+        PIL.Image lub None
+    """
+    pamiec = pobierz_pamiec_obrazow()
+    if pamiec is not None:
+        img = pamiec.pobierz(klucz)
+        if img is not None:
+            return img
+
+    def pobierz_i_zapamietaj():
+        img = pobierz()
+        if img is None:
+            return None
+        # Uszkodzony obraz nie trafia do cache ani do wyścigu źródeł; obraz
+        # z bajtami źródła sprawdzany jest bez dekodowania pikseli
+        try:
+            sprawdz_obraz(img)
+        except OSError as e:
+            print(f"Błąd dekodowania obrazu: {e}")
+            return None
+        if pamiec is not None:
+            pamiec.zapisz(klucz, img)
+        return img
+
+    # Równoczesne identyczne żądania dzielą jedno pobranie; każdy dostaje
+    # własną kopię, bo obiekt jest współdzielony z cache i innymi wątkami
+    img = pobierz_pojedynczy_lot().wykonaj(klucz, pobierz_i_zapamietaj)
+    return kopia_obrazu(img) if img is not None else None
+
+
 def wspolrzedne_do_kafelka(x, y, zoom_level=14):
     """
     Konwertuje współrzędne EPSG:2180 na indeksy kafelka WMTS
@@ -216,35 +465,10 @@ def wspolrzedne_do_kafelka(x, y, zoom_level=14):
     Returns:
         tuple: (tile_col, tile_row, pixel_x, pixel_y)
     """
-    # Parametry macierzy kafelków dla EPSG:2180 z GetCapabilities Geoportalu
-    # TopLeftCorner zgodny z oficjalną specyfikacją WMTS Geoportalu
-    # Źródło: https://mapy.geoportal.gov.pl/wss/service/PZGIK/ORTO/WMTS/StandardResolution?SERVICE=WMTS&REQUEST=GetCapabilities
-    origin_x = 0.0
-    origin_y = 850000.0
-    tile_size = 512  # Geoportal używa kafelków 512x512 dla StandardResolution
-    
-    # Rozdzielczość dla różnych poziomów zoom (metry na piksel)
-    # Źródło: GetCapabilities WMTS Geoportalu, obliczone ze ScaleDenominator × 0.00028
-    resolutions = {
-        0: 8466.68360,
-        1: 4233.34180,
-        2: 2116.67090,
-        3: 1058.33545,
-        4: 529.16773,
-        5: 264.58386,
-        6: 132.29193,
-        7: 66.14597,
-        8: 26.45839,
-        9: 13.22919,
-        10: 6.61460,
-        11: 2.64584,
-        12: 1.32292,
-        13: 0.52917,
-        14: 0.26458,
-        15: 0.13229
-    }
-    
-    resolution = resolutions.get(zoom_level, 132.29193)  # Default to zoom 6 if not found
+    resolution = WMTS_RESOLUTIONS.get(zoom_level, WMTS_RESOLUTIONS[6])  # Default to zoom 6 if not found
+    origin_x = WMTS_ORIGIN_X
+    origin_y = WMTS_ORIGIN_Y
+    tile_size = WMTS_TILE_SIZE
     
     # Oblicz indeksy kafelka
     # Origin jest w lewym górnym rogu (top-left), więc:
@@ -264,7 +488,7 @@ def wspolrzedne_do_kafelka(x, y, zoom_level=14):
     return tile_col, tile_row, pixel_x, pixel_y
 
 
-def pobierz_mape_wms(lon, lat, szerokosc_pikseli=800, wysokosc_pikseli=600):
+def pobierz_mape_wms(lon, lat, szerokosc_pikseli=800, wysokosc_pikseli=600, zakres_m=None, anuluj=None):
     """
     Pobiera mapę używając WMS jako alternatywa dla WMTS
     
@@ -273,61 +497,101 @@ def pobierz_mape_wms(lon, lat, szerokosc_pikseli=800, wysokosc_pikseli=600):
         lat: Szerokość geograficzna (WGS84)
         szerokosc_pikseli: Szerokość obrazu
         wysokosc_pikseli: Wysokość obrazu
+        zakres_m: Obszar mapy (szerokość_m, wysokość_m) - domyślnie 400 x 300 m
+        anuluj: Opcjonalny threading.Event - po jego ustawieniu żądanie nie jest
+                wysyłane, a rozpoczęte pobieranie jest przerywane (wynik None)
         
     Returns:
         PIL.Image lub None
     """
+    zakres_m = zakres_wms(zakres_m)
+    klucz = klucz_mapy('wms', lon, lat, szerokosc_pikseli, wysokosc_pikseli, zakres_m)
+    return _z_pamieci_obrazow(
+        klucz, lambda: _pobierz_mape_wms(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zakres_m, anuluj)
+    )
+
+
+def zakres_wms(zakres_m):
+    """Obszar mapy WMS (szerokość_m, wysokość_m) zaokrąglony do cm albo domyślny."""
+    return tuple(round(v, 2) for v in zakres_m) if zakres_m else DOMYSLNY_ZAKRES_WMS_M
+
+
+def parametry_wms(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zakres_m=DOMYSLNY_ZAKRES_WMS_M):
+    """
+    Parametry żądania WMS GetMap dla obszaru wokół punktu
+
+    Args:
+        lon, lat: Środek mapy (WGS84)
+        szerokosc_pikseli, wysokosc_pikseli: Rozmiar obrazu
+        zakres_m: Obszar mapy (szerokość_m, wysokość_m)
+
+    Returns:
+        dict: Parametry zapytania
+    """
+    # Konwersja do EPSG:2180
+    x, y = wgs84_do_epsg2180(lon, lat)
+    
+    # Bbox wokół punktu (domyślnie 400m x 300m)
+    width_m, height_m = zakres_m
+    
+    bbox = f"{x-width_m/2},{y-height_m/2},{x+width_m/2},{y+height_m/2}"
+    
+    return {
+        'SERVICE': 'WMS',
+        'REQUEST': 'GetMap',
+        'VERSION': '1.3.0',
+        'LAYERS': 'Raster',
+        'STYLES': '',
+        'CRS': 'EPSG:2180',
+        'BBOX': bbox,
+        'WIDTH': szerokosc_pikseli,
+        'HEIGHT': wysokosc_pikseli,
+        'FORMAT': 'image/jpeg'
+    }
+
+
+def _tresc_odpowiedzi(response, anuluj=None):
+    """Czyta treść odpowiedzi strumieniowo; None, jeśli w trakcie ustawiono anuluj."""
+    if anuluj is None:
+        return response.content
+    czesci = []
+    for czesc in response.iter_content(ROZMIAR_CZESCI_ODPOWIEDZI):
+        if anuluj.is_set():
+            return None
+        czesci.append(czesc)
+    return b''.join(czesci)
+
+
+def _pobierz_mape_wms(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zakres_m=DOMYSLNY_ZAKRES_WMS_M,
+                      anuluj=None):
+    """Wykonuje żądanie WMS GetMap z pominięciem cache."""
+    if anuluj is not None and anuluj.is_set():
+        return None
     try:
-        # Konwersja do EPSG:2180
-        x, y = wgs84_do_epsg2180(lon, lat)
-        
-        # Oblicz bbox wokół punktu (np. 400m x 300m)
-        width_m = 400
-        height_m = 300
-        
-        bbox = f"{x-width_m/2},{y-height_m/2},{x+width_m/2},{y+height_m/2}"
-        
-        params = {
-            'SERVICE': 'WMS',
-            'REQUEST': 'GetMap',
-            'VERSION': '1.3.0',
-            'LAYERS': 'Raster',
-            'STYLES': '',
-            'CRS': 'EPSG:2180',
-            'BBOX': bbox,
-            'WIDTH': szerokosc_pikseli,
-            'HEIGHT': wysokosc_pikseli,
-            'FORMAT': 'image/jpeg'
-        }
-        
-        print(f"Próba WMS: bbox={bbox}")
-        response = requests.get(GEOPORTAL_WMS_URL, params=params, timeout=10)
+        params = parametry_wms(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zakres_m)
+        print(f"Próba WMS: bbox={params['BBOX']}")
+        # Przy anulowaniu (przegrany wyścig z WMTS) pobieranie jest przerywane,
+        # a połączenie zamykane - wątek wyścigu nie czeka na cały obraz
+        with pobierz_sesje_http().get(GEOPORTAL_WMS_URL, params=params, stream=anuluj is not None) as response:
+            tresc = _tresc_odpowiedzi(response, anuluj) if response.status_code == 200 else b''
+        if tresc is None or (anuluj is not None and anuluj.is_set()):
+            print("WMS: anulowano")
+            return None
         
-        if response.status_code == 200:
-            content_type = response.headers.get('Content-Type', '')
-            
-            # Sprawdź czy to obraz
-            if 'xml' in content_type.lower() or response.content[:5] == b'<?xml':
-                print(f"WMS: otrzymano XML zamiast obrazu")
-                return None
-            
-            if not (content_type.startswith('image/') or response.content[:2] == b'\xff\xd8'):
-                print(f"WMS: nieprawidłowy format (Content-Type: {content_type})")
-                return None
-            
-            img = Image.open(BytesIO(response.content))
-            print(f"WMS: sukces! Rozmiar: {img.size}")
-            return img
-        else:
-            print(f"WMS: błąd HTTP {response.status_code}")
+        tresc = tresc_obrazu(response.status_code, response.headers.get('Content-Type', ''), tresc, 'WMS')
+        if tresc is None:
             return None
+        img = obraz_ze_zrodla(tresc)
+        print(f"WMS: sukces! Rozmiar: {img.size}")
+        return img
             
     except Exception as e:
         print(f"WMS: błąd {e}")
         return None
 
 
-def pobierz_mape_dla_obszaru(lon, lat, szerokosc_pikseli=800, wysokosc_pikseli=600, zoom_level=14):
+def pobierz_mape_dla_obszaru(lon, lat, szerokosc_pikseli=800, wysokosc_pikseli=600, zoom_level=14,
+                             hedge_opoznienie=None, zakres_m=None):
     """
     Pobiera ortofotomapę dla danego obszaru
     
@@ -337,143 +601,358 @@ def pobierz_mape_dla_obszaru(lon, lat, szerokosc_pikseli=800, wysokosc_pikseli=6
         szerokosc_pikseli: Szerokość obrazu wynikowego
         wysokosc_pikseli: Wysokość obrazu wynikowego
         zoom_level: Poziom powiększenia
+        hedge_opoznienie: Po ilu sekundach uruchomić WMTS równolegle z WMS
+                          (0 - od razu, ujemne - dopiero po błędzie WMS,
+                          None - wartość z ROOF_HEDGE_DELAY_S)
+        zakres_m: Obszar do pokrycia (szerokość_m, wysokość_m) - ustala bbox WMS
+                  i poziom WMTS zamiast zoom_level
         
     Returns:
         PIL.Image lub None
     """
-    # Najpierw spróbuj WMS (prostsze i bardziej niezawodne)
+    if zakres_m:
+        zoom_level = poziom_wmts_dla_zakresu(zakres_m, szerokosc_pikseli, wysokosc_pikseli)
+    if hedge_opoznienie is None:
+        hedge_opoznienie = domyslne_opoznienie_hedge()
+    if hedge_opoznienie < 0:
+        # WMTS dopiero po niepowodzeniu WMS
+        hedge_opoznienie = float('inf')
+
+    # Najpierw WMS (prostsze i bardziej niezawodne), WMTS startuje po opóźnieniu
+    # albo od razu po błędzie WMS - wygrywa pierwszy poprawny obraz
     print(f"Próba pobrania mapy przez WMS dla lon={lon}, lat={lat}")
-    mapa_wms = pobierz_mape_wms(lon, lat, szerokosc_pikseli, wysokosc_pikseli)
-    
-    if mapa_wms is not None:
-        print("WMS: sukces!")
-        return mapa_wms
-    
-    # Fallback na WMTS
-    print("WMS nieudane, próba WMTS...")
-    
-    # Konwersja do EPSG:2180
-    x, y = wgs84_do_epsg2180(lon, lat)
-    
-    # Pobierz kafelek centralny
-    tile_col, tile_row, pixel_x, pixel_y = wspolrzedne_do_kafelka(x, y, zoom_level)
-    
-    # Dla uproszczenia pobierzmy jeden kafelek i wytnijmy fragment
-    # W pełnej wersji należałoby złożyć kilka kafelków
-    kafelek = pobierz_kafelek_wmts(tile_col, tile_row, zoom_level)
-    
-    if kafelek is None:
-        print("WMTS również nieudane")
+
+    def wms(anuluj):
+        return pobierz_mape_wms(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zakres_m, anuluj)
+
+    def wmts(anuluj):
+        print("Start WMTS...")
+        # Konwersja do EPSG:2180
+        x, y = wgs84_do_epsg2180(lon, lat)
+        return zloz_mozaike_wmts(x, y, zoom_level, szerokosc_pikseli, wysokosc_pikseli, anuluj)
+
+    zwyciezca, mapa = wyscig(
+        [('wms', 0.0, wms), ('wmts', hedge_opoznienie, wmts)],
+        STATYSTYKI_HEDGE
+    )
+    if mapa is None:
+        print("WMS i WMTS nieudane")
+    else:
+        print(f"{zwyciezca.upper()}: sukces!")
+    return mapa
+
+
+def poziom_wmts_dla_zakresu(zakres_m, szerokosc_pikseli, wysokosc_pikseli):
+    """
+    Najdokładniejszy poziom WMTS, na którym obraz danego rozmiaru obejmuje cały obszar
+
+    Args:
+        zakres_m: Obszar (szerokość_m, wysokość_m)
+        szerokosc_pikseli, wysokosc_pikseli: Rozmiar obrazu
+
+    Returns:
+        int: Poziom powiększenia
+    """
+    potrzebna = max(zakres_m[0] / szerokosc_pikseli, zakres_m[1] / wysokosc_pikseli)
+    pasujace = [poziom for poziom, rozdzielczosc in WMTS_RESOLUTIONS.items() if rozdzielczosc >= potrzebna]
+    return max(pasujace) if pasujace else min(WMTS_RESOLUTIONS)
+
+
+def zoom_webmercator_dla_zakresu(lat, zakres_m, szerokosc_pikseli, wysokosc_pikseli, maks_zoom):
+    """
+    Największy zoom map Web Mercator (OSM, Google), przy którym obraz obejmuje obszar
+
+    Args:
+        lat: Szerokość geograficzna środka
+        zakres_m: Obszar (szerokość_m, wysokość_m)
+        szerokosc_pikseli, wysokosc_pikseli: Rozmiar obrazu
+        maks_zoom: Górne ograniczenie (domyślny zoom źródła)
+
+    Returns:
+        int: Poziom powiększenia
+    """
+    potrzebna = max(zakres_m[0] / szerokosc_pikseli, zakres_m[1] / wysokosc_pikseli)
+    metry_na_piksel_z0 = 156543.03392 * math.cos(math.radians(lat))
+    return max(1, min(maks_zoom, int(math.floor(math.log2(metry_na_piksel_z0 / potrzebna)))))
+
+
+def domyslne_opoznienie_hedge():
+    """Opóźnienie startu WMTS z ROOF_HEDGE_DELAY_S (ujemne wyłącza wyścig)."""
+    try:
+        return float(os.environ.get('ROOF_HEDGE_DELAY_S', DOMYSLNE_OPOZNIENIE_HEDGE_S))
+    except ValueError:
+        return DOMYSLNE_OPOZNIENIE_HEDGE_S
+
+
+def zloz_mozaike_wmts(x, y, zoom_level, szerokosc_pikseli, wysokosc_pikseli, anuluj=None):
+    """
+    Składa mozaikę WMTS wycentrowaną na punkcie, bez skalowania obrazu
+
+    Args:
+        x: Współrzędna X środka (EPSG:2180)
+        y: Współrzędna Y środka (EPSG:2180)
+        zoom_level: Poziom powiększenia
+        szerokosc_pikseli: Szerokość obrazu wynikowego
+        wysokosc_pikseli: Wysokość obrazu wynikowego
+        anuluj: Opcjonalny threading.Event przerywający składanie
+
+    Returns:
+        PIL.Image lub None jeśli nie udało się pobrać żadnego kafelka
+    """
+    left, top = okno_wmts_dla_punktu(x, y, zoom_level, szerokosc_pikseli, wysokosc_pikseli)
+    return zloz_okno_wmts(left, top, szerokosc_pikseli, wysokosc_pikseli, zoom_level, anuluj)
+
+
+def okno_wmts_dla_punktu(x, y, zoom_level, szerokosc_pikseli, wysokosc_pikseli):
+    """
+    Wyznacza okno pikselowe macierzy WMTS wycentrowane na punkcie
+
+    Args:
+        x, y: Środek okna (EPSG:2180)
+        zoom_level: Poziom powiększenia
+        szerokosc_pikseli, wysokosc_pikseli: Rozmiar okna
+
+    Returns:
+        tuple: (left, top) - lewy górny róg okna w globalnych pikselach macierzy
+    """
+    resolution = WMTS_RESOLUTIONS.get(zoom_level, WMTS_RESOLUTIONS[6])
+    # Globalne współrzędne pikselowe punktu w macierzy kafelków
+    pixel_x = (x - WMTS_ORIGIN_X) / resolution
+    pixel_y = (WMTS_ORIGIN_Y - y) / resolution
+    left = int(math.floor(pixel_x - szerokosc_pikseli / 2))
+    top = int(math.floor(pixel_y - wysokosc_pikseli / 2))
+    return left, top
+
+
+def zakres_kafelkow_okna(left, top, szerokosc_pikseli, wysokosc_pikseli):
+    """
+    Wyznacza kafelki pokrywające okno pikselowe macierzy WMTS
+
+    Args:
+        left, top: Lewy górny róg okna w globalnych pikselach macierzy
+        szerokosc_pikseli, wysokosc_pikseli: Rozmiar okna
+
+    Returns:
+        tuple: (col_min, row_min, col_max, row_max) - zakres włącznie
+    """
+    col_min = left // WMTS_TILE_SIZE
+    row_min = top // WMTS_TILE_SIZE
+    col_max = (left + szerokosc_pikseli - 1) // WMTS_TILE_SIZE
+    row_max = (top + wysokosc_pikseli - 1) // WMTS_TILE_SIZE
+    return col_min, row_min, col_max, row_max
+
+
+def zloz_okno_wmts(left, top, szerokosc_pikseli, wysokosc_pikseli, zoom_level, anuluj=None):
+    """
+    Pobiera tylko kafelki pokrywające okno pikselowe i wkleja je do jednego płótna
+
+    Kafelki pobierane są równolegle i wklejane z przesunięciem względem okna,
+    więc wycięcie następuje przy wklejaniu - bez przeskalowania.
+
+    Args:
+        left, top: Lewy górny róg okna w globalnych pikselach macierzy
+        szerokosc_pikseli, wysokosc_pikseli: Rozmiar okna
+        zoom_level: Poziom powiększenia
+        anuluj: Opcjonalny threading.Event - po ustawieniu niepobrane kafelki
+                są anulowane, a funkcja zwraca None
+
+    Returns:
+        PIL.Image lub None jeśli nie udało się pobrać żadnego kafelka
+    """
+    col_min, row_min, col_max, row_max = zakres_kafelkow_okna(
+        left, top, szerokosc_pikseli, wysokosc_pikseli
+    )
+    # Brakujące kafelki zostają szare
+    canvas = Image.new('RGB', (szerokosc_pikseli, wysokosc_pikseli), color='gray')
+
+    def pobierz(col, row):
+        if anuluj is not None and anuluj.is_set():
+            return None
+        return pobierz_kafelek_wmts(col, row, zoom_level)
+
+    zadania = [
+        ((col, row), pobierz, (col, row))
+        for row in range(row_min, row_max + 1)
+        for col in range(col_min, col_max + 1)
+    ]
+    pobrane = 0
+    for (col, row), tile in pobierz_silnik().pobierz_wszystkie(zadania, anuluj):
+        if tile:
+            canvas.paste(tile, (col * WMTS_TILE_SIZE - left, row * WMTS_TILE_SIZE - top))
+            pobrane += 1
+    if anuluj is not None and anuluj.is_set():
         return None
-    
-    # Wytnij i przeskaluj do żądanego rozmiaru
-    # Centrowanie na wybranym punkcie
-    tile_size = 256
-    
-    # Oblicz obszar do wycięcia (centrowany na punkcie)
-    left = max(0, pixel_x - szerokosc_pikseli // 2)
-    top = max(0, pixel_y - wysokosc_pikseli // 2)
-    right = min(tile_size, left + szerokosc_pikseli)
-    bottom = min(tile_size, top + wysokosc_pikseli)
-    
-    # Jeśli obszar wychodzi poza kafelek, trzeba pobrać dodatkowe kafelki
-    # Dla uproszczenia zwracamy to co mamy
-    if right - left < szerokosc_pikseli or bottom - top < wysokosc_pikseli:
-        # Potrzebujemy więcej kafelków - złóż z 2x2
-        return pobierz_mape_2x2(tile_col, tile_row, zoom_level, 
-                               pixel_x, pixel_y, szerokosc_pikseli, wysokosc_pikseli)
-    
-    fragment = kafelek.crop((left, top, right, bottom))
-    return fragment
+    print(f"WMTS: mozaika {col_max - col_min + 1}x{row_max - row_min + 1}, "
+          f"pobrano {pobrane}/{len(zadania)} kafelków")
+    if pobrane == 0:
+        return None
+    zaplanuj_wyprzedzanie(left, top, szerokosc_pikseli, wysokosc_pikseli, zoom_level)
+    return canvas
+
+
+def kafelki_wokol_okna(left, top, szerokosc_pikseli, wysokosc_pikseli, zoom_level,
+                       pierscien=1, nastepny_zoom=False):
+    """
+    Kafelki, których użytkownik najpewniej zażąda po obejrzeniu okna
+
+    Args:
+        left, top: Lewy górny róg okna w globalnych pikselach macierzy
+        szerokosc_pikseli, wysokosc_pikseli: Rozmiar okna
+        zoom_level: Poziom powiększenia okna
+        pierscien: Szerokość pierścienia wokół kafelków okna (w kafelkach)
+        nastepny_zoom: Czy dołączyć kafelki tego samego widoku o poziom bliżej
+
+    Returns:
+        list: Krotki (zoom, col, row) - najbliższe środka okna pierwsze
+    """
+    col_min, row_min, col_max, row_max = zakres_kafelkow_okna(
+        left, top, szerokosc_pikseli, wysokosc_pikseli
+    )
+    srodek_col = (left + szerokosc_pikseli / 2) / WMTS_TILE_SIZE - 0.5
+    srodek_row = (top + wysokosc_pikseli / 2) / WMTS_TILE_SIZE - 0.5
+    kafelki = [
+        (zoom_level, col, row)
+        for row in range(row_min - pierscien, row_max + pierscien + 1)
+        for col in range(col_min - pierscien, col_max + pierscien + 1)
+        if not (col_min <= col <= col_max and row_min <= row <= row_max) and col >= 0 and row >= 0
+    ]
+    kafelki.sort(key=lambda k: (k[1] - srodek_col) ** 2 + (k[2] - srodek_row) ** 2)
+
+    if nastepny_zoom and zoom_level + 1 in WMTS_RESOLUTIONS:
+        # Ten sam środek, poziom bliżej - jak po przybliżeniu widoku
+        resolution = WMTS_RESOLUTIONS[zoom_level]
+        x = WMTS_ORIGIN_X + (left + szerokosc_pikseli / 2) * resolution
+        y = WMTS_ORIGIN_Y - (top + wysokosc_pikseli / 2) * resolution
+        lewy, gorny = okno_wmts_dla_punktu(x, y, zoom_level + 1, szerokosc_pikseli, wysokosc_pikseli)
+        c0, r0, c1, r1 = zakres_kafelkow_okna(lewy, gorny, szerokosc_pikseli, wysokosc_pikseli)
+        kafelki.extend(
+            (zoom_level + 1, col, row) for row in range(r0, r1 + 1) for col in range(c0, c1 + 1)
+        )
+    return kafelki
+
+
+def _wyprzedz_kafelek(klucz):
+    """Pobiera kafelek (zoom, col, row) do cache na dysku, jeśli jeszcze go tam nie ma."""
+    zoom_level, tile_col, tile_row = klucz
+    klucz_kafelka = klucz_kafelka_wmts(tile_col, tile_row, zoom_level)
+    cache = pobierz_cache_kafelkow()
+    paczki = pobierz_paczki_kafelkow()
+    if (paczki is not None and paczki.zawiera(klucz_kafelka)) or (
+        cache is not None and cache.zawiera(klucz_kafelka)
+    ):
+        return False
+    return True if pobierz_bajty_kafelka_wmts(tile_col, tile_row, zoom_level) is not None else None
+
+
+def zaplanuj_wyprzedzanie(left, top, szerokosc_pikseli, wysokosc_pikseli, zoom_level):
+    """
+    Zleca pobranie w tle kafelków wokół złożonego okna (ROOF_PREFETCH)
+
+    Bez cache kafelków na dysku pobrane kafelki nie miałyby gdzie trafić,
+    więc wyprzedzanie jest wtedy pomijane.
+    """
+    ustawienia = ustawienia_wyprzedzania()
+    wyprzedzanie = pobierz_wyprzedzanie()
+    if ustawienia is None or wyprzedzanie is None or pobierz_cache_kafelkow() is None:
+        return
+    pierscien, nastepny_zoom = ustawienia
+    kafelki = kafelki_wokol_okna(
+        left, top, szerokosc_pikseli, wysokosc_pikseli, zoom_level, pierscien, nastepny_zoom
+    )
+    if kafelki:
+        wyprzedzanie.zaplanuj(kafelki, _wyprzedz_kafelek)
 
 
 def pobierz_mape_2x2(tile_col, tile_row, zoom_level, center_x, center_y, width, height):
     """
-    Pobiera i składa 4 kafelki (2x2) aby pokryć większy obszar
+    Składa mapę width x height wycentrowaną na pikselu (center_x, center_y)
+    kafelka (tile_col, tile_row) - zachowane dla zgodności, używa zloz_okno_wmts
     """
-    tile_size = 256
-    
-    # Pobierz 4 kafelki
-    tiles = []
-    for dy in range(2):
-        row = []
-        for dx in range(2):
-            tile = pobierz_kafelek_wmts(tile_col + dx, tile_row + dy, zoom_level)
-            if tile:
-                row.append(tile)
-            else:
-                # Stwórz pusty kafelek jeśli pobieranie się nie powiodło
-                row.append(Image.new('RGB', (tile_size, tile_size), color='gray'))
-        tiles.append(row)
-    
-    # Złóż kafelki w jeden obraz
-    combined = Image.new('RGB', (tile_size * 2, tile_size * 2))
-    for y, row in enumerate(tiles):
-        for x, tile in enumerate(row):
-            combined.paste(tile, (x * tile_size, y * tile_size))
-    
-    # Wytnij żądany obszar wokół punktu centralnego
-    left = max(0, center_x - width // 2)
-    top = max(0, center_y - height // 2)
-    right = min(tile_size * 2, left + width)
-    bottom = min(tile_size * 2, top + height)
-    
-    result = combined.crop((left, top, right, bottom))
-    
-    # Jeśli wycięty obszar jest mniejszy niż żądany, dopasuj
-    if result.size != (width, height):
-        result = result.resize((width, height), Image.Resampling.LANCZOS)
-    
-    return result
+    left = tile_col * WMTS_TILE_SIZE + center_x - width // 2
+    top = tile_row * WMTS_TILE_SIZE + center_y - height // 2
+    return zloz_okno_wmts(left, top, width, height, zoom_level)
 
 
 def pobierz_mape_openstreetmap(lon, lat, szerokosc_pikseli=800, wysokosc_pikseli=600, zoom=18):
     """
     Pobiera statyczną mapę z OpenStreetMap.
     """
+    klucz = klucz_mapy('osm', lon, lat, szerokosc_pikseli, wysokosc_pikseli, zoom)
+    return _z_pamieci_obrazow(
+        klucz, lambda: _pobierz_mape_openstreetmap(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zoom)
+    )
+
+
+def _pobierz_mape_openstreetmap(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zoom):
+    """Pobiera statyczną mapę OSM z pominięciem cache."""
     try:
-        params = {
-            "center": f"{lat},{lon}",
-            "zoom": str(zoom),
-            "size": f"{szerokosc_pikseli}x{wysokosc_pikseli}",
-            "maptype": "mapnik"
-        }
-        response = requests.get(OSM_STATIC_URL, params=params, timeout=10)
+        params = parametry_mapy_statycznej(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zoom, "mapnik")
+        response = pobierz_sesje_http().get(OSM_STATIC_URL, params=params)
         if response.status_code != 200:
             return None
         content_type = response.headers.get("Content-Type", "")
         if not content_type.startswith("image/"):
             return None
-        return Image.open(BytesIO(response.content))
+        return obraz_ze_zrodla(response.content)
     except (requests.RequestException, UnidentifiedImageError, OSError):
         return None
 
 
+def parametry_mapy_statycznej(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zoom, maptype):
+    """Parametry zapytania o statyczną mapę OSM/Google wycentrowaną na punkcie."""
+    return {
+        "center": f"{lat},{lon}",
+        "zoom": str(zoom),
+        "size": f"{szerokosc_pikseli}x{wysokosc_pikseli}",
+        "maptype": maptype
+    }
+
+
 def pobierz_mape_google(lon, lat, szerokosc_pikseli=800, wysokosc_pikseli=600, zoom=19, api_key=None):
     """
     Pobiera statyczną mapę z Google Maps (wymaga klucza API).
     """
     if not api_key:
         return None
+    # Klucz API nie wpływa na obraz, więc nie trafia do klucza cache
+    klucz = klucz_mapy('google', lon, lat, szerokosc_pikseli, wysokosc_pikseli, zoom)
+    return _z_pamieci_obrazow(
+        klucz, lambda: _pobierz_mape_google(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zoom, api_key)
+    )
+
+
+def _pobierz_mape_google(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zoom, api_key):
+    """Pobiera statyczną mapę Google z pominięciem cache."""
     try:
-        params = {
-            "center": f"{lat},{lon}",
-            "zoom": str(zoom),
-            "size": f"{szerokosc_pikseli}x{wysokosc_pikseli}",
-            "maptype": "satellite",
-            "key": api_key
-        }
-        response = requests.get(GOOGLE_STATIC_URL, params=params, timeout=10)
+        params = parametry_mapy_statycznej(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zoom, "satellite")
+        params["key"] = api_key
+        response = pobierz_sesje_http().get(GOOGLE_STATIC_URL, params=params)
         if response.status_code != 200:
             return None
         content_type = response.headers.get("Content-Type", "")
         if not content_type.startswith("image/"):
             return None
-        return Image.open(BytesIO(response.content))
+        return obraz_ze_zrodla(response.content)
     except (requests.RequestException, UnidentifiedImageError, OSError):
         return None
 
 
+def parsuj_wspolrzedne_tekst(wspolrzedne_text):
+    """
+    Próbuje odczytać współrzędne z tekstu (bez sieci)
+
+    Rozpoznaje pary dziesiętne, DMS, PUWG 1992 oraz linki Google Maps/OSM -
+    szczegóły w utils.coordinates.parsuj_wspolrzedne.
+
+    Args:
+        wspolrzedne_text: Tekst wpisany przez użytkownika
+
+    Returns:
+        tuple: (lon, lat) lub (None, None) jeśli tekst nie zawiera współrzędnych
+    """
+    return parsuj_wspolrzedne(wspolrzedne_text)
+
+
 def pobierz_mape_dla_wspolrzednych(
     wspolrzedne_text,
     szerokosc=800,
@@ -486,7 +965,8 @@ def pobierz_mape_dla_wspolrzednych(
     Parsuje tekst współrzędnych/adres i pobiera mapę z wybranego źródła.
     
     Args:
-        wspolrzedne_text: Tekst ze współrzędnymi (np. "52.2297,21.0122" lub adres)
+        wspolrzedne_text: Tekst ze współrzędnymi (np. "52.2297,21.0122"), adres
+                          lub identyfikator działki (np. "146518_8.0108.27/1")
         szerokosc: Szerokość obrazu
         wysokosc: Wysokość obrazu
         map_source: Źródło mapy ("geoportal", "google_maps", "openstreetmap")
@@ -496,18 +976,45 @@ def pobierz_mape_dla_wspolrzednych(
     Returns:
         tuple: (PIL.Image, lon, lat) lub z error_message gdy return_error=True
     """
-    try:
-        # Spróbuj sparsować jako współrzędne
-        parts = wspolrzedne_text.strip().replace(',', ' ').split()
-        if len(parts) >= 2:
-            lat = float(parts[0])
-            lon = float(parts[1])
-        else:
-            lon = None
-            lat = None
-    except (ValueError, TypeError):
-        lon = None
-        lat = None
+    if _async_wlaczone():
+        # Import w funkcji - utils.geoportal_async korzysta z tego modułu
+        from utils.geoportal_async import pobierz_mape_dla_wspolrzednych_async, uruchom
+        mapa, lon, lat, blad = uruchom(pobierz_mape_dla_wspolrzednych_async(
+            wspolrzedne_text, szerokosc, wysokosc, map_source, google_api_key
+        ))
+        return (mapa, lon, lat, blad) if return_error else (mapa, lon, lat)
+
+    # Pobieranie wyprzedzające w tle czeka, aż mapa dla użytkownika będzie gotowa
+    with zadanie_interaktywne():
+        return _pobierz_mape_dla_wspolrzednych(
+            wspolrzedne_text, szerokosc, wysokosc, map_source, google_api_key, return_error
+        )
+
+
+def _async_wlaczone():
+    """Czy żądania map obsługuje wspólna pętla zdarzeń (ROOF_ASYNC_FETCH=1, wymaga aiohttp)."""
+    if os.environ.get('ROOF_ASYNC_FETCH', '0').strip().lower() not in ('1', 'true', 'yes', 'on'):
+        return False
+    if aiohttp is None:
+        print("ROOF_ASYNC_FETCH: brak pakietu aiohttp - użyto pobierania synchronicznego")
+        return False
+    return True
+
+
+def _pobierz_mape_dla_wspolrzednych(wspolrzedne_text, szerokosc, wysokosc, map_source,
+                                    google_api_key, return_error):
+    lon, lat = parsuj_wspolrzedne_tekst(wspolrzedne_text)
+    zakres_m = None
+
+    if lon is None and normalizuj_identyfikator(wspolrzedne_text):
+        # Identyfikator działki - środek i rozmiar mapy z lokalnego indeksu działek
+        dzialka = znajdz_dzialke(wspolrzedne_text)
+        if dzialka is None:
+            if return_error:
+                return None, None, None, "Nie znaleziono działki w lokalnym indeksie działek (ROOF_PARCEL_INDEX)."
+            return None, None, None
+        (x, y), zakres_m = zakres_mapy_dzialki(dzialka, szerokosc, wysokosc)
+        lon, lat = epsg2180_do_wgs84(x, y)
 
     if lon is None or lat is None:
         wynik = geokoduj_adres(wspolrzedne_text)
@@ -518,7 +1025,7 @@ def pobierz_mape_dla_wspolrzednych(
         lon, lat = wynik
 
     if map_source == "geoportal":
-        mapa = pobierz_mape_dla_obszaru(lon, lat, szerokosc, wysokosc)
+        mapa = pobierz_mape_dla_obszaru(lon, lat, szerokosc, wysokosc, zakres_m=zakres_m)
         if mapa is None:
             if return_error:
                 return None, lon, lat, "Nie udało się pobrać mapy z Geoportalu."
@@ -528,7 +1035,10 @@ def pobierz_mape_dla_wspolrzednych(
         return mapa, lon, lat
 
     if map_source == "openstreetmap":
-        mapa = pobierz_mape_openstreetmap(lon, lat, szerokosc, wysokosc)
+        zoom = 18
+        if zakres_m:
+            zoom = zoom_webmercator_dla_zakresu(lat, zakres_m, szerokosc, wysokosc, zoom)
+        mapa = pobierz_mape_openstreetmap(lon, lat, szerokosc, wysokosc, zoom)
         if mapa is None:
             if return_error:
                 return None, lon, lat, "Nie udało się pobrać mapy z OpenStreetMap."
@@ -542,7 +1052,10 @@ def pobierz_mape_dla_wspolrzednych(
             if return_error:
                 return None, lon, lat, "Brak klucza API Google Maps."
             return None, lon, lat
-        mapa = pobierz_mape_google(lon, lat, szerokosc, wysokosc, api_key=google_api_key)
+        zoom = 19
+        if zakres_m:
+            zoom = zoom_webmercator_dla_zakresu(lat, zakres_m, szerokosc, wysokosc, zoom)
+        mapa = pobierz_mape_google(lon, lat, szerokosc, wysokosc, zoom, api_key=google_api_key)
         if mapa is None:
             if return_error:
                 return None, lon, lat, "Nie udało się pobrać mapy z Google Maps."
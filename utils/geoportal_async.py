@@ -0,0 +1,445 @@
+"""
+Moduł asynchronicznego (asyncio + aiohttp) pobierania map i geokodowania
+Jedna pętla zdarzeń obsługuje wiele równoczesnych żądań map; żądania HTTP
+zajmują te same limity na hosta co pula wątków (utils.fetch_engine), a WMS
+i WMTS ścigają się jak w wersji synchronicznej (utils.hedge.wyscig_async)
+"""
+
+import asyncio
+import threading
+import weakref
+from io import BytesIO
+
+import aiohttp
+from PIL import Image, UnidentifiedImageError
+
+from utils import geoportal
+from utils.fetch_engine import host_z_url, limit_hosta_async
+from utils.geocode_cache import BRAK, normalizuj_adres, pobierz_cache_geokodowania
+from utils.geocode_engine import pobierz_silnik_geokodowania
+from utils.hedge import wyscig_async
+from utils.http_session import pobierz_sesje_http_async
+from utils.image_cache import kopia_obrazu, obraz_ze_zrodla, pobierz_pamiec_obrazow, sprawdz_obraz
+from utils.parcels import normalizuj_identyfikator, zakres_mapy_dzialki, znajdz_dzialke
+from utils.prefetch import zadanie_interaktywne
+from utils.tile_cache import pobierz_cache_kafelkow
+from utils.tile_pack import pobierz_paczki_kafelkow
+
+
+class _LotyAsync:
+    """
+    Łączy równoczesne identyczne pobrania w obrębie pętli zdarzeń (jak singleflight).
+
+    Pobranie jest anulowane dopiero wtedy, gdy anulowano wszystkich, którzy
+    na nie czekają - przegrana ścieżka wyścigu nie psuje wyniku innym.
+    """
+
+    def __init__(self):
+        self._loty = {}
+
+    async def wykonaj(self, klucz, funkcja):
+        """
+        Args:
+            klucz: Klucz pobrania
+            funkcja: Funkcja bez argumentów zwracająca korutynę
+
+        Returns:
+            Wynik korutyny (wspólny dla wszystkich czekających)
+        """
+        lot = self._loty.get(klucz)
+        if lot is None:
+            lot = [asyncio.ensure_future(funkcja()), 0]
+            self._loty[klucz] = lot
+            lot[0].add_done_callback(lambda _, lot=lot: self._zakoncz(klucz, lot))
+        lot[1] += 1
+        try:
+            return await asyncio.shield(lot[0])
+        finally:
+            lot[1] -= 1
+            if lot[1] == 0 and not lot[0].done():
+                lot[0].cancel()
+                self._zakoncz(klucz, lot)
+
+    def _zakoncz(self, klucz, lot):
+        if self._loty.get(klucz) is lot:
+            del self._loty[klucz]
+
+
+# Łączenie pobrań jest związane z pętlą zdarzeń - osobne dla każdej pętli
+_loty_petli = weakref.WeakKeyDictionary()
+
+
+def _loty():
+    petla = asyncio.get_running_loop()
+    loty = _loty_petli.get(petla)
+    if loty is None:
+        loty = _loty_petli[petla] = _LotyAsync()
+    return loty
+
+
+async def _pobierz(url, params):
+    """
+    Wysyła GET przez sesję aiohttp w limicie hosta
+
+    Returns:
+        tuple: (kod HTTP, Content-Type, treść)
+    """
+    async with limit_hosta_async(host_z_url(url)):
+        async with pobierz_sesje_http_async().get(url, params=params) as response:
+            return response.status, response.headers.get('Content-Type', ''), await response.read()
+
+
+async def _z_pamieci_obrazow(klucz, pobierz):
+    """
+    Asynchroniczny odpowiednik geoportal._z_pamieci_obrazow - ta sama pamięć
+    obrazów i te same klucze, więc wersje sync i async korzystają z jednego cache
+
+    Args:
+        klucz: Krotka (źródło, parametry żądania...)
+        pobierz: Funkcja bez argumentów zwracająca korutynę z PIL.Image lub None
+
+    Returns:
+        PIL.Image lub None
+    """
+    pamiec = pobierz_pamiec_obrazow()
+    if pamiec is not None:
+        img = pamiec.pobierz(klucz)
+        if img is not None:
+            return img
+
+    async def pobierz_i_zapamietaj():
+        img = await pobierz()
+        if img is None:
+            return None
+        try:
+            sprawdz_obraz(img)
+        except OSError as e:
+            print(f"Błąd dekodowania obrazu: {e}")
+            return None
+        if pamiec is not None:
+            pamiec.zapisz(klucz, img)
+        return img
+
+    img = await _loty().wykonaj(klucz, pobierz_i_zapamietaj)
+    return kopia_obrazu(img) if img is not None else None
+
+
+async def pobierz_bajty_kafelka_wmts_async(tile_col, tile_row, zoom_level=14):
+    """
+    Asynchroniczna wersja geoportal.pobierz_bajty_kafelka_wmts (paczki, cache na dysku, Geoportal)
+
+    Odczyt i zapis cache na dysku wykonywane są w wątku, żeby nie blokować pętli.
+    Identyczne pobrania łączone są w obrębie pętli; między procesami chroni
+    przed powtórnym pobraniem cache na dysku.
+
+    Returns:
+        bytes lub None jeśli błąd
+    """
+    klucz = geoportal.klucz_kafelka_wmts(tile_col, tile_row, zoom_level)
+    paczki = pobierz_paczki_kafelkow()
+    if paczki is not None:
+        dane = paczki.pobierz(klucz)
+        if dane is not None:
+            return dane
+    cache = pobierz_cache_kafelkow()
+    if cache is not None:
+        dane = await asyncio.to_thread(cache.pobierz, klucz)
+        if dane is not None:
+            return dane
+
+    async def z_sieci():
+        try:
+            status, content_type, tresc = await _pobierz(
+                geoportal.GEOPORTAL_WMTS_URL, geoportal.parametry_kafelka_wmts(klucz)
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Błąd podczas pobierania kafelka: {e}")
+            return None
+        dane = geoportal.tresc_obrazu(status, content_type, tresc, 'WMTS')
+        if dane is not None and cache is not None:
+            await asyncio.to_thread(cache.zapisz, klucz, dane)
+        return dane
+
+    return await _loty().wykonaj(('wmts',) + tuple(klucz), z_sieci)
+
+
+async def pobierz_kafelek_wmts_async(tile_col, tile_row, zoom_level=14):
+    """
+    Asynchroniczna wersja geoportal.pobierz_kafelek_wmts
+
+    Returns:
+        PIL.Image lub None jeśli błąd
+    """
+    async def pobierz():
+        dane = await pobierz_bajty_kafelka_wmts_async(tile_col, tile_row, zoom_level)
+        if dane is None:
+            return None
+        try:
+            return Image.open(BytesIO(dane))
+        except (UnidentifiedImageError, OSError) as e:
+            print(f"Błąd dekodowania kafelka: {e}")
+            return None
+
+    return await _z_pamieci_obrazow(geoportal.klucz_obrazu_kafelka(tile_col, tile_row, zoom_level), pobierz)
+
+
+async def zloz_okno_wmts_async(left, top, szerokosc_pikseli, wysokosc_pikseli, zoom_level):
+    """
+    Asynchroniczna wersja geoportal.zloz_okno_wmts - kafelki pobierane są
+    korutynami w bieżącej pętli, a wklejane w wątku (dekodowanie JPEG)
+
+    Returns:
+        PIL.Image lub None jeśli nie udało się pobrać żadnego kafelka
+    """
+    col_min, row_min, col_max, row_max = geoportal.zakres_kafelkow_okna(
+        left, top, szerokosc_pikseli, wysokosc_pikseli
+    )
+    pozycje = [(col, row) for row in range(row_min, row_max + 1) for col in range(col_min, col_max + 1)]
+    kafelki = await asyncio.gather(
+        *(pobierz_kafelek_wmts_async(col, row, zoom_level) for col, row in pozycje)
+    )
+    pobrane = [(pozycja, tile) for pozycja, tile in zip(pozycje, kafelki) if tile]
+    print(f"WMTS: mozaika {col_max - col_min + 1}x{row_max - row_min + 1}, "
+          f"pobrano {len(pobrane)}/{len(pozycje)} kafelków")
+    if not pobrane:
+        return None
+
+    def wklej():
+        # Brakujące kafelki zostają szare
+        canvas = Image.new('RGB', (szerokosc_pikseli, wysokosc_pikseli), color='gray')
+        for (col, row), tile in pobrane:
+            canvas.paste(tile, (col * geoportal.WMTS_TILE_SIZE - left, row * geoportal.WMTS_TILE_SIZE - top))
+        return canvas
+
+    canvas = await asyncio.to_thread(wklej)
+    geoportal.zaplanuj_wyprzedzanie(left, top, szerokosc_pikseli, wysokosc_pikseli, zoom_level)
+    return canvas
+
+
+async def zloz_mozaike_wmts_async(x, y, zoom_level, szerokosc_pikseli, wysokosc_pikseli):
+    """Asynchroniczna wersja geoportal.zloz_mozaike_wmts (środek w EPSG:2180)."""
+    left, top = geoportal.okno_wmts_dla_punktu(x, y, zoom_level, szerokosc_pikseli, wysokosc_pikseli)
+    return await zloz_okno_wmts_async(left, top, szerokosc_pikseli, wysokosc_pikseli, zoom_level)
+
+
+async def pobierz_mape_wms_async(lon, lat, szerokosc_pikseli=800, wysokosc_pikseli=600, zakres_m=None):
+    """
+    Asynchroniczna wersja geoportal.pobierz_mape_wms; anulowanie korutyny
+    (przegrany wyścig) przerywa pobieranie
+
+    Returns:
+        PIL.Image lub None
+    """
+    zakres_m = geoportal.zakres_wms(zakres_m)
+
+    async def pobierz():
+        params = geoportal.parametry_wms(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zakres_m)
+        print(f"Próba WMS: bbox={params['BBOX']}")
+        try:
+            status, content_type, tresc = await _pobierz(geoportal.GEOPORTAL_WMS_URL, params)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"WMS: błąd {e}")
+            return None
+        tresc = geoportal.tresc_obrazu(status, content_type, tresc, 'WMS')
+        if tresc is None:
+            return None
+        try:
+            img = obraz_ze_zrodla(tresc)
+        except (UnidentifiedImageError, OSError) as e:
+            print(f"WMS: błąd {e}")
+            return None
+        print(f"WMS: sukces! Rozmiar: {img.size}")
+        return img
+
+    klucz = geoportal.klucz_mapy('wms', lon, lat, szerokosc_pikseli, wysokosc_pikseli, zakres_m)
+    return await _z_pamieci_obrazow(klucz, pobierz)
+
+
+async def pobierz_mape_dla_obszaru_async(lon, lat, szerokosc_pikseli=800, wysokosc_pikseli=600, zoom_level=14,
+                                         hedge_opoznienie=None, zakres_m=None):
+    """
+    Asynchroniczna wersja geoportal.pobierz_mape_dla_obszaru - wyścig WMS/WMTS
+    z tymi samymi opóźnieniami i statystykami (STATYSTYKI_HEDGE)
+
+    Returns:
+        PIL.Image lub None
+    """
+    if zakres_m:
+        zoom_level = geoportal.poziom_wmts_dla_zakresu(zakres_m, szerokosc_pikseli, wysokosc_pikseli)
+    if hedge_opoznienie is None:
+        hedge_opoznienie = geoportal.domyslne_opoznienie_hedge()
+    if hedge_opoznienie < 0:
+        hedge_opoznienie = float('inf')
+
+    def wms():
+        return pobierz_mape_wms_async(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zakres_m)
+
+    def wmts():
+        x, y = geoportal.wgs84_do_epsg2180(lon, lat)
+        return zloz_mozaike_wmts_async(x, y, zoom_level, szerokosc_pikseli, wysokosc_pikseli)
+
+    zwyciezca, mapa = await wyscig_async(
+        [('wms', 0.0, wms), ('wmts', hedge_opoznienie, wmts)],
+        geoportal.STATYSTYKI_HEDGE
+    )
+    if mapa is None:
+        print("WMS i WMTS nieudane")
+    else:
+        print(f"{zwyciezca.upper()}: sukces!")
+    return mapa
+
+
+async def _pobierz_mape_statyczna(url, params, klucz):
+    async def pobierz():
+        try:
+            status, content_type, tresc = await _pobierz(url, params)
+            if status != 200 or not content_type.startswith("image/"):
+                return None
+            return obraz_ze_zrodla(tresc)
+        except (aiohttp.ClientError, asyncio.TimeoutError, UnidentifiedImageError, OSError):
+            return None
+
+    return await _z_pamieci_obrazow(klucz, pobierz)
+
+
+async def pobierz_mape_openstreetmap_async(lon, lat, szerokosc_pikseli=800, wysokosc_pikseli=600, zoom=18):
+    """Asynchroniczna wersja geoportal.pobierz_mape_openstreetmap."""
+    return await _pobierz_mape_statyczna(
+        geoportal.OSM_STATIC_URL,
+        geoportal.parametry_mapy_statycznej(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zoom, "mapnik"),
+        geoportal.klucz_mapy('osm', lon, lat, szerokosc_pikseli, wysokosc_pikseli, zoom)
+    )
+
+
+async def pobierz_mape_google_async(lon, lat, szerokosc_pikseli=800, wysokosc_pikseli=600, zoom=19,
+                                    api_key=None):
+    """Asynchroniczna wersja geoportal.pobierz_mape_google (wymaga klucza API)."""
+    if not api_key:
+        return None
+    params = geoportal.parametry_mapy_statycznej(lon, lat, szerokosc_pikseli, wysokosc_pikseli, zoom, "satellite")
+    params["key"] = api_key
+    return await _pobierz_mape_statyczna(
+        geoportal.GOOGLE_STATIC_URL,
+        params,
+        geoportal.klucz_mapy('google', lon, lat, szerokosc_pikseli, wysokosc_pikseli, zoom)
+    )
+
+
+async def geokoduj_adres_async(adres):
+    """
+    Asynchroniczna wersja geoportal.geokoduj_adres - indeks lokalny i cache
+    (w wątku), potem wyścig źródeł sieciowych przez aiohttp
+
+    Returns:
+        tuple: (lon, lat) lub None
+    """
+    if not adres:
+        return None
+    wynik = await asyncio.to_thread(geoportal.geokoduj_adres_lokalnie, adres)
+    if wynik is not BRAK:
+        return wynik[0]
+
+    async def z_sieci():
+        wynik = await pobierz_silnik_geokodowania().szukaj_async(adres)
+        return await asyncio.to_thread(geoportal.zapisz_kandydatow, adres, wynik, pobierz_cache_geokodowania())
+
+    kandydaci = await _loty().wykonaj(('geokod', normalizuj_adres(adres), False), z_sieci)
+    if not kandydaci:
+        return None
+    return kandydaci[0]['lon'], kandydaci[0]['lat']
+
+
+async def pobierz_mape_dla_wspolrzednych_async(
+    wspolrzedne_text,
+    szerokosc=800,
+    wysokosc=600,
+    map_source="geoportal",
+    google_api_key=None
+):
+    """
+    Asynchroniczny odpowiednik geoportal.pobierz_mape_dla_wspolrzednych
+
+    Args:
+        wspolrzedne_text: Tekst ze współrzędnymi, adres lub identyfikator działki
+        szerokosc: Szerokość obrazu
+        wysokosc: Wysokość obrazu
+        map_source: Źródło mapy ("geoportal", "google_maps", "openstreetmap")
+        google_api_key: Klucz API Google Maps (opcjonalny)
+
+    Returns:
+        tuple: (PIL.Image, lon, lat, error_message) - jak przy return_error=True
+    """
+    with zadanie_interaktywne():
+        lon, lat = geoportal.parsuj_wspolrzedne_tekst(wspolrzedne_text)
+        zakres_m = None
+
+        if lon is None and normalizuj_identyfikator(wspolrzedne_text):
+            dzialka = await asyncio.to_thread(znajdz_dzialke, wspolrzedne_text)
+            if dzialka is None:
+                return None, None, None, "Nie znaleziono działki w lokalnym indeksie działek (ROOF_PARCEL_INDEX)."
+            (x, y), zakres_m = zakres_mapy_dzialki(dzialka, szerokosc, wysokosc)
+            lon, lat = geoportal.epsg2180_do_wgs84(x, y)
+
+        if lon is None or lat is None:
+            wynik = await geokoduj_adres_async(wspolrzedne_text)
+            if not wynik:
+                return None, None, None, "Nie udało się rozpoznać adresu lub współrzędnych."
+            lon, lat = wynik
+
+        if map_source == "geoportal":
+            mapa = await pobierz_mape_dla_obszaru_async(lon, lat, szerokosc, wysokosc, zakres_m=zakres_m)
+            blad = "Nie udało się pobrać mapy z Geoportalu."
+        elif map_source == "openstreetmap":
+            zoom = 18
+            if zakres_m:
+                zoom = geoportal.zoom_webmercator_dla_zakresu(lat, zakres_m, szerokosc, wysokosc, zoom)
+            mapa = await pobierz_mape_openstreetmap_async(lon, lat, szerokosc, wysokosc, zoom)
+            blad = "Nie udało się pobrać mapy z OpenStreetMap."
+        elif map_source == "google_maps":
+            if not google_api_key:
+                return None, lon, lat, "Brak klucza API Google Maps."
+            zoom = 19
+            if zakres_m:
+                zoom = geoportal.zoom_webmercator_dla_zakresu(lat, zakres_m, szerokosc, wysokosc, zoom)
+            mapa = await pobierz_mape_google_async(lon, lat, szerokosc, wysokosc, zoom, api_key=google_api_key)
+            blad = "Nie udało się pobrać mapy z Google Maps."
+        else:
+            return None, lon, lat, "Nieznane źródło mapy."
+
+        if mapa is None:
+            return None, lon, lat, blad
+        return mapa, lon, lat, None
+
+
+_petla = None
+_petla_lock = threading.Lock()
+
+
+def pobierz_petle():
+    """
+    Zwraca współdzieloną pętlę zdarzeń działającą w wątku w tle
+
+    Wątki serwera (Flask) przekazują do niej korutyny i czekają na wynik -
+    wszystkie żądania map procesu dzielą jedną pętlę i jedną sesję aiohttp.
+
+    Returns:
+        asyncio.AbstractEventLoop
+    """
+    global _petla
+    if _petla is None:
+        with _petla_lock:
+            if _petla is None:
+                petla = asyncio.new_event_loop()
+                threading.Thread(target=petla.run_forever, name='petla-map', daemon=True).start()
+                _petla = petla
+    return _petla
+
+
+def uruchom(korutyna):
+    """
+    Wykonuje korutynę we wspólnej pętli w tle i czeka na wynik (z dowolnego wątku)
+
+    Returns:
+        Wynik korutyny
+    """
+    return asyncio.run_coroutine_threadsafe(korutyna, pobierz_petle()).result()
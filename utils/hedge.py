@@ -0,0 +1,232 @@
+"""
+Moduł żądań zabezpieczonych (hedged requests)
+Kilka ścieżek pobierania startuje z opóźnieniami, wygrywa pierwszy poprawny wynik
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+DOMYSLNA_LICZBA_WATKOW = 16
+# Liczba ostatnich pomiarów czasu przechowywanych dla każdej ścieżki
+OKNO_POMIAROW = 200
+
+
+class StatystykiWyscigu:
+    """Liczniki wygranych i czasy odpowiedzi poszczególnych ścieżek wyścigu."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sciezki = {}
+
+    def _sciezka(self, nazwa):
+        sciezka = self._sciezki.get(nazwa)
+        if sciezka is None:
+            sciezka = {
+                'proby': 0,
+                'wygrane': 0,
+                'bledy': 0,
+                'anulowane': 0,
+                'czasy_ms': deque(maxlen=OKNO_POMIAROW),
+            }
+            self._sciezki[nazwa] = sciezka
+        return sciezka
+
+    def zapisz_start(self, nazwa):
+        with self._lock:
+            self._sciezka(nazwa)['proby'] += 1
+
+    def zapisz_wynik(self, nazwa, czas_s, sukces):
+        with self._lock:
+            sciezka = self._sciezka(nazwa)
+            if sukces:
+                sciezka['czasy_ms'].append(czas_s * 1000.0)
+            else:
+                sciezka['bledy'] += 1
+
+    def zapisz_wygrana(self, nazwa):
+        with self._lock:
+            self._sciezka(nazwa)['wygrane'] += 1
+
+    def zapisz_anulowanie(self, nazwa):
+        with self._lock:
+            self._sciezka(nazwa)['anulowane'] += 1
+
+    def statystyki(self):
+        """
+        Returns:
+            dict: nazwa ścieżki -> próby, wygrane, odsetek wygranych, błędy i czasy (ms)
+        """
+        wynik = {}
+        with self._lock:
+            for nazwa, sciezka in self._sciezki.items():
+                czasy = sorted(sciezka['czasy_ms'])
+                wynik[nazwa] = {
+                    'proby': sciezka['proby'],
+                    'wygrane': sciezka['wygrane'],
+                    'odsetek_wygranych': sciezka['wygrane'] / sciezka['proby'] if sciezka['proby'] else 0.0,
+                    'bledy': sciezka['bledy'],
+                    'anulowane': sciezka['anulowane'],
+                    'czas_p50_ms': czasy[len(czasy) // 2] if czasy else None,
+                    'czas_p95_ms': czasy[int(len(czasy) * 0.95)] if czasy else None,
+                }
+        return wynik
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pobierz_executor():
+    """Pula wątków dla ścieżek wyścigu (ROOF_HEDGE_THREADS) - osobna od puli kafelków."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                try:
+                    watki = max(1, int(os.environ.get('ROOF_HEDGE_THREADS', DOMYSLNA_LICZBA_WATKOW)))
+                except ValueError:
+                    print(f"ROOF_HEDGE_THREADS: błędna wartość - użyto domyślnej ({DOMYSLNA_LICZBA_WATKOW})")
+                    watki = DOMYSLNA_LICZBA_WATKOW
+                _executor = ThreadPoolExecutor(
+                    max_workers=watki,
+                    thread_name_prefix='hedge'
+                )
+    return _executor
+
+
+def wyscig(sciezki, statystyki=None, akceptuj=None):
+    """
+    Uruchamia ścieżki pobierania z opóźnieniami i zwraca pierwszy poprawny wynik
+
+    Ścieżka startuje po swoim opóźnieniu albo wcześniej, gdy wszystkie już
+    uruchomione ścieżki zakończyły się niepowodzeniem (zachowanie fallbacku).
+    Przegrane ścieżki dostają sygnał anulowania przez threading.Event -
+    ścieżka powinna go sprawdzać i przerwać pracę, gdy tylko może.
+
+    Args:
+        sciezki: Lista krotek (nazwa, opoznienie_s, funkcja(anuluj: threading.Event))
+                 - funkcja zwraca wynik lub None przy błędzie
+        statystyki: Opcjonalny obiekt StatystykiWyscigu
+        akceptuj: Opcjonalna funkcja(nazwa, wynik) -> bool decydująca, czy wynik
+                  kończy wyścig; odrzucony wynik traktowany jest jak niepowodzenie
+                  (startuje następna ścieżka), ale nie liczy się jako błąd
+
+    Returns:
+        tuple: (nazwa zwycięskiej ścieżki, wynik) lub (None, None)
+    """
+    executor = _pobierz_executor()
+    anuluj = threading.Event()
+    oczekujace = sorted(sciezki, key=lambda s: s[1])
+    start = time.monotonic()
+    uruchomione = {}
+
+    def uruchom(nazwa, funkcja):
+        if statystyki is not None:
+            statystyki.zapisz_start(nazwa)
+
+        def wykonaj():
+            t0 = time.monotonic()
+            try:
+                wynik = funkcja(anuluj)
+            except Exception as e:
+                print(f"Wyścig: ścieżka {nazwa} zakończona błędem: {e}")
+                wynik = None
+            if statystyki is not None and not (wynik is None and anuluj.is_set()):
+                statystyki.zapisz_wynik(nazwa, time.monotonic() - t0, wynik is not None)
+            return wynik
+
+        uruchomione[executor.submit(wykonaj)] = nazwa
+
+    try:
+        while oczekujace or uruchomione:
+            # Startuj ścieżki, których opóźnienie minęło, lub następną, gdy nic nie biegnie
+            teraz = time.monotonic() - start
+            while oczekujace and (oczekujace[0][1] <= teraz or not uruchomione):
+                nazwa, _, funkcja = oczekujace.pop(0)
+                uruchom(nazwa, funkcja)
+
+            timeout = None
+            if oczekujace and oczekujace[0][1] != float('inf'):
+                timeout = max(0.0, oczekujace[0][1] - (time.monotonic() - start))
+            gotowe, _ = wait(list(uruchomione), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in gotowe:
+                nazwa = uruchomione.pop(future)
+                wynik = future.result()
+                if wynik is not None and (akceptuj is None or akceptuj(nazwa, wynik)):
+                    if statystyki is not None:
+                        statystyki.zapisz_wygrana(nazwa)
+                        for przegrany in uruchomione.values():
+                            statystyki.zapisz_anulowanie(przegrany)
+                    return nazwa, wynik
+        return None, None
+    finally:
+        anuluj.set()
+
+
+async def wyscig_async(sciezki, statystyki=None, akceptuj=None):
+    """
+    Asynchroniczny odpowiednik wyscig - ścieżki są korutynami w bieżącej pętli
+    zdarzeń, a przegrane są anulowane (asyncio.CancelledError w ścieżce)
+
+    Args:
+        sciezki: Lista krotek (nazwa, opoznienie_s, funkcja() -> korutyna)
+                 - korutyna zwraca wynik lub None przy błędzie
+        statystyki: Opcjonalny obiekt StatystykiWyscigu (wspólny z wyscig)
+        akceptuj: Opcjonalna funkcja(nazwa, wynik) -> bool, jak w wyscig
+
+    Returns:
+        tuple: (nazwa zwycięskiej ścieżki, wynik) lub (None, None)
+    """
+    oczekujace = sorted(sciezki, key=lambda s: s[1])
+    start = time.monotonic()
+    uruchomione = {}
+
+    def uruchom(nazwa, funkcja):
+        if statystyki is not None:
+            statystyki.zapisz_start(nazwa)
+
+        async def wykonaj():
+            t0 = time.monotonic()
+            try:
+                wynik = await funkcja()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Wyścig: ścieżka {nazwa} zakończona błędem: {e}")
+                wynik = None
+            if statystyki is not None:
+                statystyki.zapisz_wynik(nazwa, time.monotonic() - t0, wynik is not None)
+            return wynik
+
+        uruchomione[asyncio.ensure_future(wykonaj())] = nazwa
+
+    try:
+        while oczekujace or uruchomione:
+            teraz = time.monotonic() - start
+            while oczekujace and (oczekujace[0][1] <= teraz or not uruchomione):
+                nazwa, _, funkcja = oczekujace.pop(0)
+                uruchom(nazwa, funkcja)
+
+            timeout = None
+            if oczekujace and oczekujace[0][1] != float('inf'):
+                timeout = max(0.0, oczekujace[0][1] - (time.monotonic() - start))
+            gotowe, _ = await asyncio.wait(list(uruchomione), timeout=timeout,
+                                           return_when=asyncio.FIRST_COMPLETED)
+            for zadanie in gotowe:
+                nazwa = uruchomione.pop(zadanie)
+                wynik = zadanie.result()
+                if wynik is not None and (akceptuj is None or akceptuj(nazwa, wynik)):
+                    if statystyki is not None:
+                        statystyki.zapisz_wygrana(nazwa)
+                        for przegrany in uruchomione.values():
+                            statystyki.zapisz_anulowanie(przegrany)
+                    return nazwa, wynik
+        return None, None
+    finally:
+        for zadanie in uruchomione:
+            zadanie.cancel()
@@ -0,0 +1,187 @@
+"""
+Moduł współdzielonej sesji HTTP z pulą połączeń keep-alive
+Wszystkie żądania do Geoportalu, Nominatim, OSM i Google przechodzą przez tę warstwę
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:  # Bez aiohttp dostępne jest tylko API synchroniczne
+    aiohttp = None
+
+
+DOMYSLNY_TIMEOUT_S = 10
+DOMYSLNA_LICZBA_HOSTOW = 10
+DOMYSLNY_ROZMIAR_PULI = 10
+USER_AGENT = "RoofGeoportal/1.0 (https://github.com/Majcher-creator/RoofGeoportal)"
+
+
+class SesjaHttp:
+    """
+    Bezpieczna wątkowo sesja HTTP z pulą połączeń na hosta.
+
+    Każdy wątek dostaje własny obiekt requests.Session (ciasteczka i nagłówki
+    nie są współdzielone), ale wszystkie sesje używają tych samych adapterów,
+    więc połączenia TCP/TLS z puli są ponownie wykorzystywane między wątkami.
+    Sesja żyje tylko w threading.local i znika razem z wątkiem (serwer
+    Werkzeug tworzy wątek na żądanie), pule połączeń zostają w adapterach.
+    """
+
+    def __init__(self, liczba_hostow=DOMYSLNA_LICZBA_HOSTOW, rozmiar_puli=DOMYSLNY_ROZMIAR_PULI,
+                 timeout=DOMYSLNY_TIMEOUT_S):
+        """
+        Args:
+            liczba_hostow: Liczba hostów, dla których trzymane są pule połączeń
+            rozmiar_puli: Maksymalna liczba połączeń keep-alive na hosta
+            timeout: Domyślny timeout żądań w sekundach
+        """
+        self.timeout = timeout
+        self.rozmiar_puli = rozmiar_puli
+        self._adaptery = {
+            'https://': HTTPAdapter(pool_connections=liczba_hostow, pool_maxsize=rozmiar_puli),
+            'http://': HTTPAdapter(pool_connections=liczba_hostow, pool_maxsize=rozmiar_puli),
+        }
+        self._lokalne = threading.local()
+
+    def sesja(self):
+        """Zwraca requests.Session bieżącego wątku (współdzielącą pule połączeń)."""
+        sesja = getattr(self._lokalne, 'sesja', None)
+        if sesja is None:
+            sesja = requests.Session()
+            sesja.headers['User-Agent'] = USER_AGENT
+            for prefiks, adapter in self._adaptery.items():
+                sesja.mount(prefiks, adapter)
+            self._lokalne.sesja = sesja
+        return sesja
+
+    def get(self, url, **kwargs):
+        """
+        Wysyła żądanie GET przez pulę połączeń
+
+        Args:
+            url: Adres URL
+            **kwargs: Argumenty requests (params, headers, timeout...)
+
+        Returns:
+            requests.Response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        return self.sesja().get(url, **kwargs)
+
+    def statystyki(self):
+        """
+        Zwraca statystyki ponownego użycia połączeń dla każdego hosta
+
+        Returns:
+            dict: host -> {zadania, nowe_polaczenia, ponowne_uzycia}
+        """
+        wynik = {}
+        for adapter in self._adaptery.values():
+            pule = adapter.poolmanager.pools
+            for klucz in list(pule.keys()):
+                pula = pule.get(klucz)
+                if pula is None:
+                    continue
+                host = f"{pula.scheme}://{pula.host}"
+                zadania = pula.num_requests
+                polaczenia = pula.num_connections
+                wynik[host] = {
+                    'zadania': zadania,
+                    'nowe_polaczenia': polaczenia,
+                    'ponowne_uzycia': max(0, zadania - polaczenia),
+                }
+        return wynik
+
+    def zamknij(self):
+        """Zamyka połączenia z puli (sesje wątków nie mają innych zasobów)."""
+        self._lokalne = threading.local()
+        for adapter in self._adaptery.values():
+            adapter.close()
+
+
+_domyslna_sesja = None
+_domyslna_sesja_lock = threading.Lock()
+
+
+def _liczba_ze_zmiennej(nazwa, domyslna, typ=int):
+    """Dodatnia liczba ze zmiennej środowiskowej (błędna wartość - domyślna)."""
+    try:
+        wartosc = typ(os.environ.get(nazwa, domyslna))
+    except ValueError:
+        wartosc = None
+    if wartosc is None or not wartosc > 0:
+        print(f"{nazwa}: błędna wartość - użyto domyślnej ({domyslna})")
+        return domyslna
+    return wartosc
+
+
+def pobierz_sesje_http():
+    """
+    Zwraca współdzieloną sesję HTTP skonfigurowaną zmiennymi:
+        ROOF_HTTP_TIMEOUT - timeout żądań w sekundach
+        ROOF_HTTP_POOL_SIZE - liczba połączeń keep-alive na hosta
+        ROOF_HTTP_POOL_HOSTS - liczba hostów z własną pulą
+
+    Returns:
+        SesjaHttp
+    """
+    global _domyslna_sesja
+    if _domyslna_sesja is None:
+        with _domyslna_sesja_lock:
+            if _domyslna_sesja is None:
+                _domyslna_sesja = SesjaHttp(
+                    liczba_hostow=_liczba_ze_zmiennej('ROOF_HTTP_POOL_HOSTS', DOMYSLNA_LICZBA_HOSTOW),
+                    rozmiar_puli=_liczba_ze_zmiennej('ROOF_HTTP_POOL_SIZE', DOMYSLNY_ROZMIAR_PULI),
+                    timeout=_liczba_ze_zmiennej('ROOF_HTTP_TIMEOUT', DOMYSLNY_TIMEOUT_S, float)
+                )
+    return _domyslna_sesja
+
+
+# Sesje aiohttp są związane z pętlą zdarzeń - jedna na pętlę
+_sesje_async = weakref.WeakKeyDictionary()
+
+
+def pobierz_sesje_http_async():
+    """
+    Zwraca sesję aiohttp bieżącej pętli zdarzeń (wywoływać z korutyny)
+
+    Konfiguracja jak w pobierz_sesje_http: ROOF_HTTP_TIMEOUT to łączny timeout
+    żądania, ROOF_HTTP_POOL_SIZE - liczba połączeń na hosta, a nagłówek
+    User-Agent jest ten sam. Sesję zamyka zamknij_sesje_http_async().
+
+    Returns:
+        aiohttp.ClientSession
+
+    Raises:
+        RuntimeError: Brak pakietu aiohttp
+    """
+    if aiohttp is None:
+        raise RuntimeError("Asynchroniczne pobieranie wymaga pakietu aiohttp")
+    petla = asyncio.get_running_loop()
+    sesja = _sesje_async.get(petla)
+    if sesja is None or sesja.closed:
+        sesja = aiohttp.ClientSession(
+            headers={'User-Agent': USER_AGENT},
+            timeout=aiohttp.ClientTimeout(
+                total=_liczba_ze_zmiennej('ROOF_HTTP_TIMEOUT', DOMYSLNY_TIMEOUT_S, float)
+            ),
+            connector=aiohttp.TCPConnector(
+                limit_per_host=_liczba_ze_zmiennej('ROOF_HTTP_POOL_SIZE', DOMYSLNY_ROZMIAR_PULI)
+            )
+        )
+        _sesje_async[petla] = sesja
+    return sesja
+
+
+async def zamknij_sesje_http_async():
+    """Zamyka sesję aiohttp bieżącej pętli zdarzeń (np. przed końcem asyncio.run)."""
+    sesja = _sesje_async.pop(asyncio.get_running_loop(), None)
+    if sesja is not None:
+        await sesja.close()
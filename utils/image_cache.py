@@ -0,0 +1,255 @@
+"""
+Moduł cache obrazów map w pamięci procesu
+Budżet liczony jest w bajtach faktycznie zajmowanej pamięci, a nie w liczbie wpisów:
+zdekodowane obrazy - rozmiarem pikseli, obrazy otwarte z bajtów źródła
+(obraz_ze_zrodla) - rozmiarem skompresowanych bajtów, w których są trzymane
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image
+
+
+DOMYSLNY_BUDZET_MB = 256
+# Formaty, które przeglądarka wyświetli bez przekodowania
+MIME_FORMATOW = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'GIF': 'image/gif',
+}
+
+
+def obraz_ze_zrodla(dane):
+    """
+    Otwiera obraz z bajtów odpowiedzi bez dekodowania pikseli (dekodowanie przy pierwszym użyciu)
+
+    Bajty zostają w atrybucie zrodlowe_dane - dopóki obraz nie zostanie zmieniony,
+    można je wysłać dalej zamiast ponownie kodować obraz. Operacje PIL (crop,
+    resize, convert, copy) zwracają nowe obiekty już bez tego atrybutu.
+
+    Args:
+        dane: Bajty obrazu (JPEG, PNG...)
+
+    Returns:
+        PIL.Image
+
+    Raises:
+        PIL.UnidentifiedImageError: Jeśli bajty nie są obrazem
+    """
+    dane = bytes(dane)
+    img = Image.open(BytesIO(dane))
+    img.zrodlowe_dane = dane
+    return img
+
+
+def zrodlowe_dane(img):
+    """
+    Zwraca bajty źródła niezmienionego obrazu otwartego przez obraz_ze_zrodla
+
+    Obrazu nie wolno zmieniać w miejscu (paste, ImageDraw) po otwarciu -
+    kto to robi, powinien najpierw wywołać img.copy().
+
+    Returns:
+        tuple: (bajty, typ MIME) lub None, jeśli obraz nie ma źródła w formacie dla przeglądarki
+    """
+    dane = getattr(img, 'zrodlowe_dane', None)
+    mime = MIME_FORMATOW.get(getattr(img, 'format', None))
+    if dane is None or mime is None:
+        return None
+    return dane, mime
+
+
+def kopia_obrazu(img):
+    """
+    Kopia obrazu dla wywołującego - obraz ze źródła otwierany jest na nowo
+    (bez dekodowania i z zachowaniem bajtów źródła), pozostałe kopiowane przez img.copy()
+    """
+    dane = getattr(img, 'zrodlowe_dane', None)
+    if dane is not None:
+        return obraz_ze_zrodla(dane)
+    return img.copy()
+
+
+def sprawdz_obraz(img):
+    """
+    Sprawdza, czy obraz nie jest uszkodzony (np. ucięty JPEG)
+
+    Obraz ze źródła sprawdzany jest bez dekodowania pikseli: JPEG musi kończyć
+    się znacznikiem EOI, GIF - znakiem końca pliku, pozostałe formaty przechodzą
+    verify() (sumy kontrolne PNG, struktura pliku). Inne obrazy są ładowane (load).
+
+    Raises:
+        OSError: Jeśli obraz jest uszkodzony
+    """
+    dane = getattr(img, 'zrodlowe_dane', None)
+    if dane is None:
+        img.load()
+    elif img.format == 'JPEG':
+        if not dane.rstrip(b'\x00\r\n\t ').endswith(b'\xff\xd9'):
+            raise OSError("Ucięty obraz JPEG (brak znacznika końca EOI)")
+    elif img.format == 'GIF':
+        if not dane.rstrip(b'\x00').endswith(b';'):
+            raise OSError("Ucięty obraz GIF (brak znaku końca pliku)")
+    else:
+        try:
+            Image.open(BytesIO(dane)).verify()
+        except (SyntaxError, ValueError) as e:
+            raise OSError(f"Uszkodzony obraz {img.format}: {e}") from e
+
+
+def rozmiar_obrazu(img):
+    """
+    Szacuje rozmiar zdekodowanego obrazu w pamięci
+
+    Args:
+        img: PIL.Image
+
+    Returns:
+        int: Liczba bajtów pikseli
+    """
+    bajty_na_piksel = len(img.getbands())
+    if img.mode in ('I', 'F', 'I;16'):
+        bajty_na_piksel = 4
+    return img.width * img.height * bajty_na_piksel
+
+
+class PamiecObrazow:
+    """
+    Cache LRU obrazów PIL ograniczony łącznym rozmiarem zajmowanej pamięci.
+
+    Obrazy są ładowane (load) przed zapisaniem, a z cache zwracana jest kopia,
+    więc wywołujący mogą je dowolnie modyfikować. Obrazy otwarte z bajtów źródła
+    (obraz_ze_zrodla) zapisywane są bez dekodowania i liczone rozmiarem bajtów
+    źródła; pozostałe - rozmiarem zdekodowanych pikseli.
+    """
+
+    def __init__(self, maks_bajtow=DOMYSLNY_BUDZET_MB * 1024 * 1024):
+        """
+        Args:
+            maks_bajtow: Budżet cache w bajtach (piksele zdekodowanych obrazów,
+                         bajty źródła obrazów nie zdekodowanych)
+        """
+        self.maks_bajtow = maks_bajtow
+        self._wpisy = OrderedDict()
+        self._lock = threading.Lock()
+        self._rozmiar = 0
+        self._trafienia = 0
+        self._chybienia = 0
+        self._usuniete = 0
+        self._usuniete_bajty = 0
+        self._odrzucone = 0
+
+    def pobierz(self, klucz):
+        """
+        Zwraca kopię obrazu z cache
+
+        Args:
+            klucz: Krotka (źródło, parametry...)
+
+        Returns:
+            PIL.Image lub None
+        """
+        with self._lock:
+            wpis = self._wpisy.get(klucz)
+            if wpis is None:
+                self._chybienia += 1
+                return None
+            self._wpisy.move_to_end(klucz)
+            self._trafienia += 1
+            img = wpis[0]
+        return kopia_obrazu(img)
+
+    def zapisz(self, klucz, img):
+        """
+        Zapisuje obraz w cache, usuwając najdawniej używane wpisy ponad budżet
+
+        Args:
+            klucz: Krotka (źródło, parametry...)
+            img: PIL.Image
+        """
+        dane = getattr(img, 'zrodlowe_dane', None)
+        if dane is not None:
+            rozmiar = len(dane)
+        else:
+            img.load()
+            rozmiar = rozmiar_obrazu(img)
+        with self._lock:
+            if rozmiar > self.maks_bajtow:
+                self._odrzucone += 1
+                return
+            poprzedni = self._wpisy.pop(klucz, None)
+            if poprzedni is not None:
+                self._rozmiar -= poprzedni[1]
+            self._wpisy[klucz] = (img, rozmiar)
+            self._rozmiar += rozmiar
+            while self._rozmiar > self.maks_bajtow:
+                _, (_, usuniety_rozmiar) = self._wpisy.popitem(last=False)
+                self._rozmiar -= usuniety_rozmiar
+                self._usuniete += 1
+                self._usuniete_bajty += usuniety_rozmiar
+
+    def wyczysc(self):
+        """Usuwa wszystkie obrazy z cache."""
+        with self._lock:
+            self._wpisy.clear()
+            self._rozmiar = 0
+
+    def statystyki(self):
+        """
+        Zwraca liczniki cache do doboru budżetu
+
+        Returns:
+            dict: trafienia, chybienia, usunięcia, rozmiar i budżet
+        """
+        with self._lock:
+            zapytania = self._trafienia + self._chybienia
+            return {
+                'trafienia': self._trafienia,
+                'chybienia': self._chybienia,
+                'wspolczynnik_trafien': self._trafienia / zapytania if zapytania else 0.0,
+                'wpisy': len(self._wpisy),
+                'usuniete': self._usuniete,
+                'usuniete_bajty': self._usuniete_bajty,
+                'odrzucone_za_duze': self._odrzucone,
+                'rozmiar_bajtow': self._rozmiar,
+                'budzet_bajtow': self.maks_bajtow,
+            }
+
+
+_domyslna_pamiec = None
+_domyslna_pamiec_lock = threading.Lock()
+
+
+def pobierz_pamiec_obrazow():
+    """
+    Zwraca współdzieloną pamięć obrazów skonfigurowaną zmienną
+    ROOF_IMAGE_CACHE_MB (0 wyłącza cache).
+
+    Returns:
+        PamiecObrazow lub None jeśli cache jest wyłączony
+    """
+    global _domyslna_pamiec
+    if _domyslna_pamiec is not None:
+        return _domyslna_pamiec or None
+    with _domyslna_pamiec_lock:
+        if _domyslna_pamiec is None:
+            try:
+                budzet_mb = float(os.environ.get('ROOF_IMAGE_CACHE_MB', DOMYSLNY_BUDZET_MB))
+            except ValueError:
+                budzet_mb = DOMYSLNY_BUDZET_MB
+            if budzet_mb <= 0:
+                _domyslna_pamiec = False
+            else:
+                _domyslna_pamiec = PamiecObrazow(int(budzet_mb * 1024 * 1024))
+    return _domyslna_pamiec or None
+
+
+def ustaw_pamiec_obrazow(pamiec):
+    """Podmienia współdzieloną pamięć obrazów (None wyłącza cache)."""
+    global _domyslna_pamiec
+    with _domyslna_pamiec_lock:
+        _domyslna_pamiec = pamiec if pamiec is not None else False
@@ -0,0 +1,210 @@
+"""
+Moduł kodowania obrazów map w odpowiedziach API
+Format (WebP, JPEG lub PNG) i jego parametry wybierane są z żądania, nagłówka Accept
+albo z ustawień domyślnych dla źródła mapy
+"""
+
+import os
+from collections import namedtuple
+from io import BytesIO
+
+
+# Nazwa formatu -> (format Pillow, typ MIME)
+FORMATY = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+}
+ALIASY_FORMATOW = {'jpg': 'jpeg'}
+FORMAT_DLA_MIME = {mime: nazwa for nazwa, (_, mime) in FORMATY.items()}
+DOMYSLNA_JAKOSC = 85
+DOMYSLNA_KOMPRESJA_PNG = 1
+# Metoda WebP 0-6: wyższa to mniejszy plik kosztem czasu; 0 koduje ~3x szybciej niż
+# domyślna w Pillow 4, przy zdjęciach lotniczych prawie bez wzrostu rozmiaru
+METODA_WEBP = 0
+# Zdjęcia lotnicze i satelitarne jako JPEG, mapa OSM (grafika) i DEMO jako PNG
+DOMYSLNE_FORMATY = {
+    'geoportal': f'jpeg:{DOMYSLNA_JAKOSC}',
+    'google_maps': f'jpeg:{DOMYSLNA_JAKOSC}',
+    'openstreetmap': f'png:{DOMYSLNA_KOMPRESJA_PNG}',
+    'demo': f'png:{DOMYSLNA_KOMPRESJA_PNG}',
+}
+
+# jakosc - JPEG/WebP 1-100, kompresja - PNG 0-9; przekaz_zrodlo - wolno wysłać
+# niezmienione bajty źródła w tym samym formacie zamiast kodować obraz ponownie
+UstawieniaKodowania = namedtuple('UstawieniaKodowania', ['format', 'jakosc', 'kompresja', 'przekaz_zrodlo'])
+
+
+def nazwa_formatu(tekst):
+    """
+    Normalizuje nazwę formatu ("WebP", "jpg", "image/png"...)
+
+    Raises:
+        ValueError: Jeśli format nie jest obsługiwany
+    """
+    nazwa = str(tekst).strip().lower()
+    nazwa = FORMAT_DLA_MIME.get(nazwa, ALIASY_FORMATOW.get(nazwa, nazwa))
+    if nazwa not in FORMATY:
+        raise ValueError(f"Nieobsługiwany format obrazu: {tekst} (dostępne: {', '.join(FORMATY)})")
+    return nazwa
+
+
+def _parametr(wartosc, nazwa, minimum, maksimum):
+    try:
+        liczba = int(wartosc)
+    except (TypeError, ValueError):
+        raise ValueError(f"{nazwa} musi być liczbą całkowitą {minimum}-{maksimum}") from None
+    if not minimum <= liczba <= maksimum:
+        raise ValueError(f"{nazwa} musi być liczbą całkowitą {minimum}-{maksimum}")
+    return liczba
+
+
+def parsuj_ustawienia(tekst):
+    """
+    Odczytuje ustawienia w postaci "format[:parametr]", np. "webp:80", "jpeg", "png:1"
+
+    Returns:
+        UstawieniaKodowania (parametr to jakość dla JPEG/WebP, poziom kompresji dla PNG)
+    """
+    nazwa, _, parametr = str(tekst).partition(':')
+    nazwa = nazwa_formatu(nazwa)
+    if nazwa == 'png':
+        kompresja = _parametr(parametr, 'kompresja', 0, 9) if parametr else DOMYSLNA_KOMPRESJA_PNG
+        return UstawieniaKodowania(nazwa, None, kompresja, True)
+    jakosc = _parametr(parametr, 'jakosc', 1, 100) if parametr else DOMYSLNA_JAKOSC
+    return UstawieniaKodowania(nazwa, jakosc, None, True)
+
+
+def domyslne_ustawienia(zrodlo):
+    """
+    Domyślne kodowanie dla źródła mapy (geoportal, google_maps, openstreetmap, demo)
+
+    Zmienna ROOF_MAP_FORMATS nadpisuje wybrane źródła, np. "geoportal=webp:80,openstreetmap=png:3".
+
+    Returns:
+        UstawieniaKodowania
+    """
+    formaty = dict(DOMYSLNE_FORMATY)
+    for wpis in os.environ.get('ROOF_MAP_FORMATS', '').split(','):
+        nazwa, _, ustawienia = wpis.partition('=')
+        if nazwa.strip() and ustawienia.strip():
+            formaty[nazwa.strip()] = ustawienia.strip()
+    try:
+        return parsuj_ustawienia(formaty.get(zrodlo, DOMYSLNE_FORMATY['geoportal']))
+    except ValueError as e:
+        print(f"ROOF_MAP_FORMATS: {e} - użyto ustawień domyślnych dla {zrodlo}")
+        return parsuj_ustawienia(DOMYSLNE_FORMATY.get(zrodlo, DOMYSLNE_FORMATY['geoportal']))
+
+
+def formaty_z_accept(naglowek):
+    """
+    Formaty obrazu akceptowane przez klienta według nagłówka Accept
+
+    Args:
+        naglowek: Wartość nagłówka Accept, np. "application/json, image/webp, image/*;q=0.5"
+
+    Returns:
+        dict: nazwa formatu -> waga q (tylko q > 0) lub None, jeśli klient nie wymienił
+              żadnego typu obrazu (brak preferencji)
+    """
+    if not naglowek:
+        return None
+    wagi = {}
+    wildcard = None
+    for czesc in naglowek.split(','):
+        typ, *parametry = [p.strip() for p in czesc.split(';')]
+        q = 1.0
+        for parametr in parametry:
+            klucz, _, wartosc = parametr.partition('=')
+            if klucz.strip().lower() == 'q':
+                try:
+                    q = float(wartosc)
+                except ValueError:
+                    q = 0.0
+        typ = typ.lower()
+        if typ == 'image/*':
+            wildcard = q
+        elif typ in FORMAT_DLA_MIME:
+            wagi[FORMAT_DLA_MIME[typ]] = q
+    if not wagi and wildcard is None:
+        return None
+    if wildcard is not None:
+        for nazwa in FORMATY:
+            wagi.setdefault(nazwa, wildcard)
+    return {nazwa: q for nazwa, q in wagi.items() if q > 0}
+
+
+def wybierz_ustawienia(zrodlo, format=None, jakosc=None, kompresja=None, accept=None):
+    """
+    Ustala kodowanie obrazu mapy dla żądania
+
+    Kolejność: format podany w żądaniu, potem najwyżej oceniony w Accept (przy równych
+    wagach wygrywa domyślny format źródła), na końcu domyślny format źródła.
+    Jawnie podana jakość (JPEG/WebP) lub kompresja (PNG) wymusza ponowne kodowanie obrazu.
+
+    Args:
+        zrodlo: Źródło mapy (geoportal, google_maps, openstreetmap, demo)
+        format: Format z żądania (webp, jpeg, png) lub None
+        jakosc: Jakość JPEG/WebP 1-100 lub None
+        kompresja: Poziom kompresji PNG 0-9 lub None
+        accept: Nagłówek Accept żądania
+
+    Returns:
+        UstawieniaKodowania
+
+    Raises:
+        ValueError: Nieobsługiwany format, parametr spoza zakresu lub brak formatu akceptowanego przez klienta
+    """
+    domyslne = domyslne_ustawienia(zrodlo)
+    if format:
+        nazwa = nazwa_formatu(format)
+    else:
+        nazwa = domyslne.format
+        akceptowane = formaty_z_accept(accept)
+        if akceptowane is not None:
+            if not akceptowane:
+                raise ValueError("Klient nie akceptuje żadnego z formatów: " + ', '.join(FORMATY))
+            najwyzsza = max(akceptowane.values())
+            if akceptowane.get(nazwa) != najwyzsza:
+                nazwa = next(n for n in FORMATY if akceptowane.get(n) == najwyzsza)
+
+    if nazwa == 'png':
+        if kompresja is not None:
+            return UstawieniaKodowania(nazwa, None, _parametr(kompresja, 'kompresja', 0, 9), False)
+        kompresja = domyslne.kompresja if domyslne.format == 'png' else DOMYSLNA_KOMPRESJA_PNG
+        return UstawieniaKodowania(nazwa, None, kompresja, True)
+    if jakosc is not None:
+        return UstawieniaKodowania(nazwa, _parametr(jakosc, 'jakosc', 1, 100), None, False)
+    jakosc = domyslne.jakosc if domyslne.format == nazwa else DOMYSLNA_JAKOSC
+    return UstawieniaKodowania(nazwa, jakosc, None, True)
+
+
+def koduj_obraz(img, ustawienia, zrodlo=None):
+    """
+    Koduje obraz mapy zgodnie z ustawieniami
+
+    Args:
+        img: PIL.Image
+        ustawienia: UstawieniaKodowania
+        zrodlo: (bajty, typ MIME) niezmienionego obrazu źródłowego lub None - wysyłane
+                bez kodowania, jeśli mają żądany format i ustawienia na to pozwalają
+
+    Returns:
+        tuple: (bajty, typ MIME)
+    """
+    format_pil, mime = FORMATY[ustawienia.format]
+    if zrodlo is not None and ustawienia.przekaz_zrodlo and zrodlo[1] == mime:
+        return zrodlo
+
+    bufor = BytesIO()
+    if ustawienia.format == 'png':
+        img.save(bufor, format=format_pil, compress_level=ustawienia.kompresja)
+    elif ustawienia.format == 'jpeg':
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img.save(bufor, format=format_pil, quality=ustawienia.jakosc)
+    else:
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+        img.save(bufor, format=format_pil, quality=ustawienia.jakosc, method=METODA_WEBP)
+    return bufor.getvalue(), mime
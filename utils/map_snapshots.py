@@ -0,0 +1,235 @@
+"""
+Moduł migawek obrazów map adresowanych treścią (SHA-256)
+Obraz zapisany raz pod swoim skrótem nigdy się nie zmienia, więc przeglądarka
+może go cache'ować bez końca, a identyczne mapy zajmują jeden plik
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+from utils.tile_cache import POZIOM_PO_PRZYCIECIU, ROZSZERZENIA
+
+
+DOMYSLNY_KATALOG_MIGAWEK = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'mapy'
+)
+DOMYSLNY_BUDZET_MB = 256
+SKROT_RE = re.compile(r"^[0-9a-f]{64}$")
+# Jak często (w sekundach) ponowny zapis tej samej mapy odświeża jej czas dostępu
+ODSWIEZANIE_DOSTEPU_S = 60
+PREFIKS_TMP = '.tmp-'
+ROZSZERZENIA_MIGAWEK = dict(ROZSZERZENIA, **{'image/gif': 'gif'})
+TYPY_ROZSZERZEN = {rozszerzenie: mime for mime, rozszerzenie in ROZSZERZENIA_MIGAWEK.items()}
+
+
+class MagazynMigawek:
+    """
+    Obrazy map w plikach nazwanych skrótem SHA-256 treści, z budżetem rozmiaru.
+
+    Pliki leżą w podkatalogach według dwóch pierwszych znaków skrótu; zapis jest
+    atomowy, więc katalog może być współdzielony przez workery. Po przekroczeniu
+    budżetu usuwane są najdawniej zapisane migawki.
+    """
+
+    def __init__(self, katalog, maks_bajtow=DOMYSLNY_BUDZET_MB * 1024 * 1024):
+        """
+        Args:
+            katalog: Katalog migawek
+            maks_bajtow: Budżet rozmiaru w bajtach
+        """
+        self.katalog = katalog
+        self.maks_bajtow = maks_bajtow
+        self._lock = threading.Lock()
+        self._rozmiar = None
+        self._zapisy = 0
+        self._powtorzenia = 0
+        self._usuniete = 0
+        os.makedirs(self.katalog, exist_ok=True)
+
+    def _sciezka(self, skrot, mime):
+        if mime not in ROZSZERZENIA_MIGAWEK:
+            raise ValueError(f"Nieobsługiwany typ obrazu: {mime}")
+        rozszerzenie = ROZSZERZENIA_MIGAWEK[mime]
+        return os.path.join(self.katalog, skrot[:2], f"{skrot}.{rozszerzenie}")
+
+    def zapisz(self, dane, mime):
+        """
+        Zapisuje obraz pod skrótem jego treści (bez zapisu, jeśli już jest)
+
+        Args:
+            dane: Bajty obrazu
+            mime: Typ obrazu, np. 'image/jpeg'
+
+        Returns:
+            str: Skrót SHA-256 (hex) - identyfikator i ETag migawki
+        """
+        skrot = hashlib.sha256(dane).hexdigest()
+        sciezka = self._sciezka(skrot, mime)
+        try:
+            wiek = time.time() - os.path.getmtime(sciezka)
+        except OSError:
+            wiek = None
+        if wiek is not None:
+            if wiek > ODSWIEZANIE_DOSTEPU_S:
+                try:
+                    os.utime(sciezka)
+                except OSError:
+                    pass
+            with self._lock:
+                self._powtorzenia += 1
+            return skrot
+
+        katalog = os.path.dirname(sciezka)
+        os.makedirs(katalog, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=katalog, prefix=PREFIKS_TMP)
+        try:
+            with os.fdopen(fd, 'wb') as plik:
+                plik.write(dane)
+            os.replace(tmp, sciezka)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            self._zapisy += 1
+            if self._rozmiar is not None:
+                self._rozmiar += len(dane)
+        if self.rozmiar() > self.maks_bajtow:
+            self.przytnij()
+        return skrot
+
+    def znajdz(self, skrot):
+        """
+        Zwraca plik migawki
+
+        Args:
+            skrot: Skrót SHA-256 (hex)
+
+        Returns:
+            tuple: (ścieżka, typ MIME) lub None, jeśli migawki nie ma
+        """
+        if not SKROT_RE.match(skrot or ''):
+            return None
+        for rozszerzenie, mime in TYPY_ROZSZERZEN.items():
+            sciezka = os.path.join(self.katalog, skrot[:2], f"{skrot}.{rozszerzenie}")
+            if os.path.isfile(sciezka):
+                return sciezka, mime
+        return None
+
+    def rozmiar(self):
+        """Zwraca (szacowany) łączny rozmiar migawek w bajtach."""
+        if self._rozmiar is None:
+            rozmiar = sum(r for _, r, _ in self._skanuj())
+            with self._lock:
+                self._rozmiar = rozmiar
+        return self._rozmiar
+
+    def przytnij(self):
+        """
+        Usuwa najdawniej zapisane migawki aż rozmiar spadnie poniżej
+        POZIOM_PO_PRZYCIECIU budżetu
+
+        Returns:
+            int: Liczba usuniętych migawek
+        """
+        pliki = sorted(self._skanuj(), key=lambda p: p[2])
+        laczny_rozmiar = sum(r for _, r, _ in pliki)
+        cel = int(self.maks_bajtow * POZIOM_PO_PRZYCIECIU)
+        usuniete = 0
+        if laczny_rozmiar > self.maks_bajtow:
+            for sciezka, rozmiar, _ in pliki:
+                if laczny_rozmiar <= cel:
+                    break
+                try:
+                    os.remove(sciezka)
+                except OSError:
+                    continue
+                laczny_rozmiar -= rozmiar
+                usuniete += 1
+        with self._lock:
+            self._rozmiar = laczny_rozmiar
+            self._usuniete += usuniete
+        return usuniete
+
+    def statystyki(self):
+        """
+        Returns:
+            dict: zapisy, powtórzenia (ta sama mapa ponownie), usunięte, rozmiar i budżet
+        """
+        rozmiar = self.rozmiar()
+        with self._lock:
+            return {
+                'zapisy': self._zapisy,
+                'powtorzenia': self._powtorzenia,
+                'usuniete': self._usuniete,
+                'rozmiar_bajtow': rozmiar,
+                'budzet_bajtow': self.maks_bajtow,
+            }
+
+    def _skanuj(self):
+        """Lista (ścieżka, rozmiar, czas_modyfikacji) migawek; porzucone pliki tymczasowe są usuwane."""
+        pliki = []
+        teraz = time.time()
+        for katalog, _, nazwy in os.walk(self.katalog):
+            for nazwa in nazwy:
+                sciezka = os.path.join(katalog, nazwa)
+                try:
+                    st = os.stat(sciezka)
+                except OSError:
+                    continue
+                if nazwa.startswith(PREFIKS_TMP):
+                    if teraz - st.st_mtime > 3600:
+                        try:
+                            os.remove(sciezka)
+                        except OSError:
+                            pass
+                    continue
+                pliki.append((sciezka, st.st_size, st.st_mtime))
+        return pliki
+
+
+_domyslny_magazyn = None
+_domyslny_magazyn_lock = threading.Lock()
+
+
+def pobierz_magazyn_migawek():
+    """
+    Zwraca współdzielony magazyn migawek skonfigurowany zmiennymi:
+        ROOF_MAP_SNAPSHOT_DIR - katalog migawek
+        ROOF_MAP_SNAPSHOT_MAX_MB - budżet w MB (0 wyłącza - obraz wraca w JSON jako base64)
+
+    Returns:
+        MagazynMigawek lub None jeśli wyłączony
+    """
+    global _domyslny_magazyn
+    if _domyslny_magazyn is not None:
+        return _domyslny_magazyn or None
+    with _domyslny_magazyn_lock:
+        if _domyslny_magazyn is None:
+            try:
+                budzet_mb = float(os.environ.get('ROOF_MAP_SNAPSHOT_MAX_MB', DOMYSLNY_BUDZET_MB))
+                if budzet_mb <= 0:
+                    _domyslny_magazyn = False
+                else:
+                    _domyslny_magazyn = MagazynMigawek(
+                        os.environ.get('ROOF_MAP_SNAPSHOT_DIR', DOMYSLNY_KATALOG_MIGAWEK),
+                        maks_bajtow=int(budzet_mb * 1024 * 1024)
+                    )
+            except (OSError, ValueError) as e:
+                print(f"Migawki map wyłączone: {e}")
+                _domyslny_magazyn = False
+    return _domyslny_magazyn or None
+
+
+def ustaw_magazyn_migawek(magazyn):
+    """Podmienia współdzielony magazyn migawek (None go wyłącza)."""
+    global _domyslny_magazyn
+    with _domyslny_magazyn_lock:
+        _domyslny_magazyn = magazyn if magazyn is not None else False
@@ -0,0 +1,443 @@
+"""
+Moduł cache kafelków WMTS w jednym pliku SQLite w układzie MBTiles
+Zamiast milionów małych plików - jedna baza (tabele metadata i tiles), którą można
+skopiować między serwerami razem z wypełnionymi wcześniej obszarami
+"""
+
+import argparse
+import atexit
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from utils.tile_cache import (
+    DOMYSLNY_BUDZET_MB,
+    POZIOM_PO_PRZYCIECIU,
+    ROZSZERZENIA,
+    ZAPISY_DO_PRZELICZENIA,
+    KluczKafelka,
+    _bezpieczna_nazwa,
+)
+
+
+DOMYSLNA_SCIEZKA_MBTILES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'kafelki.mbtiles'
+)
+# Zapisy trafiają do bazy paczkami: po tylu kafelkach albo po tylu sekundach
+DOMYSLNY_ROZMIAR_PACZKI = 64
+OPOZNIENIE_ZAPISU_S = 0.5
+
+
+class MBTilesCacheKafelkow:
+    """
+    Cache kafelków w bazie SQLite (MBTiles) z budżetem rozmiaru i usuwaniem LRU/LFU.
+
+    Tabela tiles ma unikalny indeks (zoom_level, tile_column, tile_row) wymagany
+    przez MBTiles; wiersze liczone są jak w WMTS (od góry), co opisuje wpis
+    scheme=xyz w metadata. Plik przechowuje jedną warstwę - klucze innej warstwy
+    lub formatu są pomijane.
+
+    Baza działa w trybie WAL: odczyty idą własnymi połączeniami wątków i nie
+    czekają na zapisy. Zapisy zbierane są w pamięci i wstawiane jedną transakcją
+    (paczkami po rozmiar_paczki lub po OPOZNIENIE_ZAPISU_S) - czekające kafelki
+    są widoczne w tym procesie od razu, w innych procesach po zapisie paczki.
+    """
+
+    def __init__(self, sciezka, maks_bajtow=DOMYSLNY_BUDZET_MB * 1024 * 1024, polityka='lru',
+                 rozmiar_paczki=DOMYSLNY_ROZMIAR_PACZKI):
+        """
+        Args:
+            sciezka: Ścieżka pliku .mbtiles
+            maks_bajtow: Budżet rozmiaru kafelków w bajtach
+            polityka: 'lru' (najdawniej używane) lub 'lfu' (najrzadziej używane)
+            rozmiar_paczki: Po ilu kafelkach zapisy są wstawiane do bazy
+        """
+        if polityka not in ('lru', 'lfu'):
+            raise ValueError(f"Nieznana polityka usuwania: {polityka}")
+        self.sciezka = sciezka
+        self.maks_bajtow = maks_bajtow
+        self.polityka = polityka
+        self.rozmiar_paczki = max(1, int(rozmiar_paczki))
+        os.makedirs(os.path.dirname(os.path.abspath(sciezka)), exist_ok=True)
+        self._lokalne = threading.local()
+        self._lock = threading.Lock()
+        # Jedno połączenie do zapisu - transakcje paczek i przycinanie po kolei
+        self._lock_zapisu = threading.Lock()
+        self._polaczenie_zapisu = self._otworz(utworz=True)
+        self._warstwa = None
+        self._oczekujace = {}
+        self._dostepy = {}
+        self._timer = None
+        self._rozmiar = None
+        self._zapisy_od_przeliczenia = 0
+        self._trafienia = 0
+        self._chybienia = 0
+        self._zapisy = 0
+        self._paczki = 0
+        self._usuniete = 0
+        self._pominiete = 0
+        atexit.register(self.oproznij)
+
+    def _otworz(self, utworz=False):
+        polaczenie = sqlite3.connect(self.sciezka, timeout=30, check_same_thread=False)
+        if utworz:
+            # auto_vacuum działa tylko ustawione przed utworzeniem tabel
+            polaczenie.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        polaczenie.execute('PRAGMA journal_mode=WAL')
+        polaczenie.execute('PRAGMA synchronous=NORMAL')
+        if utworz:
+            polaczenie.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)')
+            polaczenie.execute('CREATE UNIQUE INDEX IF NOT EXISTS name ON metadata (name)')
+            polaczenie.execute(
+                'CREATE TABLE IF NOT EXISTS tiles ('
+                ' zoom_level INTEGER NOT NULL,'
+                ' tile_column INTEGER NOT NULL,'
+                ' tile_row INTEGER NOT NULL,'
+                ' tile_data BLOB NOT NULL,'
+                ' rozmiar INTEGER NOT NULL,'
+                ' dostep REAL NOT NULL,'
+                ' uzycia INTEGER NOT NULL DEFAULT 0)'
+            )
+            polaczenie.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)'
+            )
+            polaczenie.commit()
+        return polaczenie
+
+    def _polaczenie(self):
+        polaczenie = getattr(self._lokalne, 'polaczenie', None)
+        if polaczenie is None:
+            polaczenie = self._otworz()
+            self._lokalne.polaczenie = polaczenie
+        return polaczenie
+
+    def _wspolrzedne(self, klucz, zapis=False):
+        """
+        Zwraca (zoom, kolumna, wiersz) lub None, jeśli klucz należy do innej warstwy.
+        Pierwszy zapis do pustej bazy ustala jej warstwę w metadata.
+        """
+        warstwa = (str(klucz.warstwa), str(klucz.tms), str(klucz.format))
+        if self._warstwa is None:
+            self._warstwa = self._wczytaj_warstwe(warstwa if zapis else None)
+            if self._warstwa is None:
+                return None
+        if warstwa != self._warstwa:
+            with self._lock:
+                self._pominiete += 1
+            return None
+        return int(klucz.zoom), int(klucz.kolumna), int(klucz.wiersz)
+
+    def _wczytaj_warstwe(self, nowa=None):
+        with self._lock_zapisu:
+            polaczenie = self._polaczenie_zapisu
+            metadane = dict(polaczenie.execute('SELECT name, value FROM metadata').fetchall())
+            if 'warstwa' in metadane:
+                return metadane['warstwa'], metadane.get('tms', ''), metadane.get('mime', '')
+            if nowa is None:
+                return None
+            warstwa, tms, mime = nowa
+            with polaczenie:
+                polaczenie.executemany('INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)', [
+                    ('name', f"{warstwa} ({tms})"),
+                    ('format', ROZSZERZENIA.get(mime, mime.split('/')[-1])),
+                    ('type', 'baselayer'),
+                    ('version', '1.3'),
+                    ('scheme', 'xyz'),
+                    ('description', 'Kafelki WMTS Geoportalu (wiersze od góry, siatka TILEMATRIXSET)'),
+                    ('warstwa', warstwa),
+                    ('tms', tms),
+                    ('mime', mime),
+                ])
+            return nowa
+
+    def pobierz(self, klucz):
+        """
+        Odczytuje kafelek z cache
+
+        Args:
+            klucz: KluczKafelka
+
+        Returns:
+            bytes lub None jeśli kafelka nie ma w cache
+        """
+        wspolrzedne = self._wspolrzedne(klucz)
+        dane = None
+        if wspolrzedne is not None:
+            with self._lock:
+                dane = self._oczekujace.get(wspolrzedne)
+            if dane is None:
+                try:
+                    wiersz = self._polaczenie().execute(
+                        'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+                        wspolrzedne
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    print(f"Cache kafelków (MBTiles): błąd odczytu: {e}")
+                    wiersz = None
+                dane = bytes(wiersz[0]) if wiersz is not None else None
+
+        with self._lock:
+            if dane is None:
+                self._chybienia += 1
+                return None
+            self._trafienia += 1
+            # Czas dostępu i licznik użyć zapisywane razem z najbliższą paczką
+            self._dostepy[wspolrzedne] = self._dostepy.get(wspolrzedne, 0) + 1
+            self._zaplanuj_zapis()
+        return dane
+
+    def zawiera(self, klucz):
+        """Sprawdza czy kafelek jest w cache (bez liczenia trafienia)."""
+        wspolrzedne = self._wspolrzedne(klucz)
+        if wspolrzedne is None:
+            return False
+        with self._lock:
+            if wspolrzedne in self._oczekujace:
+                return True
+        try:
+            return self._polaczenie().execute(
+                'SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?', wspolrzedne
+            ).fetchone() is not None
+        except sqlite3.Error:
+            return False
+
+    def zapisz(self, klucz, dane):
+        """
+        Dodaje kafelek do paczki zapisu (wstawianej po rozmiar_paczki kafelkach)
+
+        Args:
+            klucz: KluczKafelka
+            dane: Bajty obrazu kafelka
+        """
+        if not dane or len(dane) > self.maks_bajtow:
+            return
+        wspolrzedne = self._wspolrzedne(klucz, zapis=True)
+        if wspolrzedne is None:
+            return
+        with self._lock:
+            self._oczekujace[wspolrzedne] = bytes(dane)
+            pelna = len(self._oczekujace) >= self.rozmiar_paczki
+            if not pelna:
+                self._zaplanuj_zapis()
+        if pelna:
+            self.oproznij()
+
+    def _zaplanuj_zapis(self):
+        """Uruchamia zapis paczki po OPOZNIENIE_ZAPISU_S (wywoływane pod self._lock)."""
+        if self._timer is None:
+            self._timer = threading.Timer(OPOZNIENIE_ZAPISU_S, self.oproznij)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def oproznij(self):
+        """
+        Zapisuje czekające kafelki i czasy dostępu jedną transakcją
+
+        Returns:
+            int: Liczba zapisanych kafelków
+        """
+        with self._lock_zapisu:
+            with self._lock:
+                paczka, self._oczekujace = self._oczekujace, {}
+                dostepy, self._dostepy = self._dostepy, {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not paczka and not dostepy:
+                return 0
+            teraz = time.time()
+            polaczenie = self._polaczenie_zapisu
+            try:
+                with polaczenie:
+                    polaczenie.executemany(
+                        'INSERT OR REPLACE INTO tiles'
+                        ' (zoom_level, tile_column, tile_row, tile_data, rozmiar, dostep, uzycia)'
+                        ' VALUES (?, ?, ?, ?, ?, ?, 0)',
+                        [(z, c, r, sqlite3.Binary(d), len(d), teraz) for (z, c, r), d in paczka.items()]
+                    )
+                    polaczenie.executemany(
+                        'UPDATE tiles SET dostep = ?, uzycia = uzycia + ?'
+                        ' WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+                        [(teraz, n, z, c, r) for (z, c, r), n in dostepy.items()]
+                    )
+            except sqlite3.Error as e:
+                print(f"Cache kafelków (MBTiles): błąd zapisu paczki {len(paczka)} kafelków: {e}")
+                return 0
+
+        with self._lock:
+            self._zapisy += len(paczka)
+            self._paczki += 1 if paczka else 0
+            self._zapisy_od_przeliczenia += len(paczka)
+            if self._rozmiar is not None:
+                self._rozmiar += sum(len(d) for d in paczka.values())
+            przelicz = self._zapisy_od_przeliczenia >= ZAPISY_DO_PRZELICZENIA
+        if przelicz:
+            self._przelicz_rozmiar()
+        if paczka and self.rozmiar() > self.maks_bajtow:
+            self.przytnij()
+        return len(paczka)
+
+    def rozmiar(self):
+        """Zwraca (szacowany) łączny rozmiar kafelków w bajtach."""
+        if self._rozmiar is None:
+            self._przelicz_rozmiar()
+        return self._rozmiar
+
+    def _przelicz_rozmiar(self):
+        try:
+            rozmiar = self._polaczenie().execute('SELECT COALESCE(SUM(rozmiar), 0) FROM tiles').fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Cache kafelków (MBTiles): błąd odczytu rozmiaru: {e}")
+            return
+        with self._lock:
+            self._rozmiar = rozmiar
+            self._zapisy_od_przeliczenia = 0
+
+    def przytnij(self):
+        """
+        Usuwa kafelki zgodnie z polityką aż rozmiar spadnie poniżej
+        POZIOM_PO_PRZYCIECIU budżetu; zwolnione strony oddawane są systemowi.
+
+        Returns:
+            int: Liczba usuniętych kafelków
+        """
+        porzadek = 'uzycia, dostep' if self.polityka == 'lfu' else 'dostep'
+        usuniete = 0
+        with self._lock_zapisu:
+            polaczenie = self._polaczenie_zapisu
+            try:
+                laczny_rozmiar = polaczenie.execute('SELECT COALESCE(SUM(rozmiar), 0) FROM tiles').fetchone()[0]
+                if laczny_rozmiar > self.maks_bajtow:
+                    cel = int(self.maks_bajtow * POZIOM_PO_PRZYCIECIU)
+                    do_usuniecia = []
+                    kursor = polaczenie.execute(f'SELECT rowid, rozmiar FROM tiles ORDER BY {porzadek}')
+                    for rowid, rozmiar in kursor:
+                        if laczny_rozmiar <= cel:
+                            break
+                        do_usuniecia.append((rowid,))
+                        laczny_rozmiar -= rozmiar
+                    kursor.close()
+                    with polaczenie:
+                        polaczenie.executemany('DELETE FROM tiles WHERE rowid = ?', do_usuniecia)
+                    polaczenie.execute('PRAGMA incremental_vacuum')
+                    usuniete = len(do_usuniecia)
+            except sqlite3.Error as e:
+                print(f"Cache kafelków (MBTiles): błąd przycinania: {e}")
+                return 0
+
+        with self._lock:
+            self._rozmiar = laczny_rozmiar
+            self._zapisy_od_przeliczenia = 0
+            self._usuniete += usuniete
+        return usuniete
+
+    def wyczysc(self):
+        """Usuwa wszystkie kafelki z cache (metadane warstwy zostają)."""
+        with self._lock_zapisu:
+            with self._lock:
+                self._oczekujace.clear()
+                self._dostepy.clear()
+            with self._polaczenie_zapisu as polaczenie:
+                polaczenie.execute('DELETE FROM tiles')
+            self._polaczenie_zapisu.execute('PRAGMA incremental_vacuum')
+        with self._lock:
+            self._rozmiar = 0
+
+    def statystyki(self):
+        """
+        Zwraca liczniki cache
+
+        Returns:
+            dict: trafienia, chybienia, zapisy, usunięte, rozmiar i budżet,
+                  a także liczba paczek, kafelków czekających na zapis i pominiętych
+                  (inna warstwa niż zapisana w pliku)
+        """
+        rozmiar = self.rozmiar()
+        with self._lock:
+            zapytania = self._trafienia + self._chybienia
+            return {
+                'trafienia': self._trafienia,
+                'chybienia': self._chybienia,
+                'wspolczynnik_trafien': self._trafienia / zapytania if zapytania else 0.0,
+                'zapisy': self._zapisy,
+                'usuniete': self._usuniete,
+                'rozmiar_bajtow': rozmiar,
+                'budzet_bajtow': self.maks_bajtow,
+                'polityka': self.polityka,
+                'magazyn': 'mbtiles',
+                'paczki': self._paczki,
+                'oczekujace': len(self._oczekujace),
+                'pominiete': self._pominiete,
+            }
+
+
+def importuj_katalog(katalog, cache, nazwy=()):
+    """
+    Przenosi kafelki z cache plikowego (DyskowyCacheKafelkow) do bazy MBTiles
+
+    Args:
+        katalog: Katalog główny cache plikowego (warstwa/tms/zoom/wiersz/kolumna.roz)
+        cache: MBTilesCacheKafelkow
+        nazwy: Oryginalne nazwy warstw i TMS - katalogi mają znaki spoza
+               [A-Za-z0-9_.-] zamienione na "_" (np. EPSG:2180 -> EPSG_2180)
+
+    Returns:
+        int: Liczba zaimportowanych kafelków
+    """
+    mime_dla = {roz: mime for mime, roz in ROZSZERZENIA.items()}
+    oryginalne = {_bezpieczna_nazwa(nazwa): nazwa for nazwa in nazwy}
+    liczba = 0
+    for sciezka_katalogu, _, nazwy in os.walk(katalog):
+        czesci = os.path.relpath(sciezka_katalogu, katalog).split(os.sep)
+        if len(czesci) != 4:
+            continue
+        warstwa, tms, zoom, wiersz = czesci
+        warstwa, tms = oryginalne.get(warstwa, warstwa), oryginalne.get(tms, tms)
+        for nazwa in nazwy:
+            kolumna, _, rozszerzenie = nazwa.partition('.')
+            if nazwa.startswith('.') or not (kolumna.isdigit() and zoom.isdigit() and wiersz.isdigit()):
+                continue
+            with open(os.path.join(sciezka_katalogu, nazwa), 'rb') as plik:
+                dane = plik.read()
+            klucz = KluczKafelka(
+                warstwa, tms, int(zoom), int(wiersz), int(kolumna), mime_dla.get(rozszerzenie, rozszerzenie)
+            )
+            cache.zapisz(klucz, dane)
+            liczba += 1
+    cache.oproznij()
+    return liczba
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cache kafelków WMTS w pliku MBTiles')
+    polecenia = parser.add_subparsers(dest='polecenie', required=True)
+    importuj = polecenia.add_parser('importuj', help='Przenieś kafelki z cache plikowego do pliku MBTiles')
+    importuj.add_argument('katalog', help='Katalog cache plikowego (ROOF_TILE_CACHE_DIR)')
+    importuj.add_argument('mbtiles', help='Docelowy plik .mbtiles')
+    info = polecenia.add_parser('info', help='Metadane i liczba kafelków na poziom')
+    info.add_argument('mbtiles', help='Plik .mbtiles')
+    args = parser.parse_args()
+
+    if args.polecenie == 'importuj':
+        # Budżet bez limitu - import nie powinien usuwać kafelków
+        cache = MBTilesCacheKafelkow(args.mbtiles, maks_bajtow=sys.maxsize, rozmiar_paczki=500)
+        from utils.geoportal import WMTS_LAYER, WMTS_TILE_MATRIX_SET
+        liczba = importuj_katalog(args.katalog, cache, (WMTS_LAYER, WMTS_TILE_MATRIX_SET))
+        print(f"Zaimportowano {liczba} kafelków do {args.mbtiles} "
+              f"({cache.rozmiar() / 1024 / 1024:.1f} MB, pominięte: {cache.statystyki()['pominiete']})")
+        return 0
+
+    polaczenie = sqlite3.connect(args.mbtiles)
+    for nazwa, wartosc in polaczenie.execute('SELECT name, value FROM metadata ORDER BY name'):
+        print(f"{nazwa}: {wartosc}")
+    for zoom, liczba, rozmiar in polaczenie.execute(
+        'SELECT zoom_level, COUNT(*), SUM(rozmiar) FROM tiles GROUP BY zoom_level ORDER BY zoom_level'
+    ):
+        print(f"zoom {zoom}: {liczba} kafelków, {rozmiar / 1024 / 1024:.1f} MB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
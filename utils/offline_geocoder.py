@@ -0,0 +1,619 @@
+"""
+Moduł offline geokodowania na podstawie lokalnego indeksu punktów adresowych
+Indeks budowany jest z eksportu PRG (CSV lub GeoPackage) i zapisywany jako plik .npz
+"""
+
+import argparse
+import csv
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+
+import numpy as np
+
+from utils.crs import epsg2180_do_wgs84_wsadowo
+from utils.geocode_cache import tokeny_adresu, usun_diakrytyki
+from utils.geocode_scoring import wybierz_najlepszego
+
+
+WERSJA_INDEKSU = 1
+# Maksymalna liczba kandydatów przekazywanych do punktacji
+MAKS_KANDYDATOW = 50
+
+# Nazwy kolumn rozpoznawane w plikach źródłowych (porównywane bez wielkości liter i znaków)
+KOLUMNY_MIEJSCOWOSC = ('miejscowosc', 'msc', 'nazwa_miejscowosci', 'city', 'locality', 'town')
+KOLUMNY_ULICA = ('ulica', 'nazwa_ulicy', 'ul', 'street', 'road')
+KOLUMNY_NUMER = ('numer_porzadkowy', 'numerporzadkowy', 'numer', 'nr', 'house_number', 'housenumber')
+KOLUMNY_KOD = ('kod_pocztowy', 'kodpocztowy', 'kod', 'postcode', 'postal_code')
+KOLUMNY_LON = ('lon', 'lng', 'dlugosc', 'longitude')
+KOLUMNY_LAT = ('lat', 'szerokosc', 'latitude')
+KOLUMNY_X = ('x', 'x_2180', 'wsp_x')
+KOLUMNY_Y = ('y', 'y_2180', 'wsp_y')
+# Kod pocztowy w zapytaniu - jego cyfry nie są numerem porządkowym
+KOD_POCZTOWY_RE = re.compile(r"(?<!\d)\d{2}-\d{3}(?!\d)")
+
+
+def znajdz_kolumne(naglowki, aliasy):
+    """Zwraca nazwę kolumny pasującą do jednego z aliasów lub None."""
+    znormalizowane = {usun_diakrytyki(n).strip(): n for n in naglowki}
+    for alias in aliasy:
+        if alias in znormalizowane:
+            return znormalizowane[alias]
+    return None
+
+
+def normalizuj_numer(numer):
+    """Sprowadza numer porządkowy do postaci porównawczej ("12 A" -> "12a", "5 / 7" -> "5/7")."""
+    _, numery = tokeny_adresu(numer)
+    slowa = [t for t in usun_diakrytyki(numer).replace('/', ' / ').split() if t.isalpha()]
+    if not numery:
+        return ''
+    # Litera po numerze zapisana ze spacją ("12 A") należy do numeru
+    if len(numery) == 1 and len(slowa) == 1 and len(slowa[0]) == 1:
+        return numery[0] + slowa[0]
+    return '/'.join(numery)
+
+
+def _warianty_numeru(numery, litery=()):
+    """Możliwe numery porządkowe z tokenów zapytania ("10", "2" -> "10", "2", "10/2")."""
+    warianty = set(numery)
+    for a, b in zip(numery, numery[1:]):
+        warianty.add(f"{a}/{b}")
+    for numer in numery:
+        warianty.update(numer + litera for litera in litery)
+    return warianty
+
+
+def _wiersze_csv(sciezka, kolejnosc_osi):
+    """Czyta punkty adresowe z pliku CSV (separator wykrywany automatycznie)."""
+    with open(sciezka, newline='', encoding='utf-8-sig') as plik:
+        probka = plik.read(65536)
+        plik.seek(0)
+        try:
+            dialekt = csv.Sniffer().sniff(probka, delimiters=';,\t|')
+        except csv.Error:
+            dialekt = csv.excel
+        czytnik = csv.DictReader(plik, dialect=dialekt)
+        naglowki = czytnik.fieldnames or []
+        kol_msc = znajdz_kolumne(naglowki, KOLUMNY_MIEJSCOWOSC)
+        kol_ul = znajdz_kolumne(naglowki, KOLUMNY_ULICA)
+        kol_nr = znajdz_kolumne(naglowki, KOLUMNY_NUMER)
+        kol_kod = znajdz_kolumne(naglowki, KOLUMNY_KOD)
+        kol_lon = znajdz_kolumne(naglowki, KOLUMNY_LON)
+        kol_lat = znajdz_kolumne(naglowki, KOLUMNY_LAT)
+        kol_x = znajdz_kolumne(naglowki, KOLUMNY_X)
+        kol_y = znajdz_kolumne(naglowki, KOLUMNY_Y)
+        if not kol_msc or not kol_nr:
+            raise ValueError(f"Brak kolumn miejscowości lub numeru w {sciezka}: {naglowki}")
+        wgs84 = bool(kol_lon and kol_lat)
+        if not wgs84 and not (kol_x and kol_y):
+            raise ValueError(f"Brak kolumn współrzędnych w {sciezka}: {naglowki}")
+
+        for wiersz in czytnik:
+            try:
+                if wgs84:
+                    a, b = float(wiersz[kol_lon]), float(wiersz[kol_lat])
+                else:
+                    a = float(wiersz[kol_x].replace(',', '.'))
+                    b = float(wiersz[kol_y].replace(',', '.'))
+                    if kolejnosc_osi == 'yx':
+                        a, b = b, a
+            except (TypeError, ValueError):
+                continue
+            yield (
+                (wiersz.get(kol_msc) or '').strip(),
+                (wiersz.get(kol_ul) or '').strip() if kol_ul else '',
+                (wiersz.get(kol_nr) or '').strip(),
+                (wiersz.get(kol_kod) or '').strip() if kol_kod else '',
+                a,
+                b,
+                wgs84
+            )
+
+
+def _punkt_z_gpkg(blob):
+    """
+    Odczytuje punkt (x, y) z geometrii GeoPackage (nagłówek GP + WKB)
+
+    Returns:
+        tuple lub None jeśli geometria nie jest punktem
+    """
+    if not blob or blob[:2] != b'GP':
+        return None
+    flagi = blob[3]
+    rozmiary_obwiedni = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+    obwiednia = rozmiary_obwiedni.get((flagi >> 1) & 0x07, 0)
+    wkb = blob[8 + obwiednia:]
+    if len(wkb) < 21:
+        return None
+    kolejnosc = '<' if wkb[0] == 1 else '>'
+    typ = struct.unpack(kolejnosc + 'I', wkb[1:5])[0]
+    if typ % 1000 != 1:
+        return None
+    return struct.unpack(kolejnosc + 'dd', wkb[5:21])
+
+
+def _wiersze_gpkg(sciezka, tabela=None):
+    """Czyta punkty adresowe z warstwy punktowej GeoPackage."""
+    polaczenie = sqlite3.connect(sciezka)
+    try:
+        if tabela is None:
+            wiersz = polaczenie.execute(
+                "SELECT table_name FROM gpkg_contents WHERE data_type = 'features' LIMIT 1"
+            ).fetchone()
+            if wiersz is None:
+                raise ValueError(f"Brak warstwy wektorowej w {sciezka}")
+            tabela = wiersz[0]
+        kolumna_geom, srs_id = polaczenie.execute(
+            'SELECT column_name, srs_id FROM gpkg_geometry_columns WHERE table_name = ?', (tabela,)
+        ).fetchone()
+        uklad = polaczenie.execute(
+            'SELECT organization_coordsys_id FROM gpkg_spatial_ref_sys WHERE srs_id = ?', (srs_id,)
+        ).fetchone()
+        if uklad is not None and uklad[0] not in (2180, 4326):
+            raise ValueError(f"Nieobsługiwany układ warstwy {tabela}: EPSG:{uklad[0]}")
+        wgs84 = uklad is not None and uklad[0] == 4326
+
+        kursor = polaczenie.execute(f'SELECT * FROM "{tabela}"')
+        naglowki = [opis[0] for opis in kursor.description]
+        indeksy = {n: i for i, n in enumerate(naglowki)}
+        kol_msc = znajdz_kolumne(naglowki, KOLUMNY_MIEJSCOWOSC)
+        kol_ul = znajdz_kolumne(naglowki, KOLUMNY_ULICA)
+        kol_nr = znajdz_kolumne(naglowki, KOLUMNY_NUMER)
+        kol_kod = znajdz_kolumne(naglowki, KOLUMNY_KOD)
+        if not kol_msc or not kol_nr:
+            raise ValueError(f"Brak kolumn miejscowości lub numeru w {tabela}: {naglowki}")
+
+        for wiersz in kursor:
+            punkt = _punkt_z_gpkg(wiersz[indeksy[kolumna_geom]])
+            if punkt is None:
+                continue
+            yield (
+                str(wiersz[indeksy[kol_msc]] or '').strip(),
+                str(wiersz[indeksy[kol_ul]] or '').strip() if kol_ul else '',
+                str(wiersz[indeksy[kol_nr]] or '').strip(),
+                str(wiersz[indeksy[kol_kod]] or '').strip() if kol_kod else '',
+                punkt[0],
+                punkt[1],
+                wgs84
+            )
+    finally:
+        polaczenie.close()
+
+
+def zakoduj_napisy(napisy):
+    """
+    Koduje listę napisów jako tablicę bajtów do zapisu w pliku .npz
+    (bez tablic obiektów, które wymagałyby allow_pickle przy wczytywaniu)
+
+    Args:
+        napisy: Lista napisów bez znaków nowej linii
+
+    Returns:
+        np.ndarray: Bajty UTF-8 napisów rozdzielonych znakiem nowej linii
+    """
+    return np.frombuffer('\n'.join(napisy).encode('utf-8'), dtype=np.uint8)
+
+
+def odkoduj_napisy(tablica):
+    """Odwrotność zakoduj_napisy - lista napisów z tablicy bajtów."""
+    return bytes(tablica).decode('utf-8').split('\n')
+
+
+def zbuduj_indeks_adresow(sciezka_zrodla, sciezka_indeksu, kolejnosc_osi='xy', tabela=None):
+    """
+    Buduje indeks adresowy z pliku punktów adresowych i zapisuje go na dysku
+
+    Args:
+        sciezka_zrodla: Plik CSV lub GeoPackage (.gpkg) z punktami adresowymi
+        sciezka_indeksu: Plik wynikowy (.npz)
+        kolejnosc_osi: Dla współrzędnych EPSG:2180 w CSV - 'xy' (X na wschód)
+                       lub 'yx' (geodezyjne X na północ, jak w eksportach PRG)
+        tabela: Nazwa warstwy w GeoPackage (domyślnie pierwsza warstwa wektorowa)
+
+    Returns:
+        int: Liczba zaindeksowanych punktów adresowych
+    """
+    if sciezka_zrodla.lower().endswith('.gpkg'):
+        wiersze = _wiersze_gpkg(sciezka_zrodla, tabela)
+    else:
+        wiersze = _wiersze_csv(sciezka_zrodla, kolejnosc_osi)
+
+    slowniki = {'msc': {}, 'ul': {}, 'nr': {}, 'kod': {}}
+
+    def indeks_napisu(rodzaj, napis):
+        slownik = slowniki[rodzaj]
+        indeks = slownik.get(napis)
+        if indeks is None:
+            indeks = len(slownik)
+            slownik[napis] = indeks
+        return indeks
+
+    msc_idx, ul_idx, nr_idx, kod_idx, wsp_a, wsp_b, czy_wgs84 = [], [], [], [], [], [], []
+    for msc, ulica, numer, kod, a, b, wgs84 in wiersze:
+        if not msc or not numer:
+            continue
+        msc_idx.append(indeks_napisu('msc', msc))
+        ul_idx.append(indeks_napisu('ul', ulica))
+        nr_idx.append(indeks_napisu('nr', numer))
+        kod_idx.append(indeks_napisu('kod', kod))
+        wsp_a.append(a)
+        wsp_b.append(b)
+        czy_wgs84.append(wgs84)
+
+    msc_idx = np.asarray(msc_idx, dtype=np.int32)
+    ul_idx = np.asarray(ul_idx, dtype=np.int32)
+    lon = np.asarray(wsp_a, dtype=np.float64)
+    lat = np.asarray(wsp_b, dtype=np.float64)
+    czy_wgs84 = np.asarray(czy_wgs84, dtype=bool)
+    if len(lon) and not czy_wgs84.all():
+        lon[~czy_wgs84], lat[~czy_wgs84] = epsg2180_do_wgs84_wsadowo(lon[~czy_wgs84], lat[~czy_wgs84])
+
+    # Sortowanie po kluczu (miejscowość, ulica) - punkty jednej ulicy leżą obok siebie
+    porzadek = np.lexsort((ul_idx, msc_idx))
+    msc_idx, ul_idx = msc_idx[porzadek], ul_idx[porzadek]
+    nr_idx = np.asarray(nr_idx, dtype=np.int32)[porzadek]
+    kod_idx = np.asarray(kod_idx, dtype=np.int32)[porzadek]
+    lon, lat = lon[porzadek], lat[porzadek]
+
+    zmiana = np.ones(len(msc_idx), dtype=bool)
+    zmiana[1:] = (msc_idx[1:] != msc_idx[:-1]) | (ul_idx[1:] != ul_idx[:-1])
+    klucze_start = np.append(np.flatnonzero(zmiana), len(msc_idx)).astype(np.int64)
+    klucze_msc = msc_idx[klucze_start[:-1]]
+    klucze_ul = ul_idx[klucze_start[:-1]]
+
+    miejscowosci = list(slowniki['msc'])
+    ulice = list(slowniki['ul'])
+
+    # Indeks odwrócony: słowo nazwy miejscowości lub ulicy -> klucze (miejscowość, ulica)
+    listy = {}
+    for klucz, (m, u) in enumerate(zip(klucze_msc.tolist(), klucze_ul.tolist())):
+        slowa = set(tokeny_adresu(miejscowosci[m])[0]) | set(tokeny_adresu(ulice[u])[0])
+        for slowo in slowa:
+            listy.setdefault(slowo, []).append(klucz)
+    tokeny = sorted(listy)
+    dlugosci = [len(listy[t]) for t in tokeny]
+    listy_start = np.zeros(len(tokeny) + 1, dtype=np.int64)
+    listy_start[1:] = np.cumsum(dlugosci)
+    listy_kluczy = np.fromiter(
+        (k for t in tokeny for k in listy[t]), dtype=np.int32, count=int(listy_start[-1])
+    )
+
+    katalog = os.path.dirname(os.path.abspath(sciezka_indeksu))
+    os.makedirs(katalog, exist_ok=True)
+    tmp = sciezka_indeksu + '.tmp.npz'
+    np.savez_compressed(
+        tmp,
+        wersja=np.array([WERSJA_INDEKSU]),
+        miejscowosci=zakoduj_napisy(miejscowosci),
+        ulice=zakoduj_napisy(ulice),
+        numery=zakoduj_napisy(list(slowniki['nr'])),
+        kody=zakoduj_napisy(list(slowniki['kod'])),
+        klucze_msc=klucze_msc,
+        klucze_ul=klucze_ul,
+        klucze_start=klucze_start,
+        nr_idx=nr_idx,
+        kod_idx=kod_idx,
+        lon=lon,
+        lat=lat,
+        tokeny=zakoduj_napisy(tokeny),
+        listy_start=listy_start,
+        listy_kluczy=listy_kluczy,
+    )
+    os.replace(tmp, sciezka_indeksu)
+    return len(lon)
+
+
+class IndeksAdresow:
+    """
+    Indeks punktów adresowych w pamięci procesu.
+
+    Słowa nazw miejscowości i ulic wskazują klucze (miejscowość, ulica),
+    a punkty każdego klucza zajmują ciągły zakres tablic - wyszukiwanie to
+    przecięcie kilku krótkich list i filtr numeru w jednym zakresie.
+    """
+
+    def __init__(self, dane):
+        """
+        Args:
+            dane: Słownik tablic zapisanych przez zbuduj_indeks_adresow
+        """
+        if int(dane['wersja'][0]) != WERSJA_INDEKSU:
+            raise ValueError(f"Nieobsługiwana wersja indeksu: {int(dane['wersja'][0])}")
+        self.miejscowosci = odkoduj_napisy(dane['miejscowosci'])
+        self.ulice = odkoduj_napisy(dane['ulice'])
+        self.numery = odkoduj_napisy(dane['numery'])
+        self.kody = odkoduj_napisy(dane['kody'])
+        self.klucze_msc = dane['klucze_msc']
+        self.klucze_ul = dane['klucze_ul']
+        self.klucze_start = dane['klucze_start']
+        self.nr_idx = dane['nr_idx']
+        self.kod_idx = dane['kod_idx']
+        self.lon = dane['lon']
+        self.lat = dane['lat']
+        tokeny = odkoduj_napisy(dane['tokeny']) if len(dane['tokeny']) else []
+        self._tokeny = {t: i for i, t in enumerate(tokeny)}
+        self._listy_start = dane['listy_start']
+        self._listy_kluczy = dane['listy_kluczy']
+        # Znormalizowany numer -> indeksy w tablicy numerów
+        self.numery_norm = [normalizuj_numer(numer) for numer in self.numery]
+        self._numery_norm = {}
+        for i, numer in enumerate(self.numery_norm):
+            self._numery_norm.setdefault(numer, []).append(i)
+        # Listy odwrócone numerów: indeks numeru -> posortowane indeksy punktów
+        self._punkty_numerow = np.argsort(self.nr_idx, kind='stable').astype(np.int32)
+        self._numery_start = np.zeros(len(self.numery) + 1, dtype=np.int64)
+        self._numery_start[1:] = np.cumsum(np.bincount(self.nr_idx, minlength=len(self.numery)))
+        # Indeks ulicy -> słowa jej nazwy (uzupełniane przy wyszukiwaniu)
+        self._slowa_ulic = {}
+
+    @classmethod
+    def wczytaj(cls, sciezka):
+        """
+        Wczytuje indeks zapisany przez zbuduj_indeks_adresow
+
+        Args:
+            sciezka: Plik indeksu (.npz)
+
+        Returns:
+            IndeksAdresow
+        """
+        with np.load(sciezka) as dane:
+            return cls({nazwa: dane[nazwa] for nazwa in dane.files})
+
+    def __len__(self):
+        return len(self.lon)
+
+    @property
+    def liczba_ulic(self):
+        """Liczba kluczy (miejscowość, ulica)."""
+        return len(self.klucze_msc)
+
+    def ulice_z_miejscowosciami(self):
+        """
+        Returns:
+            list: Krotki (ulica, miejscowość) dla kolejnych kluczy (ulica pusta dla
+                  miejscowości bez ulic)
+        """
+        return [
+            (self.ulice[u], self.miejscowosci[m])
+            for m, u in zip(self.klucze_msc.tolist(), self.klucze_ul.tolist())
+        ]
+
+    def punkty_ulicy(self, klucz):
+        """
+        Returns:
+            range: Indeksy punktów adresowych klucza (miejscowość, ulica)
+        """
+        return range(int(self.klucze_start[klucz]), int(self.klucze_start[klucz + 1]))
+
+    def numer_punktu(self, rekord):
+        """Znormalizowany numer porządkowy punktu adresowego."""
+        return self.numery_norm[int(self.nr_idx[rekord])]
+
+    def _slowa_ulicy(self, klucz):
+        u = int(self.klucze_ul[klucz])
+        slowa = self._slowa_ulic.get(u)
+        if slowa is None:
+            slowa = frozenset(tokeny_adresu(self.ulice[u])[0])
+            self._slowa_ulic[u] = slowa
+        return slowa
+
+    def _lista(self, slowo):
+        indeks = self._tokeny.get(slowo)
+        if indeks is None:
+            return None
+        return self._listy_kluczy[self._listy_start[indeks]:self._listy_start[indeks + 1]]
+
+    def kandydat(self, klucz, rekord=None):
+        """Buduje kandydata w formacie Nominatim dla punktu (lub środka ulicy, gdy rekord=None)."""
+        miejscowosc = self.miejscowosci[int(self.klucze_msc[klucz])]
+        ulica = self.ulice[int(self.klucze_ul[klucz])]
+        address = {'city': miejscowosc}
+        if ulica:
+            address['road'] = ulica
+        if rekord is None:
+            start, stop = self.klucze_start[klucz], self.klucze_start[klucz + 1]
+            lon = float(self.lon[start:stop].mean())
+            lat = float(self.lat[start:stop].mean())
+            display_name = f"{ulica}, {miejscowosc}" if ulica else miejscowosc
+            klasa, typ = ('highway', 'residential') if ulica else ('place', 'village')
+        else:
+            numer = self.numery[int(self.nr_idx[rekord])]
+            kod = self.kody[int(self.kod_idx[rekord])]
+            lon = float(self.lon[rekord])
+            lat = float(self.lat[rekord])
+            address['house_number'] = numer
+            if kod:
+                address['postcode'] = kod
+            ulica_z_numerem = f"{ulica} {numer}" if ulica else f"{miejscowosc} {numer}"
+            display_name = f"{ulica_z_numerem}, {kod} {miejscowosc}".replace(',  ', ', ')
+            klasa, typ = 'place', 'house'
+        return {
+            'lat': str(lat),
+            'lon': str(lon),
+            'display_name': display_name,
+            'address': address,
+            'class': klasa,
+            'type': typ,
+            'zrodlo': 'offline',
+        }
+
+    def szukaj(self, adres, limit=MAKS_KANDYDATOW):
+        """
+        Wyszukuje kandydatów dla adresu
+
+        Wszystkie słowa zapytania muszą występować w nazwie miejscowości lub
+        ulicy - nieznane słowo oznacza brak wyniku (lepiej zapytać Nominatim niż
+        zgadywać). Jeśli zapytanie zawiera numer, zwracane są tylko punkty
+        z tym numerem; bez numeru - środki ulic, których nazwa pasuje do
+        zapytania (sama miejscowość nie daje wyniku). Kod pocztowy nie jest
+        traktowany jako numer - zawęża punkty do tych z tym kodem, jeśli są.
+
+        Args:
+            adres: Adres wpisany przez użytkownika
+            limit: Maksymalna liczba kandydatów
+
+        Returns:
+            list: Kandydaci w formacie Nominatim
+        """
+        kody = set(KOD_POCZTOWY_RE.findall(adres))
+        slowa, numery = tokeny_adresu(KOD_POCZTOWY_RE.sub(' ', adres))
+        # Pojedyncza litera to zwykle część numeru zapisana osobno ("12 a")
+        litery = [s for s in slowa if len(s) == 1]
+        slowa = [s for s in slowa if len(s) > 1]
+        if not slowa:
+            return []
+        listy = []
+        for slowo in set(slowa):
+            lista = self._lista(slowo)
+            if lista is None:
+                return []
+            listy.append(lista)
+        listy.sort(key=len)
+        klucze = listy[0]
+        for lista in listy[1:]:
+            klucze = np.intersect1d(klucze, lista, assume_unique=True)
+            if not len(klucze):
+                return []
+
+        if not numery:
+            slowa = set(slowa)
+            kandydaci = []
+            for klucz in klucze:
+                if slowa & self._slowa_ulicy(int(klucz)):
+                    kandydaci.append(self.kandydat(int(klucz)))
+                    if len(kandydaci) >= limit:
+                        break
+            return kandydaci
+
+        dozwolone = []
+        for wariant in _warianty_numeru(numery, litery):
+            dozwolone.extend(self._numery_norm.get(wariant, ()))
+        if not dozwolone:
+            return []
+        rekordy = list(zip(*(r.tolist() for r in self._punkty_z_numerem(klucze, dozwolone))))
+        if kody:
+            z_kodem = [(k, r) for k, r in rekordy if self.kody[int(self.kod_idx[r])] in kody]
+            rekordy = z_kodem or rekordy
+        return [self.kandydat(klucz, rekord) for klucz, rekord in rekordy[:limit]]
+
+    def _punkty_z_numerem(self, klucze, dozwolone):
+        """
+        Punkty kluczy (miejscowość, ulica) z jednym z dozwolonych numerów
+
+        Przecięcie liczone jest jednym przebiegiem od krótszej strony: przez
+        listy odwrócone numerów (punkty sprawdzane pod kątem klucza) albo przez
+        zakresy punktów kluczy (sprawdzane pod kątem numeru).
+
+        Args:
+            klucze: Posortowana tablica kluczy
+            dozwolone: Indeksy numerów w tablicy numerów
+
+        Returns:
+            tuple: (klucze, rekordy) - tablice posortowane po rekordzie
+        """
+        dozwolone = np.unique(np.asarray(dozwolone, dtype=np.int64))
+        starty = self.klucze_start[klucze]
+        dlugosci = self.klucze_start[klucze + 1] - starty
+        z_numerem = self._numery_start[dozwolone + 1] - self._numery_start[dozwolone]
+        if z_numerem.sum() <= dlugosci.sum():
+            rekordy = np.sort(np.concatenate([
+                self._punkty_numerow[self._numery_start[n]:self._numery_start[n + 1]] for n in dozwolone
+            ]))
+            klucze_rekordow = np.searchsorted(self.klucze_start, rekordy, side='right') - 1
+            pozycje = np.minimum(np.searchsorted(klucze, klucze_rekordow), len(klucze) - 1)
+            trafione = klucze[pozycje] == klucze_rekordow
+        else:
+            klucze_rekordow = np.repeat(klucze, dlugosci)
+            # Kolejne indeksy punktów w zakresach [start, start + długość) wszystkich kluczy
+            rekordy = np.arange(int(dlugosci.sum())) + np.repeat(starty - (np.cumsum(dlugosci) - dlugosci), dlugosci)
+            trafione = np.isin(self.nr_idx[rekordy], dozwolone)
+        return klucze_rekordow[trafione], rekordy[trafione]
+
+    def geokoduj(self, adres):
+        """
+        Zwraca współrzędne najlepiej pasującego punktu adresowego
+
+        Args:
+            adres: Adres wpisany przez użytkownika
+
+        Returns:
+            tuple: (lon, lat) lub None
+        """
+        najlepszy = wybierz_najlepszego(self.szukaj(adres), adres)
+        if najlepszy is None:
+            return None
+        return float(najlepszy['lon']), float(najlepszy['lat'])
+
+
+_domyslny_indeks = None
+_domyslny_indeks_lock = threading.Lock()
+
+
+def pobierz_indeks_adresow():
+    """
+    Zwraca indeks adresowy wskazany zmienną ROOF_ADDRESS_INDEX (wczytywany raz)
+
+    Returns:
+        IndeksAdresow lub None jeśli indeks nie jest skonfigurowany
+    """
+    global _domyslny_indeks
+    if _domyslny_indeks is not None:
+        return _domyslny_indeks or None
+    with _domyslny_indeks_lock:
+        if _domyslny_indeks is None:
+            sciezka = os.environ.get('ROOF_ADDRESS_INDEX')
+            _domyslny_indeks = False
+            if sciezka:
+                try:
+                    start = time.monotonic()
+                    _domyslny_indeks = IndeksAdresow.wczytaj(sciezka)
+                    print(f"Indeks adresowy: {len(_domyslny_indeks)} punktów "
+                          f"wczytanych w {time.monotonic() - start:.1f} s")
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Indeks adresowy niedostępny ({sciezka}): {e}")
+    return _domyslny_indeks or None
+
+
+def ustaw_indeks_adresow(indeks):
+    """Podmienia współdzielony indeks adresowy (None wyłącza geokodowanie offline)."""
+    global _domyslny_indeks
+    with _domyslny_indeks_lock:
+        _domyslny_indeks = indeks if indeks is not None else False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Indeks adresowy do geokodowania offline')
+    polecenia = parser.add_subparsers(dest='polecenie', required=True)
+    zbuduj = polecenia.add_parser('zbuduj', help='Buduje indeks z pliku CSV lub GeoPackage')
+    zbuduj.add_argument('zrodlo', help='Plik punktów adresowych (.csv lub .gpkg)')
+    zbuduj.add_argument('indeks', help='Plik wynikowy indeksu (.npz)')
+    zbuduj.add_argument('--zamien-osie', action='store_true',
+                        help='Kolumny X/Y w układzie geodezyjnym (X na północ), jak w PRG')
+    zbuduj.add_argument('--tabela', help='Warstwa GeoPackage')
+    szukaj = polecenia.add_parser('szukaj', help='Wyszukuje adres w indeksie')
+    szukaj.add_argument('indeks', help='Plik indeksu (.npz)')
+    szukaj.add_argument('adres', help='Szukany adres')
+    args = parser.parse_args()
+
+    if args.polecenie == 'zbuduj':
+        start = time.monotonic()
+        liczba = zbuduj_indeks_adresow(
+            args.zrodlo, args.indeks, 'yx' if args.zamien_osie else 'xy', args.tabela
+        )
+        print(f"Zaindeksowano {liczba} punktów adresowych w {time.monotonic() - start:.1f} s")
+    else:
+        indeks = IndeksAdresow.wczytaj(args.indeks)
+        start = time.perf_counter()
+        kandydaci = indeks.szukaj(args.adres)
+        wynik = indeks.geokoduj(args.adres)
+        print(f"Wynik: {wynik} ({len(kandydaci)} kandydatów, "
+              f"{(time.perf_counter() - start) * 1000:.3f} ms)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,582 @@
+"""
+Moduł wyszukiwania działek ewidencyjnych po identyfikatorze TERYT
+Indeks budowany jest z lokalnego eksportu działek (CSV z WKT lub GeoPackage)
+i zapisywany jako plik .npz: skróty identyfikatorów oraz siatka przestrzenna
+"""
+
+import argparse
+import csv
+import hashlib
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+
+import numpy as np
+
+from utils.crs import epsg2180_do_wgs84_wsadowo, wgs84_do_epsg2180_wsadowo
+from utils.offline_geocoder import odkoduj_napisy, zakoduj_napisy, znajdz_kolumne
+
+
+WERSJA_INDEKSU = 1
+# Bok komórki siatki przestrzennej (m, EPSG:2180)
+ROZMIAR_KOMORKI_M = 250.0
+# Margines wokół działki na mapie (ułamek jej wymiaru z każdej strony)
+MARGINES_MAPY = 0.15
+# Najmniejszy obszar mapy działki (m) - małe działki nie są powiększane ponad miarę
+MIN_ZAKRES_MAPY_M = 60.0
+
+KOLUMNY_ID = ('identyfikator', 'id_dzialki', 'iddzialki', 'idd', 'teryt', 'id')
+KOLUMNY_WKT = ('wkt', 'geom_wkt', 'geometria', 'geometry', 'geom', 'the_geom')
+
+# WWPPGG_R.OOOO[.AR_N].NR - np. 146518_8.0108.27/1 lub 126101_1.0001.AR_12.45/3
+_ID_DZIALKI_RE = re.compile(r"^\d{6}_\d\.\d{4}(?:\.AR_\d+)?\.[0-9A-Z]+(?:/[0-9A-Z]+)?$")
+_PREFIKS_RE = re.compile(r"^(?:DZIAŁKA|DZIALKA|DZ\.?)\s*(?:NR\.?)?\s*", re.IGNORECASE)
+_LICZBA_WKT_RE = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+_TOKEN_WKT_RE = re.compile(r"[()]|[^()]+")
+
+
+def normalizuj_identyfikator(tekst):
+    """
+    Sprowadza identyfikator działki do postaci kanonicznej
+
+    Args:
+        tekst: Identyfikator wpisany przez użytkownika (np. "dz. 146518_8.0108.27/1")
+
+    Returns:
+        str lub None jeśli tekst nie jest identyfikatorem działki
+    """
+    if not isinstance(tekst, str) or '_' not in tekst:
+        return None
+    tekst = _PREFIKS_RE.sub('', tekst.strip())
+    tekst = re.sub(r"\s+", '', tekst).upper()
+    return tekst if _ID_DZIALKI_RE.match(tekst) else None
+
+
+def _skrot(identyfikator):
+    """64-bitowy skrót identyfikatora (stały między procesami, w przeciwieństwie do hash())."""
+    return int.from_bytes(hashlib.blake2b(identyfikator.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _pierscienie_wkt(wkt):
+    """Zewnętrzne pierścienie POLYGON/MULTIPOLYGON z WKT jako listy [(x, y), ...]."""
+    tekst = wkt.strip()
+    if ';' in tekst[:20]:
+        tekst = tekst.split(';', 1)[1]  # EWKT: "SRID=2180;POLYGON(...)"
+    naglowek = tekst.split('(', 1)[0].strip().upper()
+    if naglowek.startswith('MULTIPOLYGON'):
+        glebokosc_pierscienia = 3
+    elif naglowek.startswith('POLYGON'):
+        glebokosc_pierscienia = 2
+    else:
+        return []
+
+    pierscienie = []
+    glebokosc = 0
+    pierwszy = False
+    for token in _TOKEN_WKT_RE.findall(tekst[len(tekst.split('(', 1)[0]):]):
+        if token == '(':
+            glebokosc += 1
+            if glebokosc == glebokosc_pierscienia - 1:
+                pierwszy = True
+        elif token == ')':
+            glebokosc -= 1
+        elif glebokosc == glebokosc_pierscienia and pierwszy:
+            pierwszy = False
+            punkty = []
+            for wierzcholek in token.split(','):
+                liczby = _LICZBA_WKT_RE.findall(wierzcholek)
+                if len(liczby) >= 2:
+                    punkty.append((float(liczby[0]), float(liczby[1])))
+            if len(punkty) >= 3:
+                pierscienie.append(punkty)
+    return pierscienie
+
+
+def _pierscienie_wkb(wkb):
+    """Zewnętrzne pierścienie Polygon/MultiPolygon z WKB (ISO lub EWKB)."""
+    pierscienie = []
+
+    def wielokat(przesuniecie):
+        kolejnosc = '<' if wkb[przesuniecie] == 1 else '>'
+        typ = struct.unpack_from(kolejnosc + 'I', wkb, przesuniecie + 1)[0]
+        przesuniecie += 5
+        # ISO: typ + 1000 (Z), 2000 (M), 3000 (ZM); EWKB: flagi w najstarszych bitach
+        flagi, typ_iso = typ & 0xE0000000, typ & 0x0FFFFFFF
+        typ_bazowy = typ_iso % 1000
+        wymiary = 2 + {0: 0, 1: 1, 2: 1, 3: 2}.get(typ_iso // 1000, 0)
+        wymiary += bool(flagi & 0x80000000) + bool(flagi & 0x40000000)
+        if flagi & 0x20000000:
+            przesuniecie += 4  # SRID w EWKB
+        if typ_bazowy == 6:
+            liczba = struct.unpack_from(kolejnosc + 'I', wkb, przesuniecie)[0]
+            przesuniecie += 4
+            for _ in range(liczba):
+                przesuniecie = wielokat(przesuniecie)
+            return przesuniecie
+        if typ_bazowy != 3:
+            raise ValueError(f"Nieobsługiwany typ geometrii WKB: {typ}")
+        liczba_pierscieni = struct.unpack_from(kolejnosc + 'I', wkb, przesuniecie)[0]
+        przesuniecie += 4
+        for numer in range(liczba_pierscieni):
+            liczba_punktow = struct.unpack_from(kolejnosc + 'I', wkb, przesuniecie)[0]
+            przesuniecie += 4
+            if numer == 0:
+                wspolrzedne = np.frombuffer(
+                    wkb, dtype=np.dtype('f8').newbyteorder(kolejnosc),
+                    count=liczba_punktow * wymiary, offset=przesuniecie
+                ).reshape(-1, wymiary)
+                pierscienie.append([(float(x), float(y)) for x, y in wspolrzedne[:, :2]])
+            przesuniecie += liczba_punktow * wymiary * 8
+        return przesuniecie
+
+    wielokat(0)
+    return pierscienie
+
+
+def _pierscienie_gpkg(blob):
+    """Zewnętrzne pierścienie z geometrii GeoPackage (nagłówek GP + WKB)."""
+    if not blob or blob[:2] != b'GP':
+        return []
+    rozmiary_obwiedni = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}
+    obwiednia = rozmiary_obwiedni.get((blob[3] >> 1) & 0x07, 0)
+    try:
+        return _pierscienie_wkb(bytes(blob[8 + obwiednia:]))
+    except (ValueError, struct.error):
+        return []
+
+
+def _wiersze_csv(sciezka):
+    """Czyta działki (identyfikator, pierścienie) z pliku CSV z geometrią WKT."""
+    csv.field_size_limit(1 << 30)
+    with open(sciezka, newline='', encoding='utf-8-sig') as plik:
+        # Separator z nagłówka - przecinki w WKT mylą csv.Sniffer
+        naglowek = plik.readline()
+        plik.seek(0)
+        separator = next((znak for znak in ';\t|' if znak in naglowek), ',')
+        czytnik = csv.DictReader(plik, delimiter=separator)
+        naglowki = czytnik.fieldnames or []
+        kol_id = znajdz_kolumne(naglowki, KOLUMNY_ID)
+        kol_wkt = znajdz_kolumne(naglowki, KOLUMNY_WKT)
+        if not kol_id or not kol_wkt:
+            raise ValueError(f"Brak kolumn identyfikatora lub geometrii WKT w {sciezka}: {naglowki}")
+        for wiersz in czytnik:
+            yield (wiersz.get(kol_id) or '').strip(), _pierscienie_wkt(wiersz.get(kol_wkt) or '')
+
+
+def _wiersze_gpkg(sciezka, tabela=None):
+    """Czyta działki (identyfikator, pierścienie) z warstwy poligonowej GeoPackage."""
+    polaczenie = sqlite3.connect(sciezka)
+    try:
+        if tabela is None:
+            wiersz = polaczenie.execute(
+                "SELECT table_name FROM gpkg_contents WHERE data_type = 'features' LIMIT 1"
+            ).fetchone()
+            if wiersz is None:
+                raise ValueError(f"Brak warstwy wektorowej w {sciezka}")
+            tabela = wiersz[0]
+        kolumna_geom, srs_id = polaczenie.execute(
+            'SELECT column_name, srs_id FROM gpkg_geometry_columns WHERE table_name = ?', (tabela,)
+        ).fetchone()
+        uklad = polaczenie.execute(
+            'SELECT organization_coordsys_id FROM gpkg_spatial_ref_sys WHERE srs_id = ?', (srs_id,)
+        ).fetchone()
+        if uklad is not None and uklad[0] not in (2180, 4326):
+            raise ValueError(f"Nieobsługiwany układ warstwy {tabela}: EPSG:{uklad[0]}")
+        wgs84 = uklad is not None and uklad[0] == 4326
+
+        kursor = polaczenie.execute(f'SELECT * FROM "{tabela}"')
+        naglowki = [opis[0] for opis in kursor.description]
+        indeksy = {n: i for i, n in enumerate(naglowki)}
+        kol_id = znajdz_kolumne(naglowki, KOLUMNY_ID)
+        if not kol_id:
+            raise ValueError(f"Brak kolumny identyfikatora działki w {tabela}: {naglowki}")
+        for wiersz in kursor:
+            yield str(wiersz[indeksy[kol_id]] or '').strip(), _pierscienie_gpkg(wiersz[indeksy[kolumna_geom]]), wgs84
+    finally:
+        polaczenie.close()
+
+
+def _powierzchnia_i_srodek(x, y):
+    """Pole (m²) i środek ciężkości pierścienia - wzór Gaussa (shoelace)."""
+    iloczyn = x[:-1] * y[1:] - x[1:] * y[:-1]
+    pole = iloczyn.sum() / 2.0
+    if abs(pole) < 1e-9:
+        return 0.0, float(x.mean()), float(y.mean())
+    cx = ((x[:-1] + x[1:]) * iloczyn).sum() / (6.0 * pole)
+    cy = ((y[:-1] + y[1:]) * iloczyn).sum() / (6.0 * pole)
+    return abs(pole), float(cx), float(cy)
+
+
+def zbuduj_indeks_dzialek(sciezka_zrodla, sciezka_indeksu, uklad='2180', zamien_osie=False, tabela=None):
+    """
+    Buduje indeks działek z eksportu ewidencji i zapisuje go na dysku
+
+    Args:
+        sciezka_zrodla: Plik CSV (identyfikator + geometria WKT) lub GeoPackage (.gpkg)
+        sciezka_indeksu: Plik wynikowy (.npz)
+        uklad: Układ geometrii WKT w CSV - '2180' lub '4326' (GeoPackage: z metadanych warstwy)
+        zamien_osie: WKT w kolejności geodezyjnej (X na północ)
+        tabela: Nazwa warstwy w GeoPackage (domyślnie pierwsza warstwa wektorowa)
+
+    Returns:
+        int: Liczba zaindeksowanych działek
+    """
+    if sciezka_zrodla.lower().endswith('.gpkg'):
+        wiersze = _wiersze_gpkg(sciezka_zrodla, tabela)
+    else:
+        wgs84 = str(uklad) in ('4326', 'EPSG:4326')
+        wiersze = ((identyfikator, pierscienie, wgs84) for identyfikator, pierscienie in _wiersze_csv(sciezka_zrodla))
+
+    dzialki = {}
+    for identyfikator, pierscienie, wgs84 in wiersze:
+        identyfikator = normalizuj_identyfikator(identyfikator)
+        if not identyfikator or not pierscienie or identyfikator in dzialki:
+            continue
+        tablice = []
+        for pierscien in pierscienie:
+            punkty = np.asarray(pierscien, dtype=np.float64)
+            if zamien_osie:
+                punkty = punkty[:, ::-1]
+            if wgs84:
+                punkty = np.column_stack(wgs84_do_epsg2180_wsadowo(punkty[:, 0], punkty[:, 1]))
+            if not np.array_equal(punkty[0], punkty[-1]):
+                punkty = np.vstack([punkty, punkty[:1]])
+            tablice.append(punkty)
+        dzialki[identyfikator] = tablice
+
+    # Kolejność działek według skrótu identyfikatora - wyszukiwanie to jedno searchsorted
+    identyfikatory = sorted(dzialki, key=_skrot)
+    skroty = np.array([_skrot(i) for i in identyfikatory], dtype=np.uint64)
+    liczba = len(identyfikatory)
+    pierscienie = [p for i in identyfikatory for p in dzialki[i]]
+    dzialki_start = np.zeros(liczba + 1, dtype=np.int64)
+    dzialki_start[1:] = np.cumsum([len(dzialki[i]) for i in identyfikatory])
+    pierscienie_start = np.zeros(len(pierscienie) + 1, dtype=np.int64)
+    pierscienie_start[1:] = np.cumsum([len(p) for p in pierscienie])
+    wx = np.concatenate([p[:, 0] for p in pierscienie]) if pierscienie else np.zeros(0)
+    wy = np.concatenate([p[:, 1] for p in pierscienie]) if pierscienie else np.zeros(0)
+
+    # Obwiednia, pole i środek ciężkości każdej działki (wszystkie pierścienie zewnętrzne)
+    obwiednie = np.zeros((liczba, 4), dtype=np.float64)
+    pola = np.zeros(liczba, dtype=np.float64)
+    srodki = np.zeros((liczba, 2), dtype=np.float64)
+    for i in range(liczba):
+        p0, p1 = pierscienie_start[dzialki_start[i]], pierscienie_start[dzialki_start[i + 1]]
+        obwiednie[i] = wx[p0:p1].min(), wy[p0:p1].min(), wx[p0:p1].max(), wy[p0:p1].max()
+        suma_pol, sx, sy = 0.0, 0.0, 0.0
+        for r in range(dzialki_start[i], dzialki_start[i + 1]):
+            a, b = pierscienie_start[r], pierscienie_start[r + 1]
+            pole, cx, cy = _powierzchnia_i_srodek(wx[a:b], wy[a:b])
+            suma_pol += pole
+            sx += pole * cx
+            sy += pole * cy
+        pola[i] = suma_pol
+        if suma_pol > 0:
+            srodki[i] = sx / suma_pol, sy / suma_pol
+        else:
+            srodki[i] = (obwiednie[i, 0] + obwiednie[i, 2]) / 2, (obwiednie[i, 1] + obwiednie[i, 3]) / 2
+    srodki_lon, srodki_lat = epsg2180_do_wgs84_wsadowo(srodki[:, 0], srodki[:, 1])
+
+    # Siatka przestrzenna: komórka -> działki, których obwiednia ją przecina
+    komorki_dzialek, numery_dzialek = [], []
+    if liczba:
+        poczatek_x, poczatek_y = obwiednie[:, 0].min(), obwiednie[:, 1].min()
+    else:
+        poczatek_x = poczatek_y = 0.0
+    for i, (xmin, ymin, xmax, ymax) in enumerate(obwiednie):
+        cx0, cx1 = int((xmin - poczatek_x) // ROZMIAR_KOMORKI_M), int((xmax - poczatek_x) // ROZMIAR_KOMORKI_M)
+        cy0, cy1 = int((ymin - poczatek_y) // ROZMIAR_KOMORKI_M), int((ymax - poczatek_y) // ROZMIAR_KOMORKI_M)
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                komorki_dzialek.append((cx << 32) | cy)
+                numery_dzialek.append(i)
+    komorki_dzialek = np.asarray(komorki_dzialek, dtype=np.int64)
+    numery_dzialek = np.asarray(numery_dzialek, dtype=np.int32)
+    porzadek = np.argsort(komorki_dzialek, kind='stable')
+    komorki_dzialek, numery_dzialek = komorki_dzialek[porzadek], numery_dzialek[porzadek]
+    komorki, komorki_start = np.unique(komorki_dzialek, return_index=True)
+    komorki_start = np.append(komorki_start, len(komorki_dzialek)).astype(np.int64)
+
+    katalog = os.path.dirname(os.path.abspath(sciezka_indeksu))
+    os.makedirs(katalog, exist_ok=True)
+    tmp = sciezka_indeksu + '.tmp.npz'
+    np.savez_compressed(
+        tmp,
+        wersja=np.array([WERSJA_INDEKSU]),
+        identyfikatory=zakoduj_napisy(identyfikatory),
+        skroty=skroty,
+        obwiednie=obwiednie,
+        pola=pola,
+        srodki_lon=srodki_lon,
+        srodki_lat=srodki_lat,
+        dzialki_start=dzialki_start,
+        pierscienie_start=pierscienie_start,
+        wx=wx,
+        wy=wy,
+        siatka=np.array([poczatek_x, poczatek_y, ROZMIAR_KOMORKI_M]),
+        komorki=komorki,
+        komorki_start=komorki_start,
+        komorki_dzialki=numery_dzialek,
+    )
+    os.replace(tmp, sciezka_indeksu)
+    return liczba
+
+
+def _punkt_w_pierscieniu(x, y, px, py):
+    """Test parzystości przecięć (ray casting) dla zamkniętego pierścienia."""
+    x0, y0, x1, y1 = px[:-1], py[:-1], px[1:], py[1:]
+    przecina = (y0 > y) != (y1 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xp = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return bool(np.count_nonzero(przecina & (x < xp)) % 2)
+
+
+class IndeksDzialek:
+    """
+    Indeks działek ewidencyjnych w pamięci procesu.
+
+    Działki są posortowane według 64-bitowego skrótu identyfikatora, więc
+    wyszukiwanie identyfikatora to jedno searchsorted; siatka kwadratowych
+    komórek EPSG:2180 wskazuje działki, których obwiednia przecina komórkę.
+    """
+
+    def __init__(self, dane):
+        """
+        Args:
+            dane: Słownik tablic zapisanych przez zbuduj_indeks_dzialek
+        """
+        if int(dane['wersja'][0]) != WERSJA_INDEKSU:
+            raise ValueError(f"Nieobsługiwana wersja indeksu: {int(dane['wersja'][0])}")
+        self.identyfikatory = odkoduj_napisy(dane['identyfikatory']) if len(dane['identyfikatory']) else []
+        self.skroty = dane['skroty']
+        self.obwiednie = dane['obwiednie']
+        self.pola = dane['pola']
+        self.srodki_lon = dane['srodki_lon']
+        self.srodki_lat = dane['srodki_lat']
+        self._dzialki_start = dane['dzialki_start']
+        self._pierscienie_start = dane['pierscienie_start']
+        self._wx = dane['wx']
+        self._wy = dane['wy']
+        self._poczatek_x, self._poczatek_y, self._rozmiar_komorki = (float(v) for v in dane['siatka'])
+        self._komorki = dane['komorki']
+        self._komorki_start = dane['komorki_start']
+        self._komorki_dzialki = dane['komorki_dzialki']
+
+    @classmethod
+    def wczytaj(cls, sciezka):
+        """
+        Wczytuje indeks zapisany przez zbuduj_indeks_dzialek
+
+        Args:
+            sciezka: Plik indeksu (.npz)
+
+        Returns:
+            IndeksDzialek
+        """
+        with np.load(sciezka) as dane:
+            return cls({nazwa: dane[nazwa] for nazwa in dane.files})
+
+    def __len__(self):
+        return len(self.identyfikatory)
+
+    def dzialka(self, numer):
+        """
+        Opis działki o danym numerze wiersza indeksu
+
+        Returns:
+            dict: identyfikator, lon, lat (środek ciężkości), bbox (EPSG:2180:
+                  xmin, ymin, xmax, ymax), bbox_wgs84 (lon_min, lat_min, lon_max, lat_max),
+                  powierzchnia_m2
+        """
+        xmin, ymin, xmax, ymax = (float(v) for v in self.obwiednie[numer])
+        lon, lat = epsg2180_do_wgs84_wsadowo([xmin, xmax], [ymin, ymax])
+        return {
+            'identyfikator': self.identyfikatory[numer],
+            'lon': float(self.srodki_lon[numer]),
+            'lat': float(self.srodki_lat[numer]),
+            'bbox': [xmin, ymin, xmax, ymax],
+            'bbox_wgs84': [float(lon[0]), float(lat[0]), float(lon[1]), float(lat[1])],
+            'powierzchnia_m2': round(float(self.pola[numer]), 1),
+        }
+
+    def znajdz(self, identyfikator):
+        """
+        Wyszukuje działkę po identyfikatorze TERYT
+
+        Args:
+            identyfikator: Identyfikator działki (np. "146518_8.0108.27/1")
+
+        Returns:
+            dict (jak dzialka) lub None
+        """
+        identyfikator = normalizuj_identyfikator(identyfikator)
+        if identyfikator is None:
+            return None
+        skrot = np.uint64(_skrot(identyfikator))
+        numer = int(np.searchsorted(self.skroty, skrot, side='left'))
+        while numer < len(self.skroty) and self.skroty[numer] == skrot:
+            if self.identyfikatory[numer] == identyfikator:
+                return self.dzialka(numer)
+            numer += 1
+        return None
+
+    def _zawiera(self, numer, x, y):
+        for r in range(self._dzialki_start[numer], self._dzialki_start[numer + 1]):
+            a, b = self._pierscienie_start[r], self._pierscienie_start[r + 1]
+            if _punkt_w_pierscieniu(x, y, self._wx[a:b], self._wy[a:b]):
+                return True
+        return False
+
+    def w_punkcie(self, x, y):
+        """
+        Wyszukuje działkę zawierającą punkt
+
+        Args:
+            x, y: Punkt w EPSG:2180
+
+        Returns:
+            dict (jak dzialka) lub None
+        """
+        cx = int((x - self._poczatek_x) // self._rozmiar_komorki)
+        cy = int((y - self._poczatek_y) // self._rozmiar_komorki)
+        if cx < 0 or cy < 0:
+            return None
+        komorka = np.int64((cx << 32) | cy)
+        pozycja = int(np.searchsorted(self._komorki, komorka))
+        if pozycja >= len(self._komorki) or self._komorki[pozycja] != komorka:
+            return None
+        numery = self._komorki_dzialki[self._komorki_start[pozycja]:self._komorki_start[pozycja + 1]]
+        obwiednie = self.obwiednie[numery]
+        w_obwiedni = numery[
+            (obwiednie[:, 0] <= x) & (x <= obwiednie[:, 2]) & (obwiednie[:, 1] <= y) & (y <= obwiednie[:, 3])
+        ]
+        # Najmniejsza działka zawierająca punkt (działki nie powinny się nakładać)
+        for numer in w_obwiedni[np.argsort(self.pola[w_obwiedni])]:
+            if self._zawiera(int(numer), x, y):
+                return self.dzialka(int(numer))
+        return None
+
+
+def zakres_mapy_dzialki(dzialka, szerokosc_pikseli, wysokosc_pikseli, margines=MARGINES_MAPY):
+    """
+    Obszar mapy obejmujący działkę z marginesem, w proporcjach obrazu
+
+    Args:
+        dzialka: Opis działki (IndeksDzialek.dzialka)
+        szerokosc_pikseli, wysokosc_pikseli: Rozmiar obrazu mapy
+        margines: Margines z każdej strony jako ułamek wymiaru działki
+
+    Returns:
+        tuple: ((x, y) środek obszaru w EPSG:2180, (szerokość_m, wysokość_m))
+    """
+    xmin, ymin, xmax, ymax = dzialka['bbox']
+    szerokosc = max((xmax - xmin) * (1 + 2 * margines), MIN_ZAKRES_MAPY_M)
+    wysokosc = max((ymax - ymin) * (1 + 2 * margines), MIN_ZAKRES_MAPY_M)
+    metry_na_piksel = max(szerokosc / szerokosc_pikseli, wysokosc / wysokosc_pikseli)
+    return ((xmin + xmax) / 2, (ymin + ymax) / 2), (
+        metry_na_piksel * szerokosc_pikseli, metry_na_piksel * wysokosc_pikseli
+    )
+
+
+_domyslny_indeks = None
+_domyslny_indeks_lock = threading.Lock()
+
+
+def pobierz_indeks_dzialek():
+    """
+    Zwraca indeks działek wskazany zmienną ROOF_PARCEL_INDEX (wczytywany raz)
+
+    Returns:
+        IndeksDzialek lub None jeśli indeks nie jest skonfigurowany
+    """
+    global _domyslny_indeks
+    if _domyslny_indeks is not None:
+        return _domyslny_indeks or None
+    with _domyslny_indeks_lock:
+        if _domyslny_indeks is None:
+            sciezka = os.environ.get('ROOF_PARCEL_INDEX')
+            _domyslny_indeks = False
+            if sciezka:
+                try:
+                    start = time.monotonic()
+                    _domyslny_indeks = IndeksDzialek.wczytaj(sciezka)
+                    print(f"Indeks działek: {len(_domyslny_indeks)} działek "
+                          f"wczytanych w {time.monotonic() - start:.1f} s")
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Indeks działek niedostępny ({sciezka}): {e}")
+    return _domyslny_indeks or None
+
+
+def ustaw_indeks_dzialek(indeks):
+    """Podmienia współdzielony indeks działek (None wyłącza wyszukiwanie działek)."""
+    global _domyslny_indeks
+    with _domyslny_indeks_lock:
+        _domyslny_indeks = indeks if indeks is not None else False
+
+
+def znajdz_dzialke(tekst):
+    """
+    Wyszukuje działkę po identyfikatorze wpisanym przez użytkownika (bez sieci)
+
+    Args:
+        tekst: Tekst wpisany przez użytkownika
+
+    Returns:
+        dict (jak IndeksDzialek.dzialka) lub None
+    """
+    if normalizuj_identyfikator(tekst) is None:
+        return None
+    indeks = pobierz_indeks_dzialek()
+    return indeks.znajdz(tekst) if indeks is not None else None
+
+
+def dzialka_w_punkcie(lon, lat):
+    """
+    Wyszukuje działkę zawierającą punkt WGS84 w lokalnym indeksie
+
+    Returns:
+        dict (jak IndeksDzialek.dzialka) lub None
+    """
+    indeks = pobierz_indeks_dzialek()
+    if indeks is None:
+        return None
+    x, y = wgs84_do_epsg2180_wsadowo([lon], [lat])
+    return indeks.w_punkcie(float(x[0]), float(y[0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Indeks działek ewidencyjnych (identyfikatory TERYT)')
+    polecenia = parser.add_subparsers(dest='polecenie', required=True)
+    zbuduj = polecenia.add_parser('zbuduj', help='Buduje indeks z pliku CSV (WKT) lub GeoPackage')
+    zbuduj.add_argument('zrodlo', help='Plik działek (.csv z kolumną WKT lub .gpkg)')
+    zbuduj.add_argument('indeks', help='Plik wynikowy indeksu (.npz)')
+    zbuduj.add_argument('--uklad', default='2180', choices=('2180', '4326'),
+                        help='Układ geometrii WKT w pliku CSV')
+    zbuduj.add_argument('--zamien-osie', action='store_true',
+                        help='Współrzędne WKT w układzie geodezyjnym (X na północ)')
+    zbuduj.add_argument('--tabela', help='Warstwa GeoPackage')
+    szukaj = polecenia.add_parser('szukaj', help='Wyszukuje działkę po identyfikatorze lub punkcie')
+    szukaj.add_argument('indeks', help='Plik indeksu (.npz)')
+    szukaj.add_argument('zapytanie', nargs='+', help='Identyfikator działki lub "lon lat" (WGS84)')
+    args = parser.parse_args()
+
+    if args.polecenie == 'zbuduj':
+        start = time.monotonic()
+        liczba = zbuduj_indeks_dzialek(args.zrodlo, args.indeks, args.uklad, args.zamien_osie, args.tabela)
+        print(f"Zaindeksowano {liczba} działek w {time.monotonic() - start:.1f} s")
+    else:
+        indeks = IndeksDzialek.wczytaj(args.indeks)
+        start = time.perf_counter()
+        if len(args.zapytanie) == 2:
+            x, y = wgs84_do_epsg2180_wsadowo([float(args.zapytanie[0])], [float(args.zapytanie[1])])
+            wynik = indeks.w_punkcie(float(x[0]), float(y[0]))
+        else:
+            wynik = indeks.znajdz(args.zapytanie[0])
+        print(f"Wynik: {wynik} ({(time.perf_counter() - start) * 1000:.3f} ms)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""
+Moduł wyprzedzającego pobierania kafelków w tle
+Po złożeniu mozaiki kafelki wokół niej trafiają do cache, zanim użytkownik przesunie widok;
+pobieranie ustępuje żądaniom interaktywnym i ma własny, niewielki limit równoległości
+"""
+
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+DOMYSLNA_LICZBA_WATKOW = 2
+DOMYSLNY_PIERSCIEN = 1
+# Najdłuższe oczekiwanie na koniec żądań interaktywnych przed ponownym sprawdzeniem (s)
+MAKS_OCZEKIWANIE_S = 0.5
+
+_aktywne_interaktywne = 0
+_warunek_interaktywne = threading.Condition()
+
+
+@contextmanager
+def zadanie_interaktywne():
+    """
+    Oznacza obsługę żądania użytkownika - w tym czasie pobieranie w tle czeka
+
+    Użycie:
+        with zadanie_interaktywne():
+            mapa = pobierz_mape(...)
+    """
+    global _aktywne_interaktywne
+    with _warunek_interaktywne:
+        _aktywne_interaktywne += 1
+    try:
+        yield
+    finally:
+        with _warunek_interaktywne:
+            _aktywne_interaktywne -= 1
+            _warunek_interaktywne.notify_all()
+
+
+class PobieranieWyprzedzajace:
+    """
+    Kolejka kafelków do pobrania w tle przez kilka wątków o niskim priorytecie.
+
+    Liczy się tylko ostatni plan - nowa mozaika zastępuje kafelki, które
+    jeszcze nie zostały pobrane (użytkownik oglądał już inne miejsce).
+    Przed każdym kafelkiem wątek czeka, aż nie będzie żądań interaktywnych.
+    """
+
+    def __init__(self, liczba_watkow=DOMYSLNA_LICZBA_WATKOW):
+        """
+        Args:
+            liczba_watkow: Najwyżej tyle kafelków pobieranych jest równocześnie
+        """
+        self.liczba_watkow = max(1, int(liczba_watkow))
+        self._kolejka = deque()
+        self._warunek = threading.Condition()
+        self._watki = []
+        self._zatrzymane = False
+        self._statystyki = {
+            'zaplanowane': 0, 'pobrane': 0, 'w_cache': 0, 'bledy': 0,
+            'porzucone': 0, 'oczekiwania': 0,
+        }
+
+    def zaplanuj(self, kafelki, pobierz):
+        """
+        Zastępuje plan pobierania nową listą kafelków (najważniejsze pierwsze)
+
+        Args:
+            kafelki: Lista kluczy kafelków, np. (zoom, col, row)
+            pobierz: Funkcja(klucz) -> True (pobrano), False (był w cache), None (błąd)
+        """
+        with self._warunek:
+            if self._zatrzymane:
+                return
+            self._statystyki['porzucone'] += len(self._kolejka)
+            self._kolejka.clear()
+            self._kolejka.extend((klucz, pobierz) for klucz in kafelki)
+            self._statystyki['zaplanowane'] += len(kafelki)
+            self._uruchom_watki()
+            self._warunek.notify_all()
+
+    def _uruchom_watki(self):
+        while len(self._watki) < self.liczba_watkow:
+            watek = threading.Thread(
+                target=self._petla, name=f'wyprzedzanie-{len(self._watki)}', daemon=True
+            )
+            self._watki.append(watek)
+            watek.start()
+
+    def _czekaj_na_interaktywne(self):
+        with _warunek_interaktywne:
+            if _aktywne_interaktywne:
+                with self._warunek:
+                    self._statystyki['oczekiwania'] += 1
+            while _aktywne_interaktywne and not self._zatrzymane:
+                _warunek_interaktywne.wait(MAKS_OCZEKIWANIE_S)
+
+    def _petla(self):
+        while True:
+            with self._warunek:
+                while not self._kolejka and not self._zatrzymane:
+                    self._warunek.wait()
+                if self._zatrzymane:
+                    return
+            self._czekaj_na_interaktywne()
+            with self._warunek:
+                if not self._kolejka:
+                    continue
+                klucz, pobierz = self._kolejka.popleft()
+            try:
+                wynik = pobierz(klucz)
+            except Exception as e:
+                print(f"Wyprzedzanie: błąd kafelka {klucz}: {e}")
+                wynik = None
+            with self._warunek:
+                if wynik is None:
+                    self._statystyki['bledy'] += 1
+                elif wynik:
+                    self._statystyki['pobrane'] += 1
+                else:
+                    self._statystyki['w_cache'] += 1
+
+    def zatrzymaj(self):
+        """Porzuca plan i kończy wątki (bieżące kafelki są dokańczane)."""
+        with self._warunek:
+            self._zatrzymane = True
+            self._kolejka.clear()
+            self._warunek.notify_all()
+        with _warunek_interaktywne:
+            _warunek_interaktywne.notify_all()
+
+    def statystyki(self):
+        """
+        Returns:
+            dict: liczniki kafelków (zaplanowane, pobrane, w_cache, bledy, porzucone),
+                  liczba oczekiwań na żądania interaktywne i długość kolejki
+        """
+        with self._warunek:
+            wynik = dict(self._statystyki)
+            wynik['w_kolejce'] = len(self._kolejka)
+            wynik['watki'] = self.liczba_watkow
+            return wynik
+
+
+def ustawienia_wyprzedzania():
+    """
+    Konfiguracja ze zmiennych:
+        ROOF_PREFETCH - 0 wyłącza pobieranie wyprzedzające (domyślnie 1)
+        ROOF_PREFETCH_RING - szerokość pierścienia wokół mozaiki w kafelkach
+        ROOF_PREFETCH_NEXT_ZOOM - 1 pobiera też widok na następnym poziomie powiększenia
+
+    Returns:
+        tuple: (pierscien, nastepny_zoom) lub None jeśli wyłączone
+    """
+    if os.environ.get('ROOF_PREFETCH', '1').strip().lower() in ('0', 'false', 'no', 'off', ''):
+        return None
+    try:
+        pierscien = max(0, int(os.environ.get('ROOF_PREFETCH_RING', DOMYSLNY_PIERSCIEN)))
+    except ValueError:
+        print(f"ROOF_PREFETCH_RING: błędna wartość - użyto domyślnej ({DOMYSLNY_PIERSCIEN})")
+        pierscien = DOMYSLNY_PIERSCIEN
+    nastepny_zoom = os.environ.get('ROOF_PREFETCH_NEXT_ZOOM', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+    return pierscien, nastepny_zoom
+
+
+_domyslne_wyprzedzanie = None
+_domyslne_wyprzedzanie_lock = threading.Lock()
+
+
+def pobierz_wyprzedzanie():
+    """
+    Zwraca współdzielone pobieranie wyprzedzające (ROOF_PREFETCH_THREADS wątków)
+
+    Returns:
+        PobieranieWyprzedzajace lub None jeśli wyłączone (ROOF_PREFETCH=0)
+    """
+    global _domyslne_wyprzedzanie
+    if _domyslne_wyprzedzanie is not None:
+        return _domyslne_wyprzedzanie or None
+    with _domyslne_wyprzedzanie_lock:
+        if _domyslne_wyprzedzanie is None:
+            _domyslne_wyprzedzanie = False
+            if ustawienia_wyprzedzania() is not None:
+                try:
+                    watki = max(1, int(os.environ.get('ROOF_PREFETCH_THREADS', DOMYSLNA_LICZBA_WATKOW)))
+                except ValueError:
+                    print(f"ROOF_PREFETCH_THREADS: błędna wartość - użyto domyślnej ({DOMYSLNA_LICZBA_WATKOW})")
+                    watki = DOMYSLNA_LICZBA_WATKOW
+                _domyslne_wyprzedzanie = PobieranieWyprzedzajace(watki)
+    return _domyslne_wyprzedzanie or None
+
+
+def ustaw_wyprzedzanie(wyprzedzanie):
+    """Podmienia współdzielone pobieranie wyprzedzające (None je wyłącza)."""
+    global _domyslne_wyprzedzanie
+    with _domyslne_wyprzedzanie_lock:
+        if _domyslne_wyprzedzanie:
+            _domyslne_wyprzedzanie.zatrzymaj()
+        _domyslne_wyprzedzanie = wyprzedzanie if wyprzedzanie is not None else False
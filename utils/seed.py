@@ -0,0 +1,439 @@
+"""
+Moduł wstępnego wypełniania cache kafelków (seeding) dla obszarów i zakresów powiększeń
+Obszar: prostokąt, wielokąt GeoJSON lub lista adresów; kafelki już w cache są pomijane,
+więc przerwane zadanie wznawia się ponownym uruchomieniem tego samego polecenia
+
+Przykład:
+    python -m utils.seed --bbox 20.85,52.10,21.27,52.37 --zoom 12-14 --watki 8
+    python -m utils.seed --adresy klienci.txt --promien 150 --zoom 14,15
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import numpy as np
+
+from utils.crs import wgs84_do_epsg2180_wsadowo
+from utils.fetch_engine import SilnikPobierania
+from utils.geoportal import (
+    WMTS_FORMAT,
+    WMTS_LAYER,
+    WMTS_ORIGIN_X,
+    WMTS_ORIGIN_Y,
+    WMTS_RESOLUTIONS,
+    WMTS_TILE_MATRIX_SET,
+    WMTS_TILE_SIZE,
+    pobierz_bajty_kafelka_wmts,
+)
+from utils.tile_cache import KluczKafelka, pobierz_cache_kafelkow
+from utils.tile_pack import pobierz_paczki_kafelkow
+
+
+DOMYSLNA_LICZBA_WATKOW = 4
+DOMYSLNY_PROMIEN_M = 150.0
+MAKS_PONOWIEN = 2
+# Średni rozmiar kafelka JPEG ortofotomapy - do oszacowania zajętości cache
+SZACOWANY_ROZMIAR_KAFELKA = 40 * 1024
+
+
+def parsuj_zoomy(tekst):
+    """
+    Odczytuje poziomy powiększenia: "14", "12-15" lub "12,14,15"
+
+    Returns:
+        list: Posortowane poziomy obecne w macierzy WMTS
+    """
+    poziomy = set()
+    for czesc in str(tekst).split(','):
+        czesc = czesc.strip()
+        if not czesc:
+            continue
+        if '-' in czesc:
+            od, do = (int(v) for v in czesc.split('-', 1))
+            poziomy.update(range(min(od, do), max(od, do) + 1))
+        else:
+            poziomy.add(int(czesc))
+    nieznane = poziomy - set(WMTS_RESOLUTIONS)
+    if nieznane:
+        raise ValueError(f"Nieznane poziomy WMTS: {sorted(nieznane)}")
+    return sorted(poziomy)
+
+
+def zakres_kafelkow(xmin, ymin, xmax, ymax, zoom_level):
+    """
+    Kafelki WMTS pokrywające prostokąt EPSG:2180
+
+    Siatka jak w wspolrzedne_do_kafelka (te same WMTS_ORIGIN_X/Y, WMTS_TILE_SIZE
+    i rozdzielczości), bez wypisywania informacji diagnostycznych dla każdego punktu.
+
+    Returns:
+        tuple: (col_min, row_min, col_max, row_max) - zakres włącznie
+    """
+    bok = WMTS_TILE_SIZE * WMTS_RESOLUTIONS[zoom_level]
+    return (
+        int((xmin - WMTS_ORIGIN_X) // bok),
+        int((WMTS_ORIGIN_Y - ymax) // bok),
+        int((xmax - WMTS_ORIGIN_X) // bok),
+        int((WMTS_ORIGIN_Y - ymin) // bok),
+    )
+
+
+def _punkty_w_wielokacie(px, py, pierscien):
+    """Test parzystości przecięć dla tablic punktów i jednego pierścienia (N, 2)."""
+    wewnatrz = np.zeros(px.shape, dtype=bool)
+    x0, y0 = pierscien[:-1, 0], pierscien[:-1, 1]
+    x1, y1 = pierscien[1:, 0], pierscien[1:, 1]
+    for a, b, c, d in zip(x0, y0, x1, y1):
+        if b == d:
+            continue
+        przecina = (b > py) != (d > py)
+        xp = a + (py - b) * (c - a) / (d - b)
+        wewnatrz ^= przecina & (px < xp)
+    return wewnatrz
+
+
+def kafelki_obszaru(wielokaty, zoom_level):
+    """
+    Kafelki WMTS przecinające wielokąty (EPSG:2180)
+
+    Kafelek jest brany, gdy jego narożnik lub środek leży w wielokącie albo
+    wierzchołek wielokąta leży w kafelku - wystarcza dla obszarów miast i osiedli.
+
+    Args:
+        wielokaty: Lista tablic (N, 2) - zamknięte pierścienie zewnętrzne
+        zoom_level: Poziom powiększenia
+
+    Yields:
+        tuple: (zoom, col, row)
+    """
+    resolution = WMTS_RESOLUTIONS[zoom_level]
+    bok = WMTS_TILE_SIZE * resolution
+
+    widziane = set()
+    for pierscien in wielokaty:
+        xmin, ymin = pierscien.min(axis=0)
+        xmax, ymax = pierscien.max(axis=0)
+        col_min, row_min, col_max, row_max = zakres_kafelkow(xmin, ymin, xmax, ymax, zoom_level)
+        if len(pierscien) == 5 and np.isin(pierscien[:, 0], (xmin, xmax)).all() \
+                and np.isin(pierscien[:, 1], (ymin, ymax)).all():
+            # Prostokąt - wszystkie kafelki zakresu
+            wybrane = np.ones((row_max - row_min + 1, col_max - col_min + 1), dtype=bool)
+        else:
+            cols = np.arange(col_min, col_max + 1)
+            rows = np.arange(row_min, row_max + 1)
+            # Narożniki siatki (wspólne dla sąsiednich kafelków) i środki kafelków
+            kx = WMTS_ORIGIN_X + np.append(cols, col_max + 1) * bok
+            ky = WMTS_ORIGIN_Y - np.append(rows, row_max + 1) * bok
+            gx, gy = np.meshgrid(kx, ky)
+            narozniki = _punkty_w_wielokacie(gx, gy, pierscien)
+            sx, sy = np.meshgrid(kx[:-1] + bok / 2, ky[:-1] - bok / 2)
+            wybrane = (
+                _punkty_w_wielokacie(sx, sy, pierscien)
+                | narozniki[:-1, :-1] | narozniki[:-1, 1:] | narozniki[1:, :-1] | narozniki[1:, 1:]
+            )
+            vc = ((pierscien[:, 0] - WMTS_ORIGIN_X) // bok).astype(int) - col_min
+            vr = ((WMTS_ORIGIN_Y - pierscien[:, 1]) // bok).astype(int) - row_min
+            poprawne = (vc >= 0) & (vc < len(cols)) & (vr >= 0) & (vr < len(rows))
+            wybrane[vr[poprawne], vc[poprawne]] = True
+        for r, c in zip(*np.nonzero(wybrane)):
+            kafelek = (zoom_level, col_min + int(c), row_min + int(r))
+            if kafelek not in widziane:
+                widziane.add(kafelek)
+                yield kafelek
+
+
+def prostokat(xmin, ymin, xmax, ymax):
+    """Pierścień prostokąta EPSG:2180 jako tablica (5, 2)."""
+    return np.array([(xmin, ymin), (xmax, ymin), (xmax, ymax), (xmin, ymax), (xmin, ymin)], dtype=np.float64)
+
+
+def wielokaty_z_bbox(lon_min, lat_min, lon_max, lat_max):
+    """Prostokąt WGS84 jako pierścień EPSG:2180 (obwiednia czterech narożników)."""
+    x, y = wgs84_do_epsg2180_wsadowo([lon_min, lon_max, lon_max, lon_min], [lat_min, lat_min, lat_max, lat_max])
+    return [prostokat(x.min(), y.min(), x.max(), y.max())]
+
+
+def wielokaty_z_geojson(sciezka):
+    """
+    Pierścienie zewnętrzne wielokątów z pliku GeoJSON (WGS84) w EPSG:2180
+
+    Obsługuje Polygon, MultiPolygon, Feature i FeatureCollection.
+    """
+    with open(sciezka, encoding='utf-8') as plik:
+        dane = json.load(plik)
+
+    def geometrie(obiekt):
+        typ = obiekt.get('type')
+        if typ == 'FeatureCollection':
+            for cecha in obiekt.get('features') or []:
+                yield from geometrie(cecha)
+        elif typ == 'Feature':
+            if obiekt.get('geometry'):
+                yield from geometrie(obiekt['geometry'])
+        elif typ == 'GeometryCollection':
+            for geometria in obiekt.get('geometries') or []:
+                yield from geometrie(geometria)
+        elif typ == 'Polygon':
+            yield obiekt['coordinates'][0]
+        elif typ == 'MultiPolygon':
+            for wielokat in obiekt['coordinates']:
+                yield wielokat[0]
+
+    wielokaty = []
+    for pierscien in geometrie(dane):
+        punkty = np.asarray(pierscien, dtype=np.float64)[:, :2]
+        x, y = wgs84_do_epsg2180_wsadowo(punkty[:, 0], punkty[:, 1])
+        punkty = np.column_stack((x, y))
+        if not np.array_equal(punkty[0], punkty[-1]):
+            punkty = np.vstack([punkty, punkty[:1]])
+        wielokaty.append(punkty)
+    if not wielokaty:
+        raise ValueError(f"Brak wielokątów w {sciezka}")
+    return wielokaty
+
+
+def wielokaty_z_adresow(adresy, promien_m=DOMYSLNY_PROMIEN_M, sciezka_postepu=None):
+    """
+    Kwadraty o boku 2 * promien_m wokół zgeokodowanych adresów (EPSG:2180)
+
+    Geokodowanie idzie przez geokoduj_wsadowo - z limitem zapytań do Nominatim
+    i wznawianiem z pliku postępu.
+
+    Returns:
+        tuple: (lista pierścieni, liczba adresów nieodnalezionych)
+    """
+    from utils.batch_geocoder import geokoduj_wsadowo
+
+    punkty, nieodnalezione = [], 0
+    for wynik in geokoduj_wsadowo(adresy, sciezka_postepu):
+        if wynik['lon'] is None:
+            nieodnalezione += 1
+            print(f"Seed: nie odnaleziono adresu '{wynik['adres']}'", file=sys.stderr)
+            continue
+        punkty.append((wynik['lon'], wynik['lat']))
+    if not punkty:
+        return [], nieodnalezione
+    punkty = np.asarray(punkty)
+    x, y = wgs84_do_epsg2180_wsadowo(punkty[:, 0], punkty[:, 1])
+    return [
+        prostokat(px - promien_m, py - promien_m, px + promien_m, py + promien_m)
+        for px, py in zip(x.tolist(), y.tolist())
+    ], nieodnalezione
+
+
+class StatystykiSeedowania:
+    """Liczniki postępu seedowania, bezpieczne wątkowo."""
+
+    def __init__(self, wszystkie):
+        self.wszystkie = wszystkie
+        self.pobrane = 0
+        self.w_cache = 0
+        self.bledy = 0
+        self.bajty = 0
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def dodaj(self, wynik, rozmiar=0):
+        with self._lock:
+            if wynik == 'pobrany':
+                self.pobrane += 1
+                self.bajty += rozmiar
+            elif wynik == 'w_cache':
+                self.w_cache += 1
+            else:
+                self.bledy += 1
+
+    def ponow(self, liczba):
+        """Nieudane kafelki wracają do kolejki - przestają liczyć się jako błędy."""
+        with self._lock:
+            self.bledy -= liczba
+
+    def slownik(self):
+        """
+        Returns:
+            dict: liczniki, czas, przepustowość (kafelki/s, MB/s) i odsetek błędów
+        """
+        with self._lock:
+            czas = max(time.monotonic() - self.start, 1e-9)
+            gotowe = self.pobrane + self.w_cache + self.bledy
+            return {
+                'wszystkie': self.wszystkie,
+                'gotowe': gotowe,
+                'pobrane': self.pobrane,
+                'w_cache': self.w_cache,
+                'bledy': self.bledy,
+                'mb': round(self.bajty / 1024 / 1024, 2),
+                'czas_s': round(czas, 1),
+                'kafelki_na_s': round(self.pobrane / czas, 1),
+                'mb_na_s': round(self.bajty / 1024 / 1024 / czas, 2),
+                'odsetek_bledow': round(self.bledy / max(1, self.pobrane + self.bledy), 4),
+            }
+
+
+def _zasiej_kafelek(kafelek, cache):
+    """Pobiera kafelek do cache; zwraca ('w_cache' | 'pobrany' | 'blad', rozmiar)."""
+    zoom_level, tile_col, tile_row = kafelek
+    klucz = KluczKafelka(WMTS_LAYER, WMTS_TILE_MATRIX_SET, zoom_level, tile_row, tile_col, WMTS_FORMAT)
+    paczki = pobierz_paczki_kafelkow()
+    if cache.zawiera(klucz) or (paczki is not None and paczki.zawiera(klucz)):
+        return 'w_cache', 0
+    dane = pobierz_bajty_kafelka_wmts(tile_col, tile_row, zoom_level)
+    if dane is None:
+        return 'blad', 0
+    return 'pobrany', len(dane)
+
+
+def zasiej(kafelki, liczba=None, watki=DOMYSLNA_LICZBA_WATKOW, postep_co_s=5.0, anuluj=None, postep=None):
+    """
+    Pobiera kafelki równolegle do cache na dysku
+
+    Kafelki obecne w cache są pomijane, a nieudane ponawiane (MAKS_PONOWIEN razy)
+    po przejściu całej listy - ponowne uruchomienie dokańcza przerwane zadanie.
+
+    Args:
+        kafelki: Iterowalne krotki (zoom, col, row)
+        liczba: Liczba kafelków (do raportu postępu), jeśli znana
+        watki: Liczba równoczesnych pobrań
+        postep_co_s: Co ile sekund raportować postęp
+        anuluj: Opcjonalny threading.Event przerywający seedowanie
+        postep: Funkcja(dict) wywoływana z bieżącymi statystykami (domyślnie wypisanie na stderr)
+
+    Returns:
+        dict: Statystyki (StatystykiSeedowania.slownik) z listą 'nieudane' (najwyżej 100)
+    """
+    cache = pobierz_cache_kafelkow()
+    if cache is None:
+        raise RuntimeError("Cache kafelków jest wyłączony (ROOF_TILE_CACHE_MAX_MB=0)")
+    postep = postep or _wypisz_postep
+    statystyki = StatystykiSeedowania(liczba)
+    silnik = SilnikPobierania(maks_watkow=watki, limit_na_hosta=watki)
+    nieudane = []
+    ostatni_raport = time.monotonic()
+
+    def przebieg(lista):
+        nonlocal ostatni_raport
+        w_toku = {}
+        zrodlo = iter(lista)
+        wyczerpane = False
+        while w_toku or not wyczerpane:
+            # Najwyżej 4 zadania na wątek w kolejce - lista kafelków może być ogromna
+            while not wyczerpane and len(w_toku) < 4 * watki:
+                if anuluj is not None and anuluj.is_set():
+                    wyczerpane = True
+                    break
+                kafelek = next(zrodlo, None)
+                if kafelek is None:
+                    wyczerpane = True
+                    break
+                w_toku[silnik.zlec(_zasiej_kafelek, kafelek, cache)] = kafelek
+            if not w_toku:
+                break
+            gotowe, _ = wait(w_toku, timeout=postep_co_s, return_when=FIRST_COMPLETED)
+            for future in gotowe:
+                kafelek = w_toku.pop(future)
+                try:
+                    wynik, rozmiar = future.result()
+                except Exception as e:
+                    print(f"Seed: błąd kafelka {kafelek}: {e}", file=sys.stderr)
+                    wynik, rozmiar = 'blad', 0
+                if wynik == 'blad':
+                    nieudane.append(kafelek)
+                statystyki.dodaj(wynik, rozmiar)
+            if time.monotonic() - ostatni_raport >= postep_co_s:
+                ostatni_raport = time.monotonic()
+                postep(statystyki.slownik())
+
+    try:
+        przebieg(kafelki)
+        for _ in range(MAKS_PONOWIEN):
+            if not nieudane or (anuluj is not None and anuluj.is_set()):
+                break
+            ponow, nieudane[:] = list(nieudane), []
+            print(f"Seed: ponawianie {len(ponow)} nieudanych kafelków", file=sys.stderr)
+            statystyki.ponow(len(ponow))
+            przebieg(ponow)
+    finally:
+        silnik.zamknij()
+        # Magazyn MBTiles trzyma ostatnią paczkę zapisów w pamięci
+        cache.oproznij()
+    wynik = statystyki.slownik()
+    wynik['nieudane'] = nieudane[:100]
+    return wynik
+
+
+def _wypisz_postep(s):
+    wszystkie = s['wszystkie']
+    procent = f" ({100.0 * s['gotowe'] / wszystkie:.1f}%)" if wszystkie else ''
+    eta = ''
+    if wszystkie and s['gotowe'] and s['czas_s']:
+        eta = f", pozostało ~{(wszystkie - s['gotowe']) * s['czas_s'] / s['gotowe']:.0f} s"
+    print(f"Seed: {s['gotowe']}/{wszystkie or '?'}{procent} - pobrane {s['pobrane']}, "
+          f"w cache {s['w_cache']}, błędy {s['bledy']}, {s['kafelki_na_s']} kafelków/s, "
+          f"{s['mb_na_s']} MB/s{eta}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Wstępne wypełnianie cache kafelków WMTS Geoportalu')
+    obszar = parser.add_mutually_exclusive_group(required=True)
+    obszar.add_argument('--bbox', help='Prostokąt WGS84: lon_min,lat_min,lon_max,lat_max')
+    obszar.add_argument('--poligon', help='Plik GeoJSON z wielokątami (WGS84)')
+    obszar.add_argument('--adresy', help='Plik tekstowy z jednym adresem w wierszu')
+    parser.add_argument('--zoom', required=True, help='Poziomy powiększenia, np. 14, 12-15 lub 12,14')
+    parser.add_argument('--promien', type=float, default=DOMYSLNY_PROMIEN_M,
+                        help='Dla --adresy: promień obszaru wokół adresu (m)')
+    parser.add_argument('--postep-geokodowania', help='Dla --adresy: plik postępu geokodowania (JSONL)')
+    parser.add_argument('--watki', type=int, default=DOMYSLNA_LICZBA_WATKOW, help='Równoczesne pobrania')
+    parser.add_argument('--raport-co', type=float, default=5.0, help='Co ile sekund raportować postęp')
+    parser.add_argument('--policz', action='store_true', help='Tylko policz kafelki, bez pobierania')
+    args = parser.parse_args()
+
+    try:
+        zoomy = parsuj_zoomy(args.zoom)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.bbox:
+        try:
+            lon_min, lat_min, lon_max, lat_max = (float(v) for v in args.bbox.split(','))
+        except ValueError:
+            parser.error('--bbox wymaga czterech liczb: lon_min,lat_min,lon_max,lat_max')
+        wielokaty = wielokaty_z_bbox(lon_min, lat_min, lon_max, lat_max)
+    elif args.poligon:
+        wielokaty = wielokaty_z_geojson(args.poligon)
+    else:
+        with open(args.adresy, encoding='utf-8') as plik:
+            adresy = [wiersz.strip() for wiersz in plik if wiersz.strip()]
+        wielokaty, nieodnalezione = wielokaty_z_adresow(adresy, args.promien, args.postep_geokodowania)
+        print(f"Seed: {len(wielokaty)} obszarów z {len(adresy)} adresów "
+              f"({nieodnalezione} nieodnalezionych)", file=sys.stderr)
+
+    # Liczba kafelków na poziom - do raportu i oszacowania miejsca w cache
+    liczby = {zoom: sum(1 for _ in kafelki_obszaru(wielokaty, zoom)) for zoom in zoomy}
+    liczba = sum(liczby.values())
+    print(f"Seed: {liczba} kafelków ({', '.join(f'z{z}: {n}' for z, n in liczby.items())}), "
+          f"szacunkowo {liczba * SZACOWANY_ROZMIAR_KAFELKA / 1024 / 1024:.0f} MB", file=sys.stderr)
+    if args.policz:
+        return 0
+
+    cache = pobierz_cache_kafelkow()
+    if cache is not None and liczba * SZACOWANY_ROZMIAR_KAFELKA > cache.maks_bajtow:
+        print("Seed: uwaga - obszar może przekroczyć budżet cache (ROOF_TILE_CACHE_MAX_MB), "
+              "najstarsze kafelki zostaną usunięte", file=sys.stderr)
+
+    anuluj = threading.Event()
+    kafelki = (kafelek for zoom in zoomy for kafelek in kafelki_obszaru(wielokaty, zoom))
+    try:
+        wynik = zasiej(kafelki, liczba, args.watki, args.raport_co, anuluj)
+    except KeyboardInterrupt:
+        anuluj.set()
+        print("Seed: przerwano - ponowne uruchomienie dokończy zadanie", file=sys.stderr)
+        return 130
+    print(json.dumps(wynik, ensure_ascii=False))
+    return 1 if wynik['bledy'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
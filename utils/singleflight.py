@@ -0,0 +1,154 @@
+"""
+Moduł łączenia identycznych równoczesnych żądań (single-flight)
+Równolegli klienci pytający o ten sam klucz czekają na jedno żądanie do serwisu
+"""
+
+import hashlib
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows - tylko łączenie w obrębie procesu
+    fcntl = None
+
+
+LICZBA_PLIKOW_BLOKAD = 1024
+
+
+class _Lot:
+    """Jedno żądanie w locie, na które mogą czekać inne wątki."""
+
+    def __init__(self):
+        self.gotowe = threading.Event()
+        self.wynik = None
+        self.wyjatek = None
+        self.oczekujacy = 0
+
+
+class PojedynczyLot:
+    """
+    Wykonuje funkcję raz dla wszystkich równoczesnych wywołań z tym samym kluczem.
+
+    W obrębie procesu pozostałe wątki czekają na wynik pierwszego. Opcjonalnie
+    (katalog_blokad) wykonanie chronione jest blokadą pliku, więc wątek z innego
+    workera czeka, aż pierwszy skończy - funkcja powinna wtedy najpierw sprawdzić
+    współdzielony magazyn (np. cache kafelków na dysku), zanim pójdzie do sieci.
+    """
+
+    def __init__(self, katalog_blokad=None):
+        """
+        Args:
+            katalog_blokad: Katalog plików blokad między procesami (None - tylko wątki)
+        """
+        self.katalog_blokad = katalog_blokad
+        if katalog_blokad:
+            os.makedirs(katalog_blokad, exist_ok=True)
+        self._lock = threading.Lock()
+        self._w_locie = {}
+        self._wykonania = 0
+        self._wspoldzielone = 0
+
+    def wykonaj(self, klucz, funkcja, miedzy_procesami=False):
+        """
+        Wykonuje funkcję lub dołącza do trwającego wykonania dla tego klucza
+
+        Args:
+            klucz: Hashowalny klucz żądania
+            funkcja: Funkcja bez argumentów wykonująca żądanie
+            miedzy_procesami: Czy użyć blokady pliku (gdy skonfigurowano katalog_blokad)
+
+        Returns:
+            Wynik funkcji (ten sam obiekt dla wszystkich czekających)
+        """
+        with self._lock:
+            lot = self._w_locie.get(klucz)
+            if lot is not None:
+                lot.oczekujacy += 1
+                self._wspoldzielone += 1
+                prowadzacy = False
+            else:
+                lot = _Lot()
+                self._w_locie[klucz] = lot
+                self._wykonania += 1
+                prowadzacy = True
+
+        if not prowadzacy:
+            lot.gotowe.wait()
+            if lot.wyjatek is not None:
+                raise lot.wyjatek
+            return lot.wynik
+
+        try:
+            if miedzy_procesami and self.katalog_blokad and fcntl is not None:
+                with self._blokada_pliku(klucz):
+                    lot.wynik = funkcja()
+            else:
+                lot.wynik = funkcja()
+        except BaseException as e:
+            lot.wyjatek = e
+            raise
+        finally:
+            with self._lock:
+                self._w_locie.pop(klucz, None)
+            lot.gotowe.set()
+        return lot.wynik
+
+    def _blokada_pliku(self, klucz):
+        # Klucze rozkładane są na stałą liczbę plików blokad, żeby nie tworzyć
+        # osobnego pliku dla każdego kafelka
+        skrot = hashlib.sha1(repr(klucz).encode('utf-8')).digest()
+        pasmo = int.from_bytes(skrot[:4], 'big') % LICZBA_PLIKOW_BLOKAD
+        return _BlokadaKlucza(os.path.join(self.katalog_blokad, f"{pasmo:04d}.lock"))
+
+    def statystyki(self):
+        """
+        Returns:
+            dict: liczba wykonanych żądań, liczba wywołań obsłużonych cudzym
+                  wynikiem i liczba żądań aktualnie w locie
+        """
+        with self._lock:
+            return {
+                'wykonania': self._wykonania,
+                'wspoldzielone': self._wspoldzielone,
+                'w_locie': len(self._w_locie),
+            }
+
+
+class _BlokadaKlucza:
+    """Wyłączna blokada flock na pliku blokady."""
+
+    def __init__(self, sciezka):
+        self.sciezka = sciezka
+        self._plik = None
+
+    def __enter__(self):
+        self._plik = open(self.sciezka, 'a+')
+        fcntl.flock(self._plik.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._plik.fileno(), fcntl.LOCK_UN)
+        self._plik.close()
+        self._plik = None
+        return False
+
+
+_domyslny_lot = None
+_domyslny_lot_lock = threading.Lock()
+
+
+def pobierz_pojedynczy_lot():
+    """
+    Zwraca współdzieloną warstwę single-flight. Zmienna ROOF_SINGLEFLIGHT_LOCK_DIR
+    włącza łączenie żądań między workerami przez pliki blokad.
+
+    Returns:
+        PojedynczyLot
+    """
+    global _domyslny_lot
+    if _domyslny_lot is None:
+        with _domyslny_lot_lock:
+            if _domyslny_lot is None:
+                _domyslny_lot = PojedynczyLot(os.environ.get('ROOF_SINGLEFLIGHT_LOCK_DIR') or None)
+    return _domyslny_lot
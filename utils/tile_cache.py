@@ -0,0 +1,370 @@
+"""
+Moduł trwałego cache kafelków WMTS na dysku
+Kafelki zapisywane są jako pliki w drzewie katalogów warstwa/tms/zoom/wiersz/kolumna
+"""
+
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import fcntl
+except ImportError:  # Windows - brak blokad między procesami
+    fcntl = None
+
+
+# Katalog i budżet cache (można nadpisać zmiennymi środowiskowymi)
+DOMYSLNY_KATALOG_CACHE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'kafelki'
+)
+DOMYSLNY_BUDZET_MB = 512
+# Po przekroczeniu budżetu usuwamy kafelki aż do tego ułamka budżetu
+POZIOM_PO_PRZYCIECIU = 0.9
+# Co ile zapisów przeliczamy rozmiar cache od nowa (zapisy innych procesów)
+ZAPISY_DO_PRZELICZENIA = 500
+# Jak często (w sekundach) odświeżamy czas dostępu przy trafieniu (LRU)
+ODSWIEZANIE_DOSTEPU_S = 60
+PREFIKS_TMP = '.tmp-'
+ROZSZERZENIA = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/webp': 'webp',
+}
+BEZPIECZNA_NAZWA_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+KluczKafelka = namedtuple('KluczKafelka', ['warstwa', 'tms', 'zoom', 'wiersz', 'kolumna', 'format'])
+
+
+def _bezpieczna_nazwa(tekst):
+    """Zamienia dowolny tekst na bezpieczną nazwę katalogu."""
+    return BEZPIECZNA_NAZWA_RE.sub('_', str(tekst)) or '_'
+
+
+class DyskowyCacheKafelkow:
+    """
+    Cache kafelków w systemie plików z budżetem rozmiaru i usuwaniem LRU/LFU.
+
+    Zapisy są atomowe (plik tymczasowy + os.replace), więc wiele procesów
+    może bezpiecznie współdzielić ten sam katalog. Przycinanie cache
+    chronione jest blokadą pliku, żeby procesy nie usuwały kafelków równocześnie.
+    """
+
+    def __init__(self, katalog, maks_bajtow=DOMYSLNY_BUDZET_MB * 1024 * 1024, polityka='lru'):
+        """
+        Args:
+            katalog: Katalog główny cache
+            maks_bajtow: Budżet rozmiaru cache w bajtach
+            polityka: 'lru' (najdawniej używane) lub 'lfu' (najrzadziej używane)
+        """
+        if polityka not in ('lru', 'lfu'):
+            raise ValueError(f"Nieznana polityka usuwania: {polityka}")
+        self.katalog = katalog
+        self.maks_bajtow = maks_bajtow
+        self.polityka = polityka
+        self._lock = threading.Lock()
+        self._rozmiar = None
+        self._zapisy_od_przeliczenia = 0
+        # Liczniki użyć dla LFU - przechowywane w pamięci procesu
+        self._uzycia = {}
+        self._trafienia = 0
+        self._chybienia = 0
+        self._zapisy = 0
+        self._usuniete = 0
+        os.makedirs(self.katalog, exist_ok=True)
+
+    def sciezka(self, klucz):
+        """
+        Zwraca ścieżkę pliku dla klucza kafelka
+
+        Args:
+            klucz: KluczKafelka
+
+        Returns:
+            str: Ścieżka do pliku kafelka
+        """
+        rozszerzenie = ROZSZERZENIA.get(klucz.format, _bezpieczna_nazwa(klucz.format))
+        return os.path.join(
+            self.katalog,
+            _bezpieczna_nazwa(klucz.warstwa),
+            _bezpieczna_nazwa(klucz.tms),
+            str(int(klucz.zoom)),
+            str(int(klucz.wiersz)),
+            f"{int(klucz.kolumna)}.{rozszerzenie}"
+        )
+
+    def pobierz(self, klucz):
+        """
+        Odczytuje kafelek z cache
+
+        Args:
+            klucz: KluczKafelka
+
+        Returns:
+            bytes lub None jeśli kafelka nie ma w cache
+        """
+        sciezka = self.sciezka(klucz)
+        try:
+            with open(sciezka, 'rb') as plik:
+                dane = plik.read()
+        except OSError:
+            with self._lock:
+                self._chybienia += 1
+            return None
+
+        with self._lock:
+            self._trafienia += 1
+            if self.polityka == 'lfu':
+                self._uzycia[sciezka] = self._uzycia.get(sciezka, 0) + 1
+        self._odswiez_dostep(sciezka)
+        return dane
+
+    def zawiera(self, klucz):
+        """Sprawdza czy kafelek jest w cache (bez liczenia trafienia)."""
+        return os.path.exists(self.sciezka(klucz))
+
+    def zapisz(self, klucz, dane):
+        """
+        Zapisuje kafelek atomowo do cache
+
+        Args:
+            klucz: KluczKafelka
+            dane: Bajty obrazu kafelka
+        """
+        if not dane or len(dane) > self.maks_bajtow:
+            return
+        sciezka = self.sciezka(klucz)
+        katalog = os.path.dirname(sciezka)
+        try:
+            os.makedirs(katalog, exist_ok=True)
+            try:
+                poprzedni_rozmiar = os.path.getsize(sciezka)
+            except OSError:
+                poprzedni_rozmiar = 0
+            fd, tmp = tempfile.mkstemp(dir=katalog, prefix=PREFIKS_TMP)
+            try:
+                with os.fdopen(fd, 'wb') as plik:
+                    plik.write(dane)
+                os.replace(tmp, sciezka)
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+        except OSError as e:
+            print(f"Cache kafelków: błąd zapisu {sciezka}: {e}")
+            return
+
+        with self._lock:
+            self._zapisy += 1
+            self._zapisy_od_przeliczenia += 1
+            if self._rozmiar is not None:
+                self._rozmiar += len(dane) - poprzedni_rozmiar
+            przelicz = self._zapisy_od_przeliczenia >= ZAPISY_DO_PRZELICZENIA
+        if przelicz:
+            self._przelicz_rozmiar()
+        if self.rozmiar() > self.maks_bajtow:
+            self.przytnij()
+
+    def rozmiar(self):
+        """Zwraca (szacowany) łączny rozmiar cache w bajtach."""
+        if self._rozmiar is None:
+            self._przelicz_rozmiar()
+        return self._rozmiar
+
+    def przytnij(self):
+        """
+        Usuwa kafelki zgodnie z polityką aż rozmiar spadnie poniżej
+        POZIOM_PO_PRZYCIECIU budżetu.
+
+        Returns:
+            int: Liczba usuniętych kafelków
+        """
+        with _BlokadaPliku(os.path.join(self.katalog, '.lock')):
+            pliki = self._skanuj()
+            laczny_rozmiar = sum(rozmiar for _, rozmiar, _ in pliki)
+            cel = int(self.maks_bajtow * POZIOM_PO_PRZYCIECIU)
+            usuniete = 0
+            if laczny_rozmiar > self.maks_bajtow:
+                with self._lock:
+                    uzycia = dict(self._uzycia)
+                if self.polityka == 'lfu':
+                    pliki.sort(key=lambda p: (uzycia.get(p[0], 0), p[2]))
+                else:
+                    pliki.sort(key=lambda p: p[2])
+                for sciezka, rozmiar, _ in pliki:
+                    if laczny_rozmiar <= cel:
+                        break
+                    try:
+                        os.remove(sciezka)
+                    except OSError:
+                        continue
+                    laczny_rozmiar -= rozmiar
+                    usuniete += 1
+                    with self._lock:
+                        self._uzycia.pop(sciezka, None)
+
+        with self._lock:
+            self._rozmiar = laczny_rozmiar
+            self._zapisy_od_przeliczenia = 0
+            self._usuniete += usuniete
+        return usuniete
+
+    def wyczysc(self):
+        """Usuwa wszystkie kafelki z cache."""
+        with _BlokadaPliku(os.path.join(self.katalog, '.lock')):
+            for sciezka, _, _ in self._skanuj():
+                try:
+                    os.remove(sciezka)
+                except OSError:
+                    pass
+        with self._lock:
+            self._rozmiar = 0
+            self._uzycia.clear()
+
+    def oproznij(self):
+        """Zapisy trafiają na dysk od razu - nie ma czego opróżniać (zgodność z MBTilesCacheKafelkow)."""
+        return 0
+
+    def statystyki(self):
+        """
+        Zwraca liczniki cache
+
+        Returns:
+            dict: trafienia, chybienia, zapisy, usunięte, rozmiar i budżet
+        """
+        rozmiar = self.rozmiar()
+        with self._lock:
+            zapytania = self._trafienia + self._chybienia
+            return {
+                'trafienia': self._trafienia,
+                'chybienia': self._chybienia,
+                'wspolczynnik_trafien': self._trafienia / zapytania if zapytania else 0.0,
+                'zapisy': self._zapisy,
+                'usuniete': self._usuniete,
+                'rozmiar_bajtow': rozmiar,
+                'budzet_bajtow': self.maks_bajtow,
+                'polityka': self.polityka,
+                'magazyn': 'pliki',
+            }
+
+    def _odswiez_dostep(self, sciezka):
+        """Aktualizuje czas modyfikacji pliku (znacznik LRU), najwyżej raz na minutę."""
+        try:
+            teraz = time.time()
+            if teraz - os.path.getmtime(sciezka) > ODSWIEZANIE_DOSTEPU_S:
+                os.utime(sciezka, (teraz, teraz))
+        except OSError:
+            pass
+
+    def _przelicz_rozmiar(self):
+        rozmiar = sum(r for _, r, _ in self._skanuj())
+        with self._lock:
+            self._rozmiar = rozmiar
+            self._zapisy_od_przeliczenia = 0
+
+    def _skanuj(self):
+        """
+        Zwraca listę (ścieżka, rozmiar, czas_modyfikacji) wszystkich kafelków.
+        Przy okazji usuwa porzucone pliki tymczasowe starsze niż godzina.
+        """
+        pliki = []
+        teraz = time.time()
+        for katalog, _, nazwy in os.walk(self.katalog):
+            for nazwa in nazwy:
+                sciezka = os.path.join(katalog, nazwa)
+                try:
+                    st = os.stat(sciezka)
+                except OSError:
+                    continue
+                if nazwa.startswith(PREFIKS_TMP):
+                    if teraz - st.st_mtime > 3600:
+                        try:
+                            os.remove(sciezka)
+                        except OSError:
+                            pass
+                    continue
+                if nazwa.startswith('.'):
+                    continue
+                pliki.append((sciezka, st.st_size, st.st_mtime))
+        return pliki
+
+
+class _BlokadaPliku:
+    """Wyłączna blokada między procesami oparta o flock (no-op bez fcntl)."""
+
+    def __init__(self, sciezka):
+        self.sciezka = sciezka
+        self._plik = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._plik = open(self.sciezka, 'a+')
+            fcntl.flock(self._plik.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._plik is not None:
+            fcntl.flock(self._plik.fileno(), fcntl.LOCK_UN)
+            self._plik.close()
+            self._plik = None
+        return False
+
+
+_domyslny_cache = None
+_domyslny_cache_lock = threading.Lock()
+
+
+def pobierz_cache_kafelkow():
+    """
+    Zwraca współdzielony cache kafelków skonfigurowany zmiennymi środowiskowymi:
+        ROOF_TILE_CACHE_DIR - katalog cache
+        ROOF_TILE_CACHE_MAX_MB - budżet w MB (0 wyłącza cache)
+        ROOF_TILE_CACHE_POLICY - 'lru' lub 'lfu'
+        ROOF_TILE_CACHE_BACKEND - 'pliki' (drzewo katalogów) lub 'mbtiles' (jeden plik SQLite)
+        ROOF_TILE_CACHE_MBTILES - plik bazy dla magazynu 'mbtiles'
+
+    Returns:
+        DyskowyCacheKafelkow, MBTilesCacheKafelkow lub None jeśli cache jest wyłączony
+    """
+    global _domyslny_cache
+    if _domyslny_cache is not None:
+        return _domyslny_cache or None
+    with _domyslny_cache_lock:
+        if _domyslny_cache is None:
+            try:
+                budzet_mb = float(os.environ.get('ROOF_TILE_CACHE_MAX_MB', DOMYSLNY_BUDZET_MB))
+                magazyn = os.environ.get('ROOF_TILE_CACHE_BACKEND', 'pliki').strip().lower()
+                polityka = os.environ.get('ROOF_TILE_CACHE_POLICY', 'lru').lower()
+                if budzet_mb <= 0:
+                    _domyslny_cache = False
+                elif magazyn == 'mbtiles':
+                    from utils.mbtiles_cache import DOMYSLNA_SCIEZKA_MBTILES, MBTilesCacheKafelkow
+                    _domyslny_cache = MBTilesCacheKafelkow(
+                        os.environ.get('ROOF_TILE_CACHE_MBTILES', DOMYSLNA_SCIEZKA_MBTILES),
+                        maks_bajtow=int(budzet_mb * 1024 * 1024),
+                        polityka=polityka
+                    )
+                elif magazyn != 'pliki':
+                    raise ValueError(f"Nieznany magazyn kafelków: {magazyn}")
+                else:
+                    _domyslny_cache = DyskowyCacheKafelkow(
+                        os.environ.get('ROOF_TILE_CACHE_DIR', DOMYSLNY_KATALOG_CACHE),
+                        maks_bajtow=int(budzet_mb * 1024 * 1024),
+                        polityka=polityka
+                    )
+            except (OSError, ValueError, sqlite3.Error) as e:
+                print(f"Cache kafelków wyłączony: {e}")
+                _domyslny_cache = False
+    return _domyslny_cache or None
+
+
+def ustaw_cache_kafelkow(cache):
+    """Podmienia współdzielony cache kafelków (None wyłącza cache)."""
+    global _domyslny_cache
+    with _domyslny_cache_lock:
+        _domyslny_cache = cache if cache is not None else False
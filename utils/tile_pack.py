@@ -0,0 +1,328 @@
+"""
+Moduł niezmiennych paczek kafelków WMTS czytanych przez mmap
+Paczka to posortowany indeks kafelków i sklejone za nim bajty JPEG; workery mapują
+plik w pamięć i wycinają kafelki bez kopiowania - strony współdzieli cache systemu
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+
+import numpy as np
+
+from utils.tile_cache import KluczKafelka
+
+
+MAGIA = b'RGPACK01'
+WERSJA = 1
+# Nagłówek: magia, wersja, liczba kafelków, offsety indeksu i metadanych, długość metadanych
+NAGLOWEK = struct.Struct('<8sIIQQQQ')
+ROZMIAR_NAGLOWKA = 64
+ROZSZERZENIE_PACZKI = '.pack'
+# Klucz indeksu: zoom (8 bitów) | kolumna (28 bitów) | wiersz (28 bitów)
+BITY_INDEKSU = 28
+MAKS_INDEKSU = (1 << BITY_INDEKSU) - 1
+
+
+def klucz_indeksu(zoom, kolumna, wiersz):
+    """Łączy (zoom, kolumna, wiersz) w jedną liczbę 64-bitową - porządek jak sortowanie krotek."""
+    if not (0 <= kolumna <= MAKS_INDEKSU and 0 <= wiersz <= MAKS_INDEKSU and 0 <= zoom < 256):
+        raise ValueError(f"Kafelek poza zakresem paczki: {(zoom, kolumna, wiersz)}")
+    return (int(zoom) << (2 * BITY_INDEKSU)) | (int(kolumna) << BITY_INDEKSU) | int(wiersz)
+
+
+class PaczkaKafelkow:
+    """
+    Paczka kafelków jednej warstwy zmapowana w pamięć (tylko do odczytu).
+
+    Indeks (klucze, offsety, długości) to tablice NumPy nałożone na mmap,
+    więc wyszukanie kafelka to searchsorted bez wywołań systemowych, a wynik
+    to memoryview na fragment pliku - bez kopiowania bajtów.
+    """
+
+    def __init__(self, sciezka):
+        """
+        Args:
+            sciezka: Plik paczki (.pack) zbudowany przez zbuduj_paczke
+        """
+        self.sciezka = sciezka
+        with open(sciezka, 'rb') as plik:
+            self._mmap = mmap.mmap(plik.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magia, wersja, _, liczba, offset_indeksu, offset_metadanych, dlugosc_metadanych = \
+                NAGLOWEK.unpack_from(self._mmap, 0)
+            if magia != MAGIA or wersja != WERSJA:
+                raise ValueError(f"{sciezka} nie jest paczką kafelków (wersja {WERSJA})")
+            self.metadane = json.loads(bytes(self._mmap[offset_metadanych:offset_metadanych + dlugosc_metadanych]))
+            self.liczba = liczba
+            self._klucze = np.frombuffer(self._mmap, dtype='<u8', count=liczba, offset=offset_indeksu)
+            self._offsety = np.frombuffer(self._mmap, dtype='<u8', count=liczba, offset=offset_indeksu + 8 * liczba)
+            self._dlugosci = np.frombuffer(self._mmap, dtype='<u4', count=liczba, offset=offset_indeksu + 16 * liczba)
+        except Exception:
+            self._mmap.close()
+            raise
+        self._widok = memoryview(self._mmap)
+        self.warstwa = (self.metadane['warstwa'], self.metadane['tms'], self.metadane['mime'])
+
+    def _pozycja(self, klucz):
+        if (klucz.warstwa, klucz.tms, klucz.format) != self.warstwa:
+            return None
+        try:
+            szukany = klucz_indeksu(klucz.zoom, klucz.kolumna, klucz.wiersz)
+        except ValueError:
+            return None
+        i = int(np.searchsorted(self._klucze, szukany))
+        if i < self.liczba and int(self._klucze[i]) == szukany:
+            return i
+        return None
+
+    def pobierz(self, klucz):
+        """
+        Zwraca bajty kafelka jako memoryview na zmapowany plik
+
+        Args:
+            klucz: KluczKafelka
+
+        Returns:
+            memoryview lub None jeśli kafelka nie ma w paczce
+        """
+        i = self._pozycja(klucz)
+        if i is None:
+            return None
+        offset = int(self._offsety[i])
+        return self._widok[offset:offset + int(self._dlugosci[i])]
+
+    def zawiera(self, klucz):
+        """Sprawdza czy kafelek jest w paczce."""
+        return self._pozycja(klucz) is not None
+
+    def zamknij(self):
+        """Zwalnia mapowanie (kafelki wydane wcześniej jako memoryview muszą być już zwolnione)."""
+        self._klucze = self._offsety = self._dlugosci = None
+        self._widok.release()
+        self._mmap.close()
+
+
+class ZestawPaczek:
+    """Kilka paczek przeszukiwanych po kolei, z licznikami trafień."""
+
+    def __init__(self, paczki):
+        """
+        Args:
+            paczki: Lista PaczkaKafelkow
+        """
+        self.paczki = list(paczki)
+        self._lock = threading.Lock()
+        self._trafienia = 0
+        self._chybienia = 0
+
+    def pobierz(self, klucz):
+        """
+        Returns:
+            memoryview z bajtami kafelka lub None jeśli nie ma go w żadnej paczce
+        """
+        for paczka in self.paczki:
+            dane = paczka.pobierz(klucz)
+            if dane is not None:
+                with self._lock:
+                    self._trafienia += 1
+                return dane
+        with self._lock:
+            self._chybienia += 1
+        return None
+
+    def zawiera(self, klucz):
+        return any(paczka.zawiera(klucz) for paczka in self.paczki)
+
+    def zamknij(self):
+        for paczka in self.paczki:
+            paczka.zamknij()
+
+    def statystyki(self):
+        """
+        Returns:
+            dict: trafienia, chybienia, liczba paczek i kafelków, rozmiar plików
+        """
+        with self._lock:
+            zapytania = self._trafienia + self._chybienia
+            return {
+                'trafienia': self._trafienia,
+                'chybienia': self._chybienia,
+                'wspolczynnik_trafien': self._trafienia / zapytania if zapytania else 0.0,
+                'paczki': len(self.paczki),
+                'kafelki': sum(paczka.liczba for paczka in self.paczki),
+                'rozmiar_bajtow': sum(len(paczka._mmap) for paczka in self.paczki),
+            }
+
+
+def zbuduj_paczke(kafelki, sciezka, warstwa, tms, mime):
+    """
+    Zapisuje paczkę kafelków (atomowo - plik tymczasowy i os.replace)
+
+    Workery z otwartą poprzednią wersją pliku czytają ją dalej do ponownego
+    wczytania paczek - zastąpiony plik pozostaje zmapowany.
+
+    Args:
+        kafelki: Iterowalne (zoom, kolumna, wiersz, bajty) - kolejność dowolna
+        sciezka: Plik wynikowy
+        warstwa, tms, mime: Warstwa WMTS, zestaw macierzy i format kafelków
+
+    Returns:
+        int: Liczba kafelków w paczce
+    """
+    katalog = os.path.dirname(os.path.abspath(sciezka))
+    os.makedirs(katalog, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=katalog, prefix='.tmp-', suffix=ROZSZERZENIE_PACZKI)
+    try:
+        with os.fdopen(fd, 'wb') as plik:
+            plik.write(b'\0' * ROZMIAR_NAGLOWKA)
+            klucze, offsety, dlugosci = [], [], []
+            widziane = set()
+            offset = ROZMIAR_NAGLOWKA
+            for zoom, kolumna, wiersz, dane in kafelki:
+                klucz = klucz_indeksu(zoom, kolumna, wiersz)
+                if not dane or klucz in widziane:
+                    continue
+                widziane.add(klucz)
+                plik.write(dane)
+                klucze.append(klucz)
+                offsety.append(offset)
+                dlugosci.append(len(dane))
+                offset += len(dane)
+
+            porzadek = np.argsort(np.asarray(klucze, dtype=np.uint64), kind='stable')
+            # Indeks wyrównany do 8 bajtów
+            wyrownanie = -offset % 8
+            plik.write(b'\0' * wyrownanie)
+            offset_indeksu = offset + wyrownanie
+            plik.write(np.asarray(klucze, dtype='<u8')[porzadek].tobytes())
+            plik.write(np.asarray(offsety, dtype='<u8')[porzadek].tobytes())
+            plik.write(np.asarray(dlugosci, dtype='<u4')[porzadek].tobytes())
+            metadane = json.dumps({'warstwa': warstwa, 'tms': tms, 'mime': mime, 'kafelki': len(klucze)}).encode()
+            offset_metadanych = offset_indeksu + 20 * len(klucze)
+            plik.write(metadane)
+            plik.seek(0)
+            plik.write(NAGLOWEK.pack(
+                MAGIA, WERSJA, 0, len(klucze), offset_indeksu, offset_metadanych, len(metadane)
+            ))
+            plik.flush()
+            os.fsync(plik.fileno())
+        os.replace(tmp, sciezka)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return len(klucze)
+
+
+def sciezki_paczek(wartosc):
+    """
+    Rozwija ROOF_TILE_PACKS: pliki i katalogi (wszystkie *.pack) rozdzielone os.pathsep
+
+    Returns:
+        list: Posortowane ścieżki paczek
+    """
+    sciezki = []
+    for czesc in (wartosc or '').split(os.pathsep):
+        czesc = czesc.strip()
+        if not czesc:
+            continue
+        if os.path.isdir(czesc):
+            sciezki.extend(sorted(
+                os.path.join(czesc, nazwa) for nazwa in os.listdir(czesc)
+                if nazwa.endswith(ROZSZERZENIE_PACZKI) and not nazwa.startswith('.')
+            ))
+        else:
+            sciezki.append(czesc)
+    return sciezki
+
+
+_domyslne_paczki = None
+_domyslne_paczki_lock = threading.Lock()
+
+
+def pobierz_paczki_kafelkow():
+    """
+    Zwraca współdzielony zestaw paczek z ROOF_TILE_PACKS (pierwszy poziom wyszukiwania kafelków)
+
+    Returns:
+        ZestawPaczek lub None jeśli nie skonfigurowano paczek
+    """
+    global _domyslne_paczki
+    if _domyslne_paczki is not None:
+        return _domyslne_paczki or None
+    with _domyslne_paczki_lock:
+        if _domyslne_paczki is None:
+            paczki = []
+            for sciezka in sciezki_paczek(os.environ.get('ROOF_TILE_PACKS')):
+                try:
+                    paczki.append(PaczkaKafelkow(sciezka))
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Paczka kafelków {sciezka} pominięta: {e}")
+            _domyslne_paczki = ZestawPaczek(paczki) if paczki else False
+    return _domyslne_paczki or None
+
+
+def ustaw_paczki_kafelkow(paczki):
+    """Podmienia współdzielony zestaw paczek (None wyłącza paczki)."""
+    global _domyslne_paczki
+    with _domyslne_paczki_lock:
+        _domyslne_paczki = paczki if paczki is not None else False
+
+
+def main():
+    from utils.geoportal import WMTS_FORMAT, WMTS_LAYER, WMTS_TILE_MATRIX_SET
+    from utils.seed import kafelki_obszaru, parsuj_zoomy, wielokaty_z_bbox, wielokaty_z_geojson
+    from utils.tile_cache import pobierz_cache_kafelkow
+
+    parser = argparse.ArgumentParser(description='Niezmienne paczki kafelków WMTS (mmap)')
+    polecenia = parser.add_subparsers(dest='polecenie', required=True)
+    zbuduj = polecenia.add_parser('zbuduj', help='Zamroź kafelki obszaru z cache w paczkę')
+    zbuduj.add_argument('paczka', help='Plik wynikowy (.pack)')
+    obszar = zbuduj.add_mutually_exclusive_group(required=True)
+    obszar.add_argument('--bbox', help='Prostokąt WGS84: lon_min,lat_min,lon_max,lat_max')
+    obszar.add_argument('--poligon', help='Plik GeoJSON z wielokątami (WGS84)')
+    zbuduj.add_argument('--zoom', required=True, help='Poziomy powiększenia, np. 14, 12-15 lub 12,14')
+    info = polecenia.add_parser('info', help='Metadane paczki')
+    info.add_argument('paczka', help='Plik paczki')
+    args = parser.parse_args()
+
+    if args.polecenie == 'info':
+        paczka = PaczkaKafelkow(args.paczka)
+        print(json.dumps(dict(paczka.metadane, rozmiar_bajtow=len(paczka._mmap)), ensure_ascii=False))
+        return 0
+
+    cache = pobierz_cache_kafelkow()
+    if cache is None:
+        parser.error('Cache kafelków jest wyłączony (ROOF_TILE_CACHE_MAX_MB=0)')
+    if args.bbox:
+        wielokaty = wielokaty_z_bbox(*(float(v) for v in args.bbox.split(',')))
+    else:
+        wielokaty = wielokaty_z_geojson(args.poligon)
+    brakujace = 0
+
+    def kafelki():
+        nonlocal brakujace
+        for zoom in parsuj_zoomy(args.zoom):
+            for _, kolumna, wiersz in kafelki_obszaru(wielokaty, zoom):
+                dane = cache.pobierz(KluczKafelka(WMTS_LAYER, WMTS_TILE_MATRIX_SET, zoom, wiersz, kolumna, WMTS_FORMAT))
+                if dane is None:
+                    brakujace += 1
+                    continue
+                yield zoom, kolumna, wiersz, dane
+
+    liczba = zbuduj_paczke(kafelki(), args.paczka, WMTS_LAYER, WMTS_TILE_MATRIX_SET, WMTS_FORMAT)
+    print(f"Paczka {args.paczka}: {liczba} kafelków, {os.path.getsize(args.paczka) / 1024 / 1024:.1f} MB"
+          + (f" ({brakujace} kafelków obszaru brak w cache - uruchom najpierw utils.seed)" if brakujace else ''))
+    return 1 if brakujace else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())